@@ -0,0 +1,210 @@
+"""
+This module renders the time to first appointment (TTFA) report off the scheduling critical path.
+
+The booked TTFAs are saved to a .npz file by TtfaAccumulator.save, and this module, run as a separate
+process, turns them into:
+
+    ttfa_statistics_<timestamp>.png   mean and median TTFA, combined and by program
+    ttfa_by_state_<timestamp>.png     mean and median TTFA by state
+    ttfa_report_<timestamp>.json      count, mean, median, p90 and p99 by program and by state
+    ttfa_report_<timestamp>.html      a static page with both charts and tables
+
+matplotlib is only imported when the charts are drawn, with the non-interactive Agg backend, so
+nothing waits on a display and processes that never render do not pay for the import.
+
+Usage:
+    python src/analysis/report.py --bookings data/output/ttfa_bookings_<timestamp>.npz --output-dir data/output/
+
+Functions:
+    start_report(accumulator, output_dir, background): Saves the bookings and renders the report.
+    render_report(bookings_path, output_dir, timestamp): Renders the charts, JSON and HTML of saved bookings.
+    build_summary(accumulator): Computes the statistics the report shows.
+    parse_args(argv): Parses the command line options.
+    main(argv): Renders a report from the command line.
+"""
+
+import argparse
+import html
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+# Allow running this file directly, like src/main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis.ttfa_accumulator import TtfaAccumulator
+
+STATISTICS = ['count', 'mean', 'median', 'p90', 'p99']
+
+def start_report(accumulator:TtfaAccumulator, output_dir:str='data/output/', background:bool=True):
+    """
+    Saves the bookings next to the report and renders it, by default in a detached process so the
+    caller returns at once. The process writes its output to ttfa_report_<timestamp>.log.
+
+    Args:
+        accumulator (TtfaAccumulator): the booked TTFAs
+        output_dir (str, optional): folder the report is written to
+        background (bool, optional): render in a separate process. Defaults to True.
+
+    Returns:
+        subprocess.Popen or None: the rendering process, None when rendered in this process
+    """
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    os.makedirs(output_dir, exist_ok=True)
+    bookings_path = os.path.join(output_dir, f'ttfa_bookings_{timestamp}.npz')
+    accumulator.save(bookings_path)
+    if not background:
+        render_report(bookings_path, output_dir, timestamp)
+        return None
+
+    with open(os.path.join(output_dir, f'ttfa_report_{timestamp}.log'), 'w') as log_file:
+        return subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--bookings', bookings_path, '--output-dir', output_dir,
+             '--timestamp', timestamp],
+            stdout=log_file, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+            env={**os.environ, 'MPLBACKEND': 'Agg'}, start_new_session=True)
+
+def render_report(bookings_path:str, output_dir:str='data/output/', timestamp:str=None) -> dict:
+    """
+    Renders the charts, JSON summary and HTML page of bookings saved by TtfaAccumulator.save.
+
+    Args:
+        bookings_path (str): the .npz file of bookings
+        output_dir (str, optional): folder the report is written to
+        timestamp (str, optional): suffix of the file names. Defaults to now.
+
+    Returns:
+        dict: the paths written, keyed 'json', 'program_chart', 'state_chart' and 'html'
+    """
+    timestamp = timestamp or datetime.now().strftime('%Y%m%d_%H%M%S')
+    summary = build_summary(TtfaAccumulator.load(bookings_path))
+    paths = {
+        'json': os.path.join(output_dir, f'ttfa_report_{timestamp}.json'),
+        'program_chart': os.path.join(output_dir, f'ttfa_statistics_{timestamp}.png'),
+        'state_chart': os.path.join(output_dir, f'ttfa_by_state_{timestamp}.png'),
+        'html': os.path.join(output_dir, f'ttfa_report_{timestamp}.html')
+    }
+
+    with open(paths['json'], 'w') as file:
+        json.dump(summary, file, indent=4)
+    _plot_statistics(summary['by_program'], 'Mean & Median TTFA by Program', 'Program', paths['program_chart'])
+    _plot_statistics(summary['by_state'], 'Mean & Median TTFA by State', 'State', paths['state_chart'])
+    with open(paths['html'], 'w') as file:
+        file.write(_format_html(summary, paths))
+    print(f"TTFA report written to {paths['html']}")
+    return paths
+
+def build_summary(accumulator:TtfaAccumulator) -> dict:
+    """
+    Computes the statistics the report shows.
+
+    Args:
+        accumulator (TtfaAccumulator): the booked TTFAs
+
+    Returns:
+        dict: 'generated_at', 'bookings', and 'by_program' and 'by_state', each mapping 'Combined'
+            and every group, in name order, to its count, mean, median, p90 and p99 TTFA in hours
+    """
+    def ordered(statistics):
+        combined = statistics.pop(TtfaAccumulator.COMBINED)
+        return {TtfaAccumulator.COMBINED: combined, **dict(sorted(statistics.items()))}
+
+    return {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'bookings': len(accumulator),
+        'by_program': ordered(accumulator.final_statistics(by='program')),
+        'by_state': ordered(accumulator.final_statistics(by='state'))
+    }
+
+def _plot_statistics(statistics:dict, title:str, label:str, path:str):
+    """
+    Draws the mean and median TTFA of every group side by side, with the values above the bars.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    groups = list(statistics)
+    mean_values = [statistics[group]['mean'] or 0.0 for group in groups]
+    median_values = [statistics[group]['median'] or 0.0 for group in groups]
+    x = np.arange(len(groups))
+    bar_width = 0.4
+
+    figure = plt.figure(figsize=(max(10, 0.8 * len(groups)), 5))
+    bars1 = plt.bar(x - bar_width / 2, mean_values, width=bar_width, label='Mean TTFA')
+    bars2 = plt.bar(x + bar_width / 2, median_values, width=bar_width, label='Median TTFA')
+
+    # Adjust text position above the bars
+    plt.ylim(0, max(mean_values + median_values + [0]) + 2)
+    for bars, values in [(bars1, mean_values), (bars2, median_values)]:
+        for bar, value in zip(bars, values):
+            plt.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.05,
+                     f'{value:.2f}', ha='center', fontsize=10 if len(groups) <= 12 else 7)
+
+    plt.xlabel(label)
+    plt.ylabel('TTFA (hours)')
+    plt.title(title, pad=15)
+    plt.xticks(x, groups)
+    plt.legend(loc='upper left', bbox_to_anchor=(1, 1))
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close(figure)
+
+def _format_html(summary:dict, paths:dict) -> str:
+    """
+    Formats the summary as a static HTML page that shows the charts from the same folder.
+    """
+    def table(statistics, label):
+        rows = [f"<tr><th>{html.escape(label)}</th>" + ''.join(f'<th>{name}</th>' for name in STATISTICS) + '</tr>']
+        for group, values in statistics.items():
+            cells = [str(values['count'])] + ['-' if values[name] is None else f'{values[name]:.2f}' for name in STATISTICS[1:]]
+            rows.append(f'<tr><td>{html.escape(str(group))}</td>' + ''.join(f'<td>{cell}</td>' for cell in cells) + '</tr>')
+        return '<table>\n' + '\n'.join(rows) + '\n</table>'
+
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>TTFA report {summary['generated_at']}</title>
+<style>body {{ font-family: sans-serif; }} table {{ border-collapse: collapse; margin-bottom: 1em; }}
+td, th {{ border: 1px solid #ccc; padding: 4px 8px; text-align: right; }}</style>
+</head>
+<body>
+<h1>Time to first appointment</h1>
+<p>{summary['bookings']} new patient appointments, generated {summary['generated_at']}. TTFA in hours.
+Data: <a href="{os.path.basename(paths['json'])}">{os.path.basename(paths['json'])}</a></p>
+<h2>By program</h2>
+{table(summary['by_program'], 'Program')}
+<img src="{os.path.basename(paths['program_chart'])}" alt="TTFA by program">
+<h2>By state</h2>
+{table(summary['by_state'], 'State')}
+<img src="{os.path.basename(paths['state_chart'])}" alt="TTFA by state">
+</body>
+</html>
+"""
+
+def parse_args(argv=None):
+    """
+    Parse the command line options.
+
+    Args:
+        argv (list[str], optional): Arguments to parse. Defaults to sys.argv.
+
+    Returns:
+        argparse.Namespace: The parsed options
+    """
+    parser = argparse.ArgumentParser(description='Render the TTFA report of saved bookings.')
+    parser.add_argument('--bookings', required=True, help='.npz file written by TtfaAccumulator.save')
+    parser.add_argument('--output-dir', default='data/output/', help='Folder to write the report to')
+    parser.add_argument('--timestamp', default=None, help='Suffix of the report file names (default: now)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    render_report(args.bookings, args.output_dir, args.timestamp)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""
+This module contains the columnar accumulator behind the time to first appointment (TTFA) statistics.
+
+Bookings are appended to preallocated arrays of patient id, program and state codes and TTFA seconds. A running
+count and sum per program, and P² quantile estimators for the median, p90 and p99, keep live statistics
+current at constant cost per booking, so a long batch run or the online scheduler service can report at
+any point. The exact final statistics, by program or by state, are computed from the arrays in one
+vectorized pass. The arrays can be saved to a .npz file, so a report can be rendered in another process.
+
+Classes:
+    P2Quantile: Streaming estimate of one quantile in constant memory (Jain & Chlamtac's P² algorithm).
+    TtfaAccumulator: Columnar store of booked TTFAs with live and exact statistics by program.
+"""
+
+import numpy as np
+
+SECONDS_PER_HOUR = 3600
+
+class P2Quantile:
+    """
+    Estimates a quantile from a stream without storing it, by moving five markers toward the minimum,
+    the p/2, p and (1+p)/2 quantiles and the maximum with piecewise-parabolic interpolation.
+    """
+    def __init__(self, quantile:float):
+        """
+        Args:
+            quantile (float): the quantile to estimate, between 0 and 1
+        """
+        if not 0 < quantile < 1:
+            raise ValueError(f"quantile must be between 0 and 1, got {quantile}")
+        self.quantile = quantile
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * quantile, 4 * quantile, 2 + 2 * quantile, 4]
+        self.increments = [0, quantile / 2, quantile, (1 + quantile) / 2, 1]
+        self.count = 0
+
+    def add(self, value:float):
+        """Adds one observation."""
+        self.count += 1
+        heights = self.heights
+        if self.count <= 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+        positions, desired = self.positions, self.desired
+        for marker in range(cell + 1, 5):
+            positions[marker] += 1
+        for marker in range(5):
+            desired[marker] += self.increments[marker]
+
+        for marker in (1, 2, 3):
+            offset = desired[marker] - positions[marker]
+            if (offset >= 1 and positions[marker + 1] - positions[marker] > 1) or \
+                    (offset <= -1 and positions[marker - 1] - positions[marker] < -1):
+                step = 1 if offset > 0 else -1
+                height = self.__parabolic(marker, step)
+                if not heights[marker - 1] < height < heights[marker + 1]:
+                    height = heights[marker] + step * (heights[marker + step] - heights[marker]) / \
+                        (positions[marker + step] - positions[marker])
+                heights[marker] = height
+                positions[marker] += step
+
+    def __parabolic(self, marker:int, step:int) -> float:
+        heights, positions = self.heights, self.positions
+        below = positions[marker] - positions[marker - 1]
+        above = positions[marker + 1] - positions[marker]
+        return heights[marker] + step / (positions[marker + 1] - positions[marker - 1]) * (
+            (below + step) * (heights[marker + 1] - heights[marker]) / above +
+            (above - step) * (heights[marker] - heights[marker - 1]) / below)
+
+    def value(self) -> float:
+        """
+        Returns:
+            float: the estimate, exact for fewer than six observations, None before the first
+        """
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            return float(np.quantile(self.heights, self.quantile))
+        return float(self.heights[2])
+
+class TtfaAccumulator:
+    """
+    Columnar store of booked TTFAs. Row i of the arrays holds one booking; rows of cancelled bookings
+    are marked inactive and skipped by the exact statistics.
+
+    patient_ids   [int64,   ...]
+    program_codes [int16,   ...]  index into programs
+    state_codes   [int16,   ...]  index into states, -1 when unknown
+    ttfa_seconds  [float64, ...]
+    active        [bool,    ...]
+    """
+    COMBINED = 'Combined'
+    QUANTILES = {'median': 0.5, 'p90': 0.9, 'p99': 0.99}
+
+    def __init__(self, capacity:int=1024):
+        """
+        Args:
+            capacity (int, optional): rows preallocated; the arrays double when full
+        """
+        self.patient_ids = np.empty(capacity, dtype=np.int64)
+        self.program_codes = np.empty(capacity, dtype=np.int16)
+        self.state_codes = np.empty(capacity, dtype=np.int16)
+        self.ttfa_seconds = np.empty(capacity, dtype=np.float64)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.size = 0
+        self.programs = []
+        self.program_code_by_name = {}
+        self.states = []
+        self.state_code_by_name = {}
+        self.row_by_patient = {}
+        self.counts = {self.COMBINED: 0}
+        self.sums = {self.COMBINED: 0.0}
+        self.estimators = {self.COMBINED: self.__new_estimators()}
+
+    def __len__(self):
+        return self.counts[self.COMBINED]
+
+    def add(self, patient_id:int, program:str, ttfa_seconds:float, state:str=None):
+        """
+        Records a booking. A patient booked again replaces their previous booking.
+
+        Args:
+            patient_id (int): the new patient
+            program (str): the patient's program, e.g. 'SUD'
+            ttfa_seconds (float): time from registration to the appointment start
+            state (str, optional): the patient's state, for the statistics by state
+        """
+        if patient_id in self.row_by_patient:
+            self.remove(patient_id)
+        code = self.program_code_by_name.get(program)
+        if code is None:
+            code = self.program_code_by_name[program] = len(self.programs)
+            self.programs.append(program)
+            self.counts[program], self.sums[program] = 0, 0.0
+            self.estimators[program] = self.__new_estimators()
+        state_code = -1
+        if state is not None:
+            state_code = self.state_code_by_name.get(state)
+            if state_code is None:
+                state_code = self.state_code_by_name[state] = len(self.states)
+                self.states.append(state)
+        if self.size == len(self.ttfa_seconds):
+            self.__grow()
+
+        row = self.size
+        self.patient_ids[row] = patient_id
+        self.program_codes[row] = code
+        self.state_codes[row] = state_code
+        self.ttfa_seconds[row] = ttfa_seconds
+        self.active[row] = True
+        self.size += 1
+        self.row_by_patient[patient_id] = row
+
+        for name in (self.COMBINED, program):
+            self.counts[name] += 1
+            self.sums[name] += ttfa_seconds
+            for estimator in self.estimators[name]:
+                estimator.add(ttfa_seconds)
+
+    def remove(self, patient_id:int) -> bool:
+        """
+        Drops the booking of a patient, e.g. when it is cancelled. Counts and means stay exact;
+        the live quantile estimates cannot forget an observation and keep it until the next
+        final_statistics.
+
+        Returns:
+            bool: whether the patient had a booking
+        """
+        row = self.row_by_patient.pop(patient_id, None)
+        if row is None:
+            return False
+        self.active[row] = False
+        program = self.programs[self.program_codes[row]]
+        for name in (self.COMBINED, program):
+            self.counts[name] -= 1
+            self.sums[name] -= float(self.ttfa_seconds[row])
+        return True
+
+    def patient_ids_booked(self) -> list:
+        """Returns the ids of the patients with a booking, in booking order."""
+        return self.patient_ids[:self.size][self.active[:self.size]].tolist()
+
+    def live_statistics(self) -> dict:
+        """
+        Current statistics from the running sums and quantile estimators, at a cost independent
+        of the number of bookings.
+
+        Returns:
+            dict: 'Combined' and each program mapped to its 'count' and its 'mean', 'median',
+                'p90' and 'p99' TTFA in hours (None without bookings)
+        """
+        statistics = {}
+        for name in [self.COMBINED] + self.programs:
+            count = self.counts[name]
+            statistics[name] = {'count': count, 'mean': self.sums[name] / count / SECONDS_PER_HOUR if count else None}
+            for label, estimator in zip(self.QUANTILES, self.estimators[name]):
+                estimate = estimator.value() if count else None
+                statistics[name][label] = None if estimate is None else estimate / SECONDS_PER_HOUR
+        return statistics
+
+    def final_statistics(self, by:str='program') -> dict:
+        """
+        Exact statistics of the active bookings, in one vectorized pass over the arrays: bookings
+        are sorted by group and TTFA once, and every group's quantiles are read from its run.
+
+        Args:
+            by (str, optional): group by 'program' or by 'state'. Defaults to 'program'.
+
+        Returns:
+            dict: same layout as live_statistics, with states in place of programs when by='state'
+        """
+        if by not in ('program', 'state'):
+            raise ValueError(f"by must be 'program' or 'state', got {by}")
+        names = self.programs if by == 'program' else self.states
+        active = self.active[:self.size]
+        codes = (self.program_codes if by == 'program' else self.state_codes)[:self.size][active].astype(np.int64)
+        ttfa_hours = self.ttfa_seconds[:self.size][active] / SECONDS_PER_HOUR
+        # Bookings without a state only count towards Combined
+        known = codes >= 0
+
+        # Combined is one more group, so every group is handled by the same arrays
+        group_count = len(names) + 1
+        groups = np.concatenate([np.full(len(codes), len(names)), codes[known]])
+        values = np.concatenate([ttfa_hours, ttfa_hours[known]])
+        order = np.lexsort((values, groups))
+        sorted_values = values[order]
+        counts = np.bincount(groups, minlength=group_count)
+        sums = np.bincount(groups, weights=values, minlength=group_count)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        # Linear interpolation between the closest ranks, as np.quantile does
+        quantiles = np.array(list(self.QUANTILES.values()))
+        ranks = starts[:, None] + quantiles[None, :] * np.maximum(counts - 1, 0)[:, None]
+        lower = np.floor(ranks).astype(np.int64)
+        upper = np.ceil(ranks).astype(np.int64)
+        quantile_values = np.full(ranks.shape, np.nan)
+        if len(sorted_values):
+            lower_values = sorted_values[np.minimum(lower, len(sorted_values) - 1)]
+            upper_values = sorted_values[np.minimum(upper, len(sorted_values) - 1)]
+            quantile_values = lower_values + (upper_values - lower_values) * (ranks - lower)
+
+        statistics = {}
+        for name, group in [(self.COMBINED, len(names))] + [(name, code) for code, name in enumerate(names)]:
+            count = int(counts[group])
+            statistics[name] = {'count': count, 'mean': float(sums[group] / count) if count else None}
+            for label, value in zip(self.QUANTILES, quantile_values[group]):
+                statistics[name][label] = float(value) if count else None
+        return statistics
+
+    def save(self, path:str):
+        """
+        Writes the active bookings to a .npz file.
+        """
+        active = self.active[:self.size]
+        np.savez(path, patient_ids=self.patient_ids[:self.size][active],
+                 program_codes=self.program_codes[:self.size][active], state_codes=self.state_codes[:self.size][active],
+                 ttfa_seconds=self.ttfa_seconds[:self.size][active],
+                 programs=np.array(self.programs, dtype=str), states=np.array(self.states, dtype=str))
+
+    @classmethod
+    def load(cls, path:str) -> 'TtfaAccumulator':
+        """
+        Reads bookings written by save. Counts, means and final statistics are restored; the live
+        quantile estimates start empty.
+        """
+        with np.load(path) as data:
+            accumulator = cls(capacity=max(len(data['ttfa_seconds']), 1))
+            accumulator.programs = data['programs'].tolist()
+            accumulator.states = data['states'].tolist()
+            size = accumulator.size = len(data['ttfa_seconds'])
+            for name in ('patient_ids', 'program_codes', 'state_codes', 'ttfa_seconds'):
+                getattr(accumulator, name)[:size] = data[name]
+        accumulator.active[:size] = True
+        accumulator.program_code_by_name = {program: code for code, program in enumerate(accumulator.programs)}
+        accumulator.state_code_by_name = {state: code for code, state in enumerate(accumulator.states)}
+        accumulator.row_by_patient = {patient_id: row for row, patient_id in enumerate(accumulator.patient_ids[:size].tolist())}
+        counts = np.bincount(accumulator.program_codes[:size], minlength=len(accumulator.programs))
+        sums = np.bincount(accumulator.program_codes[:size], weights=accumulator.ttfa_seconds[:size],
+                           minlength=len(accumulator.programs))
+        accumulator.counts = {cls.COMBINED: size, **dict(zip(accumulator.programs, counts.tolist()))}
+        accumulator.sums = {cls.COMBINED: float(sums.sum()), **dict(zip(accumulator.programs, sums.tolist()))}
+        accumulator.estimators = {name: accumulator.__new_estimators() for name in accumulator.counts}
+        return accumulator
+
+    def __new_estimators(self) -> list:
+        return [P2Quantile(quantile) for quantile in self.QUANTILES.values()]
+
+    def __grow(self):
+        capacity = 2 * len(self.ttfa_seconds)
+        for name in ('patient_ids', 'program_codes', 'state_codes', 'ttfa_seconds', 'active'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
@@ -0,0 +1,151 @@
+"""
+This module defines the interface every scheduling algorithm implements for backtesting, a registry
+to look algorithms up by name, and the algorithms that ship with the scheduler.
+
+An algorithm only plans: it is given a copy of the populated calendar, the new patients in
+first-come-first-served order and a NewAppointmentTracker holding the appointments already booked,
+and returns the slot it would give each patient. Nothing is booked and no file is written, so
+algorithms can be run side by side on the same inputs.
+
+Classes:
+    SchedulingAlgorithm: Base class of the scheduling algorithms.
+    GreedyAlgorithm: Books each patient, in registration order, into the earliest open slot.
+    ParallelGreedyAlgorithm: The greedy plan, computed per state/provider component in worker processes.
+    OptimalAlgorithm: Plans the whole backlog at once with BatchOptimizer.
+
+Functions:
+    register_algorithm(algorithm): Adds an algorithm to the registry.
+    get_algorithm(name): Looks an algorithm up by name.
+    available_algorithms(): Lists the registered algorithm names.
+"""
+
+import pandas as pd
+
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.batch_optimizer import BatchOptimizer
+from scheduling.component_scheduler import ComponentScheduler
+from scheduling.free_slot_index import FreeSlotIndex, NS_PER_DAY
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+
+_ALGORITHMS = {}
+
+class SchedulingAlgorithm:
+    """
+    Base class of the scheduling algorithms. Subclasses set name and description and implement plan.
+    """
+    name = None
+    description = ''
+
+    def plan(self, calendar:ProviderCalendar, sorted_new_patient_df:pd.DataFrame,
+             new_appointment_tracker:NewAppointmentTracker) -> dict:
+        """
+        Plan bookings for the new patients.
+
+        Args:
+            calendar (ProviderCalendar): a copy of the populated calendar the algorithm may modify
+            sorted_new_patient_df (pd.DataFrame): new patients in first-come-first-served order
+            new_appointment_tracker (NewAppointmentTracker): new appointments already booked per
+                provider/day; the algorithm may modify it
+
+        Returns:
+            dict: maps the position of each booked patient in sorted_new_patient_df to the
+                (start, provider_id) of its slot, with start in nanoseconds since the epoch
+        """
+        raise NotImplementedError
+
+def register_algorithm(algorithm:SchedulingAlgorithm) -> SchedulingAlgorithm:
+    """
+    Adds an algorithm to the registry under its name, replacing any algorithm of the same name.
+
+    Args:
+        algorithm (SchedulingAlgorithm): the algorithm to register
+
+    Returns:
+        SchedulingAlgorithm: the algorithm, so the call can wrap a definition
+    """
+    if not algorithm.name:
+        raise ValueError(f"{type(algorithm).__name__} has no name to register it under")
+    _ALGORITHMS[algorithm.name] = algorithm
+    return algorithm
+
+def get_algorithm(name:str) -> SchedulingAlgorithm:
+    """
+    Looks an algorithm up by name.
+
+    Raises:
+        KeyError: if no algorithm is registered under the name
+    """
+    if name not in _ALGORITHMS:
+        raise KeyError(f"Unknown scheduling algorithm {name}, expected one of {available_algorithms()}")
+    return _ALGORITHMS[name]
+
+def available_algorithms() -> list[str]:
+    """Lists the registered algorithm names in registration order."""
+    return list(_ALGORITHMS)
+
+class GreedyAlgorithm(SchedulingAlgorithm):
+    """
+    The production scheduler: each patient, in registration order, takes the earliest open slot on a
+    day after they registered with a provider licensed in their state and below the daily limit.
+    """
+    name = 'greedy'
+    description = 'earliest open slot, first come first served'
+
+    def plan(self, calendar, sorted_new_patient_df, new_appointment_tracker):
+        free_slot_index = FreeSlotIndex(calendar)
+        registration = pd.to_datetime(sorted_new_patient_df['REGISTRATIONDATE']).to_numpy(dtype='datetime64[ns]').view('int64')
+        earliest_starts = (registration // NS_PER_DAY + 1) * NS_PER_DAY
+
+        assignments = {}
+        for position, (state, earliest_start) in enumerate(zip(sorted_new_patient_df['STATE'].tolist(), earliest_starts.tolist())):
+            earliest_slot = free_slot_index.earliest_free_slot(state, earliest_start, new_appointment_tracker.has_capacity)
+            if earliest_slot is None:
+                continue
+            start, provider_id = earliest_slot
+            free_slot_index.remove_slot(provider_id, start)
+            new_appointment_tracker.increment_provider_appointments(provider_id, pd.Timestamp(start))
+            assignments[position] = earliest_slot
+        return assignments
+
+class ParallelGreedyAlgorithm(SchedulingAlgorithm):
+    """
+    The greedy plan, computed for each independent state/provider component in a worker process.
+    """
+    name = 'greedy-parallel'
+    description = 'greedy, one worker process per state/provider component'
+
+    def __init__(self, workers:int=None):
+        """
+        Args:
+            workers (int, optional): number of worker processes, None for one per CPU
+        """
+        self.workers = workers
+
+    def plan(self, calendar, sorted_new_patient_df, new_appointment_tracker):
+        plan = ComponentScheduler(new_appointment_tracker, self.workers).plan(calendar, sorted_new_patient_df)
+        return {position: earliest_slot for position, (earliest_slot, _) in enumerate(plan) if earliest_slot is not None}
+
+class OptimalAlgorithm(SchedulingAlgorithm):
+    """
+    Plans the whole backlog at once with BatchOptimizer, minimizing the total or the largest TTFA.
+    """
+
+    def __init__(self, objective:str='total', time_limit:float=30.0):
+        """
+        Args:
+            objective (str, optional): 'total' or 'max' TTFA
+            time_limit (float, optional): seconds before BatchOptimizer falls back to the greedy heuristic
+        """
+        self.objective = objective
+        self.time_limit = time_limit
+        self.name = f'optimal-{objective}'
+        self.description = f'batch matching, minimum {objective} TTFA'
+
+    def plan(self, calendar, sorted_new_patient_df, new_appointment_tracker):
+        optimizer = BatchOptimizer(FreeSlotIndex(calendar), new_appointment_tracker, self.objective, self.time_limit)
+        return optimizer.plan(sorted_new_patient_df)['assignments']
+
+register_algorithm(GreedyAlgorithm())
+register_algorithm(ParallelGreedyAlgorithm())
+register_algorithm(OptimalAlgorithm('total'))
+register_algorithm(OptimalAlgorithm('max'))
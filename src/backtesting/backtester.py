@@ -0,0 +1,263 @@
+"""
+This module contains the Backtester class, which runs several scheduling algorithms from the registry
+on in-memory copies of the same preprocessed inputs and compares them. The data files are only read;
+no booking is written anywhere.
+
+For every algorithm it reports the time to first appointment (TTFA) mean, median and 90th percentile
+in hours, combined and by program, the number of patients left unscheduled, the wall time, the peak
+memory allocated while planning and the bookings per second.
+
+Usage:
+    python src/backtesting/backtester.py --algorithms greedy optimal-total optimal-max --json backtest.json
+
+Classes:
+    Backtester: Runs scheduling algorithms on the same inputs and measures them.
+
+Functions:
+    load_inputs(data_dir, year, month, start_date, end_date): Reads and preprocesses the CSV files of a data folder.
+    format_table(results): Formats backtest results as a table.
+    parse_args(argv): Parses the command line options.
+    main(argv): Runs a backtest from the command line.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Allow running this file directly, like src/main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backtesting.algorithms import available_algorithms, get_algorithm
+from preprocessing.preprocessor import Preprocessor
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.free_slot_index import NS_PER_DAY
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+from util.utility import read_json
+
+NS_PER_HOUR = 3_600_000_000_000
+PROGRAMS = ['Combined', 'Mental Health', 'SUD']
+
+class Backtester:
+    """
+    Runs scheduling algorithms on copies of the same calendar and new patients and measures them.
+    """
+
+    def __init__(self, calendar:ProviderCalendar, new_patient_df:pd.DataFrame, tracker_snapshot:dict=None):
+        """
+        Args:
+            calendar (ProviderCalendar): the populated calendar
+            new_patient_df (pd.DataFrame): the new patients to schedule
+            tracker_snapshot (dict, optional): NewAppointmentTracker.snapshot() of appointments already
+                booked. Defaults to the tracker's current state.
+        """
+        self.calendar = calendar.copy()
+        self.sorted_new_patient_df = new_patient_df.sort_values(by=['REGISTRATIONDATE', 'PATIENTID'], ascending=True) \
+            .reset_index(drop=True)
+        self.new_appointment_tracker = NewAppointmentTracker()
+        self.tracker_snapshot = tracker_snapshot or self.new_appointment_tracker.snapshot()
+
+    def run(self, algorithm_names:list[str], measure_memory:bool=True) -> list[dict]:
+        """
+        Runs each algorithm on fresh copies of the inputs.
+
+        The wall time is measured on a run without memory tracing, which slows Python code down;
+        the peak memory comes from a second, traced run.
+
+        Args:
+            algorithm_names (list[str]): registered algorithm names
+            measure_memory (bool, optional): also trace the peak memory of every algorithm
+
+        Returns:
+            list[dict]: one result per algorithm, see __summarize
+        """
+        algorithms = [get_algorithm(name) for name in algorithm_names]
+        original_snapshot = self.new_appointment_tracker.snapshot()
+        results = []
+        try:
+            for algorithm in algorithms:
+                print(f'Backtesting {algorithm.name}...')
+                assignments, wall_time = self.__run_once(algorithm)
+                self.__validate(algorithm.name, assignments)
+
+                peak_memory = None
+                if measure_memory:
+                    tracemalloc.start()
+                    try:
+                        self.__run_once(algorithm)
+                        _, peak_memory = tracemalloc.get_traced_memory()
+                    finally:
+                        tracemalloc.stop()
+
+                results.append(self.__summarize(algorithm, assignments, wall_time, peak_memory))
+        finally:
+            # The tracker is shared, so leave it as the caller had it
+            self.new_appointment_tracker.restore(original_snapshot)
+        return results
+
+    def __run_once(self, algorithm) -> tuple:
+        """
+        Plans with one algorithm on a copy of the calendar and a tracker reset to the snapshot.
+
+        Returns:
+            tuple: the assignments and the wall time in seconds
+        """
+        calendar = self.calendar.copy()
+        self.new_appointment_tracker.restore(self.tracker_snapshot)
+        started = time.perf_counter()
+        assignments = algorithm.plan(calendar, self.sorted_new_patient_df.copy(), self.new_appointment_tracker)
+        return assignments, time.perf_counter() - started
+
+    def __validate(self, name:str, assignments:dict):
+        """
+        Checks a plan against the scheduling rules: an open slot, taken once, in the patient's state,
+        on a day after they registered, within the daily limit of new appointments.
+
+        Raises:
+            ValueError: if the plan breaks a rule
+        """
+        open_rows, open_states = self.calendar.state_slot_rows(free_only=True)
+        open_slots = set(zip(self.calendar.starts[open_rows].tolist(), self.calendar.provider_ids[open_rows].tolist(),
+                             open_states.tolist()))
+        self.new_appointment_tracker.restore(self.tracker_snapshot)
+
+        taken = set()
+        states = self.sorted_new_patient_df['STATE'].tolist()
+        registration = pd.to_datetime(self.sorted_new_patient_df['REGISTRATIONDATE'])
+        for position, (start, provider_id) in sorted(assignments.items()):
+            if (start, provider_id, states[position]) not in open_slots or (start, provider_id) in taken:
+                raise ValueError(f'{name} booked patient {position} into a slot that is not open to them')
+            if start // NS_PER_DAY <= registration.iloc[position].value // NS_PER_DAY:
+                raise ValueError(f'{name} booked patient {position} on or before their registration day')
+            taken.add((start, provider_id))
+            self.new_appointment_tracker.increment_provider_appointments(provider_id, pd.Timestamp(start))
+            if self.new_appointment_tracker.get_provider_by_date(provider_id, pd.Timestamp(start)) > \
+                    NewAppointmentTracker.MAX_NEW_APPOINTMENTS_PER_DAY:
+                raise ValueError(f'{name} booked provider {provider_id} past the daily limit')
+
+    def __summarize(self, algorithm, assignments:dict, wall_time:float, peak_memory:int) -> dict:
+        """
+        Computes the TTFA statistics and throughput of a plan.
+
+        Returns:
+            dict: 'algorithm', 'description', 'patients', 'scheduled', 'unscheduled', 'wall_time_s',
+                'bookings_per_second', 'peak_memory_mb' and 'ttfa_hours', which maps 'Combined' and each
+                program to its 'count', 'mean', 'median' and 'p90'
+        """
+        positions = np.array(sorted(assignments), dtype=np.int64)
+        starts = np.array([assignments[position][0] for position in positions.tolist()], dtype=np.int64)
+        registration = pd.to_datetime(self.sorted_new_patient_df['REGISTRATIONDATE']) \
+            .to_numpy(dtype='datetime64[ns]').view(np.int64)
+        ttfa_hours = (starts - registration[positions]) / NS_PER_HOUR if len(positions) else np.array([])
+        programs = self.sorted_new_patient_df['PROGRAM'].to_numpy()[positions]
+
+        ttfa_by_program = {}
+        for program in PROGRAMS:
+            values = ttfa_hours if program == 'Combined' else ttfa_hours[programs == program]
+            ttfa_by_program[program] = {
+                'count': int(len(values)),
+                'mean': float(np.mean(values)) if len(values) else None,
+                'median': float(np.median(values)) if len(values) else None,
+                'p90': float(np.percentile(values, 90)) if len(values) else None
+            }
+
+        return {
+            'algorithm': algorithm.name,
+            'description': algorithm.description,
+            'patients': len(self.sorted_new_patient_df),
+            'scheduled': len(assignments),
+            'unscheduled': len(self.sorted_new_patient_df) - len(assignments),
+            'wall_time_s': wall_time,
+            'bookings_per_second': len(assignments) / wall_time if wall_time > 0 else None,
+            'peak_memory_mb': None if peak_memory is None else peak_memory / 1024 ** 2,
+            'ttfa_hours': ttfa_by_program
+        }
+
+def load_inputs(data_dir:str='data/', year:int=2025, month:int=1, start_date:str=None, end_date:str=None) -> tuple:
+    """
+    Reads and preprocesses the CSV files of a data folder without writing anything to it.
+
+    Args:
+        data_dir (str, optional): folder holding the CSV files and pattern_map.json
+        year (int, optional): year of the calendar
+        month (int, optional): month of the calendar
+        start_date (str, optional): first day of the calendar, instead of year and month
+        end_date (str, optional): last day of the calendar. Defaults to the end of start_date's month.
+
+    Returns:
+        tuple: the populated calendar and the new patients
+    """
+    pattern_mapping = read_json(os.path.join(data_dir, 'pattern_map.json'))
+    preprocessor = Preprocessor(data_dir)
+    preprocessor.read_csvs(pattern_mapping)
+    populated_calendar = preprocessor.populate_calendar(year=year, month=month, start_date=start_date, end_date=end_date)
+    return populated_calendar, preprocessor.get_dataframe('new_patient_df')
+
+def format_table(results:list[dict]) -> str:
+    """
+    Formats backtest results as a table, one row per algorithm.
+
+    Args:
+        results (list[dict]): results returned by Backtester.run
+
+    Returns:
+        str: the table
+    """
+    def hours(value):
+        return f'{value:.2f}' if value is not None else '-'
+
+    header = f"{'algorithm':<18}{'program':<15}{'scheduled':>10}{'mean (h)':>10}{'median (h)':>12}{'p90 (h)':>10}"
+    header += f"{'unscheduled':>13}{'wall (s)':>10}{'bookings/s':>12}{'peak MB':>10}"
+    lines = [header]
+    for result in results:
+        for program in PROGRAMS:
+            ttfa = result['ttfa_hours'][program]
+            line = f"{result['algorithm'] if program == 'Combined' else '':<18}{program:<15}{ttfa['count']:>10}"
+            line += f"{hours(ttfa['mean']):>10}{hours(ttfa['median']):>12}{hours(ttfa['p90']):>10}"
+            if program == 'Combined':
+                bookings_per_second = result['bookings_per_second']
+                line += f"{result['unscheduled']:>13}{result['wall_time_s']:>10.3f}"
+                line += f"{bookings_per_second:>12.0f}" if bookings_per_second is not None else f"{'-':>12}"
+                line += f"{hours(result['peak_memory_mb']):>10}"
+            lines.append(line)
+    return '\n'.join(lines)
+
+def parse_args(argv=None):
+    """
+    Parse the command line options.
+
+    Args:
+        argv (list[str], optional): Arguments to parse. Defaults to sys.argv.
+
+    Returns:
+        argparse.Namespace: The parsed options
+    """
+    parser = argparse.ArgumentParser(description='Compare scheduling algorithms on the same inputs without booking anything.')
+    parser.add_argument('--data-dir', default='data/', help='Folder holding the CSV files and pattern_map.json')
+    parser.add_argument('--year', type=int, default=2025, help='Year of the calendar')
+    parser.add_argument('--month', type=int, default=1, help='Month of the calendar')
+    parser.add_argument('--algorithms', nargs='+', default=['greedy', 'optimal-total', 'optimal-max'],
+                        choices=available_algorithms(), help='Registered algorithms to run')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the traced run that measures peak memory')
+    parser.add_argument('--json', default=None, help='Also write the results to this JSON file')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    calendar, new_patient_df = load_inputs(args.data_dir, args.year, args.month)
+
+    results = Backtester(calendar, new_patient_df).run(args.algorithms, measure_memory=not args.no_memory)
+
+    print(format_table(results))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=4)
+        print(f'Backtest results written to {args.json}')
+
+if __name__ == '__main__':
+    main()
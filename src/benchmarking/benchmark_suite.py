@@ -0,0 +1,215 @@
+"""
+This module times each stage of the scheduling pipeline on synthetic datasets of increasing size and
+fits a power law, seconds = coefficient * providers ^ exponent, to every stage. An exponent well
+above 1 warns of a stage that will not scale long before it becomes a problem on the real data.
+
+Every dataset is generated into a temporary folder with generate_dataset, so the data folder is
+never touched.
+
+Usage:
+    python src/benchmarking/benchmark_suite.py --providers 250 500 1000 2000 --json benchmark.json
+
+Functions:
+    run_benchmarks(sizes, ...): Times every pipeline stage at each size.
+    fit_scaling(sizes, seconds): Fits a power law to the timings of one stage.
+    format_report(report): Formats the timings and fitted curves as a table.
+    parse_args(argv): Parses the command line options.
+    main(argv): Runs the benchmark suite from the command line.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Allow running this file directly, like src/main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backtesting.algorithms import get_algorithm
+from benchmarking.synthetic_data import PATTERN_MAP, generate_dataset
+from preprocessing.populator import CalendarPopulator
+from preprocessing.preprocessor import Preprocessor
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.free_slot_index import FreeSlotIndex
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+
+STAGES = ['read_csvs', 'process_appointment_times', 'setup_provider_schedule', 'populate_calendar',
+          'free_slot_index', 'greedy_schedule']
+# Exponents above this are reported as super-linear
+SUPERLINEAR_EXPONENT = 1.3
+
+def run_benchmarks(sizes:list[int], patients_per_provider:float=6.0, include_optimal:bool=False,
+                   seed:int=0, **dataset_options) -> dict:
+    """
+    Generates a dataset for every number of providers and times the pipeline stages on it.
+
+    Args:
+        sizes (list[int]): numbers of providers to benchmark
+        patients_per_provider (float, optional): the backlog grows with the number of providers
+        include_optimal (bool, optional): also time BatchOptimizer with the total objective
+        seed (int, optional): seed of the generated datasets
+        **dataset_options: further generate_dataset options, e.g. weeks or appointment_density
+
+    Returns:
+        dict: 'sizes', 'datasets' (the row counts of every dataset), 'seconds' (stage name to one
+            timing per size) and 'scaling' (stage name to fit_scaling of its timings)
+    """
+    stages = STAGES + (['optimal_schedule'] if include_optimal else [])
+    seconds = {stage: [] for stage in stages}
+    datasets = []
+    new_appointment_tracker = NewAppointmentTracker()
+    original_snapshot = new_appointment_tracker.snapshot()
+    try:
+        for providers in sizes:
+            with tempfile.TemporaryDirectory() as data_dir:
+                counts = generate_dataset(data_dir, providers=providers, backlog=int(providers * patients_per_provider),
+                                          seed=seed, **dataset_options)
+                datasets.append(counts)
+                print(f"Benchmarking {providers} providers, {counts['appointments']} appointments, "
+                      f"{counts['new_patients']} new patients...")
+                timings = _time_stages(data_dir, counts, include_optimal, new_appointment_tracker)
+            for stage in stages:
+                seconds[stage].append(timings[stage])
+    finally:
+        new_appointment_tracker.restore(original_snapshot)
+
+    return {
+        'sizes': list(sizes),
+        'datasets': datasets,
+        'seconds': seconds,
+        'scaling': {stage: fit_scaling(sizes, stage_seconds) for stage, stage_seconds in seconds.items()}
+    }
+
+def _time_stages(data_dir:str, counts:dict, include_optimal:bool, new_appointment_tracker:NewAppointmentTracker) -> dict:
+    """
+    Runs the pipeline once on a generated dataset and times each stage.
+    """
+    timings = {}
+
+    def timed(stage, function, *args, **kwargs):
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        timings[stage] = time.perf_counter() - started
+        return result
+
+    preprocessor = Preprocessor(data_dir + os.sep)
+    timed('read_csvs', preprocessor.read_csvs, PATTERN_MAP)
+    processed_appointments = timed('process_appointment_times', preprocessor.process_appointment_times)
+    provider_availability = timed('setup_provider_schedule', preprocessor.setup_provider_schedule,
+                                  start_date=counts['start_date'], end_date=counts['end_date'])
+    populated_calendar = timed('populate_calendar', lambda: ProviderCalendar.from_slots(
+        CalendarPopulator(provider_availability, processed_appointments).populate_calendar(),
+        preprocessor.get_provider_licences()))
+    timed('free_slot_index', FreeSlotIndex, populated_calendar)
+
+    sorted_new_patient_df = preprocessor.get_dataframe('new_patient_df') \
+        .sort_values(by=['REGISTRATIONDATE', 'PATIENTID']).reset_index(drop=True)
+    new_appointment_tracker.reset()
+    timed('greedy_schedule', get_algorithm('greedy').plan, populated_calendar.copy(), sorted_new_patient_df,
+          new_appointment_tracker)
+    if include_optimal:
+        new_appointment_tracker.reset()
+        timed('optimal_schedule', get_algorithm('optimal-total').plan, populated_calendar.copy(), sorted_new_patient_df,
+              new_appointment_tracker)
+    return timings
+
+def fit_scaling(sizes:list[int], seconds:list[float]) -> dict:
+    """
+    Fits seconds = coefficient * size ^ exponent by least squares on the logarithms.
+
+    Args:
+        sizes (list[int]): the benchmarked sizes
+        seconds (list[float]): the timing at each size
+
+    Returns:
+        dict: 'exponent', 'coefficient' and 'r_squared' of the fit, None when fewer than two
+            positive timings were measured
+    """
+    sizes, seconds = np.asarray(sizes, dtype=float), np.asarray(seconds, dtype=float)
+    measured = (sizes > 0) & (seconds > 0)
+    if measured.sum() < 2:
+        return {'exponent': None, 'coefficient': None, 'r_squared': None}
+
+    log_sizes, log_seconds = np.log(sizes[measured]), np.log(seconds[measured])
+    exponent, intercept = np.polyfit(log_sizes, log_seconds, 1)
+    residuals = log_seconds - (exponent * log_sizes + intercept)
+    total = ((log_seconds - log_seconds.mean()) ** 2).sum()
+    return {
+        'exponent': float(exponent),
+        'coefficient': float(np.exp(intercept)),
+        'r_squared': float(1 - (residuals ** 2).sum() / total) if total > 0 else 1.0
+    }
+
+def format_report(report:dict, predict_size:int=None) -> str:
+    """
+    Formats the timings and fitted scaling curves as a table, one row per stage.
+
+    Args:
+        report (dict): returned by run_benchmarks
+        predict_size (int, optional): also extrapolate every stage to this number of providers
+
+    Returns:
+        str: the table
+    """
+    header = f"{'stage':<28}" + ''.join(f"{f'{size} (s)':>14}" for size in report['sizes'])
+    header += f"{'exponent':>10}{'r2':>7}"
+    if predict_size:
+        header += f"{f'{predict_size} (s, fit)':>18}"
+    lines = [header]
+    for stage, stage_seconds in report['seconds'].items():
+        scaling = report['scaling'][stage]
+        line = f'{stage:<28}' + ''.join(f'{value:>14.3f}' for value in stage_seconds)
+        if scaling['exponent'] is None:
+            line += f"{'-':>10}{'-':>7}"
+        else:
+            line += f"{scaling['exponent']:>10.2f}{scaling['r_squared']:>7.2f}"
+        if predict_size:
+            predicted = None if scaling['exponent'] is None else scaling['coefficient'] * predict_size ** scaling['exponent']
+            line += f'{predicted:>18.1f}' if predicted is not None else f"{'-':>18}"
+        if scaling['exponent'] is not None and scaling['exponent'] > SUPERLINEAR_EXPONENT:
+            line += '  super-linear'
+        lines.append(line)
+    return '\n'.join(lines)
+
+def parse_args(argv=None):
+    """
+    Parse the command line options.
+
+    Args:
+        argv (list[str], optional): Arguments to parse. Defaults to sys.argv.
+
+    Returns:
+        argparse.Namespace: The parsed options
+    """
+    parser = argparse.ArgumentParser(description='Time the scheduling pipeline on synthetic data of increasing size.')
+    parser.add_argument('--providers', type=int, nargs='+', default=[250, 500, 1000, 2000],
+                        help='Numbers of providers to benchmark')
+    parser.add_argument('--patients-per-provider', type=float, default=6.0, help='Backlog size per provider')
+    parser.add_argument('--weeks', type=int, default=4)
+    parser.add_argument('--states', type=int, default=12)
+    parser.add_argument('--states-per-provider', type=float, default=2.5)
+    parser.add_argument('--appointment-density', type=float, default=0.5)
+    parser.add_argument('--include-optimal', action='store_true', help='Also time the batch optimizer')
+    parser.add_argument('--predict', type=int, default=None, help='Extrapolate every stage to this number of providers')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='Also write the report to this JSON file')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmarks(args.providers, args.patients_per_provider, args.include_optimal, args.seed,
+                            weeks=args.weeks, states=args.states, states_per_provider=args.states_per_provider,
+                            appointment_density=args.appointment_density)
+
+    print(format_report(report, args.predict))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=4)
+        print(f'Benchmark report written to {args.json}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+This module generates seeded synthetic scheduling data at any scale, in the same four CSV files, with
+the same columns and formats, as the bundled data, plus the pattern_map.json the Preprocessor reads.
+
+The generated data follows the shape of the bundled files: providers work a few days a week in
+shifts of 40 minute slots, are licensed in one or more states, and have existing appointments of
+10 to 60 minutes starting on their slots. New patients register on any day of the horizon. Every
+step is vectorized with numpy, so tens of thousands of providers and millions of appointments can
+be generated in seconds.
+
+Usage:
+    python src/benchmarking/synthetic_data.py --output-dir /tmp/synthetic --providers 5000 --weeks 4
+
+Functions:
+    generate_dataset(output_dir, ...): Writes a synthetic dataset and returns its row counts.
+    parse_args(argv): Parses the command line options.
+    main(argv): Generates a dataset from the command line.
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+STATES = ['AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY',
+          'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND',
+          'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY']
+PROGRAMS = ['SUD', 'Mental Health']
+PATTERN_MAP = {
+    "Appointment.*\\.csv": "appointment_df",
+    "New Patient.*\\.csv": "new_patient_df",
+    "Provider Schedule.*\\.csv": "provider_schedule_df",
+    "Provider State.*\\.csv": "provider_state_df"
+}
+SLOT_MINUTES = 40
+# Appointment lengths in minutes and how often they occur in the bundled data
+APPOINTMENT_DURATIONS = np.array([10, 20, 30, 60])
+APPOINTMENT_DURATION_WEIGHTS = np.array([0.65, 0.31, 0.01, 0.03])
+
+def generate_dataset(output_dir:str, providers:int=80, states:int=12, states_per_provider:float=2.5,
+                     weeks:int=4, appointment_density:float=0.5, backlog:int=450, start_date:str='2025-01-01',
+                     seed:int=0) -> dict:
+    """
+    Writes a synthetic dataset to output_dir.
+
+    Args:
+        output_dir (str): folder the CSV files and pattern_map.json are written to
+        providers (int, optional): number of providers
+        states (int, optional): number of states providers are licensed in, at most 50
+        states_per_provider (float, optional): average number of states each provider is licensed in
+        weeks (int, optional): length of the horizon appointments and registrations fall in
+        appointment_density (float, optional): share of the provider slots in the horizon that hold
+            an existing appointment
+        backlog (int, optional): number of new patients waiting for a first appointment
+        start_date (str, optional): first day of the horizon
+        seed (int, optional): seed of the random generator; the same arguments write the same files
+
+    Returns:
+        dict: the number of rows written to each file and the horizon, keyed 'providers',
+            'provider_states', 'schedule_slots', 'appointments', 'new_patients', 'start_date', 'end_date'
+    """
+    if not 1 <= states <= len(STATES):
+        raise ValueError(f"states must be between 1 and {len(STATES)}, got {states}")
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    state_names = np.array(STATES[:states])
+    provider_ids = np.arange(100, 100 + providers)
+
+    # Licences: 1 + a Poisson number of further states, drawn without repeats per provider
+    licence_counts = np.minimum(1 + rng.poisson(max(states_per_provider - 1, 0), providers), states)
+    # Ranking random keys picks a uniformly random subset of states for every provider at once
+    state_ranks = np.argsort(rng.random((providers, states)), axis=1)
+    licensed = state_ranks < licence_counts[:, None]
+    licence_providers, licence_states = np.nonzero(licensed)
+    provider_state_df = pd.DataFrame({'PROVIDERID': provider_ids[licence_providers],
+                                      'STATE': state_names[licence_states]})
+
+    # Weekly template: 3 to 5 working days between Monday and Saturday, one shift each, inside the
+    # 8:30 AM - 9:00 PM business hours process_appointment_times keeps
+    days_per_provider = rng.integers(3, 6, providers)
+    day_ranks = np.argsort(rng.random((providers, 6)), axis=1)
+    works, day_index = np.nonzero(day_ranks < days_per_provider[:, None])
+    shift_start = rng.integers(17, 29, len(works)) * 30          # 8:30 to 14:00, in minutes
+    shift_slots = rng.integers(6, 11, len(works))                # 4 to 6.7 hours of 40 minute slots
+    shift_of_slot = np.repeat(np.arange(len(works)), shift_slots)
+    slot_in_shift = np.arange(shift_slots.sum()) - np.repeat(np.cumsum(shift_slots) - shift_slots, shift_slots)
+    slot_start = shift_start[shift_of_slot] + slot_in_shift * SLOT_MINUTES
+    schedule_df = pd.DataFrame({
+        'PROVIDERID': provider_ids[works[shift_of_slot]],
+        'DAYOFWEEK': day_index[shift_of_slot] + 1,
+        'SLOTSTARTTIME': _format_clock(slot_start, '%H:%M'),
+        'SLOTENDTIME': _format_clock(slot_start + SLOT_MINUTES, '%H:%M')
+    })
+
+    # Existing appointments start on a share of the slots of every week in the horizon
+    first_day = pd.Timestamp(start_date).normalize()
+    days = pd.date_range(first_day, periods=weeks * 7, freq='D')
+    slots_per_week = len(schedule_df)
+    booked = np.flatnonzero(rng.random(slots_per_week * weeks) < appointment_density)
+    week, template_row = np.divmod(booked, slots_per_week)
+    weekday = schedule_df['DAYOFWEEK'].to_numpy()[template_row] - 1
+    day_offset = week * 7 + (weekday - first_day.dayofweek) % 7
+    in_horizon = day_offset < len(days)
+    template_row, day_offset = template_row[in_horizon], day_offset[in_horizon]
+    order = rng.permutation(len(template_row))
+    template_row, day_offset = template_row[order], day_offset[order]
+    appointment_df = pd.DataFrame({
+        'APPOINTMENTID': 200000 + np.arange(len(template_row)),
+        'APPOINTMENTDATE': np.array(days.strftime('%Y-%m-%d'))[day_offset],
+        'APPOINTMENTSTARTTIME': _format_clock(slot_start[template_row], '%I:%M %p'),
+        'APPOINTMENTDURATION': rng.choice(APPOINTMENT_DURATIONS, len(template_row), p=APPOINTMENT_DURATION_WEIGHTS),
+        'PROVIDERID': schedule_df['PROVIDERID'].to_numpy()[template_row]
+    })
+
+    # New patients live in states with licensed providers, in proportion to the licences there
+    new_patient_df = pd.DataFrame({
+        'PATIENTID': 8001 + np.arange(backlog),
+        'STATE': rng.choice(provider_state_df['STATE'].to_numpy(), backlog),
+        'REGISTRATIONDATE': np.array(days.strftime('%Y-%m-%d'))[rng.integers(0, len(days), backlog)],
+        'PROGRAM': rng.choice(PROGRAMS, backlog, p=[0.55, 0.45])
+    })
+
+    # The bundled provider and new patient files carry a byte order mark; the appointment data does not
+    appointment_df.to_csv(os.path.join(output_dir, 'Appointment Data.csv'), index=False)
+    new_patient_df.to_csv(os.path.join(output_dir, 'New Patient Data.csv'), index=False, encoding='utf-8-sig')
+    schedule_df.to_csv(os.path.join(output_dir, 'Provider Schedule Data.csv'), index=False, encoding='utf-8-sig')
+    provider_state_df.to_csv(os.path.join(output_dir, 'Provider State Data.csv'), index=False, encoding='utf-8-sig')
+    with open(os.path.join(output_dir, 'pattern_map.json'), 'w') as file:
+        json.dump(PATTERN_MAP, file, indent=4)
+
+    return {
+        'providers': providers,
+        'provider_states': len(provider_state_df),
+        'schedule_slots': len(schedule_df),
+        'appointments': len(appointment_df),
+        'new_patients': len(new_patient_df),
+        'start_date': str(days[0].date()),
+        'end_date': str(days[-1].date())
+    }
+
+def _format_clock(minutes:np.ndarray, time_format:str) -> np.ndarray:
+    """
+    Formats minutes after midnight, through a lookup table of the 1440 possible values.
+    """
+    clock = np.array(pd.date_range('2000-01-01', periods=24 * 60, freq='min').strftime(time_format))
+    return clock[np.asarray(minutes) % (24 * 60)]
+
+def parse_args(argv=None):
+    """
+    Parse the command line options.
+
+    Args:
+        argv (list[str], optional): Arguments to parse. Defaults to sys.argv.
+
+    Returns:
+        argparse.Namespace: The parsed options
+    """
+    parser = argparse.ArgumentParser(description='Generate seeded synthetic scheduling data in the bundled CSV format.')
+    parser.add_argument('--output-dir', required=True, help='Folder to write the CSV files and pattern_map.json to')
+    parser.add_argument('--providers', type=int, default=80)
+    parser.add_argument('--states', type=int, default=12, help='Number of states providers are licensed in')
+    parser.add_argument('--states-per-provider', type=float, default=2.5)
+    parser.add_argument('--weeks', type=int, default=4)
+    parser.add_argument('--appointment-density', type=float, default=0.5,
+                        help='Share of the provider slots that hold an existing appointment')
+    parser.add_argument('--backlog', type=int, default=450, help='Number of new patients')
+    parser.add_argument('--start-date', default='2025-01-01')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    counts = generate_dataset(args.output_dir, args.providers, args.states, args.states_per_provider, args.weeks,
+                              args.appointment_density, args.backlog, args.start_date, args.seed)
+    print(f"Wrote {counts['providers']} providers, {counts['provider_states']} provider states, "
+          f"{counts['schedule_slots']} weekly slots, {counts['appointments']} appointments and "
+          f"{counts['new_patients']} new patients for {counts['start_date']} to {counts['end_date']} "
+          f"to {args.output_dir}")
+
+if __name__ == '__main__':
+    main()
@@ -1,64 +1,405 @@
 """
-This module handles the preprocessing of appointment data, populating a calendar with provider availability and scheduled appointments, 
-and scheduling new patients into the calendar.
+This module is the command line entry point. It preprocesses appointment data, populates a calendar with provider
+availability and scheduled appointments, and schedules new patients into the calendar.
 
-Classes:
-    Preprocessor: Handles reading and processing of CSV files containing appointment data.
-    CalendarPopulator: Populates a calendar with provider availability and scheduled appointments.
-    NewPatientScheduler: Schedules new patients into the populated calendar.
-    Debug: Manages debug settings.
+Commands:
+    preprocess: Reads the CSV files and builds the populated calendar into the snapshot cache or a SQLite store.
+    schedule: Schedules the new patients and writes the bookings (the default command).
+    backtest: Compares scheduling algorithms on the same inputs without booking anything.
+    report: Renders the TTFA report of saved bookings.
+    serve: Runs the online scheduling service.
+
+Heavy modules (pandas, numpy, matplotlib and the packages built on them) are only imported by the command
+that needs them, so `--help` and argument errors return at once.
 
 Functions:
-    main: The main function that orchestrates the preprocessing, calendar population, and new patient scheduling.
+    build_parser: Builds the command line parser.
+    parse_args: Parses the command line options.
+    load_inputs: Reads the CSV files and builds the populated calendar.
+    preprocess: Runs the preprocess command.
+    schedule: Runs the schedule command.
+    backtest: Runs the backtest command.
+    report: Runs the report command.
+    serve: Runs the serve command.
+    main: Parses the command line and runs the command.
 
 Usage:
-    Run this module to preprocess appointment data, populate the calendar, and schedule new patients.
+    python src/main.py [command] [options]
 """
-import pandas as pd
+import argparse
+import glob
+import os
+import sys
+from datetime import datetime
+
+from util.event_log import EventLog
+from util.profiling import Profiler
+
+
+COMMANDS = ('preprocess', 'schedule', 'backtest', 'report', 'serve')
+DEFAULT_DATA_DIR = 'data/'
+DEFAULT_OUTPUT_DIR = 'data/output/'
+DEFAULT_CACHE_DIR = 'data/cache/'
+# The sample data covers January 2025
+DEFAULT_START_DATE = '2025-01-01'
+# Scheduling algorithms, named as in the backtesting registry, and the mode and objective
+# NewPatientScheduler.schedule_new_patients runs them with
+ALGORITHMS = {
+    'greedy': ('greedy', 'total'),
+    'optimal-total': ('optimal', 'total'),
+    'optimal-max': ('optimal', 'max')
+}
+
+def _date(value:str) -> str:
+    """
+    Argument type of the horizon options: a YYYY-MM-DD date, kept as a string.
+    """
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a YYYY-MM-DD date, got '{value}'")
+    return value
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Build the command line parser, one sub-parser per command.
+
+    Returns:
+        argparse.ArgumentParser: The parser
+    """
+    inputs = argparse.ArgumentParser(add_help=False)
+    inputs.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                        help='Folder holding the CSV files and pattern_map.json (default: %(default)s)')
+    inputs.add_argument('--start-date', type=_date, default=DEFAULT_START_DATE,
+                        help='First day of the scheduling horizon, YYYY-MM-DD (default: %(default)s)')
+    inputs.add_argument('--end-date', type=_date, default=None,
+                        help="Last day of the scheduling horizon, YYYY-MM-DD (default: the end of the start date's month)")
+
+    cache = argparse.ArgumentParser(add_help=False)
+    cache.add_argument('--cache-dir', default=None,
+                       help='Directory for the snapshot cache of parsed inputs (caching is off unless set)')
+    cache.add_argument('--rebuild-cache', action='store_true',
+                       help=f'Ignore any existing snapshot and write a new one (uses {DEFAULT_CACHE_DIR} '
+                            'if --cache-dir is not given)')
+
+    outputs = argparse.ArgumentParser(add_help=False)
+    outputs.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR,
+                         help='Folder reports are written to (default: %(default)s)')
+
+    parser = argparse.ArgumentParser(description='Preprocess appointment data and schedule new patients. '
+                                                 'Without a command, runs schedule.')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+
+    command = commands.add_parser('preprocess', parents=[inputs, cache],
+                                  help='Build the populated calendar into the snapshot cache or a SQLite store')
+    command.add_argument('--store', default=None,
+                         help='Also build this SQLite store from the CSV files, replacing its contents')
+    command.add_argument('--interval-memory-report', action='store_true',
+                         help='Print the memory of the appointment start/end columns next to an estimate of the '
+                              'minute-level time_range column they replaced')
+    command.set_defaults(handler=preprocess)
+
+    command = commands.add_parser('schedule', parents=[inputs, cache, outputs],
+                                  help='Schedule the new patients and write the bookings')
+    command.add_argument('--algorithm', choices=ALGORITHMS, default='greedy',
+                         help='greedy books patients one at a time; optimal-total and optimal-max plan the whole '
+                              'backlog at once, minimizing the total or the maximum time to first appointment')
+    command.add_argument('--time-limit', type=float, default=30.0,
+                         help='For the optimal algorithms, seconds before falling back to the greedy heuristic')
+    command.add_argument('--workers', type=int, default=1,
+                         help='For --algorithm greedy, plan independent state/provider groups in N worker processes '
+                              '(0 for one per CPU); the bookings are identical to a serial run')
+    command.add_argument('--rolling-horizon', action='store_true',
+                         help='For --algorithm greedy, start from the horizon (one week unless --end-date is given) and '
+                              'build later weeks from the weekly schedule when patients run out of timeslots, '
+                              'evicting the weeks behind them')
+    command.add_argument('--id-sequence-file', default=None,
+                         help='File used to reserve blocks of appointment ids so concurrent or resumed runs never collide')
+    command.add_argument('--flush-every', type=int, default=None,
+                         help='Journal bookings every N appointments (default: once at the end)')
+    command.add_argument('--tracker-checkpoint', default=None,
+                         help='.npz file the new appointment counts are loaded from (if present) and saved to')
+    command.add_argument('--store', default=None,
+                         help='SQLite file that keeps the calendar, appointments, counters and new patient queue. '
+                              'If it already holds a calendar, the CSV files are not read again')
+    command.add_argument('--rebuild-store', action='store_true',
+                         help='Rebuild the --store file from the CSV files')
+    command.add_argument('--report', choices=['background', 'inline', 'off'], default='background',
+                         help='Render the TTFA charts and HTML/JSON report in a background process after the bookings '
+                              'are written, in this process, or not at all')
+    command.add_argument('--log-mode', choices=EventLog.MODES, default='full',
+                         help='Which per-patient and per-booking events to keep: all of them, a sample, or none')
+    command.add_argument('--log-file', default=None,
+                         help='Append events to this JSONL file from a background thread instead of printing '
+                              'the per-patient ones')
+    command.add_argument('--log-sample-every', type=int, default=100,
+                         help='With --log-mode sampled, keep one in this many events of each kind')
+    command.add_argument('--profile-dir', default=None,
+                         help='Time every stage, count slots scanned, capacity rejections and bookings, and write '
+                              'profile.json and profile.prom (Prometheus text format) to this directory')
+    command.add_argument('--profile-capture', choices=Profiler.CAPTURE_MODES, default=None,
+                         help='With --profile-dir, also capture a cProfile of the run or the peak memory of every stage')
+    command.add_argument('--debug', action='store_true',
+                         help='Schedule six test patients with provider 202 only, without updating the new patient data')
+    command.set_defaults(handler=schedule)
+
+    command = commands.add_parser('backtest', parents=[inputs],
+                                  help='Compare scheduling algorithms on the same inputs without booking anything')
+    command.add_argument('--algorithms', nargs='+', default=['greedy', 'optimal-total', 'optimal-max'],
+                         help='Registered algorithms to run (default: %(default)s)')
+    command.add_argument('--no-memory', action='store_true', help='Skip the traced run that measures peak memory')
+    command.add_argument('--json', default=None, help='Also write the results to this JSON file')
+    command.set_defaults(handler=backtest)
 
-from preprocessing.preprocessor import Preprocessor
-from preprocessing.populator import CalendarPopulator
-from scheduling.new_patient_scheduler import NewPatientScheduler
-from util.debug import Debug
-from util.utility import read_json
+    command = commands.add_parser('report', parents=[outputs], help='Render the TTFA report of saved bookings')
+    command.add_argument('--bookings', default=None,
+                         help='.npz file of bookings (default: the latest ttfa_bookings_*.npz in --output-dir)')
+    command.set_defaults(handler=report)
 
+    command = commands.add_parser('serve', parents=[inputs, cache], help='Run the online scheduling service')
+    command.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: localhost)')
+    command.add_argument('--port', type=int, default=8080, help='TCP port to listen on')
+    command.add_argument('--socket', default=None, help='Listen on this Unix socket instead of TCP')
+    command.add_argument('--store', default=None,
+                         help='SQLite store to load the calendar from and write every booking to')
+    command.add_argument('--id-sequence-file', default=None, help='File used to reserve blocks of appointment ids')
+    command.add_argument('--flush-every', type=int, default=None,
+                         help='Journal bookings every N appointments (default: on /flush and shutdown)')
+    command.set_defaults(handler=serve)
+    return parser
+
+def parse_args(argv=None):
+    """
+    Parse the command line options. Without a command, the options are those of schedule.
+
+    Args:
+        argv (list[str], optional): Arguments to parse. Defaults to sys.argv.
+
+    Returns:
+        argparse.Namespace: The parsed options
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ('-h', '--help')):
+        argv = ['schedule'] + argv
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'profile_capture', None) and args.profile_dir is None:
+        parser.error('--profile-capture requires --profile-dir')
+    if getattr(args, 'rolling_horizon', False) and (args.algorithm != 'greedy' or args.workers != 1 or args.store):
+        parser.error('--rolling-horizon requires --algorithm greedy, --workers 1 and no --store')
+    if getattr(args, 'rebuild_cache', False) and args.cache_dir is None:
+        args.cache_dir = DEFAULT_CACHE_DIR
+    return args
+
+def load_inputs(args):
+    """
+    Read the CSV files and build the populated calendar, after applying any appointment journal an
+    interrupted run left in the data folder.
+
+    Args:
+        args (argparse.Namespace): the parsed options
+
+    Returns:
+        tuple: the populated calendar, the new patients, the appointment data and the preprocessor
+    """
+    from preprocessing.preprocessor import Preprocessor
+    from scheduling.appointment_data_handler import AppointmentDataHandler
+    from util.utility import read_json
+
+    # Bookings journaled by a run that was interrupted before compacting belong in the files read below
+    AppointmentDataHandler(os.path.join(args.data_dir, 'Appointment Data.csv'),
+                           os.path.join(args.data_dir, 'New Patient Data.csv')).recover()
 
-def main():
     # Maps CSV files to corresponding DataFrames
-    pattern_mapping = read_json('data/pattern_map.json')
+    pattern_mapping = read_json(os.path.join(args.data_dir, 'pattern_map.json'))
 
     # Create preprocessor and load data
-    preprocessor = Preprocessor("data/")
+    preprocessor = Preprocessor(args.data_dir, cache_dir=args.cache_dir, rebuild_cache=args.rebuild_cache)
     dfs = preprocessor.read_csvs(pattern_mapping)
 
-    processed_appointments = preprocessor.process_appointment_times()
+    # Builds the calendar, or updates the cached one with newly appended appointments
+    populated_calendar = preprocessor.populate_calendar(start_date=args.start_date, end_date=args.end_date)
+    print(populated_calendar.to_frame(booked_only=True))
 
-    provider_availability = preprocessor.setup_provider_schedule(month=1, year=2025)
+    new_patient_df = preprocessor.get_dataframe('new_patient_df')
+    return populated_calendar, new_patient_df, preprocessor.get_dataframe('appointment_df'), preprocessor
 
-    # Initialize and use the calendar populator
-    calendar = CalendarPopulator(provider_availability, processed_appointments)
-    populated_calendar = calendar.populate_calendar()
-    print(populated_calendar[populated_calendar['APPOINTMENTID'].notna()])
+def preprocess(args):
+    """
+    Read the CSV files and build the populated calendar into the snapshot cache, so that later commands
+    start from it, and into a SQLite store if one is given.
 
-    new_patient_df = preprocessor.get_dataframe('new_patient_df')
+    Args:
+        args (argparse.Namespace): the parsed options
+    """
+    from scheduling.new_appointment_tracker import NewAppointmentTracker
+    from storage.calendar_store import CalendarStore
+
+    if args.cache_dir is None:
+        args.cache_dir = DEFAULT_CACHE_DIR
+    populated_calendar, new_patient_df, appointment_df, preprocessor = load_inputs(args)
+    if args.interval_memory_report:
+        preprocessor.print_appointment_interval_memory_report()
+    print(f'Populated calendar: {len(populated_calendar)} timeslots ({populated_calendar.state_slot_count()} by state), '
+          f'{populated_calendar.booked_count()} booked, {populated_calendar.memory_usage() / 1024 ** 2:.1f} MB, '
+          f'{len(new_patient_df)} new patients')
+    print(f'Snapshot cache written to {args.cache_dir}')
+
+    if args.store:
+        calendar_store = CalendarStore(args.store)
+        calendar_store.initialize(populated_calendar, new_patient_df, appointment_df, NewAppointmentTracker())
+        calendar_store.close()
+        print(f'Saved calendar to {args.store}')
+
+def schedule(args):
+    """
+    Schedule the new patients into the populated calendar and write the bookings.
 
-    new_patient_scheduler = NewPatientScheduler()
+    Args:
+        args (argparse.Namespace): the parsed options
+    """
+    import pandas as pd
+
+    from scheduling.new_patient_scheduler import NewPatientScheduler
+    from scheduling.rolling_horizon import RollingHorizon
+    from storage.calendar_store import CalendarStore
+    from util.debug import Debug
+
+    event_log = EventLog()
+    event_log.configure(args.log_mode, args.log_file, args.log_sample_every)
+
+    profiler = Profiler()
+    if args.profile_dir:
+        profiler.start(args.profile_capture)
+
+    calendar_store = None
+    if args.store:
+        calendar_store = CalendarStore(args.store)
+
+    if calendar_store is not None and calendar_store.is_initialized() and not args.rebuild_store:
+        print(f'Loading calendar from {args.store}')
+        populated_calendar = calendar_store.get_calendar()
+        new_patient_df = calendar_store.get_new_patient_df()
+        appointment_df = calendar_store.get_appointment_df()
+    else:
+        if args.rolling_horizon and args.end_date is None:
+            # Later weeks are built as the search reaches them
+            args.end_date = str((pd.Timestamp(args.start_date) + pd.Timedelta(days=RollingHorizon.DAYS_PER_WEEK - 1)).date())
+        populated_calendar, new_patient_df, appointment_df, preprocessor = load_inputs(args)
+
+    rolling_horizon = None
+    if args.rolling_horizon:
+        rolling_horizon = RollingHorizon(preprocessor.build_calendar, args.start_date, args.end_date)
+
+    new_patient_scheduler = NewPatientScheduler(appointment_df, args.id_sequence_file, args.flush_every, calendar_store,
+                                                args.data_dir, rolling_horizon)
 
     debug = Debug()
-    debug.set_debug(False)
+    debug.set_debug(args.debug)
     if debug.get_debug():
         # When debugging, only schedule two test patients
         # new_patient_df = new_patient_df[new_patient_df['PATIENTID'].isin([22905, 22922])]
-        populated_calendar = populated_calendar[populated_calendar['PROVIDERID'].isin([202])]
+        populated_calendar = populated_calendar.select_providers([202])
         new_patient_df = pd.DataFrame({
             'PATIENTID': [99990, 99991,99992,99993,99994,99995],
             'STATE': ['CT', 'CT','CT','CT','CT','CT'],
             'REGISTRATIONDATE': ['2025-01-10', '2025-01-10','2025-01-10','2025-01-10','2025-01-10','2025-01-10'],
             'PROGRAM': ['SUD', 'SUD','SUD','SUD','SUD','SUD']})
 
-    updated_calendar = new_patient_scheduler.schedule_new_patients(populated_calendar, new_patient_df)
+    if args.tracker_checkpoint and os.path.exists(args.tracker_checkpoint):
+        new_patient_scheduler.new_appointment_tracker.load(args.tracker_checkpoint)
+
+    if calendar_store is not None:
+        if calendar_store.is_initialized() and not args.rebuild_store:
+            calendar_store.restore_tracker(new_patient_scheduler.new_appointment_tracker)
+        else:
+            calendar_store.initialize(populated_calendar, new_patient_df, appointment_df,
+                                      new_patient_scheduler.new_appointment_tracker)
+            print(f'Saved calendar to {args.store}')
+
+    mode, objective = ALGORITHMS[args.algorithm]
+    updated_calendar = new_patient_scheduler.schedule_new_patients(populated_calendar, new_patient_df,
+                                                                   mode, objective, args.time_limit,
+                                                                   args.workers or None)
+
+    if args.tracker_checkpoint:
+        new_patient_scheduler.new_appointment_tracker.save(args.tracker_checkpoint)
+
+    if args.report != 'off':
+        new_patient_scheduler.analysis.render_report(args.output_dir, background=args.report == 'background')
+
+    if calendar_store is not None:
+        calendar_store.close()
+
+    if args.profile_dir:
+        profiler.stop()
+        os.makedirs(args.profile_dir, exist_ok=True)
+        profiler.write_json(os.path.join(args.profile_dir, 'profile.json'))
+        profiler.write_prometheus(os.path.join(args.profile_dir, 'profile.prom'))
 
     print('Finished scheduling new patients')
+    event_log.close()
+
+def backtest(args):
+    """
+    Run the registered scheduling algorithms on the same inputs and print how they compare.
+
+    Args:
+        args (argparse.Namespace): the parsed options
+    """
+    import json
+
+    from backtesting.algorithms import available_algorithms
+    from backtesting.backtester import Backtester, format_table, load_inputs as load_backtest_inputs
+
+    unknown = [name for name in args.algorithms if name not in available_algorithms()]
+    if unknown:
+        print(f"Error: unknown algorithms {', '.join(unknown)}; available: {', '.join(available_algorithms())}")
+        return
+
+    calendar, new_patient_df = load_backtest_inputs(args.data_dir, start_date=args.start_date, end_date=args.end_date)
+    results = Backtester(calendar, new_patient_df).run(args.algorithms, measure_memory=not args.no_memory)
+
+    print(format_table(results))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=4)
+        print(f'Backtest results written to {args.json}')
+
+def report(args):
+    """
+    Render the TTFA report of bookings saved by a schedule run.
+
+    Args:
+        args (argparse.Namespace): the parsed options
+    """
+    from analysis.report import render_report
+
+    bookings_path = args.bookings
+    if bookings_path is None:
+        # The timestamp in the file names sorts in time order
+        saved = sorted(glob.glob(os.path.join(args.output_dir, 'ttfa_bookings_*.npz')))
+        if not saved:
+            print(f'Error: no saved bookings in {args.output_dir}; run schedule first or pass --bookings')
+            return
+        bookings_path = saved[-1]
+    render_report(bookings_path, args.output_dir)
+
+def serve(args):
+    """
+    Run the online scheduling service until interrupted.
+
+    Args:
+        args (argparse.Namespace): the parsed options
+    """
+    from service.scheduler_service import run
+
+    run(args)
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.handler(args)
     print('Program complete')
 
 if __name__ == '__main__':
@@ -66,7 +407,6 @@ if __name__ == '__main__':
 
 # TODO: If max appointments is 5 per provider per day, what happens if a provider has 5 appointments already scheduled?
 #       Should we increment to their next day on the calendar?
-# TODO: Turn the appointment tracker into a file so the data can be saved and loaded?
 # TODO: Should appointments be booked on same day as registration?
 #       We'd need a timestamp of registration to know
 # TODO: There should be a connection to the new patient and the appointment data.
@@ -1,6 +1,10 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 
+from preprocessing.provider_day_bitmap import ProviderDayBitmap
+from util.profiling import timed
+
 class CalendarPopulator:
 
     def __init__(self, provider_availability_df=None, appointments_df=None):
@@ -31,32 +35,103 @@ class CalendarPopulator:
             if self.appointments[col].dtype != 'datetime64[ns]':
                 self.appointments[col] = pd.to_datetime(self.appointments[col])
 
+    @timed('populate_calendar')
     def populate_calendar(self):
         """
         Populate the calendar by marking availability slots as booked when they overlap with appointments.
-        Uses a simplified overlap detection focused on start times falling within appointment ranges.
+        A slot is booked when an appointment covers any part of it, not only its start time.
+
+        The overlaps are found on a bitmap of every provider's days, see _find_slot_owners, so the cost
+        grows with the number of slots plus the appointment minutes instead of appointments x slots.
+        When appointments overlap, the one appearing last in the appointments dataframe keeps the slot.
+        Availability with a STATE column, one row per slot and state, has every state row of the
+        provider at that start time marked with the same APPOINTMENTID.
         """
         calendar = self.provider_availability.copy()
         calendar['APPOINTMENTID'] = None
 
-        for _, appointment in self.appointments.iterrows():
-            # Find slots where the start time falls within the appointment duration
-            overlapping_slots = calendar[
-                (calendar['PROVIDERID'] == appointment['PROVIDERID']) &
-                (calendar['START_DATETIME'] >= appointment['appointment_start']) &
-                (calendar['START_DATETIME'] < appointment['appointment_end'])
-            ]
-
-            if not overlapping_slots.empty:
-                # Mark all states for this provider during these time slots
-                time_slots = overlapping_slots['START_DATETIME'].unique()
-                calendar.loc[
-                    (calendar['PROVIDERID'] == appointment['PROVIDERID']) &
-                    (calendar['START_DATETIME'].isin(time_slots)),
-                    'APPOINTMENTID'
-                ] = appointment['APPOINTMENTID']
-
-        return calendar.sort_values(['PROVIDERID', 'START_DATETIME', 'STATE'])
+        owners = self._find_slot_owners(calendar)
+        booked = owners >= 0
+        if booked.any():
+            appointment_ids = self.appointments['APPOINTMENTID'].to_numpy(dtype=object)
+            appointment_column = calendar.columns.get_loc('APPOINTMENTID')
+            calendar.iloc[np.flatnonzero(booked), appointment_column] = appointment_ids[owners[booked]]
+
+        return calendar.sort_values([column for column in ['PROVIDERID', 'START_DATETIME', 'STATE'] if column in calendar])
+
+    @timed('populate_calendar')
+    def mark_appointments(self, calendar, appointments_df):
+        """
+        Mark the slots taken by additional appointments on an already populated calendar, in place.
+        Used for appointments appended to the appointment data after the calendar was populated;
+        they come later in the appointments dataframe, so they keep any slot they overlap.
+
+        Args:
+            calendar (ProviderCalendar): A populated calendar.
+            appointments_df (pd.DataFrame): Processed appointments to add to it.
+
+        Returns:
+            ProviderCalendar: The calendar with the new appointments marked.
+        """
+        self.appointments = appointments_df
+        slots = pd.DataFrame({'PROVIDERID': calendar.provider_ids, 'START_DATETIME': calendar.starts.view('datetime64[ns]'),
+                              'END_DATETIME': calendar.ends.view('datetime64[ns]')})
+        owners = self._find_slot_owners(slots)
+        booked = owners >= 0
+        if booked.any():
+            appointment_ids = self.appointments['APPOINTMENTID'].to_numpy(dtype=np.int64)
+            calendar.assign_appointments(np.flatnonzero(booked), appointment_ids[owners[booked]])
+        return calendar
+
+    def _find_slot_owners(self, calendar):
+        """
+        Overlap join between calendar slots and appointments on a ProviderDayBitmap with a row for
+        every provider and day that has slots.
+
+        The bins of every appointment are set in the bitmap and, in a parallel array, painted with the
+        appointment's position, later appointments on top. A slot is taken when any of its bins is set,
+        by the appointment painted last in them, so an appointment covering only part of a slot takes it.
+
+        Args:
+            calendar (pd.DataFrame): The calendar dataframe with PROVIDERID, START_DATETIME and
+                END_DATETIME columns.
+
+        Returns:
+            np.ndarray: For each calendar row, the position of the owning appointment in
+                self.appointments, or -1 when the slot is free.
+        """
+        owners = np.full(len(calendar), -1, dtype=np.int64)
+        if calendar.empty or self.appointments.empty:
+            return owners
+
+        slot_providers = calendar['PROVIDERID'].to_numpy(dtype=np.int64)
+        slot_starts = calendar['START_DATETIME'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        slot_ends = calendar['END_DATETIME'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        bitmap = ProviderDayBitmap.covering(slot_providers, slot_starts)
+
+        appointment_providers = pd.to_numeric(self.appointments['PROVIDERID'], errors='coerce').to_numpy(dtype=float)
+        appointment_starts = self.appointments['appointment_start'].to_numpy(dtype='datetime64[ns]')
+        appointment_ends = self.appointments['appointment_end'].to_numpy(dtype='datetime64[ns]')
+        valid = ~np.isnan(appointment_providers) & ~np.isnat(appointment_starts) & ~np.isnat(appointment_ends)
+        positions = np.flatnonzero(valid)
+        if positions.size == 0:
+            return owners
+
+        # Appointments on a provider's day without slots can never overlap, and are skipped
+        bins, appointment_of_bin = bitmap.flat_bins(appointment_providers[valid].astype(np.int64),
+                                                    appointment_starts[valid].view(np.int64),
+                                                    appointment_ends[valid].view(np.int64))
+        # The extra last bin keeps the slot ranges reduced below within bounds
+        painted = np.full(bitmap.bits.size + 1, -1, dtype=np.int64)
+        np.maximum.at(painted, bins, positions[appointment_of_bin])
+        bitmap.bits.ravel()[bins] = True
+
+        booked = bitmap.any_marked(slot_providers, slot_starts, slot_ends)
+        if booked.any():
+            rows, first_bins, end_bins = bitmap.locate(slot_providers[booked], slot_starts[booked], slot_ends[booked])
+            bounds = np.column_stack((rows * bitmap.BINS_PER_DAY + first_bins, rows * bitmap.BINS_PER_DAY + end_bins))
+            owners[booked] = np.maximum.reduceat(painted, bounds.ravel())[::2]
+        return owners
 
     def get_available_slots(self, calendar, provider_id=None, state=None, start_date=None, end_date=None):
         """
@@ -1,29 +1,70 @@
+import numpy as np
 import pandas as pd
+import io
 import os
+import sys
 import re
 import glob
 import calendar
 from datetime import datetime, timedelta
 
+from preprocessing.populator import CalendarPopulator
+from preprocessing.provider_calendar import ProviderCalendar
+from preprocessing.provider_day_bitmap import BUSINESS_END_MINUTE, BUSINESS_START_MINUTE, within_business_hours
+from preprocessing.snapshot_cache import SnapshotCache
+from util.profiling import timed
+
 class Preprocessor:
     """
     The Preprocessor class is responsible for reading and preprocessing the input data.
     It can read multiple CSV files, join provider schedule data with state data, and process appointment times.
-    """
 
-    def __init__(self, folderpath=None):
+    With a snapshot cache, the appointment data is ingested incrementally: the snapshot records how far
+    the file was read, and a later run only reads the rows appended since and marks them on the cached
+    populated calendar.
+    """
+    # Sources that only grow by appended rows, with the column identifying each row
+    APPENDABLE_SOURCES = {'appointment_df': 'APPOINTMENTID'}
+    # Sources no other cached DataFrame is derived from
+    INDEPENDENT_SOURCES = ('new_patient_df', )
+    # Preprocessed DataFrames kept until the source they are derived from is read again
+    DERIVED_FRAMES = {
+        'appointment_df': ('appointment_df_processed', ),
+        'provider_schedule_df': ('provider_schedule_with_state', 'provider_schedule_business_hours'),
+        'provider_state_df': ('provider_schedule_with_state', 'provider_schedule_business_hours')
+    }
+
+    def __init__(self, folderpath=None, cache_dir=None, rebuild_cache=False):
         """
         Initialize the Preprocessor with a folder path.
 
         Args:
             folderpath (str, optional): Path to the folder containing CSV files
+            cache_dir (str, optional): Directory for the opt-in snapshot cache of parsed and
+                preprocessed DataFrames. Caching is disabled when None.
+            rebuild_cache (bool, optional): Ignore any existing snapshot and write a fresh one
         """
         self.folderpath = folderpath
         self.dataframes = {}  # Dictionary to store multiple dataframes
-
+        self.snapshot_cache = SnapshotCache(cache_dir) if cache_dir else None
+        self.rebuild_cache = rebuild_cache
+        self.loaded_from_snapshot = False
+        self.source_files = {}
+        self.high_water_marks = {}
+        self.appended_rows = {}
+        # Derived from a DataFrame once and reused while it stays the same object, see build_calendar
+        self.__appointment_starts = None
+        self.__schedule_template = None
+        self.__provider_licences = None
+
+    @timed('read_csvs')
     def read_csvs(self, pattern_df_mapping):
         """
         Read multiple CSV files matching regex patterns and assign to specified DataFrame names.
+
+        When a snapshot cache is configured and every matched file is unchanged, the parsed and
+        preprocessed DataFrames are loaded from the snapshot instead. Otherwise the CSVs are parsed,
+        preprocessed and written to a fresh snapshot.
         """
         try:
             # Check if pattern_df_mapping is None or empty
@@ -43,6 +84,7 @@ class Preprocessor:
             all_csv_files = glob.glob(os.path.join(self.folderpath, "*.csv"))
             print(f"Found CSV files: {all_csv_files}")  # Debug print
 
+            source_files = {}
             for pattern, df_name in pattern_df_mapping.items():
                 matching_files = []
                 for file in all_csv_files:
@@ -58,11 +100,24 @@ class Preprocessor:
                 if len(matching_files) > 1:
                     print(f"Warning: Multiple files found for pattern '{pattern}'. Using the first match.")
 
-                try:
-                    self.dataframes[df_name] = pd.read_csv(matching_files[0])
-                    print(f"Successfully loaded {matching_files[0]} as {df_name}")
-                except Exception as e:
-                    print(f"Error reading {matching_files[0]}: {str(e)}")
+                source_files[df_name] = matching_files[0]
+
+            self.source_files = source_files
+            if self.snapshot_cache is not None and not self.rebuild_cache:
+                cached_dataframes = self.snapshot_cache.load(source_files, self.APPENDABLE_SOURCES, self.INDEPENDENT_SOURCES)
+                if cached_dataframes is not None:
+                    self.dataframes.update(cached_dataframes)
+                    self.loaded_from_snapshot = True
+                    self.__refresh_stale_sources(source_files)
+                    for df_name, offset in self.snapshot_cache.tails.items():
+                        self.__read_appended_rows(df_name, source_files[df_name], offset)
+                    return self.dataframes
+
+            for df_name, file in source_files.items():
+                self.__read_source(df_name, file)
+
+            if self.snapshot_cache is not None:
+                self.__save_snapshot(source_files)
 
             return self.dataframes
 
@@ -70,6 +125,241 @@ class Preprocessor:
             print(f"Error in read_csvs: {str(e)}")
             return None
 
+    def __read_source(self, df_name, file):
+        """
+        Parse one CSV file. An appendable source is read as bytes first, so the high-water mark
+        describes exactly the rows that were parsed even if the file is appended to meanwhile.
+        """
+        try:
+            if df_name in self.APPENDABLE_SOURCES:
+                with open(file, 'rb') as source:
+                    data = source.read()
+                df = pd.read_csv(io.BytesIO(data))
+                if self.snapshot_cache is not None:
+                    key_column = self.APPENDABLE_SOURCES[df_name]
+                    last_key = df[key_column].iloc[-1] if len(df) else None
+                    self.high_water_marks[df_name] = self.snapshot_cache.high_water_mark(file, len(data), last_key)
+            else:
+                df = pd.read_csv(file)
+            self.dataframes[df_name] = df
+            for derived_name in self.DERIVED_FRAMES.get(df_name, ()):
+                self.dataframes.pop(derived_name, None)
+            print(f"Successfully loaded {file} as {df_name}")
+        except Exception as e:
+            print(f"Error reading {file}: {str(e)}")
+
+    def __refresh_stale_sources(self, source_files):
+        """
+        Re-read the independent sources that changed since the snapshot and store them in it.
+        """
+        stale_files = {df_name: source_files[df_name] for df_name in self.snapshot_cache.stale_sources}
+        for df_name, file in stale_files.items():
+            self.__read_source(df_name, file)
+        if stale_files:
+            self.snapshot_cache.update(stale_files, {df_name: self.dataframes[df_name] for df_name in stale_files})
+
+    def __read_appended_rows(self, df_name, file, offset):
+        """
+        Read the rows appended to a source after the offset its snapshot was taken at and add
+        them to its DataFrame. For the appointment data, the processed appointments are extended
+        the same way and the new rows are kept for populate_calendar to mark.
+
+        Args:
+            df_name (str): name of the appendable source
+            file (str): the source file
+            offset (int): byte offset the snapshot read up to
+        """
+        with open(file, 'rb') as source:
+            source.seek(offset)
+            data = source.read()
+
+        df = self.dataframes[df_name]
+        appended_df = pd.read_csv(io.BytesIO(data), header=None, names=list(df.columns), skip_blank_lines=True)
+        appended_df = appended_df.astype(df.dtypes.to_dict())
+        appended_df.index = pd.RangeIndex(len(df), len(df) + len(appended_df))
+        self.dataframes[df_name] = pd.concat([df, appended_df])
+        self.appended_rows[df_name] = appended_df
+
+        key_column = self.APPENDABLE_SOURCES[df_name]
+        last_key = self.dataframes[df_name][key_column].iloc[-1] if len(self.dataframes[df_name]) else None
+        self.high_water_marks[df_name] = self.snapshot_cache.high_water_mark(file, offset + len(data), last_key)
+        print(f"Read {len(appended_df)} rows appended to {file} since the snapshot")
+
+        if df_name == 'appointment_df' and 'appointment_df_processed' in self.dataframes:
+            processed_df = self.__process_appointment_rows(appended_df)
+            self.dataframes['appointment_df_processed'] = pd.concat([self.dataframes['appointment_df_processed'], processed_df])
+            self.appended_rows['appointment_df_processed'] = processed_df
+
+    def __save_snapshot(self, source_files):
+        """
+        Run the preprocessing steps that only depend on the CSVs and store their results,
+        together with the parsed CSVs, in the snapshot cache.
+
+        Args:
+            source_files (dict): Maps DataFrame names to the CSV file they were read from
+        """
+        if self.process_appointment_times() is None or self.join_provider_state_data() is None:
+            print("Warning: Preprocessing failed, snapshot cache not written")
+            return
+        try:
+            self.snapshot_cache.save(source_files, self.dataframes, self.high_water_marks)
+        except Exception as e:
+            print(f"Error writing snapshot cache: {str(e)}")
+
+    def populate_calendar(self, year=None, month=None, start_date=None, end_date=None):
+        """
+        Build the provider calendar for a month, or for the horizon from start_date to end_date, and
+        mark the slots taken by existing appointments. Each timeslot is stored once, with the states
+        its provider is licensed in kept apart, see ProviderCalendar.
+
+        With a snapshot cache the populated calendar is stored in the snapshot. On later runs it is
+        loaded from there, and only appointments appended to the appointment data since are marked
+        on it, through the same interval join CalendarPopulator uses for the whole file. The
+        high-water mark covers the whole snapshot, so the appended appointments are marked on every
+        cached calendar, whatever its horizon, and all of them are stored with the new mark.
+
+        Args:
+            year (int, optional): Year of the calendar. Defaults to the current year.
+            month (int, optional): Month of the calendar. Defaults to the current month.
+            start_date (str or datetime, optional): First day of the horizon, as in setup_provider_schedule
+            end_date (str or datetime, optional): Last day of the horizon, as in setup_provider_schedule
+
+        Returns:
+            ProviderCalendar: The populated calendar
+        """
+        if start_date is None and end_date is None:
+            today = datetime.now()
+            frame_name = f'populated_calendar_{year or today.year}_{month or today.month:02d}'
+        else:
+            start_date, end_date, _ = self.__resolve_schedule_horizon(year, month, start_date, end_date)
+            frame_name = f'populated_calendar_{start_date:%Y%m%d}_{end_date:%Y%m%d}'
+        licences_name = f'{frame_name}_licences'
+
+        appended_appointments = self.appended_rows.get('appointment_df_processed')
+        marked_calendars = []
+        if self.loaded_from_snapshot and appended_appointments is not None:
+            marked_calendars = self.__mark_cached_calendars(appended_appointments)
+
+        if self.loaded_from_snapshot and frame_name in self.dataframes and licences_name in self.dataframes:
+            populated_calendar = ProviderCalendar(self.dataframes[frame_name], self.dataframes[licences_name])
+            if appended_appointments is None:
+                print(f"Loaded the populated calendar from the snapshot cache")
+                return populated_calendar
+        else:
+            populated_calendar = self.build_calendar(year=year, month=month, start_date=start_date, end_date=end_date)
+
+        self.dataframes[frame_name] = populated_calendar.slots
+        self.dataframes[licences_name] = populated_calendar.licences
+        if self.snapshot_cache is not None:
+            # The calendars, the appended frames and their high-water marks are switched over together
+            appended_files = {df_name: self.source_files[df_name] for df_name in self.APPENDABLE_SOURCES
+                              if df_name in self.appended_rows}
+            frames = {df_name: self.dataframes[df_name]
+                      for df_name in [frame_name, licences_name] + marked_calendars + list(self.appended_rows)}
+            try:
+                self.snapshot_cache.update(appended_files, frames, self.high_water_marks)
+                self.appended_rows = {}
+            except Exception as e:
+                print(f"Error writing snapshot cache: {str(e)}")
+        return populated_calendar
+
+    def __mark_cached_calendars(self, appended_appointments):
+        """
+        Mark appended appointments on every populated calendar loaded from the snapshot.
+
+        Args:
+            appended_appointments (pandas.DataFrame): Processed appointments read after the high-water mark
+
+        Returns:
+            list: Names of the calendar frames that were marked
+        """
+        marked_calendars = []
+        for frame_name in list(self.dataframes):
+            licences_name = f'{frame_name}_licences'
+            if not frame_name.startswith('populated_calendar_') or licences_name not in self.dataframes:
+                continue
+            cached_calendar = ProviderCalendar(self.dataframes[frame_name], self.dataframes[licences_name])
+            CalendarPopulator().mark_appointments(cached_calendar, appended_appointments)
+            self.dataframes[frame_name] = cached_calendar.slots
+            marked_calendars.append(frame_name)
+        if marked_calendars:
+            print(f"Marked {len(appended_appointments)} appended appointments on {len(marked_calendars)} cached calendars")
+        return marked_calendars
+
+    def build_calendar(self, year=None, month=None, start_date=None, end_date=None):
+        """
+        Build and populate the provider calendar of a month, or of the horizon from start_date to
+        end_date, without going through the snapshot cache. RollingHorizon builds each week it adds
+        to the calendar with it.
+
+        Only the appointments overlapping the horizon are handed to the CalendarPopulator. They are
+        found on the appointments sorted by start, which are sorted once and reused, as are the
+        weekly schedule template and the provider licences, so a week costs its own slots and
+        appointments rather than the whole appointment data.
+
+        Args:
+            year (int, optional): Year of the calendar. Defaults to the current year.
+            month (int, optional): Month of the calendar. Defaults to the current month.
+            start_date (str or datetime, optional): First day of the horizon, as in setup_provider_schedule
+            end_date (str or datetime, optional): Last day of the horizon, as in setup_provider_schedule
+
+        Returns:
+            ProviderCalendar: The populated calendar, or None if the schedule could not be set up
+        """
+        processed_appointments = self.process_appointment_times()
+        provider_availability = self.setup_provider_schedule(year=year, month=month, start_date=start_date,
+                                                             end_date=end_date)
+        if processed_appointments is None or provider_availability is None:
+            return None
+        appointments = self.__appointments_overlapping(processed_appointments,
+                                                       provider_availability['START_DATETIME'].min(),
+                                                       provider_availability['END_DATETIME'].max())
+        slots_df = CalendarPopulator(provider_availability, appointments).populate_calendar()
+        return ProviderCalendar.from_slots(slots_df, self.get_provider_licences())
+
+    def __appointments_overlapping(self, appointments_df, start, end):
+        """
+        The processed appointments overlapping [start, end), in their original order, which decides
+        who keeps a slot when appointments overlap.
+
+        Returns:
+            pandas.DataFrame: The overlapping rows of appointments_df
+        """
+        if pd.isna(start) or pd.isna(end):
+            return appointments_df.iloc[:0]
+        if self.__appointment_starts is None or self.__appointment_starts[0] is not appointments_df:
+            starts = appointments_df['appointment_start_ns'].to_numpy()
+            order = np.argsort(starts, kind='stable')
+            durations = appointments_df['appointment_end_ns'].to_numpy() - starts
+            longest = int(durations.max()) if len(durations) else 0
+            self.__appointment_starts = (appointments_df, order, starts[order], longest)
+        _, order, sorted_starts, longest = self.__appointment_starts
+
+        start, end = pd.Timestamp(start).value, pd.Timestamp(end).value
+        # An appointment starting more than the longest duration before the horizon ends before it
+        candidates = np.sort(order[np.searchsorted(sorted_starts, start - longest, 'left'):
+                                   np.searchsorted(sorted_starts, end, 'left')])
+        overlapping = (appointments_df['appointment_start_ns'].to_numpy()[candidates] >= start) | \
+            (appointments_df['appointment_end_ns'].to_numpy()[candidates] > start)
+        return appointments_df.iloc[candidates[overlapping]]
+
+    def get_provider_licences(self):
+        """
+        The states each scheduled provider is licensed in.
+
+        Returns:
+            pandas.DataFrame: PROVIDERID and STATE, one row per licence, or None if the data is not loaded
+        """
+        schedule_df = self.dataframes.get('provider_schedule_business_hours')
+        if schedule_df is None:
+            schedule_df = self.join_provider_state_data()
+        if schedule_df is None:
+            return None
+        if self.__provider_licences is None or self.__provider_licences[0] is not schedule_df:
+            self.__provider_licences = (schedule_df, schedule_df[['PROVIDERID', 'STATE']].dropna()
+                                        .drop_duplicates().reset_index(drop=True))
+        return self.__provider_licences[1]
+
     def get_dataframe(self, df_name):
         """
         Retrieve a specific DataFrame by name.
@@ -94,6 +384,10 @@ class Preprocessor:
             pandas.DataFrame: Joined DataFrame with provider schedule and state data
         """
         try:
+            # Built once, when the snapshot is saved or loaded or on the first call, and reused after
+            if (provider_key, how) == ('PROVIDERID', 'left') and 'provider_schedule_business_hours' in self.dataframes:
+                return self.dataframes['provider_schedule_business_hours']
+
             schedule_df = self.dataframes.get('provider_schedule_df')
             state_df = self.dataframes.get('provider_state_df')
 
@@ -129,16 +423,13 @@ class Preprocessor:
 
             joined_df = joined_df.copy()
 
-            # Define the time range (we'll only care about the time, not the date)
-            start_time = pd.to_datetime('2025-02-20 08:30:00').time()  # Extracting only the time
-            end_time = pd.to_datetime('2025-02-20 21:00:00').time()
+            # Minutes after midnight (we'll only care about the time, not the date)
+            slot_start_minutes = pd.to_timedelta(joined_df['SLOTSTARTTIME'].astype(str) + ':00') // pd.Timedelta(minutes=1)
 
-            joined_df['SLOTSTARTTIME_TIMESTAMP'] = pd.to_datetime(joined_df['SLOTSTARTTIME']).dt.time
+            # GET RID OF SLOTS THAT DON'T START WITHIN THE START AND END TIMES 8:30 AM - 9:00 PM
+            joined_df = joined_df[(slot_start_minutes >= BUSINESS_START_MINUTE) & (slot_start_minutes <= BUSINESS_END_MINUTE)]
 
-            # GET RID OF SLOTS THAT DON'T FIT WITHIN THE START AND END TIMES 8:30 AM - 9:00 PM
-            joined_df = joined_df[(joined_df['SLOTSTARTTIME_TIMESTAMP'] >= start_time) & (joined_df['SLOTSTARTTIME_TIMESTAMP'] <= end_time)]
-
-            joined_df = joined_df.drop('SLOTSTARTTIME_TIMESTAMP', axis=1)
+            self.dataframes['provider_schedule_business_hours'] = joined_df
 
             return joined_df
 
@@ -146,62 +437,33 @@ class Preprocessor:
             print(f"Error joining provider state data: {str(e)}")
             return None
 
+    @timed('process_appointment_times')
     def process_appointment_times(self, ):
         """
         Process appointment dataframe to:
         1. Convert date and time to datetime objects
         2. Calculate end time based on duration
         3. Remove appointments outside business hours (8:30 AM - 9:00 PM)
+        4. Keep each appointment's interval as int64 start/end nanosecond columns
+           (appointment_start_ns, appointment_end_ns) for overlap checks
 
-        TO DO, SEND THE CANCELLED APPOINTMENTS BACK TO THE QUEUE
+        Cancelled appointments are released, and their patients sent back to the queue, by
+        NewPatientScheduler.cancel_appointment.
 
         Returns:
             pandas.DataFrame: Processed appointment DataFrame
         """
         try:
+            # Built once, when the snapshot is saved or loaded or on the first call, and reused after
+            if 'appointment_df_processed' in self.dataframes:
+                return self.dataframes['appointment_df_processed']
+
             # Get the appointment dataframe
             df = self.dataframes.get('appointment_df')
             if df is None:
                 raise ValueError("Appointment DataFrame not found. Please load the data first.")
 
-            # Make a copy to avoid modifying original
-            df = df.copy()
-
-            # Combine date and time into a single datetime column
-            df['appointment_start'] = pd.to_datetime(
-                df['APPOINTMENTDATE'] + ' ' + df['APPOINTMENTSTARTTIME'],
-                format='%Y-%m-%d %I:%M %p'
-            )
-
-            # Convert duration to timedelta and calculate end time
-            df['appointment_end'] = df['appointment_start'] + pd.to_timedelta(df['APPOINTMENTDURATION'], unit='minutes')
-
-            # Create time range (useful for checking overlaps)
-            df['time_range'] = df.apply(
-                lambda x: pd.date_range(
-                    start=x['appointment_start'],
-                    end=x['appointment_end'],
-                    freq='min'  # 'min' represents minutes
-                ),
-                axis=1
-            )
-
-            # Filter for business hours
-            df['start_time'] = df['appointment_start'].dt.time
-            df['end_time'] = df['appointment_end'].dt.time
-
-            # Create business hour bounds
-            business_start = pd.to_datetime('8:30 AM').time()
-            business_end = pd.to_datetime('9:00 PM').time()
-
-            # Filter appointments within business hours
-            df_filtered = df[
-                (df['start_time'] >= business_start) &
-                (df['end_time'] <= business_end)
-            ]
-
-            # Remove temporary columns used for filtering
-            df_filtered = df_filtered.drop(['start_time', 'end_time'], axis=1)
+            df, df_filtered = self.__process_appointment_rows(df, keep_all=True)
 
             # Store processed dataframe
             self.dataframes['appointment_df_processed'] = df_filtered
@@ -217,13 +479,97 @@ class Preprocessor:
             print(f"Error processing appointment times: {str(e)}")
             return None
 
-    def setup_provider_schedule(self, year=None, month=None):
+    def __process_appointment_rows(self, df, keep_all=False):
+        """
+        Convert the date and time of appointment rows and keep those within business hours.
+
+        Args:
+            df (pandas.DataFrame): Appointment rows in the Appointment Data columns
+            keep_all (bool, optional): Also return every converted row, before the business hours filter
+
+        Returns:
+            pandas.DataFrame or tuple: The processed rows, preceded by all converted rows if keep_all
+        """
+        # Make a copy to avoid modifying original
+        df = df.copy()
+
+        # Combine date and time into a single datetime column
+        df['appointment_start'] = pd.to_datetime(
+            df['APPOINTMENTDATE'] + ' ' + df['APPOINTMENTSTARTTIME'],
+            format='%Y-%m-%d %I:%M %p'
+        )
+
+        # Convert duration to timedelta and calculate end time
+        df['appointment_end'] = df['appointment_start'] + pd.to_timedelta(df['APPOINTMENTDURATION'], unit='minutes')
+
+        # Compact interval representation (useful for checking overlaps): nanoseconds since epoch
+        df['appointment_start_ns'] = df['appointment_start'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        df['appointment_end_ns'] = df['appointment_end'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+        # Filter appointments within business hours (8:30 AM - 9:00 PM)
+        df_filtered = df[within_business_hours(df['appointment_start_ns'].to_numpy(), df['appointment_end_ns'].to_numpy())]
+
+        return (df, df_filtered) if keep_all else df_filtered
+
+    def appointment_interval_memory_report(self, df=None):
+        """
+        Compare the memory used by the compact start/end interval columns with the minute-level
+        time_range column that process_appointment_times used to build for every appointment.
+
+        The old column held one pd.DatetimeIndex per appointment with a timestamp for every minute
+        from start to end (inclusive), so its size is estimated from the appointment durations
+        rather than built just to be measured: 8 bytes a minute plus the overhead of an empty index.
+
+        Args:
+            df (pd.DataFrame, optional): Processed appointments. Defaults to appointment_df_processed.
+
+        Returns:
+            dict: Estimated bytes before and measured bytes after, keyed 'estimated_time_range_bytes'
+                and 'interval_bytes'
+        """
+        if df is None:
+            df = self.dataframes.get('appointment_df_processed')
+        if df is None:
+            raise ValueError("Processed appointment DataFrame not found. Please process appointment times first.")
+
+        minutes = (df['appointment_end_ns'] - df['appointment_start_ns']) // 60_000_000_000 + 1
+        index_overhead = sys.getsizeof(pd.DatetimeIndex([])) + pd.Series([None]).memory_usage(index=False)
+        estimated_time_range_bytes = int(minutes.clip(lower=0).sum() * 8 + len(df) * index_overhead)
+        interval_bytes = int(df[['appointment_start_ns', 'appointment_end_ns']].memory_usage(index=False).sum())
+
+        return {'estimated_time_range_bytes': estimated_time_range_bytes, 'interval_bytes': interval_bytes}
+
+    def print_appointment_interval_memory_report(self, df=None):
+        """
+        Print the before and after footprint of the appointment interval representation, see
+        appointment_interval_memory_report. Only printed when asked for, e.g. by `preprocess --interval-memory-report`.
+
+        Args:
+            df (pd.DataFrame, optional): Processed appointments. Defaults to appointment_df_processed.
+        """
+        report = self.appointment_interval_memory_report(df)
+        print("Appointment interval memory report:")
+        print(f"  Minute-level time_range column, estimated from the durations (not built): "
+              f"{report['estimated_time_range_bytes'] / 1024 ** 2:.2f} MB")
+        print(f"  int64 start/end columns, measured: {report['interval_bytes'] / 1024 ** 2:.2f} MB")
+
+    @timed('setup_provider_schedule')
+    def setup_provider_schedule(self, year=None, month=None, start_date=None, end_date=None):
         """
         Set up a calendar of date-time slots for providers based on their weekly schedule.
 
+        The weekly template is crossed with every matching weekday of the horizon using array
+        operations, so the horizon can span several months without a per-day Python loop.
+        When neither start_date nor end_date is given, the horizon is the whole of year/month.
+        Each timeslot appears once; the states of its provider are given by get_provider_licences.
+
         Args:
             year (int, optional): Year to generate schedule for. Defaults to current year.
             month (int, optional): Month to generate schedule for. Defaults to current month.
+            start_date (str or datetime, optional): First day of the horizon (inclusive).
+                Defaults to the first day of end_date's month.
+            end_date (str or datetime, optional): Last day of the horizon (inclusive).
+                Defaults to the last day of start_date's month.
 
         Returns:
             pandas.DataFrame: Calendar of available slots with provider IDs
@@ -232,60 +578,48 @@ class Preprocessor:
             schedule_df = self.join_provider_state_data()
             if schedule_df is None:
                 raise ValueError("Provider schedule DataFrame not found. Please load the data first.")
-
-            # Use current year and month if not specified
-            today = datetime.now()
-            year = year or today.year
-            month = month or today.month
-
-            # Get number of days in the month
-            num_days = calendar.monthrange(year, month)[1]
-
-            # Create a list to store all schedule entries
-            schedule_entries = []
-
-            # For each provider's schedule
-            for _, row in schedule_df.iterrows():
-                provider_id = row['PROVIDERID']
-                day_of_week = row['DAYOFWEEK']  # 1 = Monday, 7 = Sunday
-                start_time = datetime.strptime(row['SLOTSTARTTIME'], '%H:%M').time()
-                end_time = datetime.strptime(row['SLOTENDTIME'], '%H:%M').time()
-
-                # For each day in the month
-                for day in range(1, num_days + 1):
-                    # Create datetime for this day
-                    current_date = datetime(year, month, day)
-
-                    # Check if this day matches the provider's schedule day
-                    # Convert Python's weekday (0 = Monday) to match your data's format
-                    if (current_date.weekday() + 1) == day_of_week:
-                        # Create datetime for start and end times
-                        slot_start = datetime.combine(current_date, start_time)
-                        slot_end = datetime.combine(current_date, end_time)
-
-                        # Calculate time range
-                        time_range = slot_end - slot_start
-
-                        # Add entry to schedule
-                        schedule_entries.append({
-                            'PROVIDERID': provider_id,
-                            'DATE': current_date.date(),
-                            'START_DATETIME': slot_start,
-                            'END_DATETIME': slot_end,
-                            'TIME_RANGE': time_range,  # New column
-                            'STATE': row.get('STATE', None)  # Include state if available
-                        })
-
-            # Create DataFrame from entries
-            provider_availability_df = pd.DataFrame(schedule_entries)
+            # The join repeats every template row once per licensed state
+            if self.__schedule_template is None or self.__schedule_template[0] is not schedule_df:
+                self.__schedule_template = (schedule_df, schedule_df.drop_duplicates(
+                    ['PROVIDERID', 'DAYOFWEEK', 'SLOTSTARTTIME', 'SLOTENDTIME']))
+            schedule_df = self.__schedule_template[1]
+
+            start_date, end_date, horizon_name = self.__resolve_schedule_horizon(year, month, start_date, end_date)
+
+            # Group the days of the horizon by weekday (1 = Monday, 7 = Sunday), keeping them in date order
+            days = pd.date_range(start_date, end_date, freq='D')
+            day_of_week = days.dayofweek.to_numpy() + 1
+            days_by_weekday = days.to_numpy()[np.argsort(day_of_week, kind='stable')]
+            days_per_weekday = np.bincount(day_of_week, minlength=8)
+            first_day_of_weekday = np.concatenate(([0], np.cumsum(days_per_weekday)[:-1]))
+
+            # Each template row is repeated once for every day in the horizon that falls on its weekday
+            row_weekdays = pd.to_numeric(schedule_df['DAYOFWEEK'], errors='coerce').to_numpy()
+            row_weekdays = np.where((row_weekdays >= 1) & (row_weekdays <= 7), row_weekdays, 0).astype(np.int64)
+            repeats = np.where(row_weekdays > 0, days_per_weekday[row_weekdays], 0)
+            row_index = np.repeat(np.arange(len(schedule_df)), repeats)
+            day_offset = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+            slot_dates = days_by_weekday[np.repeat(first_day_of_weekday[row_weekdays], repeats) + day_offset]
+
+            start_offsets = pd.to_timedelta(schedule_df['SLOTSTARTTIME'].astype(str) + ':00').to_numpy()
+            end_offsets = pd.to_timedelta(schedule_df['SLOTENDTIME'].astype(str) + ':00').to_numpy()
+
+            provider_availability_df = pd.DataFrame({
+                'PROVIDERID': schedule_df['PROVIDERID'].to_numpy()[row_index],
+                'DATE': slot_dates,
+                'START_DATETIME': slot_dates + start_offsets[row_index],
+                'END_DATETIME': slot_dates + end_offsets[row_index],
+                'TIME_RANGE': end_offsets[row_index] - start_offsets[row_index]
+            })
 
             # Sort by date and start time
-            provider_availability_df = provider_availability_df.sort_values(['DATE', 'START_DATETIME', 'PROVIDERID'])
+            provider_availability_df = provider_availability_df.sort_values(
+                ['DATE', 'START_DATETIME', 'PROVIDERID'], kind='stable')
 
             # Store in dataframes dictionary
             self.dataframes['provider_calendar'] = provider_availability_df
 
-            print(f"Successfully created schedule for {calendar.month_name[month]} {year}")
+            print(f"Successfully created schedule for {horizon_name}")
             print(f"Total slots generated: {len(provider_availability_df)}")
 
             return provider_availability_df
@@ -293,3 +627,31 @@ class Preprocessor:
         except Exception as e:
             print(f"Error setting up schedule: {str(e)}")
             return None
+
+    def __resolve_schedule_horizon(self, year, month, start_date, end_date):
+        """
+        Work out the first and last day of the schedule horizon.
+
+        Returns:
+            tuple: (start_date, end_date, description) where both dates are normalized pd.Timestamps
+        """
+        if start_date is None and end_date is None:
+            # Use current year and month if not specified
+            today = datetime.now()
+            year = year or today.year
+            month = month or today.month
+            num_days = calendar.monthrange(year, month)[1]
+            return (pd.Timestamp(year, month, 1), pd.Timestamp(year, month, num_days),
+                    f"{calendar.month_name[month]} {year}")
+
+        if start_date is None:
+            start_date = pd.Timestamp(end_date).replace(day=1)
+        start_date = pd.Timestamp(start_date).normalize()
+        if end_date is None:
+            end_date = start_date + pd.offsets.MonthEnd(0)
+        end_date = pd.Timestamp(end_date).normalize()
+
+        if end_date < start_date:
+            raise ValueError(f"end_date {end_date.date()} is before start_date {start_date.date()}")
+
+        return start_date, end_date, f"{start_date.date()} to {end_date.date()}"
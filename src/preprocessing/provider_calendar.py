@@ -0,0 +1,386 @@
+"""
+This module contains the ProviderCalendar class, the normalized calendar new patients are booked into.
+
+A provider's timeslot is stored once, however many states the provider is licensed in: a slot table
+holds one row per (provider, start) and a licence table one row per (provider, state). The
+DataFrame with one row per timeslot and licensed state, which the scheduler used to book into and
+had to keep consistent across states, is now only a view built by to_frame when it is asked for.
+A booking writes the single row of its timeslot and is refused if the timeslot is taken, so a
+timeslot cannot be booked twice, in the same state or through another one.
+
+Appointments of any length are booked with book_window: a ProviderDayBitmap of the open minutes of
+every provider and day finds the earliest run of free minutes long enough, and every timeslot the
+appointment overlaps is booked for it.
+
+Classes:
+    ProviderCalendar: The timeslots of every provider and the states each provider is licensed in.
+"""
+
+import numpy as np
+import pandas as pd
+
+from preprocessing.provider_day_bitmap import NS_PER_MINUTE, ProviderDayBitmap
+from util.event_log import EventLog
+
+class ProviderCalendar:
+    """
+    The timeslots of every provider and the states each provider is licensed in.
+
+    Slot table, one row per provider timeslot, sorted by provider then start. Start and end are
+    int64 nanoseconds since the epoch:
+        provider_ids (int32), starts (int64), ends (int64), appointment_ids (int64, FREE when open)
+
+    Licence table, one row per provider and state, sorted by provider then state:
+        licences = pd.DataFrame({'PROVIDERID': int32, 'STATE': category})
+    """
+    FREE = -1
+    FRAME_COLUMNS = ['PROVIDERID', 'DATE', 'START_DATETIME', 'END_DATETIME', 'TIME_RANGE', 'STATE', 'APPOINTMENTID']
+
+    def __init__(self, slots:pd.DataFrame, licences:pd.DataFrame):
+        """
+        Args:
+            slots (pd.DataFrame): PROVIDERID, START and END (int64 nanoseconds) and APPOINTMENTID
+                (FREE when open) of every timeslot. Of several rows for the same provider and start,
+                the first is kept.
+            licences (pd.DataFrame): PROVIDERID and STATE of every licence. Rows without a state are dropped.
+        """
+        provider_ids = slots['PROVIDERID'].to_numpy(dtype=np.int32)
+        starts = slots['START'].to_numpy(dtype=np.int64)
+        order = np.lexsort((starts, provider_ids))
+        provider_ids, starts = provider_ids[order], starts[order]
+        unique = np.ones(len(order), dtype=bool)
+        unique[1:] = (provider_ids[1:] != provider_ids[:-1]) | (starts[1:] != starts[:-1])
+        if not unique.all():
+            dropped = int(len(unique) - unique.sum())
+            EventLog().warning('duplicate_timeslots', f"Warning: {dropped} duplicate provider timeslots dropped "
+                               f"from the calendar", dropped=dropped)
+
+        self.provider_ids = provider_ids[unique]
+        self.starts = starts[unique]
+        self.ends = slots['END'].to_numpy(dtype=np.int64)[order][unique]
+        self.appointment_ids = slots['APPOINTMENTID'].to_numpy(dtype=np.int64)[order][unique]
+
+        licences = licences.dropna(subset=['STATE'])
+        states = licences['STATE'].astype(str)
+        licences = pd.DataFrame({
+            'PROVIDERID': licences['PROVIDERID'].to_numpy(dtype=np.int32),
+            'STATE': pd.Categorical(states, categories=sorted(states.unique()))
+        })
+        self.licences = licences.drop_duplicates().sort_values(['PROVIDERID', 'STATE']).reset_index(drop=True)
+        self.__rows_by_appointment = None
+        self.__open_minutes = None
+
+    @classmethod
+    def from_slots(cls, slots_df:pd.DataFrame, licences_df:pd.DataFrame) -> 'ProviderCalendar':
+        """
+        Builds the calendar from the one-row-per-timeslot frame CalendarPopulator marks.
+
+        Args:
+            slots_df (pd.DataFrame): PROVIDERID, START_DATETIME, END_DATETIME and APPOINTMENTID
+                (None when open)
+            licences_df (pd.DataFrame): PROVIDERID and STATE of every licence
+        """
+        return cls(pd.DataFrame({
+            'PROVIDERID': slots_df['PROVIDERID'].to_numpy(),
+            'START': slots_df['START_DATETIME'].to_numpy(dtype='datetime64[ns]').view(np.int64),
+            'END': slots_df['END_DATETIME'].to_numpy(dtype='datetime64[ns]').view(np.int64),
+            'APPOINTMENTID': pd.to_numeric(slots_df['APPOINTMENTID']).fillna(cls.FREE).to_numpy(dtype=np.int64)
+        }), licences_df)
+
+    @classmethod
+    def from_frame(cls, calendar_df:pd.DataFrame) -> 'ProviderCalendar':
+        """
+        Builds the calendar from a frame with one row per timeslot and licensed state, as to_frame
+        returns. A timeslot booked in any of its state rows is booked.
+
+        Args:
+            calendar_df (pd.DataFrame): PROVIDERID, STATE, START_DATETIME, END_DATETIME and APPOINTMENTID
+        """
+        booked_first = np.argsort(calendar_df['APPOINTMENTID'].isna().to_numpy(), kind='stable')
+        return cls.from_slots(calendar_df.iloc[booked_first], calendar_df[['PROVIDERID', 'STATE']])
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def slots(self) -> pd.DataFrame:
+        """The slot table as a DataFrame: PROVIDERID, START, END and APPOINTMENTID."""
+        return pd.DataFrame({'PROVIDERID': self.provider_ids, 'START': self.starts, 'END': self.ends,
+                             'APPOINTMENTID': self.appointment_ids})
+
+    def booked_count(self) -> int:
+        """Number of booked timeslots."""
+        return int(np.count_nonzero(self.appointment_ids != self.FREE))
+
+    def provider_states(self) -> dict:
+        """
+        Returns:
+            dict: the states each provider is licensed in, in name order, {provider_id: [state, ...]}
+        """
+        provider_states = {}
+        for provider_id, state in zip(self.licences['PROVIDERID'].tolist(), self.licences['STATE'].tolist()):
+            provider_states.setdefault(provider_id, []).append(state)
+        return provider_states
+
+    def slot_row(self, provider_id:int, start:int) -> int:
+        """
+        Finds a timeslot with two binary searches, one for the provider's rows and one for the start.
+
+        Args:
+            provider_id (int): provider id
+            start (int): slot start, in nanoseconds since the epoch
+
+        Returns:
+            int: the row of the timeslot, or -1 if the provider has no timeslot starting then
+        """
+        first = np.searchsorted(self.provider_ids, provider_id, 'left')
+        last = np.searchsorted(self.provider_ids, provider_id, 'right')
+        row = first + np.searchsorted(self.starts[first:last], start)
+        return int(row) if row < last and self.starts[row] == start else -1
+
+    def book(self, provider_id:int, start:int, appointment_id:int):
+        """
+        Books a timeslot, for every state the provider is licensed in at once.
+
+        Args:
+            provider_id (int): provider id
+            start (int): slot start, in nanoseconds since the epoch
+            appointment_id (int): id of the new appointment
+
+        Raises:
+            ValueError: if the provider has no timeslot starting then, or it is already booked
+        """
+        row = self.slot_row(provider_id, start)
+        if row < 0:
+            raise ValueError(f"Provider {provider_id} has no timeslot at {pd.Timestamp(start)}")
+        if self.appointment_ids[row] != self.FREE:
+            raise ValueError(f"Provider {provider_id}'s timeslot at {pd.Timestamp(start)} is already booked "
+                             f"by appointment {self.appointment_ids[row]}")
+        self.__occupy(np.array([row]), appointment_id)
+
+    def earliest_window(self, provider_id:int, minutes:int, after:int):
+        """
+        Finds the earliest start from which a provider has some minutes of open timeslots in a row,
+        on a ProviderDayBitmap boundary. The run may span consecutive timeslots but not a gap.
+
+        Args:
+            provider_id (int): provider id
+            minutes (int): length of the appointment
+            after (int): earliest acceptable start, in nanoseconds since the epoch
+
+        Returns:
+            int or None: the start, in nanoseconds since the epoch
+        """
+        return self.__get_open_minutes().earliest_window(provider_id, minutes, after)
+
+    def book_window(self, provider_id:int, start:int, minutes:int, appointment_id:int) -> list:
+        """
+        Books an appointment of any length. Every timeslot it overlaps is booked whole, for every
+        state the provider is licensed in.
+
+        Args:
+            provider_id (int): provider id
+            start (int): appointment start, in nanoseconds since the epoch
+            minutes (int): length of the appointment
+            appointment_id (int): id of the new appointment
+
+        Returns:
+            list: (start, provider_id) keys of the booked timeslots, ordered by start
+
+        Raises:
+            ValueError: if any minute of the appointment is outside the provider's open timeslots
+        """
+        end = start + minutes * NS_PER_MINUTE
+        if not self.__get_open_minutes().all_marked([provider_id], [start], [end])[0]:
+            raise ValueError(f"Provider {provider_id} is not free for {minutes} minutes from {pd.Timestamp(start)}")
+
+        first = np.searchsorted(self.provider_ids, provider_id, 'left')
+        last = np.searchsorted(self.provider_ids, provider_id, 'right')
+        rows = np.arange(first + np.searchsorted(self.ends[first:last], start, 'right'),
+                         first + np.searchsorted(self.starts[first:last], end, 'left'))
+        self.__occupy(rows, appointment_id)
+        return list(zip(self.starts[rows].tolist(), self.provider_ids[rows].tolist()))
+
+    def assign_appointments(self, rows:np.ndarray, appointment_ids:np.ndarray):
+        """
+        Marks timeslots as taken by existing appointments, replacing whatever held them: when
+        recorded appointments overlap, the later one keeps the timeslot. New bookings go through book.
+
+        Args:
+            rows (np.ndarray): slot rows
+            appointment_ids (np.ndarray): the appointment holding each of them
+        """
+        self.appointment_ids[rows] = appointment_ids
+        self.__rows_by_appointment = None
+        if self.__open_minutes is not None:
+            self.__open_minutes.mark(self.provider_ids[rows], self.starts[rows], self.ends[rows], False)
+
+    def release(self, appointment_id:int) -> list:
+        """
+        Frees every timeslot of an appointment.
+
+        Args:
+            appointment_id (int): id of the cancelled appointment
+
+        Returns:
+            list: (start, provider_id) keys of the released timeslots, ordered by start
+        """
+        if self.__rows_by_appointment is None:
+            # Indexed on the first cancellation; bookings keep it up to date afterwards
+            booked = np.flatnonzero(self.appointment_ids != self.FREE)
+            self.__rows_by_appointment = {}
+            for row, booked_id in zip(booked.tolist(), self.appointment_ids[booked].tolist()):
+                self.__rows_by_appointment.setdefault(booked_id, []).append(row)
+
+        rows = np.array(self.__rows_by_appointment.pop(int(appointment_id), []), dtype=np.int64)
+        self.appointment_ids[rows] = self.FREE
+        if self.__open_minutes is not None:
+            self.__open_minutes.mark(self.provider_ids[rows], self.starts[rows], self.ends[rows])
+        return sorted(zip(self.starts[rows].tolist(), self.provider_ids[rows].tolist()))
+
+    def state_slot_rows(self, free_only:bool=False) -> tuple:
+        """
+        Joins the timeslots with the states their provider is licensed in.
+
+        Args:
+            free_only (bool, optional): only join the open timeslots
+
+        Returns:
+            tuple: (slot rows, states) arrays, one entry per timeslot and licensed state, ordered
+                by provider, start and state
+        """
+        rows = np.flatnonzero(self.appointment_ids == self.FREE) if free_only else np.arange(len(self))
+        return self.__join_states(rows)
+
+    def state_slot_count(self) -> int:
+        """Number of rows to_frame returns: the timeslots times the states of their provider."""
+        licence_providers = self.licences['PROVIDERID'].to_numpy()
+        return int((np.searchsorted(licence_providers, self.provider_ids, 'right') -
+                    np.searchsorted(licence_providers, self.provider_ids, 'left')).sum())
+
+    def to_frame(self, booked_only:bool=False) -> pd.DataFrame:
+        """
+        Builds the view with one row per timeslot and licensed state. It is not kept: the calendar
+        itself only stores each timeslot once.
+
+        Args:
+            booked_only (bool, optional): only include booked timeslots
+
+        Returns:
+            pd.DataFrame: PROVIDERID, DATE, START_DATETIME, END_DATETIME, TIME_RANGE, STATE and
+                APPOINTMENTID (None when open), ordered by provider, start and state
+        """
+        rows = np.flatnonzero(self.appointment_ids != self.FREE) if booked_only else np.arange(len(self))
+        rows, states = self.__join_states(rows)
+        start_datetimes = pd.DatetimeIndex(self.starts[rows].view('datetime64[ns]'))
+        end_datetimes = pd.DatetimeIndex(self.ends[rows].view('datetime64[ns]'))
+        appointment_ids = self.appointment_ids[rows]
+        booked = appointment_ids != self.FREE
+        appointment_id_column = np.full(len(rows), None, dtype=object)
+        appointment_id_column[booked] = appointment_ids[booked].tolist()
+        return pd.DataFrame({
+            'PROVIDERID': self.provider_ids[rows].astype(np.int64),
+            'DATE': start_datetimes.normalize(),
+            'START_DATETIME': start_datetimes,
+            'END_DATETIME': end_datetimes,
+            'TIME_RANGE': end_datetimes - start_datetimes,
+            'STATE': states,
+            'APPOINTMENTID': appointment_id_column
+        }, columns=self.FRAME_COLUMNS)
+
+    def select_providers(self, provider_ids) -> 'ProviderCalendar':
+        """
+        Copies the timeslots and licences of some providers.
+
+        Args:
+            provider_ids (iterable): ids of the providers to keep
+
+        Returns:
+            ProviderCalendar: a calendar of those providers only
+        """
+        provider_ids = np.fromiter(provider_ids, dtype=np.int64)
+        slots = self.slots[np.isin(self.provider_ids, provider_ids)]
+        return ProviderCalendar(slots, self.licences[self.licences['PROVIDERID'].isin(provider_ids)])
+
+    def extend(self, calendar:'ProviderCalendar'):
+        """
+        Adds the timeslots and licences of another calendar in place, e.g. the next week of a
+        rolling horizon. A timeslot this calendar already has is kept as it is.
+
+        Args:
+            calendar (ProviderCalendar): the calendar to add
+        """
+        merged = ProviderCalendar(pd.concat([self.slots, calendar.slots], ignore_index=True),
+                                  pd.concat([self.licences, calendar.licences], ignore_index=True))
+        self.__replace_tables(merged.provider_ids, merged.starts, merged.ends, merged.appointment_ids, merged.licences)
+
+    def evict(self, before:int) -> int:
+        """
+        Drops the timeslots, booked or open, that start before a point in time, in place.
+
+        Args:
+            before (int): earliest start to keep, in nanoseconds since the epoch
+
+        Returns:
+            int: the number of timeslots dropped
+        """
+        keep = self.starts >= before
+        dropped = len(keep) - int(np.count_nonzero(keep))
+        if dropped:
+            self.__replace_tables(self.provider_ids[keep], self.starts[keep], self.ends[keep],
+                                  self.appointment_ids[keep], self.licences)
+        return dropped
+
+    def copy(self) -> 'ProviderCalendar':
+        """Copies the calendar, so bookings in the copy leave this one untouched."""
+        return ProviderCalendar(self.slots, self.licences)
+
+    def memory_usage(self) -> int:
+        """Bytes held by the slot and licence tables."""
+        return int(self.provider_ids.nbytes + self.starts.nbytes + self.ends.nbytes + self.appointment_ids.nbytes
+                   + self.licences.memory_usage(deep=True).sum())
+
+    def __replace_tables(self, provider_ids:np.ndarray, starts:np.ndarray, ends:np.ndarray,
+                         appointment_ids:np.ndarray, licences:pd.DataFrame):
+        """
+        Swaps in new slot and licence tables. Slot rows move, so the indexes built on them are
+        dropped and built again when next needed.
+        """
+        self.provider_ids, self.starts, self.ends, self.appointment_ids = provider_ids, starts, ends, appointment_ids
+        self.licences = licences
+        self.__rows_by_appointment = None
+        self.__open_minutes = None
+
+    def __occupy(self, rows:np.ndarray, appointment_id:int):
+        """
+        Marks open slot rows as booked by an appointment, keeping the indexes that have been built in step.
+        """
+        self.appointment_ids[rows] = appointment_id
+        if self.__rows_by_appointment is not None:
+            self.__rows_by_appointment.setdefault(int(appointment_id), []).extend(rows.tolist())
+        if self.__open_minutes is not None:
+            self.__open_minutes.mark(self.provider_ids[rows], self.starts[rows], self.ends[rows], False)
+
+    def __get_open_minutes(self) -> ProviderDayBitmap:
+        """
+        The open minutes of every provider and day, built on the first window lookup; bookings and
+        releases keep it up to date afterwards.
+        """
+        if self.__open_minutes is None:
+            self.__open_minutes = ProviderDayBitmap.covering(self.provider_ids, self.starts)
+            open_rows = np.flatnonzero(self.appointment_ids == self.FREE)
+            self.__open_minutes.mark(self.provider_ids[open_rows], self.starts[open_rows], self.ends[open_rows])
+        return self.__open_minutes
+
+    def __join_states(self, rows:np.ndarray) -> tuple:
+        """
+        Repeats each slot row once for every licence of its provider. Providers without a licence
+        have no state to be booked in and are left out.
+        """
+        licence_providers = self.licences['PROVIDERID'].to_numpy()
+        slot_providers = self.provider_ids[rows]
+        first = np.searchsorted(licence_providers, slot_providers, 'left')
+        counts = np.searchsorted(licence_providers, slot_providers, 'right') - first
+        total = int(counts.sum())
+        licence_rows = np.repeat(first - (np.cumsum(counts) - counts), counts) + np.arange(total)
+        return np.repeat(rows, counts), self.licences['STATE'].to_numpy()[licence_rows]
@@ -0,0 +1,219 @@
+"""
+This module contains the ProviderDayBitmap class, a bitmap of fixed-width minute bins for every
+provider and day, and the business hours rule expressed on the same bins.
+
+Provider timeslots and appointments are intervals of any length. Once they are cut into
+GRANULARITY_MINUTES bins, overlap, containment and "the earliest run of D free minutes" become
+prefix-sum and slice operations on a boolean array, whatever the length of the intervals.
+Interval starts are rounded down and ends up to a bin boundary, so an interval is never reported
+smaller than it is. Intervals are cut at the end of the day they start on.
+
+Classes:
+    ProviderDayBitmap: One row of minute bins per provider and day.
+
+Functions:
+    within_business_hours(starts, ends): Whether intervals lie within business hours.
+"""
+
+import numpy as np
+
+NS_PER_MINUTE = 60_000_000_000
+NS_PER_DAY = 24 * 60 * NS_PER_MINUTE
+# Business hours, 8:30 AM to 9:00 PM, in minutes after midnight
+BUSINESS_START_MINUTE = 8 * 60 + 30
+BUSINESS_END_MINUTE = 21 * 60
+
+class ProviderDayBitmap:
+    """
+    A row of GRANULARITY_MINUTES bins for every provider and day, in (provider, day) order.
+    Times are int64 nanoseconds since the epoch and days count from the epoch.
+        provider_ids (int32), days (int64): the key of every row
+        bits (bool): shape (rows, BINS_PER_DAY)
+    """
+    # Timeslot boundaries in the provider schedule and appointment start times fall on 5 minute marks
+    GRANULARITY_MINUTES = 5
+    BINS_PER_DAY = 24 * 60 // GRANULARITY_MINUTES
+    NS_PER_BIN = GRANULARITY_MINUTES * NS_PER_MINUTE
+    # Days since the epoch stay far below this, so provider * KEY_STRIDE + day orders the rows
+    KEY_STRIDE = 1 << 32
+
+    def __init__(self, provider_ids:np.ndarray, days:np.ndarray):
+        """
+        Args:
+            provider_ids (np.ndarray): provider of every row
+            days (np.ndarray): day of every row. Repeated (provider, day) keys get a single row.
+        """
+        provider_ids = np.asarray(provider_ids, dtype=np.int32)
+        days = np.asarray(days, dtype=np.int64)
+        order = np.lexsort((days, provider_ids))
+        provider_ids, days = provider_ids[order], days[order]
+        unique = np.ones(len(order), dtype=bool)
+        unique[1:] = (provider_ids[1:] != provider_ids[:-1]) | (days[1:] != days[:-1])
+
+        self.provider_ids = provider_ids[unique]
+        self.days = days[unique]
+        self.bits = np.zeros((len(self.days), self.BINS_PER_DAY), dtype=bool)
+
+    @classmethod
+    def covering(cls, provider_ids:np.ndarray, starts:np.ndarray) -> 'ProviderDayBitmap':
+        """
+        Builds an empty bitmap with a row for every provider and day an interval starts on.
+
+        Args:
+            provider_ids (np.ndarray): provider of every interval
+            starts (np.ndarray): start of every interval
+        """
+        return cls(provider_ids, np.asarray(starts, dtype=np.int64) // NS_PER_DAY)
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def locate(self, provider_ids:np.ndarray, starts:np.ndarray, ends:np.ndarray) -> tuple:
+        """
+        Finds the row and the bins of intervals.
+
+        Args:
+            provider_ids (np.ndarray): provider of every interval
+            starts (np.ndarray): start of every interval
+            ends (np.ndarray): end of every interval
+
+        Returns:
+            tuple: (rows, first bins, end bins) arrays. The row is -1 when the provider has no row
+                for the day, and the bins are [first, end) within it, empty for an empty interval.
+        """
+        provider_ids = np.asarray(provider_ids, dtype=np.int64)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        days = starts // NS_PER_DAY
+
+        # Rows are in (provider, day) order, so one combined key finds them with a single search
+        row_keys = self.provider_ids.astype(np.int64) * self.KEY_STRIDE + self.days
+        keys = provider_ids * self.KEY_STRIDE + days
+        rows = np.searchsorted(row_keys, keys)
+        found = rows < len(row_keys)
+        found[found] = row_keys[rows[found]] == keys[found]
+        rows = np.where(found, rows, -1)
+
+        day_starts = days * NS_PER_DAY
+        first_bins = (starts - day_starts) // self.NS_PER_BIN
+        end_bins = np.minimum(-((day_starts - ends) // self.NS_PER_BIN), self.BINS_PER_DAY)
+        return rows, first_bins, np.maximum(end_bins, first_bins)
+
+    def flat_bins(self, provider_ids:np.ndarray, starts:np.ndarray, ends:np.ndarray) -> tuple:
+        """
+        Lists the bins of intervals as positions in bits.ravel(). Intervals on a provider and day
+        without a row are skipped.
+
+        Returns:
+            tuple: (positions, the interval each position belongs to)
+        """
+        rows, first_bins, end_bins = self.locate(provider_ids, starts, ends)
+        intervals = np.flatnonzero(rows >= 0)
+        lengths = end_bins[intervals] - first_bins[intervals]
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(rows[intervals] * self.BINS_PER_DAY + first_bins[intervals], lengths) + offsets
+        return positions, np.repeat(intervals, lengths)
+
+    def mark(self, provider_ids:np.ndarray, starts:np.ndarray, ends:np.ndarray, value:bool=True):
+        """
+        Sets, or with value=False clears, the bins of intervals.
+        """
+        positions, _ = self.flat_bins(provider_ids, starts, ends)
+        self.bits.ravel()[positions] = value
+
+    def count_marked(self, provider_ids:np.ndarray, starts:np.ndarray, ends:np.ndarray) -> tuple:
+        """
+        Counts the set bins of intervals with a prefix sum over the row of each interval.
+
+        Returns:
+            tuple: (set bins, bins) of every interval; both are 0 without a row for the day
+        """
+        rows, first_bins, end_bins = self.locate(provider_ids, starts, ends)
+        found = np.flatnonzero(rows >= 0)
+        prefix = np.zeros((len(found), self.BINS_PER_DAY + 1), dtype=np.int32)
+        np.cumsum(self.bits[rows[found]], axis=1, out=prefix[:, 1:])
+
+        marked = np.zeros(len(rows), dtype=np.int64)
+        bins = np.zeros(len(rows), dtype=np.int64)
+        positions = np.arange(len(found))
+        marked[found] = prefix[positions, end_bins[found]] - prefix[positions, first_bins[found]]
+        bins[found] = end_bins[found] - first_bins[found]
+        return marked, bins
+
+    def any_marked(self, provider_ids:np.ndarray, starts:np.ndarray, ends:np.ndarray) -> np.ndarray:
+        """Whether any bin of each interval is set."""
+        marked, _ = self.count_marked(provider_ids, starts, ends)
+        return marked > 0
+
+    def all_marked(self, provider_ids:np.ndarray, starts:np.ndarray, ends:np.ndarray) -> np.ndarray:
+        """Whether every bin of each non-empty interval is set."""
+        marked, bins = self.count_marked(provider_ids, starts, ends)
+        return (bins > 0) & (marked == bins)
+
+    def earliest_window(self, provider_id:int, minutes:int, after:int):
+        """
+        Finds the earliest run of set bins long enough for an interval of some minutes, on any of
+        the provider's days, starting at or after a point in time. The provider's days are scanned
+        in order, with a prefix sum over one day at a time, until one has a run that fits.
+
+        Args:
+            provider_id (int): provider id
+            minutes (int): length of the interval
+            after (int): earliest acceptable start, in nanoseconds since the epoch
+
+        Returns:
+            int or None: the start of the run, in nanoseconds since the epoch
+        """
+        width = -(-minutes // self.GRANULARITY_MINUTES)
+        if width <= 0 or width > self.BINS_PER_DAY:
+            return None
+        after_day = after // NS_PER_DAY
+        first = np.searchsorted(self.provider_ids, provider_id, 'left')
+        last = np.searchsorted(self.provider_ids, provider_id, 'right')
+        first += np.searchsorted(self.days[first:last], after_day)
+
+        prefix = np.zeros(self.BINS_PER_DAY + 1, dtype=np.int32)
+        for row in range(first, last):
+            # Runs on the day of `after` may not start before the first bin boundary at or after it
+            first_allowed_bin = -((after_day * NS_PER_DAY - after) // self.NS_PER_BIN) \
+                if self.days[row] == after_day else 0
+            np.cumsum(self.bits[row], out=prefix[1:])
+            if prefix[-1] - prefix[first_allowed_bin] < width:
+                continue
+            fits = np.flatnonzero(prefix[first_allowed_bin + width:] - prefix[first_allowed_bin:-width] == width)
+            if fits.size:
+                return int(self.days[row]) * NS_PER_DAY + (first_allowed_bin + int(fits[0])) * self.NS_PER_BIN
+        return None
+
+    def memory_usage(self) -> int:
+        """Bytes held by the keys and the bits."""
+        return int(self.provider_ids.nbytes + self.days.nbytes + self.bits.nbytes)
+
+# Business hours of a day, as bins
+_BUSINESS_HOURS = np.zeros(ProviderDayBitmap.BINS_PER_DAY, dtype=bool)
+_BUSINESS_HOURS[BUSINESS_START_MINUTE // ProviderDayBitmap.GRANULARITY_MINUTES:
+                BUSINESS_END_MINUTE // ProviderDayBitmap.GRANULARITY_MINUTES] = True
+_BUSINESS_HOURS_PREFIX = np.concatenate(([0], np.cumsum(_BUSINESS_HOURS)))
+
+def within_business_hours(starts:np.ndarray, ends:np.ndarray) -> np.ndarray:
+    """
+    Whether each interval lies within business hours on the day it starts, checked against the
+    business hours bins with a prefix sum. An interval running past midnight is outside, and an
+    empty interval is checked as the bin it starts in.
+
+    Args:
+        starts (np.ndarray): start of every interval, in nanoseconds since the epoch
+        ends (np.ndarray): end of every interval, in nanoseconds since the epoch
+
+    Returns:
+        np.ndarray: one boolean per interval
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    day_starts = starts // NS_PER_DAY * NS_PER_DAY
+    first_bins = (starts - day_starts) // ProviderDayBitmap.NS_PER_BIN
+    end_bins = np.maximum(-((day_starts - ends) // ProviderDayBitmap.NS_PER_BIN), first_bins + 1)
+    inside = end_bins <= ProviderDayBitmap.BINS_PER_DAY
+    clipped = np.clip(end_bins, first_bins, ProviderDayBitmap.BINS_PER_DAY)
+    business_bins = _BUSINESS_HOURS_PREFIX[clipped] - _BUSINESS_HOURS_PREFIX[first_bins]
+    return inside & (business_bins == clipped - first_bins)
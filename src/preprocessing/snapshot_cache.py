@@ -0,0 +1,343 @@
+"""
+This module provides the SnapshotCache class, an opt-in on-disk cache of the typed and
+preprocessed DataFrames built by the Preprocessor. A warm start loads the frames from
+binary files instead of re-parsing the CSVs and redoing the datetime and state-join work.
+
+Each snapshot is keyed on the size, modification time and content hash of every source
+CSV. A snapshot is only used when all of its sources are unchanged; otherwise it is
+treated as stale and rebuilt. Two kinds of source are exempt:
+
+- An appendable source, such as the appointment data, is keyed on a high-water mark: the
+  byte offset read up to, the key of the last row and hashes of the first bytes and of the
+  bytes just before the offset. When the file still matches the mark but has grown, it was
+  appended to, and only the rows after the offset need to be read. Any other change is
+  treated as a rewrite.
+- An independent source, such as the new patient data, has no other cached frame derived
+  from it. When it changes, only its own frame is dropped and re-read.
+
+Classes:
+    SnapshotCache: Stores and validates snapshots of preprocessed DataFrames.
+
+Methods:
+    fingerprint(source_files, high_water_marks): Describes the source files a snapshot is built from.
+    high_water_mark(path, offset, last_key): Describes an appendable source read up to a byte offset.
+    load(source_files, appendable, independent): Returns the cached DataFrames if the snapshot is still valid.
+    save(source_files, dataframes, high_water_marks): Writes a new snapshot of the given DataFrames.
+    update(source_files, dataframes, high_water_marks): Replaces some DataFrames of the current snapshot.
+    clear(): Removes the current snapshot.
+"""
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  Parquet support is optional
+    _SNAPSHOT_FORMAT = 'parquet'
+except ImportError:
+    _SNAPSHOT_FORMAT = 'pickle'
+
+class SnapshotCache:
+    """
+    Opt-in binary snapshot of preprocessed DataFrames stored in a cache directory
+    """
+
+    # Bump whenever the preprocessing output changes shape so old snapshots are ignored
+    SNAPSHOT_VERSION = 4
+    MANIFEST_NAME = 'manifest.json'
+    # Bytes hashed at the start of an appendable source and just before its high-water mark
+    HIGH_WATER_WINDOW = 1 << 16
+
+    def __init__(self, cache_dir):
+        """
+        Args:
+            cache_dir (str): Directory holding the snapshot files and manifest
+        """
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, self.MANIFEST_NAME)
+        self.tails = {}
+        self.stale_sources = set()
+
+    def fingerprint(self, source_files, high_water_marks=None):
+        """
+        Describe the source files with their size, modification time and content hash.
+        Appendable sources are described by their high-water mark instead of a content hash.
+
+        Args:
+            source_files (dict): Maps DataFrame names to the CSV file they are read from
+            high_water_marks (dict, optional): Maps appendable DataFrame names to their high_water_mark
+
+        Returns:
+            dict: Maps DataFrame names to {'path', 'size', 'mtime_ns', 'sha256'} or
+                {'path', 'size', 'mtime_ns', 'high_water_mark'}
+        """
+        high_water_marks = high_water_marks or {}
+        fingerprint = {}
+        for df_name, path in source_files.items():
+            if df_name in high_water_marks:
+                mark = high_water_marks[df_name]
+                fingerprint[df_name] = {
+                    'path': os.path.abspath(path),
+                    'size': mark['offset'],
+                    'mtime_ns': os.stat(path).st_mtime_ns,
+                    'high_water_mark': mark
+                }
+            else:
+                fingerprint[df_name] = self.__describe_file(path)
+        return fingerprint
+
+    def high_water_mark(self, path, offset, last_key):
+        """
+        Describe an appendable source that was read up to a byte offset.
+
+        Args:
+            path (str): the source file
+            offset (int): number of bytes that were read
+            last_key: key of the last row that was read, or None if there were no rows
+
+        Returns:
+            dict: {'offset', 'last_key', 'head_sha256', 'tail_sha256'}
+        """
+        with open(path, 'rb') as file:
+            head = file.read(min(offset, self.HIGH_WATER_WINDOW))
+            file.seek(max(0, offset - self.HIGH_WATER_WINDOW))
+            tail = file.read(offset - file.tell())
+        return {
+            'offset': offset,
+            'last_key': None if last_key is None else str(last_key),
+            'head_sha256': hashlib.sha256(head).hexdigest(),
+            'tail_sha256': hashlib.sha256(tail).hexdigest()
+        }
+
+    def load(self, source_files, appendable=(), independent=()):
+        """
+        Load the snapshot if every source file is unchanged since it was written.
+
+        Size and modification time are checked first. When only the modification time
+        differs (for example, the file was touched or copied) the content hash decides,
+        and the manifest is refreshed so the next start takes the fast path again.
+
+        An appendable source that has only been appended to is still loaded, and the offset its
+        new rows start at is recorded in tails. An independent source that changed is left out of
+        the result and recorded in stale_sources, for the caller to re-read.
+
+        Args:
+            source_files (dict): Maps DataFrame names to the CSV file they are read from
+            appendable (iterable, optional): names of sources that only grow by appended rows
+            independent (iterable, optional): names of sources no other cached frame is derived from
+
+        Returns:
+            dict or None: Maps DataFrame names to DataFrames, or None if the snapshot is missing or stale
+        """
+        self.tails = {}
+        self.stale_sources = set()
+        manifest = self.__read_manifest()
+        if manifest is None:
+            return None
+
+        if manifest.get('version') != self.SNAPSHOT_VERSION or manifest.get('format') != _SNAPSHOT_FORMAT:
+            print('Snapshot cache is from a different version, ignoring it')
+            return None
+
+        cached_sources = manifest.get('sources', {})
+        if set(cached_sources) != set(source_files):
+            print('Snapshot cache was built from different source files, ignoring it')
+            return None
+
+        refreshed = False
+        for df_name, path in source_files.items():
+            cached = cached_sources[df_name]
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            if cached['path'] != os.path.abspath(path):
+                print(f'Snapshot cache is stale: {path} changed')
+                return None
+            if 'high_water_mark' in cached:
+                if df_name in appendable and self.__is_appended(path, stat.st_size, cached['high_water_mark']):
+                    if stat.st_size > cached['size']:
+                        self.tails[df_name] = cached['size']
+                    continue
+                print(f'Snapshot cache is stale: {path} was rewritten')
+                return None
+            if cached['size'] != stat.st_size:
+                if df_name in independent:
+                    self.stale_sources.add(df_name)
+                    continue
+                print(f'Snapshot cache is stale: {path} changed')
+                return None
+            if cached['mtime_ns'] != stat.st_mtime_ns:
+                if self.__hash_file(path) != cached['sha256']:
+                    if df_name in independent:
+                        self.stale_sources.add(df_name)
+                        continue
+                    print(f'Snapshot cache is stale: {path} changed')
+                    return None
+                cached['mtime_ns'] = stat.st_mtime_ns
+                refreshed = True
+
+        try:
+            dataframes = {df_name: self.__read_frame(file_name) for df_name, file_name in manifest['frames'].items()
+                          if df_name not in self.stale_sources}
+        except Exception as e:
+            print(f'Error reading snapshot cache: {str(e)}')
+            return None
+
+        if refreshed:
+            self.__write_manifest(manifest)
+
+        print(f'Loaded {len(dataframes)} DataFrames from snapshot cache {self.cache_dir}')
+        return dataframes
+
+    def save(self, source_files, dataframes, high_water_marks=None):
+        """
+        Write a snapshot of the DataFrames, replacing any previous one.
+
+        The frames are written first and the manifest last, so an interrupted save leaves
+        no manifest pointing at partially written files.
+
+        Args:
+            source_files (dict): Maps DataFrame names to the CSV file they are read from
+            dataframes (dict): Maps DataFrame names to the DataFrames to store
+            high_water_marks (dict, optional): Maps appendable DataFrame names to their high_water_mark
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.clear()
+
+        frames = {}
+        for df_name, df in dataframes.items():
+            if not isinstance(df, pd.DataFrame):
+                continue
+            frames[df_name] = self.__write_frame(df_name, df)
+
+        self.__write_manifest({
+            'version': self.SNAPSHOT_VERSION,
+            'format': _SNAPSHOT_FORMAT,
+            'sources': self.fingerprint(source_files, high_water_marks),
+            'frames': frames,
+            'generation': 0
+        })
+        print(f'Saved {len(frames)} DataFrames to snapshot cache {self.cache_dir}')
+
+    def update(self, source_files, dataframes, high_water_marks=None):
+        """
+        Replace or add some DataFrames of the current snapshot, and the description of the
+        sources they were refreshed from, leaving the rest of the snapshot as it is.
+
+        The frames are written to new files and the manifest is switched over in one rename,
+        so an interrupted update leaves the previous snapshot intact.
+
+        Args:
+            source_files (dict): Maps DataFrame names to the CSV files that were re-read
+            dataframes (dict): Maps DataFrame names to the DataFrames to store
+            high_water_marks (dict, optional): Maps appendable DataFrame names to their high_water_mark
+
+        Returns:
+            bool: False if there is no snapshot to update
+        """
+        manifest = self.__read_manifest()
+        if manifest is None or manifest.get('version') != self.SNAPSHOT_VERSION:
+            return False
+
+        generation = manifest.get('generation', 0) + 1
+        replaced = []
+        for df_name, df in dataframes.items():
+            if df_name in manifest['frames']:
+                replaced.append(manifest['frames'][df_name])
+            manifest['frames'][df_name] = self.__write_frame(df_name, df, generation)
+        manifest['sources'].update(self.fingerprint(source_files, high_water_marks))
+        manifest['generation'] = generation
+        self.__write_manifest(manifest)
+
+        for file_name in replaced:
+            path = os.path.join(self.cache_dir, file_name)
+            if os.path.exists(path):
+                os.remove(path)
+        print(f'Updated {len(dataframes)} DataFrames in snapshot cache {self.cache_dir}')
+        return True
+
+    def clear(self):
+        """Remove the current snapshot, if any."""
+        manifest = self.__read_manifest()
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        if manifest is None:
+            return
+        for file_name in manifest.get('frames', {}).values():
+            path = os.path.join(self.cache_dir, file_name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __describe_file(self, path):
+        stat = os.stat(path)
+        return {
+            'path': os.path.abspath(path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': self.__hash_file(path)
+        }
+
+    def __is_appended(self, path, size, mark):
+        """
+        Check that a source still matches its high-water mark: it is at least as long, its first
+        bytes and the bytes before the offset hash the same, the last row read still ends at the
+        offset and anything after the offset starts a new row.
+        """
+        offset = mark['offset']
+        if size < offset:
+            return False
+        with open(path, 'rb') as file:
+            file.seek(max(0, offset - self.HIGH_WATER_WINDOW))
+            window = file.read(offset - file.tell())
+            following = file.read(1)
+        if self.high_water_mark(path, offset, mark['last_key']) != mark:
+            return False
+        if following and not window.endswith(b'\n') and following not in (b'\n', b'\r'):
+            return False
+        if mark['last_key'] is None:
+            return True
+        last_line = window.rstrip(b'\r\n').rsplit(b'\n', 1)[-1].decode('utf-8', errors='replace')
+        return last_line.split(',', 1)[0].strip() == mark['last_key']
+
+    def __hash_file(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def __read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return None
+        try:
+            with open(self.manifest_path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            print(f'Error reading snapshot manifest: {str(e)}')
+            return None
+
+    def __write_manifest(self, manifest):
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(manifest, file, indent=4)
+        os.replace(temp_path, self.manifest_path)
+
+    def __write_frame(self, df_name, df, generation=0):
+        file_name = f'{df_name}.{_SNAPSHOT_FORMAT}' if generation == 0 else f'{df_name}.{generation}.{_SNAPSHOT_FORMAT}'
+        path = os.path.join(self.cache_dir, file_name)
+        temp_path = path + '.tmp'
+        if _SNAPSHOT_FORMAT == 'parquet':
+            df.to_parquet(temp_path)
+        else:
+            df.to_pickle(temp_path)
+        os.replace(temp_path, path)
+        return file_name
+
+    def __read_frame(self, file_name):
+        path = os.path.join(self.cache_dir, file_name)
+        if _SNAPSHOT_FORMAT == 'parquet':
+            return pd.read_parquet(path)
+        return pd.read_pickle(path)
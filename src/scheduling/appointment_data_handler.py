@@ -3,70 +3,418 @@ This module provides functionality for handling appointment data, including
 removing scheduled patients from the new patients table and updating the
 appointment data table with new appointments.
 
+New appointments are buffered in memory. Each commit appends one record to a journal
+next to the data files: the new appointments, the cancelled appointment ids and the
+patients booked or returned since the last commit, so a commit costs as much as the
+bookings it writes rather than the size of the tables. compact() applies the journal
+to both tables at the end of a run. It writes them to temporary files, records the
+renames in a second journal and then renames them into place, so a crash never
+leaves appointments written while their patients are still listed as new. A journal
+left behind by a crash is applied by the next recover().
+
 Classes:
     AppointmentDataHandler: Handles storage and modification of appointment-related data.
 
 Methods:
+    begin(new_patient_df, update_new_patients):
+        Starts buffering bookings against a new patients table.
+
+    update_appointment_data_table(new_appointment_id, new_appointment, patient_id):
+        Buffers a new record for the latest appointment in the appointment data table.
+
+    cancel_appointment(appointment_id, patient_id):
+        Buffers the removal of a cancelled appointment and returns its patient to the new patients table.
+
     remove_scheduled_patients_from_new_patients_table(booked_new_patient_ids, new_patient_df):
         Removes scheduled patients from the new patients table.
 
-    update_appointment_data_table(new_appointment_id, new_appointment):
-        Inserts a new record for the latest appointment into the appointment data table.
+    commit():
+        Appends the buffered bookings to the journal.
+
+    compact():
+        Applies the journal to the appointment data and new patients tables.
 
-    __format_appointment_for_csv(new_appointment):
+    recover():
+        Finishes an interrupted compaction and applies a journal left behind by a crash.
+
+    __format_appointments_for_csv(new_appointments):
         Formats the new appointment information to align with the CSV file requirements.
 """
 
+import json
+import os
+import shutil
+import threading
+
 import pandas as pd
 
+from util.event_log import EventLog
+from util.profiling import timed
+
 class AppointmentDataHandler:
     """
     Handles storage and modification of appointment-related data.
+
+    Bookings can be buffered on one thread while another commits: the buffers are swapped out
+    under a lock and the journal is written outside it.
     """
 
+    def __init__(self, appointment_data_path:str='data/Appointment Data.csv',
+                 new_patient_data_path:str='data/New Patient Data.csv', flush_every:int=None):
+        """
+        Args:
+            appointment_data_path (str, optional): the appointment data csv file
+            new_patient_data_path (str, optional): the new patient data csv file
+            flush_every (int, optional): commit automatically once this many appointments are buffered.
+                When None, appointments are only written by an explicit commit.
+        """
+        self.appointment_data_path = appointment_data_path
+        self.new_patient_data_path = new_patient_data_path
+        data_dir = os.path.dirname(appointment_data_path) or '.'
+        self.journal_path = os.path.join(data_dir, '.appointment_journal.jsonl')
+        self.compaction_path = os.path.join(data_dir, '.appointment_commit.json')
+        self.flush_every = flush_every
+        self.event_log = EventLog()
+
+        self.pending_appointments = []
+        self.cancelled_appointment_ids = set()
+        self.booked_new_patient_ids = []
+        self.new_patient_df = None
+        self.update_new_patients = True
+        # Booked patients the journal already records, to journal only the changes
+        self.journaled_new_patient_ids = set()
+        self._lock = threading.Lock()
+
+    def begin(self, new_patient_df:pd.DataFrame, update_new_patients:bool=True):
+        """
+        Start buffering bookings for the patients in a new patients table. Every commit rewrites
+        the table without the patients booked so far.
+
+        Args:
+            new_patient_df (pd.DataFrame): the new patients table as it was loaded
+            update_new_patients (bool, optional): when False, only appointments are written
+        """
+        self.new_patient_df = new_patient_df
+        self.update_new_patients = update_new_patients
+        self.booked_new_patient_ids = []
+        self.journaled_new_patient_ids = set()
+
     def remove_scheduled_patients_from_new_patients_table(self, booked_new_patient_ids:list[int], new_patient_df:pd.DataFrame):
         """
         Remove scheduled patients from new patients table because they
-        are no longer new. They have been scheduled.
+        are no longer new. They have been scheduled. Any buffered appointments
+        are written with them, and the journal is compacted.
 
         Args:
             booked_new_patient_ids (list[int]): ids of new patients who were booked
         """
-        remaining_new_patients_df = \
-            new_patient_df[~new_patient_df["PATIENTID"].isin(booked_new_patient_ids)]
-        try:
-            remaining_new_patients_df.to_csv("data/New Patient Data.csv", mode='w', index=False)
-            print(f'{len(booked_new_patient_ids)} scheduled patients have been removed from New Patient Data')
-        except FileNotFoundError:
-            print("Error: The file 'data.csv' was not found.")
-        except KeyError as e:
-            print(f"Error: {e}")
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
+        self.new_patient_df = new_patient_df
+        self.update_new_patients = True
+        self.booked_new_patient_ids = list(booked_new_patient_ids)
+        self.compact()
 
-    def update_appointment_data_table(self, new_appointment_id:int, new_appointment:pd.DataFrame):
+    def update_appointment_data_table(self, new_appointment_id:int, new_appointment:pd.DataFrame, patient_id:int=None):
         """
-        Opens the Appointment Data Source and inserts a new record for the latest appointment
+        Buffers a new record for the latest appointment. It is journaled by the next commit, together
+        with the removal of the patient from the new patients table.
 
         Args:
             new_appointment_id (int): id of the appointment about to be created
             new_appointment (pd.DataFrame): information pertaining to the new appointment
+            patient_id (int, optional): id of the new patient the appointment was booked for
+        """
+        with self._lock:
+            self.pending_appointments.append({
+                'APPOINTMENTID': new_appointment_id,
+                'DATE': new_appointment['DATE'],
+                'START_DATETIME': new_appointment['START_DATETIME'],
+                'TIME_RANGE': new_appointment['TIME_RANGE'],
+                'PROVIDERID': new_appointment['PROVIDERID']
+            })
+            if patient_id is not None:
+                self.booked_new_patient_ids.append(patient_id)
+            flush = self.flush_every is not None and len(self.pending_appointments) >= self.flush_every
+
+        if flush:
+            self.commit()
+
+    def cancel_appointment(self, appointment_id:int, patient_id:int=None):
+        """
+        Buffers the cancellation of an appointment. An appointment that has not been written yet is
+        simply dropped; one already journaled or in the Appointment Data Source is removed by the next
+        compaction.
+        The patient it was booked for stays in the new patients table, back in the queue.
+
+        Args:
+            appointment_id (int): id of the cancelled appointment
+            patient_id (int, optional): id of the new patient the appointment was booked for
         """
-        new_appointment = new_appointment.copy()
-        new_appointment['APPOINTMENTID'] = new_appointment_id
+        with self._lock:
+            pending_count = len(self.pending_appointments)
+            self.pending_appointments = [appointment for appointment in self.pending_appointments
+                                         if appointment['APPOINTMENTID'] != appointment_id]
+            if len(self.pending_appointments) == pending_count:
+                self.cancelled_appointment_ids.add(int(appointment_id))
+            if patient_id is not None and patient_id in self.booked_new_patient_ids:
+                self.booked_new_patient_ids.remove(patient_id)
+
+    @timed('writes')
+    def commit(self) -> bool:
+        """
+        Appends the buffered bookings to the journal as one record: the new appointments, the
+        cancelled appointment ids and the changes to the booked patients since the last commit.
+
+        The record is one line flushed to disk before the buffers are cleared; a record cut short
+        by a crash is ignored, so either all or none of a commit is applied by compact().
+
+        Returns:
+            bool: True if the commit succeeded. On failure the buffers are kept for the next commit.
+        """
+        with self._lock:
+            pending_appointments, self.pending_appointments = self.pending_appointments, []
+            cancelled_appointment_ids, self.cancelled_appointment_ids = self.cancelled_appointment_ids, set()
+            booked_new_patient_ids = set(self.booked_new_patient_ids) \
+                if self.update_new_patients and self.new_patient_df is not None else set()
+            journaled_new_patient_ids = self.journaled_new_patient_ids
+
+        record = {}
+        if pending_appointments:
+            record['appointments'] = self.__format_appointments_for_csv(
+                pd.DataFrame(pending_appointments)).astype(str).values.tolist()
+        if cancelled_appointment_ids:
+            record['cancelled'] = sorted(cancelled_appointment_ids)
+        if booked_new_patient_ids - journaled_new_patient_ids:
+            record['booked'] = sorted(int(patient_id) for patient_id in booked_new_patient_ids - journaled_new_patient_ids)
+        if journaled_new_patient_ids - booked_new_patient_ids:
+            record['returned'] = sorted(int(patient_id) for patient_id in journaled_new_patient_ids - booked_new_patient_ids)
+        if not record:
+            return True
 
-        new_appointment_data_entry = self.__format_appointment_for_csv(new_appointment)
         try:
-            new_appointment_data_entry.to_csv('data/Appointment Data.csv', mode='a', header=False, index=False)
-            print('New Appointment added to table successfully!')
-        except FileNotFoundError:
-            print("Error: The specified file was not found.")
+            self.__append_journal(record)
+        except Exception as e:
+            if isinstance(e, PermissionError):
+                self.event_log.error('commit_failed', "Error: You do not have permission to write to this file.")
+            else:
+                self.event_log.error('commit_failed', f"An unexpected error occurred: {e}")
+            with self._lock:
+                # Bookings and cancellations buffered since the swap stay after the ones put back
+                self.pending_appointments = pending_appointments + self.pending_appointments
+                self.cancelled_appointment_ids |= cancelled_appointment_ids
+            return False
+
+        self.event_log.info('appointments_journaled', f"{len(pending_appointments)} new appointments journaled",
+                            appointments=len(pending_appointments))
+        with self._lock:
+            self.journaled_new_patient_ids = booked_new_patient_ids
+        return True
+
+    @timed('compaction')
+    def compact(self) -> bool:
+        """
+        Commits the buffered bookings and applies the journal to both tables in one transaction.
+
+        Both tables are written to temporary files first. A journal naming the files is then
+        written, the temporary files are renamed over the originals and both journals are removed.
+        If the process dies part way, recover() completes the renames; a compaction that failed
+        after its renames were journaled is completed by the next compact() or recover().
+
+        Returns:
+            bool: True if the compaction succeeded. On failure the journal is kept for the next one.
+        """
+        if os.path.exists(self.compaction_path):
+            self.__finish_compaction()
+        if not self.commit():
+            return False
+        records = self.__read_journal()
+        if not records:
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            return True
+
+        # Ids are never reused, so an id that was journaled and then cancelled is simply dropped
+        appointment_rows = {}
+        cancelled_appointment_ids = set()
+        booked_new_patient_ids = set()
+        for record in records:
+            for row in record.get('appointments', []):
+                appointment_rows[row[0]] = row
+            for appointment_id in record.get('cancelled', []):
+                if appointment_rows.pop(str(appointment_id), None) is None:
+                    cancelled_appointment_ids.add(appointment_id)
+            booked_new_patient_ids.update(record.get('booked', []))
+            booked_new_patient_ids.difference_update(record.get('returned', []))
+        new_patients_changed = any('booked' in record or 'returned' in record for record in records)
+
+        replacements = []
+        renames_journaled = False
+        try:
+            if appointment_rows or cancelled_appointment_ids:
+                temp_path = self.appointment_data_path + '.tmp'
+                self.__write_appointments(temp_path, list(appointment_rows.values()), cancelled_appointment_ids)
+                replacements.append((temp_path, self.appointment_data_path))
+
+            if new_patients_changed:
+                temp_path = self.new_patient_data_path + '.tmp'
+                if self.new_patient_df is not None:
+                    new_patient_df = self.new_patient_df
+                    booked_new_patient_ids = set(self.booked_new_patient_ids)
+                else:
+                    # Recovering without the table as it was loaded; the file still lists the journaled patients
+                    new_patient_df = pd.read_csv(self.new_patient_data_path, dtype=str)
+                remaining_new_patients_df = \
+                    new_patient_df[~new_patient_df["PATIENTID"].astype(int).isin(booked_new_patient_ids)]
+                remaining_new_patients_df.to_csv(temp_path, mode='w', index=False)
+                self.__fsync(temp_path)
+                replacements.append((temp_path, self.new_patient_data_path))
+
+            self.__write_compaction_journal(replacements)
+            renames_journaled = True
+            self.__finish_compaction()
+        except FileNotFoundError as e:
+            self.event_log.error('commit_failed', f"Error: The specified file was not found. {e}")
+            if not renames_journaled:
+                self.__discard_temp_files(replacements)
+            return False
         except PermissionError:
-            print("Error: You do not have permission to write to this file.")
+            self.event_log.error('commit_failed', "Error: You do not have permission to write to this file.")
+            if not renames_journaled:
+                self.__discard_temp_files(replacements)
+            return False
         except Exception as e:
-            print(f"An unexpected error occurred: {e}")
+            self.event_log.error('commit_failed', f"An unexpected error occurred: {e}")
+            if not renames_journaled:
+                self.__discard_temp_files(replacements)
+            return False
+
+        self.event_log.info('appointments_written', f'{len(appointment_rows)} new appointments added to table successfully!',
+                            appointments=len(appointment_rows))
+        if cancelled_appointment_ids:
+            self.event_log.info('cancellations_written',
+                                f'{len(cancelled_appointment_ids)} cancelled appointments removed from table',
+                                appointments=len(cancelled_appointment_ids))
+        if new_patients_changed and booked_new_patient_ids:
+            self.event_log.info('new_patients_written',
+                                f'{len(booked_new_patient_ids)} scheduled patients have been removed from New Patient Data',
+                                patients=len(booked_new_patient_ids))
+        return True
+
+    def recover(self):
+        """
+        Finishes a compaction that was interrupted after its renames were journaled, or discards
+        the temporary files of one that was interrupted before, then applies any journal left
+        behind by a run that did not reach its compaction. Call it before the data files are read.
+        """
+        if os.path.exists(self.compaction_path):
+            self.__finish_compaction()
+            self.event_log.warning('commit_recovered', 'Recovered an interrupted appointment data commit')
+            return
+
+        for path in [self.appointment_data_path, self.new_patient_data_path]:
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+        if os.path.exists(self.journal_path):
+            self.event_log.warning('journal_recovered', 'Applying the appointment journal of an interrupted run')
+            self.compact()
+
+    def __write_appointments(self, temp_path:str, appointment_rows:list, cancelled_appointment_ids:set):
+        """
+        Copy the appointment data table to temp_path, without any cancelled appointments, and
+        append the journaled appointments in one write.
 
-    def __format_appointment_for_csv(self, new_appointment:pd.DataFrame) -> pd.DataFrame:
+        Cancelled rows are dropped by the APPOINTMENTID at the start of each line; every other line
+        is copied byte for byte, so the rows before the first cancelled one, and a snapshot's
+        high-water mark over them, are left as they were.
+        """
+        if cancelled_appointment_ids:
+            cancelled_keys = {str(int(appointment_id)).encode() for appointment_id in cancelled_appointment_ids}
+            with open(self.appointment_data_path, 'rb') as source, open(temp_path, 'wb') as target:
+                target.write(source.readline())
+                for line in source:
+                    if line.split(b',', 1)[0].strip().strip(b'"') not in cancelled_keys:
+                        target.write(line)
+        else:
+            shutil.copyfile(self.appointment_data_path, temp_path)
+        if not appointment_rows:
+            self.__fsync(temp_path)
+            return
+
+        with open(temp_path, 'rb+') as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() > 0:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    file.write(b'\n')
+        pd.DataFrame(appointment_rows).to_csv(temp_path, mode='a', header=False, index=False)
+        self.__fsync(temp_path)
+
+    def __append_journal(self, record:dict):
+        """
+        Appends a record to the journal as one line and flushes it to disk. A line cut short by
+        an earlier failure is ended first, so it cannot swallow this record.
+        """
+        with open(self.journal_path, 'ab+') as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() > 0:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    file.write(b'\n')
+            file.write(json.dumps(record).encode() + b'\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def __read_journal(self) -> list:
+        """
+        The complete records of the journal, in the order they were committed.
+        """
+        if not os.path.exists(self.journal_path):
+            return []
+        records = []
+        with open(self.journal_path, 'rb') as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Cut short by a crash while it was appended
+                    continue
+        return records
+
+    def __finish_compaction(self):
+        """
+        Renames the temporary files named in the compaction journal over the tables, then removes
+        the appointment journal they apply and the compaction journal.
+        """
+        with open(self.compaction_path, 'r') as file:
+            replacements = json.load(file)['replacements']
+        self.__apply_replacements(replacements)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        os.remove(self.compaction_path)
+
+    def __write_compaction_journal(self, replacements:list):
+        temp_path = self.compaction_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'replacements': replacements}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.compaction_path)
+
+    def __apply_replacements(self, replacements:list):
+        for temp_path, path in replacements:
+            # A missing temp file was already renamed before the interruption
+            if os.path.exists(temp_path):
+                os.replace(temp_path, path)
+
+    def __discard_temp_files(self, replacements:list):
+        for temp_path, _ in replacements:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def __fsync(self, path:str):
+        with open(path, 'rb+') as file:
+            os.fsync(file.fileno())
+
+    def __format_appointments_for_csv(self, new_appointments:pd.DataFrame) -> pd.DataFrame:
         """
         This method modifies the column names to align with the csv as well as
         converts the values to their proper string formats
@@ -75,23 +423,17 @@ class AppointmentDataHandler:
         291760,        2025-01-29,      12:30 PM,           60,                 118
 
         Args:
-            new_appointment (pd.DataFrame): new appointment information
+            new_appointments (pd.DataFrame): new appointment information, one row per appointment
 
         Returns:
             pd.DataFrame: new appointment information formatted for the csv file
         """
-        appointment_id = str(new_appointment['APPOINTMENTID'])
-        date = new_appointment['DATE'].strftime('%Y-%m-%d')
-        start_time = new_appointment['START_DATETIME'].strftime('%I:%M %p')
-        duration = int(new_appointment['TIME_RANGE'].seconds/60)
-        provider_id = str(new_appointment['PROVIDERID'])
-
-        new_appointment_data_entry = pd.DataFrame([{
-            'APPOINTMENTID' : appointment_id,
-            'APPOINTMENTDATE' : date,
-            'APPOINTMENTSTARTTIME' : start_time,
-            'APPOINTMENTDURATION' : duration,
-            'PROVIDERID': provider_id
-        }])
-
-        return new_appointment_data_entry
+        new_appointment_data_entries = pd.DataFrame({
+            'APPOINTMENTID' : new_appointments['APPOINTMENTID'].astype(str),
+            'APPOINTMENTDATE' : pd.to_datetime(new_appointments['DATE']).dt.strftime('%Y-%m-%d'),
+            'APPOINTMENTSTARTTIME' : pd.to_datetime(new_appointments['START_DATETIME']).dt.strftime('%I:%M %p'),
+            'APPOINTMENTDURATION' : (pd.to_timedelta(new_appointments['TIME_RANGE']).dt.seconds // 60).astype(int),
+            'PROVIDERID': new_appointments['PROVIDERID'].astype(str)
+        })
+
+        return new_appointment_data_entries
@@ -0,0 +1,116 @@
+"""
+This module provides the AppointmentIdAllocator class, which hands out new appointment ids from
+memory instead of reloading the appointment data to find the current maximum for every booking.
+
+Classes:
+    AppointmentIdAllocator: Allocates increasing appointment ids, optionally backed by a sequence file.
+
+Methods:
+    next_id(): Returns the next free appointment id.
+    peek_next_id(): Returns the id next_id would hand out without consuming it.
+"""
+
+import os
+import threading
+
+import pandas as pd
+
+try:
+    import fcntl  # File locking is only available on POSIX systems
+except ImportError:
+    fcntl = None
+
+class AppointmentIdAllocator:
+    """
+    Allocates appointment ids that are higher than every id already in the appointment data.
+
+    Without a sequence file, ids are simply counted up in memory. With a sequence file, ids are
+    reserved in blocks: the file stores the highest id handed out to any run, and every run
+    advances it by block_size before using the block. Concurrent or resumed runs sharing the file
+    therefore never hand out the same id; unused ids at the end of a block are skipped.
+    """
+
+    def __init__(self, appointment_df:pd.DataFrame=None, sequence_file:str=None, block_size:int=100):
+        """
+        Args:
+            appointment_df (pd.DataFrame, optional): loaded appointment data used to seed the allocator
+            sequence_file (str, optional): path of the file used to reserve blocks of ids durably
+            block_size (int, optional): number of ids reserved from the sequence file at a time
+        """
+        if block_size < 1:
+            raise ValueError(f"block_size must be at least 1, got {block_size}")
+
+        self.sequence_file = sequence_file
+        self.block_size = block_size
+        self._lock = threading.Lock()
+
+        max_appointment_id = 0
+        if appointment_df is not None and not appointment_df.empty:
+            max_appointment_id = int(appointment_df['APPOINTMENTID'].max())
+
+        self._next_id = max_appointment_id + 1
+        # Last id of the currently reserved block; ids beyond it must be reserved first
+        self._block_end = None if sequence_file is None else max_appointment_id
+
+    def next_id(self) -> int:
+        """
+        Returns the next free appointment id.
+
+        Returns:
+            int: a new appointment id
+        """
+        with self._lock:
+            if self._block_end is not None and self._next_id > self._block_end:
+                self.__reserve_block()
+            new_appointment_id = self._next_id
+            self._next_id += 1
+            return new_appointment_id
+
+    def peek_next_id(self) -> int:
+        """
+        Returns the id next_id would hand out, without consuming it. When a sequence file is used
+        and the current block is exhausted, the actual id may be higher.
+
+        Returns:
+            int: the next appointment id
+        """
+        return self._next_id
+
+    def __reserve_block(self):
+        """
+        Reserve the next block of ids in the sequence file. The file is locked while it is read
+        and rewritten, and the new value is flushed to disk before any id in the block is used.
+        """
+        directory = os.path.dirname(os.path.abspath(self.sequence_file))
+        os.makedirs(directory, exist_ok=True)
+
+        with open(self.sequence_file + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                reserved = self.__read_sequence()
+                block_start = max(self._next_id, reserved + 1)
+                block_end = block_start + self.block_size - 1
+                self.__write_sequence(block_end)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        self._next_id = block_start
+        self._block_end = block_end
+
+    def __read_sequence(self) -> int:
+        try:
+            with open(self.sequence_file, 'r') as file:
+                content = file.read().strip()
+            return int(content) if content else 0
+        except FileNotFoundError:
+            return 0
+
+    def __write_sequence(self, value:int):
+        temp_path = self.sequence_file + '.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(f'{value}\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.sequence_file)
@@ -6,133 +6,454 @@ Classes:
     AppointmentScheduler: Handles appointment scheduling logic, ensuring patients are booked efficiently.
 
 Functions:
-    __init__(new_appointment_tracker: NewAppointmentTracker, analysis):
+    __init__(new_appointment_tracker: NewAppointmentTracker, analysis, appointment_id_allocator=None,
+             appointment_data_handler=None, calendar_store=None, data_dir='data/', rolling_horizon=None):
         Initializes the AppointmentScheduler with the necessary components.
-    find_earliest_appointments(new_patient: pd.DataFrame, current_calendar_df: pd.DataFrame) -> pd.DataFrame:
-        Finds the earliest available timeslots for a new patient.
-    book_earliest_appointment(new_patient: pd.DataFrame, current_calendar_df: pd.DataFrame,
-                                available_time_slots_df: pd.DataFrame) -> pd.DataFrame: 
+    load_calendar(current_calendar: ProviderCalendar):
+        Builds the free-slot index used to find timeslots, and attaches it to the rolling horizon if there is one.
+    find_earliest_appointment(new_patient: pd.DataFrame) -> pd.Series:
+        Finds the earliest available timeslot for a new patient.
+    book_earliest_appointment(new_patient: pd.DataFrame, current_calendar: ProviderCalendar,
+                                available_time_slot: pd.Series) -> ProviderCalendar:
         Books the earliest available appointment for a new patient.
-    __update_new_appointment_tracker(new_appointment_id: int, current_calendar_df: pd.DataFrame):
+    book_appointment(new_patient: pd.DataFrame, current_calendar: ProviderCalendar,
+                     available_time_slot: pd.Series) -> tuple:
+        Books a timeslot for a new patient and returns the new appointment id with the calendar.
+    find_earliest_window(new_patient: pd.DataFrame, current_calendar: ProviderCalendar, minutes: int) -> tuple:
+        Finds the earliest run of open timeslots long enough for an appointment of any length.
+    book_window_appointment(new_patient: pd.DataFrame, current_calendar: ProviderCalendar, provider_id: int,
+                            start: int, minutes: int) -> tuple:
+        Books an appointment of any length for a new patient on every timeslot it overlaps.
+    cancel_appointment(appointment_id: int, current_calendar: ProviderCalendar, promote: bool,
+                       waiting_patients: list, max_promotions: int) -> tuple:
+        Cancels an appointment, releases its timeslots and optionally promotes patients into them.
+    __update_new_appointment_tracker(available_time_slot: pd.Series):
         Updates the new appointment tracker with the new appointment.
     __add_to_analysis(new_patient: pd.DataFrame, available_time_slot: pd.DataFrame):
         Adds the new appointment information to the analysis.
 """
 
+import os
+from collections import deque
+
 import pandas as pd
 
 from preprocessing.preprocessor import Preprocessor
+from preprocessing.provider_calendar import ProviderCalendar
 
 from scheduling.appointment_data_handler import AppointmentDataHandler
+from scheduling.appointment_id_allocator import AppointmentIdAllocator
 from scheduling.calendar_manager import CalendarManager
+from scheduling.free_slot_index import FreeSlotIndex, NS_PER_DAY
 from scheduling.new_appointment_tracker import NewAppointmentTracker
+from scheduling.rolling_horizon import RollingHorizon
 
+from util.event_log import EventLog
+from util.profiling import Profiler, timed
 from util.utility import read_json
 
 class AppointmentScheduler:
     """
     Handles appointment scheduling logic, ensuring patients are booked efficiently.
+
+    The new patient appointments booked by this scheduler are kept so they can be cancelled
+    or moved to an earlier timeslot.
+    {
+        appointment_id: (new_patient, booked timeslot),
+        ...
+    }
     """
 
-    def __init__(self, new_appointment_tracker:NewAppointmentTracker, analysis):
-        self.appointment_data_handler = AppointmentDataHandler()
+    def __init__(self, new_appointment_tracker:NewAppointmentTracker, analysis,
+                 appointment_id_allocator:AppointmentIdAllocator=None,
+                 appointment_data_handler:AppointmentDataHandler=None, calendar_store=None,
+                 data_dir:str='data/', rolling_horizon:RollingHorizon=None):
+        """
+        Args:
+            new_appointment_tracker (NewAppointmentTracker): tracks the daily limit of new appointments
+            analysis (Analysis): collects the booked appointments for the TTFA statistics
+            appointment_id_allocator (AppointmentIdAllocator, optional): hands out new appointment ids.
+                When omitted, one is seeded from the appointment data the first time an id is needed.
+            appointment_data_handler (AppointmentDataHandler, optional): buffers and writes new appointments
+            calendar_store (CalendarStore, optional): SQLite store that serves earliest-slot lookups
+                and records every booking in a single transaction
+            data_dir (str, optional): folder the appointment data is read from to seed new appointment ids
+            rolling_horizon (RollingHorizon, optional): builds later weeks of the calendar when a search
+                runs out of timeslots, and evicts the weeks patients can no longer be booked in
+        """
+        self.appointment_data_handler = appointment_data_handler or AppointmentDataHandler()
         self.calendar_manager = CalendarManager()
-        self.preprocessor = Preprocessor("data/")
+        self.data_dir = data_dir
+        self.preprocessor = Preprocessor(data_dir)
         self.analysis = analysis
         self.new_appointment_tracker = new_appointment_tracker
+        self.free_slot_index = None
+        self.appointment_id_allocator = appointment_id_allocator
+        self.calendar_store = calendar_store
+        self.rolling_horizon = rolling_horizon
+        self.booked_appointments = {}
+        # Appointments booked with book_window_appointment, which span a run of timeslots
+        self.window_appointment_ids = set()
+        self.profiler = Profiler()
+        self.event_log = EventLog()
 
 
-    def find_earliest_appointments(self, new_patient:pd.DataFrame, current_calendar_df:pd.DataFrame) -> pd.DataFrame:
+    @timed('load_calendar')
+    def load_calendar(self, current_calendar:ProviderCalendar):
+        """
+        Builds the per-state index of open timeslots that find_earliest_appointment searches.
+        Must be called with the populated calendar before any patient is booked.
+
+        Args:
+            current_calendar (ProviderCalendar): the calendar containing all timeslots
+        """
+        self.free_slot_index = FreeSlotIndex(current_calendar)
+        if self.rolling_horizon is not None:
+            self.rolling_horizon.attach(current_calendar, self.free_slot_index)
+
+    def find_earliest_appointment(self, new_patient:pd.DataFrame) -> pd.Series:
             """
-            Finds all providers in same state as new patient,
-            finds all available timeslots, removes taken timeslots
-            and timeslots earlier than registration.
-            Lastly, sorts the list of avaiable timeslots from earliest to latest
+            Finds the earliest open timeslot, on a day after the patient registered, with a provider
+            licensed in the patient's state who has not reached their daily limit of new appointments.
+            Ties on start time go to the lowest provider id. With a rolling horizon, later weeks are
+            built until one has such a timeslot or no later week can.
 
             Args:
                 new_patient (pd.DataFrame): information pertaining to the new patient
-                current_calendar_df (pd.DataFrame): the calendar containing all timeslots
 
             Returns:
-                pd.DataFrame: a collection of available timeslots
+                pd.Series: the earliest available timeslot, or None if there is none
             """
+            registration_date = pd.Timestamp(new_patient['REGISTRATIONDATE'])
+            earliest_start = (registration_date.normalize() + pd.Timedelta(days=1)).value
 
-            same_state_providers_df = current_calendar_df[current_calendar_df['STATE'] == new_patient['STATE']].sort_values(by = 'PROVIDERID')
-
-            available_time_slots_df = self.calendar_manager.remove_taken_timeslots(same_state_providers_df)
+            if self.calendar_store is not None:
+                earliest_slot = self.calendar_store.earliest_free_slot(
+                    new_patient['STATE'], earliest_start, NewAppointmentTracker.MAX_NEW_APPOINTMENTS_PER_DAY)
+                if earliest_slot is None:
+                    return None
+                start, provider_id = earliest_slot
+                return self.calendar_store.get_slot(provider_id, start, new_patient['STATE'])
 
-            available_time_slots_df = self.calendar_manager.remove_timeslots_earlier_than_registration(new_patient, available_time_slots_df)
+            if self.rolling_horizon is not None:
+                self.rolling_horizon.advance(earliest_start)
+            earliest_slot = self.free_slot_index.earliest_free_slot(
+                new_patient['STATE'], earliest_start, self.new_appointment_tracker.has_capacity,
+                self.__report_unavailable_providers)
+            while earliest_slot is None and self.rolling_horizon is not None:
+                # Only the new week has to be searched; every earlier timeslot was rejected already
+                week_start = self.rolling_horizon.extend(new_patient['STATE'])
+                if week_start is None:
+                    break
+                earliest_slot = self.free_slot_index.earliest_free_slot(
+                    new_patient['STATE'], max(week_start, earliest_start), self.new_appointment_tracker.has_capacity,
+                    self.__report_unavailable_providers)
+            if earliest_slot is None:
+                return None
 
-            return available_time_slots_df.sort_values(by=['DATE', 'START_DATETIME'])
+            start, provider_id = earliest_slot
+            return self.free_slot_index.get_slot(provider_id, start, new_patient['STATE'])
 
-    def book_earliest_appointment(self, new_patient:pd.DataFrame, current_calendar_df:pd.DataFrame,
-                                    available_time_slots_df:pd.DataFrame) -> pd.DataFrame:
+    def book_earliest_appointment(self, new_patient:pd.DataFrame, current_calendar:ProviderCalendar,
+                                    available_time_slot:pd.Series) -> ProviderCalendar:
         """
-        This private method populates the current_calendar_df calendar.
-        It takes the new patient and assigns them to a slot in the calendar dataframe.
-        It also writes their appointment info to the appointment data csv file.
+        This private method populates the current_calendar calendar.
+        It takes the new patient and assigns them to a slot in the calendar.
+        It also buffers their appointment info for the appointment data csv file.
 
         Args:
             new_patient (pd.DataFrame): future state, we have to tie patient to appointment somehow
-            current_calendar_df (pd.DataFrame): the current state of the calendar
-            available_time_slots_df (pd.DataFrame): the available timeslots for the new patient
+            current_calendar (ProviderCalendar): the current state of the calendar
+            available_time_slot (pd.Series): the timeslot returned by find_earliest_appointment
 
         Returns:
-            pd.DataFrame: the updated calendar
-        """
-        for _, available_time_slot in available_time_slots_df.iterrows():
-            if self.new_appointment_tracker.check_if_provider_has_availibility(available_time_slot):
-                # BETTER TO GO TO DATABASE INSTEAD?
-                max_appointment_id = self.__get_max_appointment_id()
-                new_appointment_id = int(max_appointment_id + 1)
-                self.appointment_data_handler.update_appointment_data_table(new_appointment_id, available_time_slot)
-                current_calendar_df = self.calendar_manager.update_calendar(new_appointment_id, available_time_slot, current_calendar_df)
-                self.__update_new_appointment_tracker(new_appointment_id, current_calendar_df)
-                self.__add_to_analysis(new_patient, available_time_slot)
-                return current_calendar_df
-            else:
-                print(f"Provider: {available_time_slot['PROVIDERID']} does not have ability for {available_time_slot['DATE']}")
-        return current_calendar_df
+            ProviderCalendar: the updated calendar
+        """
+        current_calendar, _ = self.book_appointment(new_patient, current_calendar, available_time_slot)
+        return current_calendar
 
-    def __update_new_appointment_tracker(self, new_appointment_id:int,current_calendar_df:pd.DataFrame):
+    def book_appointment(self, new_patient:pd.DataFrame, current_calendar:ProviderCalendar,
+                         available_time_slot:pd.Series) -> tuple:
         """
-        Providers can only have 5 additional appointments booked per day. We have to keep track of that.
+        Books a timeslot for a new patient: allocates the appointment id, buffers the appointment
+        record, and updates the calendar, the free-slot index, the tracker and the analysis.
 
         Args:
-            new_appointment_id (int): id of the new appointment that was just created
-            current_calendar_df (pd.DataFrame): a calendar showing all appointments
+            new_patient (pd.DataFrame): information pertaining to the new patient
+            current_calendar (ProviderCalendar): the current state of the calendar
+            available_time_slot (pd.Series): an open timeslot the patient can take
+
+        Returns:
+            tuple: the updated calendar and the new appointment id
         """
-        provider_id, appointment_date = current_calendar_df.loc[
-            current_calendar_df['APPOINTMENTID'] == new_appointment_id, ['PROVIDERID', 'DATE']].iloc[0]
+        new_appointment_id = self.__get_appointment_id_allocator().next_id()
+        if self.calendar_store is not None:
+            self.calendar_store.book(new_appointment_id, available_time_slot['PROVIDERID'],
+                                     available_time_slot['START_DATETIME'].value, new_patient['PATIENTID'])
+        self.appointment_data_handler.update_appointment_data_table(new_appointment_id, available_time_slot,
+                                                                    new_patient['PATIENTID'])
+        current_calendar = self.calendar_manager.update_calendar(new_appointment_id, available_time_slot, current_calendar)
+        self.free_slot_index.remove_slot(available_time_slot['PROVIDERID'], available_time_slot['START_DATETIME'].value)
+        self.__update_new_appointment_tracker(available_time_slot)
+        self.__add_to_analysis(new_patient, available_time_slot)
+        self.booked_appointments[new_appointment_id] = (new_patient, available_time_slot)
+        self.profiler.count('bookings')
+        return current_calendar, new_appointment_id
 
-        new_appointment_count = self.new_appointment_tracker.get_provider_by_date(provider_id, appointment_date)
+    def find_earliest_window(self, new_patient:pd.DataFrame, current_calendar:ProviderCalendar, minutes:int) -> tuple:
+        """
+        Finds the earliest start, on a day after the patient registered, from which a provider
+        licensed in the patient's state has some minutes of open timeslots in a row and has not
+        reached their daily limit of new appointments. Ties on start time go to the lowest provider
+        id. Only the weeks already in the calendar are searched.
 
-        if  new_appointment_count != 'Not found':
-            self.new_appointment_tracker.increment_provider_appointments(provider_id, appointment_date)
-        else:
-            self.new_appointment_tracker.add_provider(provider_id, appointment_date)
-            self.new_appointment_tracker.increment_provider_appointments(provider_id, appointment_date)
+        Args:
+            new_patient (pd.DataFrame): information pertaining to the new patient
+            current_calendar (ProviderCalendar): the current state of the calendar
+            minutes (int): length of the appointment
 
-    def __add_to_analysis(self, new_patient:pd.DataFrame, available_time_slot:pd.DataFrame):
-        self.analysis.registration_info.append({
-            'patient_id' : new_patient['PATIENTID'],
-            'registration_date' : new_patient['REGISTRATIONDATE'],
-            'program' : new_patient['PROGRAM'],
-            'appointment_start_time' : available_time_slot['START_DATETIME']
+        Returns:
+            tuple: (start, provider_id) of the earliest window, or None if there is none
+        """
+        registration_date = pd.Timestamp(new_patient['REGISTRATIONDATE'])
+        earliest_start = (registration_date.normalize() + pd.Timedelta(days=1)).value
+
+        earliest_window = None
+        for provider_id in sorted(self.free_slot_index.provider_states):
+            if new_patient['STATE'] not in self.free_slot_index.provider_states[provider_id]:
+                continue
+            after = earliest_start
+            while True:
+                start = current_calendar.earliest_window(provider_id, minutes, after)
+                # Providers are visited in id order, so a tie keeps the earlier one
+                if start is None or (earliest_window is not None and start >= earliest_window[0]):
+                    break
+                if self.new_appointment_tracker.get_provider_by_date(provider_id, pd.Timestamp(start).normalize()) \
+                        < NewAppointmentTracker.MAX_NEW_APPOINTMENTS_PER_DAY:
+                    earliest_window = (start, provider_id)
+                    break
+                after = (start // NS_PER_DAY + 1) * NS_PER_DAY
+        return earliest_window
+
+    def book_window_appointment(self, new_patient:pd.DataFrame, current_calendar:ProviderCalendar, provider_id:int,
+                                start:int, minutes:int) -> tuple:
+        """
+        Books an appointment of any length for a new patient, usually at a start found by
+        find_earliest_window. Every timeslot it overlaps is taken and leaves the free-slot index,
+        while the daily limit, the analysis and the appointment data count it as one appointment.
+        Cancelling it releases all of its timeslots.
+
+        Args:
+            new_patient (pd.DataFrame): information pertaining to the new patient
+            current_calendar (ProviderCalendar): the current state of the calendar
+            provider_id (int): provider id
+            start (int): appointment start, in nanoseconds since the epoch
+            minutes (int): length of the appointment
+
+        Returns:
+            tuple: the updated calendar and the new appointment id
+
+        Raises:
+            ValueError: if the provider is not free for the whole appointment, or bookings go to a
+                CalendarStore, which only books single timeslots
+        """
+        if self.calendar_store is not None:
+            raise ValueError("The calendar store only books single timeslots")
+        new_appointment_id = self.__get_appointment_id_allocator().next_id()
+        booked_time_slots = self.calendar_manager.book_window(new_appointment_id, provider_id, start, minutes,
+                                                              current_calendar)
+        start_datetime = pd.Timestamp(start)
+        booked_time_slot = pd.Series({
+            'PROVIDERID': provider_id,
+            'DATE': start_datetime.normalize(),
+            'START_DATETIME': start_datetime,
+            'END_DATETIME': start_datetime + pd.Timedelta(minutes=minutes),
+            'TIME_RANGE': pd.Timedelta(minutes=minutes),
+            'STATE': new_patient['STATE']
         })
+        self.appointment_data_handler.update_appointment_data_table(new_appointment_id, booked_time_slot,
+                                                                    new_patient['PATIENTID'])
+        for slot_start, slot_provider_id in booked_time_slots:
+            self.free_slot_index.remove_slot(slot_provider_id, slot_start)
+        self.__update_new_appointment_tracker(booked_time_slot)
+        self.__add_to_analysis(new_patient, booked_time_slot)
+        self.booked_appointments[new_appointment_id] = (new_patient, booked_time_slot)
+        self.window_appointment_ids.add(new_appointment_id)
+        self.profiler.count('bookings')
+        return current_calendar, new_appointment_id
+
+    def cancel_appointment(self, appointment_id:int, current_calendar:ProviderCalendar, promote:bool=False,
+                           waiting_patients:list=None, max_promotions:int=None) -> tuple:
+        """
+        Cancels an appointment and releases its timeslots in every state the provider is licensed
+        in. The calendar, the free-slot index, the daily limit counter, the analysis and the
+        appointment data are all updated in place; the calendar is not rebuilt.
+
+        With promote, each released timeslot is offered to the patient who gains the most from it.
+        A waiting patient who has no appointment gains the most, first registered first. Otherwise
+        the booked patient whose appointment moves the furthest forward is moved, and the timeslot
+        they leave is offered in turn.
+
+        Args:
+            appointment_id (int): id of the appointment to cancel
+            current_calendar (ProviderCalendar): the current state of the calendar
+            promote (bool, optional): fill the released timeslots from waiting or booked patients
+            waiting_patients (list, optional): unscheduled new patients in registration order.
+                Patients who are booked are removed from it.
+            max_promotions (int, optional): stop after this many patients have been booked or moved
 
-    def __get_max_appointment_id(self, ) -> int:
+        Returns:
+            tuple: the updated calendar, the new patient whose appointment was cancelled (None for
+                an appointment this scheduler did not book) and the (patient_id, appointment_id)
+                of every promotion
+        """
+        current_calendar, cancelled_patient, released_time_slots = \
+            self.__release_appointment(appointment_id, current_calendar)
+        if not released_time_slots:
+            self.event_log.warning('nothing_released', f"Appointment {appointment_id} has no timeslots to release",
+                                   appointment_id=appointment_id)
+
+        promotions = []
+        released_time_slots = deque(released_time_slots)
+        while promote and released_time_slots and (max_promotions is None or len(promotions) < max_promotions):
+            start, provider_id = released_time_slots.popleft()
+            promotion = self.__find_promotion(provider_id, start, waiting_patients or [])
+            if promotion is None:
+                continue
+
+            new_patient, previous_appointment_id = promotion
+            if previous_appointment_id is None:
+                del waiting_patients[next(position for position, waiting_patient in enumerate(waiting_patients)
+                                          if waiting_patient is new_patient)]
+            else:
+                current_calendar, _, vacated_time_slots = \
+                    self.__release_appointment(previous_appointment_id, current_calendar)
+                released_time_slots.extend(vacated_time_slots)
+
+            available_time_slot = self.free_slot_index.get_slot(provider_id, start, new_patient['STATE'])
+            current_calendar, new_appointment_id = self.book_appointment(
+                new_patient, current_calendar, available_time_slot)
+            promotions.append((new_patient['PATIENTID'], new_appointment_id))
+            self.event_log.detail('patient_promoted', 'Patient {patient_id} promoted to {start} with provider {provider_id}',
+                                  patient_id=new_patient['PATIENTID'], start=available_time_slot['START_DATETIME'],
+                                  provider_id=provider_id, appointment_id=new_appointment_id)
+        return current_calendar, cancelled_patient, promotions
+
+    def __release_appointment(self, appointment_id:int, current_calendar:ProviderCalendar) -> tuple:
+        """
+        Frees the timeslots of an appointment and reverses its bookkeeping.
+
+        Returns:
+            tuple: the updated calendar, the new patient the appointment was booked for (or None)
+                and the (start, provider_id) keys of the released timeslots
+        """
+        released_time_slots = self.calendar_manager.release_appointment(appointment_id, current_calendar)
+        for start, provider_id in released_time_slots:
+            self.free_slot_index.add_slot(provider_id, start)
+
+        cancelled_patient = None
+        booking = self.booked_appointments.pop(appointment_id, None)
+        self.window_appointment_ids.discard(appointment_id)
+        if booking is not None:
+            cancelled_patient, booked_time_slot = booking
+            self.new_appointment_tracker.decrement_provider_appointments(
+                booked_time_slot['PROVIDERID'], booked_time_slot['DATE'])
+            # The provider is below the daily limit again that day
+            self.free_slot_index.reopen_provider_day(
+                booked_time_slot['PROVIDERID'], pd.Timestamp(booked_time_slot['DATE']).value // NS_PER_DAY)
+            self.__remove_from_analysis(cancelled_patient['PATIENTID'])
+
+        self.appointment_data_handler.cancel_appointment(
+            appointment_id, None if cancelled_patient is None else cancelled_patient['PATIENTID'])
+        if self.calendar_store is not None:
+            self.calendar_store.cancel(appointment_id)
+        self.event_log.info('appointment_cancelled',
+                            f"Appointment {appointment_id} cancelled, {len(released_time_slots)} provider timeslots released",
+                            appointment_id=appointment_id, timeslots=len(released_time_slots))
+        return current_calendar, cancelled_patient, released_time_slots
+
+    def __find_promotion(self, provider_id:int, start:int, waiting_patients:list):
         """
-        Retrieves the maximum appointment ID from the appointments DataFrame.
+        Picks the patient who gains the most from a released timeslot: the first waiting patient
+        who can take it, otherwise the booked patient whose appointment moves the furthest forward.
+        Patients can only take timeslots in their state, on a day after they registered, with a
+        provider below the daily limit of new appointments.
+
+        Returns:
+            tuple or None: the patient and the id of the appointment they give up (None for a
+                waiting patient), or None when nobody can take the timeslot
+        """
+        states = self.free_slot_index.provider_states.get(provider_id, [])
+        day = start // NS_PER_DAY
+        has_capacity = self.new_appointment_tracker.get_provider_by_date(provider_id, pd.Timestamp(day, unit='D')) \
+            < NewAppointmentTracker.MAX_NEW_APPOINTMENTS_PER_DAY
+
+        def can_take(new_patient):
+            registration_day = pd.Timestamp(new_patient['REGISTRATIONDATE']).value // NS_PER_DAY
+            return new_patient['STATE'] in states and registration_day < day
 
-        This method fetches the appointments DataFrame and returns the highest value
-        in the 'APPOINTMENTID' column.
+        if has_capacity:
+            for new_patient in waiting_patients:
+                if can_take(new_patient):
+                    return new_patient, None
+
+        promotion = None
+        largest_gain = 0
+        for appointment_id, (new_patient, booked_time_slot) in self.booked_appointments.items():
+            gain = booked_time_slot['START_DATETIME'].value - start
+            # An appointment spanning a run of timeslots does not fit in the one released
+            if gain <= largest_gain or appointment_id in self.window_appointment_ids or not can_take(new_patient):
+                continue
+            # Moving within the same provider and day frees the counter it needs
+            same_day = booked_time_slot['PROVIDERID'] == provider_id and \
+                booked_time_slot['START_DATETIME'].value // NS_PER_DAY == day
+            if has_capacity or same_day:
+                promotion = (new_patient, appointment_id)
+                largest_gain = gain
+        return promotion
+
+    def __report_unavailable_providers(self, rejected_time_slots:list):
+        """
+        Reports candidate timeslots that were skipped because their provider reached the
+        daily limit of new appointments.
+
+        Args:
+            rejected_time_slots (list): (start, provider_id) keys of the skipped timeslots
+        """
+        for start, provider_id in rejected_time_slots:
+            appointment_date = self.free_slot_index.get_slot_date(provider_id, start)
+            self.event_log.detail('capacity_rejected', 'Provider: {provider_id} does not have ability for {date}',
+                                  provider_id=provider_id, date=appointment_date)
+
+    def __update_new_appointment_tracker(self, available_time_slot:pd.Series):
+        """
+        Providers can only have 5 additional appointments booked per day. We have to keep track of that.
+
+        Args:
+            available_time_slot (pd.Series): the timeslot that was just booked
+        """
+        self.new_appointment_tracker.increment_provider_appointments(
+            available_time_slot['PROVIDERID'], available_time_slot['DATE'])
+
+    def __add_to_analysis(self, new_patient:pd.DataFrame, available_time_slot:pd.DataFrame):
+        self.analysis.record_appointment(new_patient['PATIENTID'], new_patient['PROGRAM'],
+                                         new_patient['REGISTRATIONDATE'], available_time_slot['START_DATETIME'],
+                                         new_patient['STATE'])
+
+    def __remove_from_analysis(self, patient_id:int):
+        self.analysis.remove_appointment(patient_id)
+
+    def __get_appointment_id_allocator(self, ) -> AppointmentIdAllocator:
+        """
+        Retrieves the appointment id allocator, seeding one from the appointment data
+        the first time it is needed if none was provided.
 
         Returns:
-            int: The maximum appointment ID.
+            AppointmentIdAllocator: The allocator for new appointment ids.
         """
-        appointment_df:pd.DataFrame = self.__get_appointments_df()
-        return appointment_df['APPOINTMENTID'].max()
+        if self.appointment_id_allocator is None:
+            self.appointment_id_allocator = AppointmentIdAllocator(self.__get_appointments_df())
+        return self.appointment_id_allocator
 
     def __get_appointments_df(self, ) -> pd.DataFrame:
         """
@@ -145,9 +466,9 @@ class AppointmentScheduler:
             pd.DataFrame: The DataFrame containing appointment data.
         """
         # Maps CSV files to corresponding DataFrames
-        pattern_mapping = read_json('data/pattern_map.json')
+        pattern_mapping = read_json(os.path.join(self.data_dir, 'pattern_map.json'))
 
         # Create preprocessor and load data
-        preprocessor = Preprocessor("data/")
+        preprocessor = Preprocessor(self.data_dir)
         dfs = preprocessor.read_csvs(pattern_mapping)
         return dfs['appointment_df']
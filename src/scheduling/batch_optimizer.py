@@ -0,0 +1,443 @@
+"""
+This module contains the BatchOptimizer class, an alternative to the greedy first-come-first-served
+scheduler that plans the whole new patient backlog at once.
+
+Model:
+    A patient can be booked with any provider licensed in their state, on any day after they registered.
+    Every provider/day can take at most NewAppointmentTracker.MAX_NEW_APPOINTMENTS_PER_DAY new
+    appointments, minus those already booked. All patients that can use a provider/day can use any of its
+    slots, so a provider/day taking k patients always uses its k earliest open slots. Each of those slots
+    is a "unit" and the problem is a bipartite matching between units and patients.
+
+Objectives:
+    total: book as many patients as possible with the minimum total time to first appointment (TTFA).
+        The total TTFA of a matching is the sum of the unit start times minus the sum of the booked
+        patients' registration times, so the two sides can be optimized separately. The sets of units
+        (and of patients) that can be matched together form a transversal matroid, so taking units in
+        start-time order, and patients latest-registration first, whenever an augmenting path exists
+        gives the best set on each side. By the Mendelsohn-Dulmage theorem a single matching covers
+        both sets, and it is found by matching the chosen units to the chosen patients.
+    max: book as many patients as possible while minimizing the largest TTFA (then the total TTFA).
+        Solved by a binary search on the TTFA threshold with the same matching routines.
+
+If the instance is larger than max_units or the solve runs past time_limit, the plan falls back to the
+greedy heuristic, which runs in bounded time.
+
+Classes:
+    BatchOptimizer: Plans bookings for a batch of new patients.
+
+Methods:
+    plan(sorted_new_patient_df): Plans bookings with the configured objective.
+    plan_greedy(sorted_new_patient_df): Plans bookings the way the greedy scheduler would.
+"""
+
+import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from scheduling.free_slot_index import NS_PER_DAY
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+from util.event_log import EventLog
+
+NS_PER_HOUR = 3_600_000_000_000
+NS_PER_MINUTE = 60_000_000_000
+
+class BatchOptimizer:
+    """
+    Plans bookings for a batch of new patients with a global objective instead of one patient at a time.
+    """
+    OBJECTIVES = ('total', 'max')
+
+    def __init__(self, free_slot_index, new_appointment_tracker:NewAppointmentTracker,
+                 objective:str='total', time_limit:float=30.0, max_units:int=500_000):
+        """
+        Args:
+            free_slot_index (FreeSlotIndex): the open slots of the populated calendar
+            new_appointment_tracker (NewAppointmentTracker): appointments already booked per provider/day
+            objective (str, optional): 'total' or 'max' TTFA. Defaults to 'total'.
+            time_limit (float, optional): seconds before falling back to the greedy heuristic
+            max_units (int, optional): instances with more candidate units use the greedy heuristic
+        """
+        if objective not in self.OBJECTIVES:
+            raise ValueError(f"objective must be one of {self.OBJECTIVES}, got {objective}")
+        self.free_slot_index = free_slot_index
+        self.new_appointment_tracker = new_appointment_tracker
+        self.event_log = EventLog()
+        self.objective = objective
+        self.time_limit = time_limit
+        self.max_units = max_units
+
+    def plan(self, sorted_new_patient_df:pd.DataFrame) -> dict:
+        """
+        Plan bookings for the patients with the configured objective.
+
+        Args:
+            sorted_new_patient_df (pd.DataFrame): new patients in first-come-first-served order
+
+        Returns:
+            dict: 'assignments' maps the position of each booked patient in sorted_new_patient_df to
+                the (start, provider_id) of its slot; also 'engine', 'solve_time', 'scheduled',
+                'total_ttfa_hours' and 'max_ttfa_hours'
+        """
+        started = time.perf_counter()
+        patients = self.__prepare_patients(sorted_new_patient_df)
+        units = self.__prepare_units()
+
+        engine = f'optimal ({self.objective})'
+        assignments = None
+        if len(units['start']) <= self.max_units:
+            deadline = None if self.time_limit is None else started + self.time_limit
+            try:
+                threshold = None
+                if self.objective == 'max':
+                    threshold = self.__find_min_max_threshold(patients, units, deadline)
+                assignments = self.__match_min_total(patients, units, deadline, threshold)
+            except TimeoutError:
+                self.event_log.warning('optimal_solve_timeout',
+                                       f'Optimal solve exceeded {self.time_limit}s, falling back to the greedy heuristic',
+                                       time_limit=self.time_limit)
+        else:
+            self.event_log.warning('optimal_too_large',
+                                   f'{len(units["start"])} candidate slots exceed max_units={self.max_units}, '
+                                   'falling back to the greedy heuristic',
+                                   candidate_slots=len(units['start']), max_units=self.max_units)
+
+        if assignments is None:
+            engine = 'greedy fallback'
+            assignments = self.__greedy(patients, units)
+
+        return self.__summarize(engine, assignments, patients, time.perf_counter() - started)
+
+    def plan_greedy(self, sorted_new_patient_df:pd.DataFrame) -> dict:
+        """
+        Plan bookings the way the greedy scheduler books them: each patient, in order, takes the
+        earliest open slot in their state. Nothing is booked, so this can run next to plan() for comparison.
+
+        Args:
+            sorted_new_patient_df (pd.DataFrame): new patients in first-come-first-served order
+
+        Returns:
+            dict: same shape as plan()
+        """
+        started = time.perf_counter()
+        patients = self.__prepare_patients(sorted_new_patient_df)
+        units = self.__prepare_units()
+        assignments = self.__greedy(patients, units)
+        return self.__summarize('greedy', assignments, patients, time.perf_counter() - started)
+
+    def __prepare_patients(self, sorted_new_patient_df:pd.DataFrame) -> dict:
+        """
+        Collect patient arrays and, per state, the patients ordered by registration.
+        """
+        registration = pd.to_datetime(sorted_new_patient_df['REGISTRATIONDATE']).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        # Patients can only be booked on a day after they registered
+        earliest_start = (registration // NS_PER_DAY + 1) * NS_PER_DAY
+        states = sorted_new_patient_df['STATE'].tolist()
+
+        patients_by_state = {}
+        for position in np.lexsort((np.arange(len(states)), registration)).tolist():
+            patients_by_state.setdefault(states[position], []).append(position)
+
+        return {
+            'registration': registration,
+            'earliest_start': earliest_start,
+            'states': states,
+            'by_state': patients_by_state,
+            'registration_by_state': {state: [int(registration[p]) for p in members]
+                                      for state, members in patients_by_state.items()},
+            'earliest_by_state': {state: [int(earliest_start[p]) for p in members]
+                                  for state, members in patients_by_state.items()}
+        }
+
+    def __prepare_units(self) -> dict:
+        """
+        Turn the open slots into units: the earliest open slots of each provider/day, as many as
+        the provider can still take that day, ordered by start time then provider id.
+        """
+        free_keys = set(self.free_slot_index.iter_open_keys())
+        keys = np.array(sorted(free_keys), dtype=np.int64).reshape(-1, 2)
+        starts, providers = keys[:, 0], keys[:, 1]
+        days = starts // NS_PER_DAY
+
+        # Rank of each slot within its provider/day
+        order = np.lexsort((starts, days, providers))
+        group_start = np.ones(len(order), dtype=bool)
+        group_start[1:] = (providers[order][1:] != providers[order][:-1]) | (days[order][1:] != days[order][:-1])
+        group_first = np.maximum.accumulate(np.where(group_start, np.arange(len(order)), 0))
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order)) - group_first
+
+        remaining = NewAppointmentTracker.MAX_NEW_APPOINTMENTS_PER_DAY - \
+            self.new_appointment_tracker.get_counts(providers, days)
+        keep = rank < remaining
+
+        return {
+            'start': starts[keep].tolist(),
+            'provider': providers[keep].tolist(),
+            'day_start': (days[keep] * NS_PER_DAY).tolist()
+        }
+
+    def __eligible_window(self, patients, state, start, day_start, threshold):
+        """
+        The patients of a state that can take a unit form a contiguous run of the state's
+        registration-ordered list: registered before the unit's day, and within the TTFA threshold.
+        """
+        high = bisect_right(patients['earliest_by_state'][state], day_start)
+        low = 0 if threshold is None else bisect_left(patients['registration_by_state'][state], start - threshold)
+        return low, high
+
+    def __match_min_total(self, patients, units, deadline, threshold=None):
+        """
+        Pick the cheapest units and the latest-registered patients that can be booked, then match them.
+        Returns {patient position: (start, provider_id)}.
+        """
+        unit_matching = self.__match_units(patients, units, deadline, threshold)
+        patient_matching = self.__match_patients(patients, units, deadline, threshold)
+        chosen_units = sorted(unit_matching.values())
+        matching = self.__match_units(patients, units, deadline, threshold, chosen_units, set(patient_matching))
+        return {patient: (units['start'][unit], units['provider'][unit]) for patient, unit in matching.items()}
+
+    def __match_units(self, patients, units, deadline, threshold=None, unit_order=None, allowed_patients=None):
+        """
+        Matroid greedy over units: take units in start-time order and keep each one that can be added
+        to the matching along an augmenting path. Returns {patient position: unit index}.
+
+        Args:
+            unit_order (list, optional): unit indexes to consider, in order. Defaults to all units.
+            allowed_patients (set, optional): patient positions that may be matched. Defaults to all.
+        """
+        provider_states = self.free_slot_index.provider_states
+        by_state = patients['by_state']
+        patient_unit = {}
+        # Per state, the next position that may still hold an unmatched patient (path-compressed)
+        next_free = {}
+        for state, members in by_state.items():
+            next_free[state] = list(range(len(members) + 1))
+            if allowed_patients is not None:
+                for position, patient in enumerate(members):
+                    if patient not in allowed_patients:
+                        next_free[state][position] = position + 1
+        unmatched = len(patients['states']) if allowed_patients is None else len(allowed_patients)
+        if unit_order is None:
+            unit_order = range(len(units['start']))
+        # Units of a provider/day share their patients, so once one fails the rest fail too
+        failed_groups = set()
+
+        def find_free(state, position):
+            jumps = next_free[state]
+            root = position
+            while jumps[root] != root:
+                root = jumps[root]
+            while jumps[position] != root:
+                jumps[position], position = root, jumps[position]
+            return root
+
+        for step, unit in enumerate(unit_order):
+            provider, day_start = units['provider'][unit], units['day_start'][unit]
+            if unmatched == 0:
+                break
+            if (provider, day_start) in failed_groups:
+                continue
+            if deadline is not None and step % 256 == 0 and time.perf_counter() > deadline:
+                raise TimeoutError
+
+            # Breadth-first search for an augmenting path: unit -> patient -> that patient's unit -> ...
+            came_from = {unit: None}
+            visited = {}
+            queue = deque([unit])
+            found = None
+            while queue and found is None:
+                current = queue.popleft()
+                current_start = units['start'][current]
+                current_day_start = units['day_start'][current]
+                for state in provider_states.get(units['provider'][current], []):
+                    if state not in by_state:
+                        continue
+                    low, high = self.__eligible_window(patients, state, current_start, current_day_start, threshold)
+                    free_position = find_free(state, low)
+                    if free_position < high:
+                        found = (current, state, free_position)
+                        break
+                    # No unmatched patient here; try to move a matched one to another unit
+                    skip = visited.setdefault(state, {})
+                    position = low
+                    while position < high:
+                        if position in skip:
+                            position = skip[position]
+                            continue
+                        skip[position] = high
+                        other_unit = patient_unit.get(by_state[state][position])
+                        if other_unit is not None and other_unit not in came_from:
+                            came_from[other_unit] = (current, by_state[state][position])
+                            queue.append(other_unit)
+                        position += 1
+
+            if found is None:
+                failed_groups.add((provider, day_start))
+                continue
+
+            current, state, free_position = found
+            patient = by_state[state][free_position]
+            next_free[state][free_position] = free_position + 1
+            unmatched -= 1
+            while True:
+                patient_unit[patient] = current
+                if came_from[current] is None:
+                    break
+                current, patient = came_from[current]
+
+        return patient_unit
+
+    def __match_patients(self, patients, units, deadline, threshold=None):
+        """
+        Matroid greedy over patients: take patients latest registration first and keep each one that
+        can be added to the matching along an augmenting path. Returns {patient position: unit index}.
+        """
+        units_by_state, starts_by_state = self.__units_by_state(units)
+        unit_positions = {}
+        for state, members in units_by_state.items():
+            for position, unit in enumerate(members):
+                unit_positions.setdefault(unit, []).append((state, position))
+
+        registration = patients['registration']
+        earliest_start = patients['earliest_start']
+        states = patients['states']
+        patient_unit = {}
+        patient_unit_owner = {}
+        # Per state, the next position that may still hold an unmatched unit (path-compressed)
+        next_free = {state: list(range(len(members) + 1)) for state, members in units_by_state.items()}
+        # Patients of a state with the same registration time can use the same units
+        failed_groups = set()
+
+        def find_free(state, position):
+            jumps = next_free[state]
+            root = position
+            while jumps[root] != root:
+                root = jumps[root]
+            while jumps[position] != root:
+                jumps[position], position = root, jumps[position]
+            return root
+
+        def window(patient):
+            state_starts = starts_by_state[states[patient]]
+            low = bisect_left(state_starts, int(earliest_start[patient]))
+            high = len(state_starts) if threshold is None else \
+                bisect_right(state_starts, int(registration[patient]) + threshold)
+            return low, high
+
+        order = sorted(range(len(states)), key=lambda patient: (-int(registration[patient]), patient))
+        for step, patient in enumerate(order):
+            group = (states[patient], int(registration[patient]))
+            if states[patient] not in units_by_state or group in failed_groups:
+                continue
+            if deadline is not None and step % 256 == 0 and time.perf_counter() > deadline:
+                raise TimeoutError
+
+            # Breadth-first search for an augmenting path: patient -> unit -> that unit's patient -> ...
+            came_from = {patient: None}
+            visited = {}
+            queue = deque([patient])
+            found = None
+            while queue and found is None:
+                current = queue.popleft()
+                state = states[current]
+                members = units_by_state[state]
+                low, high = window(current)
+                free_position = find_free(state, low)
+                if free_position < high:
+                    found = (current, members[free_position])
+                    break
+                skip = visited.setdefault(state, {})
+                position = low
+                while position < high:
+                    if position in skip:
+                        position = skip[position]
+                        continue
+                    skip[position] = high
+                    other_patient = patient_unit_owner[members[position]]
+                    if other_patient not in came_from:
+                        came_from[other_patient] = (current, members[position])
+                        queue.append(other_patient)
+                    position += 1
+
+            if found is None:
+                failed_groups.add(group)
+                continue
+
+            current, unit = found
+            for state, position in unit_positions[unit]:
+                next_free[state][position] = position + 1
+            while True:
+                patient_unit[current] = unit
+                patient_unit_owner[unit] = current
+                if came_from[current] is None:
+                    break
+                current, unit = came_from[current]
+
+        return patient_unit
+
+    def __find_min_max_threshold(self, patients, units, deadline):
+        """
+        Binary search, in whole minutes, for the smallest TTFA threshold that still books as many
+        patients as the unrestricted matching.
+        """
+        best = self.__match_units(patients, units, deadline)
+        if not best:
+            return None
+        target = len(best)
+        low = 0
+        high = max(units['start'][unit] - int(patients['registration'][patient])
+                   for patient, unit in best.items()) // NS_PER_MINUTE + 1
+        while low < high:
+            middle = (low + high) // 2
+            if len(self.__match_units(patients, units, deadline, middle * NS_PER_MINUTE)) == target:
+                high = middle
+            else:
+                low = middle + 1
+        return low * NS_PER_MINUTE
+
+    def __units_by_state(self, units):
+        """
+        For every state, the units of the providers licensed there, ordered by start time.
+        """
+        units_by_state = {}
+        for unit, provider in enumerate(units['provider']):
+            for state in self.free_slot_index.provider_states.get(provider, []):
+                units_by_state.setdefault(state, []).append(unit)
+        starts_by_state = {state: [units['start'][unit] for unit in members] for state, members in units_by_state.items()}
+        return units_by_state, starts_by_state
+
+    def __greedy(self, patients, units):
+        """
+        First-come-first-served: each patient takes the earliest unit in their state that starts on
+        a day after they registered. Returns {patient position: (start, provider_id)}.
+        """
+        units_by_state, starts_by_state = self.__units_by_state(units)
+
+        taken = set()
+        assignments = {}
+        for patient, state in enumerate(patients['states']):
+            members = units_by_state.get(state, [])
+            position = bisect_left(starts_by_state.get(state, []), int(patients['earliest_start'][patient]))
+            while position < len(members) and members[position] in taken:
+                position += 1
+            if position < len(members):
+                unit = members[position]
+                taken.add(unit)
+                assignments[patient] = (units['start'][unit], units['provider'][unit])
+        return assignments
+
+    def __summarize(self, engine, assignments, patients, solve_time):
+        ttfas = np.array([start - patients['registration'][p] for p, (start, _) in assignments.items()],
+                         dtype=np.int64) / NS_PER_HOUR
+        return {
+            'engine': engine,
+            'assignments': assignments,
+            'solve_time': solve_time,
+            'scheduled': len(assignments),
+            'total_ttfa_hours': float(ttfas.sum()) if len(ttfas) else 0.0,
+            'max_ttfa_hours': float(ttfas.max()) if len(ttfas) else float('nan')
+        }
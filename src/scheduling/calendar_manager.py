@@ -14,19 +14,33 @@ Methods:
     remove_timeslots_earlier_than_registration(new_patient: pd.DataFrame, available_time_slots_df: pd.DataFrame) -> pd.DataFrame:
         Removes timeslots that are earlier than the registration date of a new patient.
 
-    update_calendar(new_appointment_id: int, new_appointment: pd.DataFrame, current_calendar_df: pd.DataFrame) -> pd.DataFrame:
+    update_calendar(new_appointment_id: int, new_appointment: pd.DataFrame, current_calendar: ProviderCalendar) -> ProviderCalendar:
         Updates the calendar to include a new appointment, preventing double-booking.
+
+    book_window(new_appointment_id: int, provider_id: int, start: int, minutes: int, current_calendar: ProviderCalendar) -> list:
+        Books an appointment of any length on every timeslot it overlaps.
+
+    release_appointment(appointment_id: int, current_calendar: ProviderCalendar) -> list:
+        Clears a cancelled appointment from every timeslot it occupies.
 """
 
 import pandas as pd
 
 from preprocessing.populator import CalendarPopulator
+from preprocessing.provider_calendar import ProviderCalendar
+from util.event_log import EventLog
 
 class CalendarManager:
     """
     Handles calendar-related operations, such as finding and updating timeslots.
+
+    A provider timeslot is stored once in the ProviderCalendar, whatever the number of states the
+    provider is licensed in, so booking or releasing it writes a single slot row.
     """
 
+    def __init__(self):
+        self.event_log = EventLog()
+
     def remove_taken_timeslots(self, calendar_df:pd.DataFrame) -> pd.DataFrame:
         """
         A private method for removing occupied timeslots from the calendar. New patients
@@ -56,7 +70,7 @@ class CalendarManager:
         available_time_slots_df = available_time_slots_df[available_time_slots_df['DATE'] > new_patient['REGISTRATIONDATE']]
         return available_time_slots_df
 
-    def update_calendar(self, new_appointment_id:int, new_appointment:pd.DataFrame, current_calendar_df:pd.DataFrame) -> pd.DataFrame:
+    def update_calendar(self, new_appointment_id:int, new_appointment:pd.DataFrame, current_calendar:ProviderCalendar) -> ProviderCalendar:
         """
         This method updates the in-program calendar to include the new appointment.
         This is important as it updates the calendar mid-execution, allowing us to
@@ -66,29 +80,59 @@ class CalendarManager:
             new_appointment_id (int): id of the new appointment
             new_appointment (pd.DataFrame): information about the new
                 appointment that was booked
-            current_calendar (pd.DataFrame): the calendar used for booking appointments
+            current_calendar (ProviderCalendar): the calendar used for booking appointments
 
         Returns:
-            pd.DataFrame: updated calendar
+            ProviderCalendar: updated calendar
+
+        Raises:
+            ValueError: if the timeslot does not exist or is already booked
+        """
+        # The start identifies the day too, so provider and start find the timeslot
+        start = pd.Timestamp(new_appointment['START_DATETIME'])
+        current_calendar.book(new_appointment['PROVIDERID'], start.value, new_appointment_id)
+
+        self.event_log.detail('timeslot_booked', 'Provider {provider_id} timeslot at {start} booked for appointment {appointment_id}',
+                              appointment_id=new_appointment_id, provider_id=new_appointment['PROVIDERID'], start=str(start))
+
+        return current_calendar
+
+    def book_window(self, new_appointment_id:int, provider_id:int, start:int, minutes:int,
+                    current_calendar:ProviderCalendar) -> list:
         """
+        Books an appointment of any length. Every timeslot it overlaps is taken whole.
 
-        new_appointment = new_appointment.copy()
+        Args:
+            new_appointment_id (int): id of the new appointment
+            provider_id (int): provider id
+            start (int): appointment start, in nanoseconds since the epoch
+            minutes (int): length of the appointment
+            current_calendar (ProviderCalendar): the calendar used for booking appointments
 
-        # Ensure 'START_DATETIME' is in datetime format before comparison
-        current_calendar_df['START_DATETIME'] = pd.to_datetime(current_calendar_df['START_DATETIME'])
-        current_calendar_df['DATE'] = pd.to_datetime(current_calendar_df['DATE'])
-        new_appointment['START_DATETIME'] = pd.to_datetime(new_appointment['START_DATETIME'])
-        new_appointment['DATE'] = pd.to_datetime(new_appointment['DATE'])
+        Returns:
+            list: (start, provider_id) keys of the booked timeslots, ordered by start
 
+        Raises:
+            ValueError: if any minute of the appointment is outside the provider's open timeslots
+        """
+        booked_time_slots = current_calendar.book_window(provider_id, start, minutes, new_appointment_id)
 
-        condition = (current_calendar_df['DATE'] == new_appointment['DATE']) & \
-            (current_calendar_df['START_DATETIME'] == new_appointment['START_DATETIME']) & \
-            (current_calendar_df['PROVIDERID'] == new_appointment['PROVIDERID'])
+        self.event_log.detail('window_booked', 'Provider {provider_id} booked for {minutes} minutes from {start} for appointment {appointment_id}',
+                              appointment_id=new_appointment_id, provider_id=provider_id, minutes=minutes,
+                              start=str(pd.Timestamp(start)), timeslots=len(booked_time_slots))
 
-        # Count rows meeting the condition
-        num_rows_updated = condition.sum()
-        current_calendar_df.loc[condition,'APPOINTMENTID'] = new_appointment_id
+        return booked_time_slots
 
-        print('Provider timeslots booked as a result of this appointment: %i' % num_rows_updated)
+    def release_appointment(self, appointment_id:int, current_calendar:ProviderCalendar) -> list:
+        """
+        Clears a cancelled appointment from every timeslot it occupies. The timeslot is open
+        again in every state the provider is licensed in.
 
-        return current_calendar_df
\ No newline at end of file
+        Args:
+            appointment_id (int): id of the cancelled appointment
+            current_calendar (ProviderCalendar): the calendar used for booking appointments
+
+        Returns:
+            list: (start, provider_id) keys of the released timeslots, ordered by start
+        """
+        return current_calendar.release(appointment_id)
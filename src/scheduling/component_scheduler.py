@@ -0,0 +1,148 @@
+"""
+This module contains the ComponentScheduler class, which splits greedy scheduling into independent
+parts that can run in separate worker processes.
+
+Providers are licensed in several states, and the graph linking states to the providers licensed in
+them breaks into connected components. A patient only ever competes for slots of providers in their
+own component, so each component can be planned on its own. The workers only plan; the plans are
+merged back in registration order and booked by the caller, so appointment ids, calendar updates
+and analysis records come out exactly as in a serial run.
+
+Classes:
+    ComponentScheduler: Plans greedy bookings per connected component, in parallel.
+
+Functions:
+    find_components(calendar): Finds the connected components of the state/provider graph.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.free_slot_index import FreeSlotIndex
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+from util.event_log import EventLog
+
+def find_components(calendar:ProviderCalendar) -> list[dict]:
+    """
+    Finds the connected components of the graph linking each state to the providers licensed in it.
+
+    Args:
+        calendar (ProviderCalendar): calendar whose licences link providers to states
+
+    Returns:
+        list[dict]: one {'states': set, 'providers': set} per component, largest first
+    """
+    parent = {}
+
+    def find(node):
+        root = node
+        while parent.setdefault(root, root) != root:
+            root = parent[root]
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    licences = calendar.licences
+    for provider_id, state in zip(licences['PROVIDERID'].tolist(), licences['STATE'].tolist()):
+        parent[find(('provider', provider_id))] = find(('state', state))
+
+    components = {}
+    for kind, value in list(parent):
+        component = components.setdefault(find((kind, value)), {'states': set(), 'providers': set()})
+        component['states' if kind == 'state' else 'providers'].add(value)
+
+    return sorted(components.values(), key=lambda component: (-len(component['providers']), sorted(component['states'])))
+
+def _plan_component(calendar:ProviderCalendar, patients:list, tracker_snapshot:dict) -> list:
+    """
+    Greedy first-come-first-served plan for the patients of one component. Runs in a worker process.
+
+    Args:
+        calendar (ProviderCalendar): the timeslots and licences of the component's providers
+        patients (list): (position, state, earliest start) of each patient, in registration order
+        tracker_snapshot (dict): NewAppointmentTracker.snapshot() taken before scheduling
+
+    Returns:
+        list: (position, (start, provider_id) or None, rejected (start, provider_id) keys) per patient
+    """
+    free_slot_index = FreeSlotIndex(calendar)
+    new_appointment_tracker = NewAppointmentTracker()
+    new_appointment_tracker.restore(tracker_snapshot)
+
+    plan = []
+    for position, state, earliest_start in patients:
+        rejected = []
+        earliest_slot = free_slot_index.earliest_free_slot(
+            state, earliest_start, new_appointment_tracker.has_capacity, rejected.extend)
+        if earliest_slot is not None:
+            start, provider_id = earliest_slot
+            free_slot_index.remove_slot(provider_id, start)
+            new_appointment_tracker.increment_provider_appointments(
+                provider_id, free_slot_index.get_slot_date(provider_id, start))
+        plan.append((position, earliest_slot, rejected))
+    return plan
+
+class ComponentScheduler:
+    """
+    Plans greedy bookings for each connected component of the state/provider graph in its own process.
+    """
+
+    def __init__(self, new_appointment_tracker:NewAppointmentTracker, workers:int=None):
+        """
+        Args:
+            new_appointment_tracker (NewAppointmentTracker): appointments already booked per provider/day
+            workers (int, optional): number of worker processes. Defaults to the number of CPUs.
+        """
+        self.new_appointment_tracker = new_appointment_tracker
+        self.workers = workers or os.cpu_count() or 1
+        self.event_log = EventLog()
+
+    def plan(self, current_calendar:ProviderCalendar, sorted_new_patient_df:pd.DataFrame) -> list:
+        """
+        Plans the greedy booking of every patient, one component per task.
+
+        Args:
+            current_calendar (ProviderCalendar): the calendar containing all timeslots
+            sorted_new_patient_df (pd.DataFrame): new patients in first-come-first-served order
+
+        Returns:
+            list: for every patient, in the order of sorted_new_patient_df, a tuple of the planned
+                (start, provider_id) or None, and the (start, provider_id) keys skipped because the
+                provider had reached the daily limit
+        """
+        registration_dates = pd.to_datetime(sorted_new_patient_df['REGISTRATIONDATE'])
+        # Patients can only be booked on a day after they registered
+        earliest_starts = (registration_dates.dt.normalize() + pd.Timedelta(days=1)) \
+            .to_numpy(dtype='datetime64[ns]').view('int64').tolist()
+        states = sorted_new_patient_df['STATE'].tolist()
+
+        tasks = []
+        for component in find_components(current_calendar):
+            patients = [(position, state, earliest_starts[position])
+                        for position, state in enumerate(states) if state in component['states']]
+            if patients:
+                tasks.append((current_calendar.select_providers(component['providers']), patients))
+
+        tracker_snapshot = self.new_appointment_tracker.snapshot()
+        workers = min(self.workers, len(tasks))
+        self.event_log.info('components_planned', f'Planning {len(tasks)} independent components with {max(workers, 1)} worker(s)...',
+                            components=len(tasks), workers=max(workers, 1))
+        if workers <= 1:
+            component_plans = [_plan_component(calendar, patients, tracker_snapshot) for calendar, patients in tasks]
+            # Planning in this process used the shared tracker; the bookings are replayed by the caller
+            self.new_appointment_tracker.restore(tracker_snapshot)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_plan_component, calendar, patients, tracker_snapshot)
+                           for calendar, patients in tasks]
+                component_plans = [future.result() for future in futures]
+
+        # Patients in states no provider is licensed in are never planned
+        plan = [(None, []) for _ in states]
+        for component_plan in component_plans:
+            for position, earliest_slot, rejected in component_plan:
+                plan[position] = (earliest_slot, rejected)
+        return plan
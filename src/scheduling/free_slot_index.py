@@ -0,0 +1,409 @@
+"""
+This module provides the FreeSlotIndex class, a persistent per-state index of the open timeslots
+in the calendar. It answers "earliest free slot after time T for state S" with a binary search
+instead of filtering and sorting the whole calendar for every patient.
+
+The slots of each state are kept in one sorted list per day, so booking or releasing a slot only
+shifts the slots of that day. A provider/day that has reached its daily limit is closed: its open
+slots are taken out of every state until a cancellation reopens it, so later searches skip the
+provider/day instead of rejecting its slots again for every patient.
+
+Classes:
+    FreeSlotIndex: Per-state free-slot index ordered by start time.
+
+Methods:
+    earliest_free_slot(state, after, has_capacity=None, on_rejected=None): Finds the earliest open slot for a state.
+    iter_free_slots(state, after): Iterates over open slots for a state from a point in time.
+    iter_open_keys(): Iterates over the open slots of every state.
+    remove_slot(provider_id, start): Removes a slot from every state the provider is licensed in.
+    add_slot(provider_id, start): Puts a slot back into every state the provider is licensed in.
+    reopen_provider_day(provider_id, day): Puts the slots of a closed provider/day back once it has capacity again.
+    add_calendar(calendar): Indexes the open slots of timeslots added to the calendar.
+    evict_before(before): Drops the slots that start before a point in time.
+    is_free(provider_id, start): Checks whether a slot is still open.
+    get_slot_date(provider_id, start): Returns the day a slot falls on.
+    get_slot(provider_id, start, state=None): Returns the calendar details of a slot.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+
+import numpy as np
+import pandas as pd
+
+from preprocessing.provider_calendar import ProviderCalendar
+from util.profiling import Profiler
+
+NS_PER_DAY = 86_400_000_000_000
+_profiler = Profiler()
+
+class FreeSlotIndex:
+    """
+    Keeps, for every state, a sorted list of (start, provider_id) keys per day for the slots that are
+    still open, and the sorted days that have any. Start times are stored as int64 nanoseconds since
+    the epoch and days count from the epoch.
+    {
+        state: {day: [(start, provider_id), (start, provider_id), ...], ...},
+        ...
+    }
+    The open slots of a closed provider/day are held in closed_slots, {(provider_id, day): [start, ...]},
+    instead.
+    """
+    FIRST_CHUNK_SIZE = 16
+
+    def __init__(self, calendar:ProviderCalendar):
+        """
+        Build the index from the open timeslots of a populated calendar, one entry per timeslot
+        and state its provider is licensed in.
+
+        Args:
+            calendar (ProviderCalendar): the calendar containing all timeslots
+        """
+        self.calendar = calendar
+        self.free_slots_by_state = {}
+        self.days_by_state = {}
+        self.closed_slots = {}
+
+        # Every state a provider is licensed in, booked or not, has to be kept in sync on booking
+        self.provider_states = calendar.provider_states()
+
+        self.__index_free_slots(calendar)
+
+    def earliest_free_slot(self, state, after, has_capacity=None, on_rejected=None):
+        """
+        Find the earliest open slot in a state that starts at or after a point in time.
+
+        Days are searched in order. Within a day, candidates are checked in chunks that double in
+        size, so a provider/day limit check can mask a whole run of candidates in one vectorized call.
+        The provider/days that has_capacity rejects are closed, so no later search scans them. While
+        the Profiler is on, the candidates scanned and those rejected by has_capacity are counted.
+
+        Args:
+            state (str): state the patient lives in
+            after (int): earliest acceptable start, in nanoseconds since the epoch
+            has_capacity (callable, optional): called with arrays (provider_ids, days) where days
+                count from the epoch; returns a boolean mask of acceptable candidates, e.g. providers
+                that have not reached their daily limit. A rejected provider/day must stay full until
+                reopen_provider_day is called for it
+            on_rejected (callable, optional): called with the (start, provider_id) keys that were
+                rejected before the returned slot
+
+        Returns:
+            tuple or None: (start, provider_id) of the earliest acceptable slot, or None
+        """
+        slots_by_day = self.free_slots_by_state.get(state, {})
+        days = self.days_by_state.get(state, [])
+        day_position = bisect_left(days, after // NS_PER_DAY)
+        scanned = rejected = 0
+        while day_position < len(days):
+            day = days[day_position]
+            free_slots = slots_by_day[day]
+            position = bisect_left(free_slots, (after, ))
+            if has_capacity is None:
+                if position < len(free_slots):
+                    self.__record_scan(scanned + 1, 0)
+                    return free_slots[position]
+                day_position += 1
+                continue
+
+            full_providers = set()
+            earliest_slot = None
+            chunk_size = self.FIRST_CHUNK_SIZE
+            while position < len(free_slots):
+                chunk = free_slots[position:position + chunk_size]
+                keys = np.array(chunk, dtype=np.int64)
+                available = np.flatnonzero(has_capacity(keys[:, 1], keys[:, 0] // NS_PER_DAY))
+                first_available = available[0] if available.size else len(chunk)
+                if first_available > 0:
+                    if on_rejected is not None:
+                        on_rejected(chunk[:first_available])
+                    full_providers.update(provider_id for _, provider_id in chunk[:first_available])
+                    rejected += first_available
+                scanned += first_available
+                if available.size:
+                    earliest_slot = chunk[first_available]
+                    scanned += 1
+                    break
+                position += len(chunk)
+                chunk_size *= 2
+
+            for provider_id in full_providers:
+                self.__close_provider_day(provider_id, day)
+            if earliest_slot is not None:
+                self.__record_scan(scanned, rejected)
+                return earliest_slot
+            # Closing may have emptied this day, and days before it never change here
+            day_position = bisect_right(days, day)
+        self.__record_scan(scanned, rejected)
+        return None
+
+    def iter_free_slots(self, state, after):
+        """
+        Iterate over the open slots in a state ordered by start time, then provider id. The slots
+        of closed provider/days are left out.
+
+        Args:
+            state (str): state to search
+            after (int): earliest start, in nanoseconds since the epoch
+
+        Yields:
+            tuple: (start, provider_id)
+        """
+        slots_by_day = self.free_slots_by_state.get(state, {})
+        days = self.days_by_state.get(state, [])
+        day_position = bisect_left(days, after // NS_PER_DAY)
+        while day_position < len(days):
+            day = days[day_position]
+            free_slots = slots_by_day.get(day, [])
+            for position in range(bisect_left(free_slots, (after, )), len(free_slots)):
+                yield free_slots[position]
+            day_position = bisect_right(days, day)
+
+    def iter_open_keys(self):
+        """
+        Iterate over the open slots of every state, each (start, provider_id) once per state its
+        provider is licensed in. The slots of closed provider/days are left out.
+
+        Yields:
+            tuple: (start, provider_id)
+        """
+        for slots_by_day in self.free_slots_by_state.values():
+            for free_slots in slots_by_day.values():
+                yield from free_slots
+
+    def remove_slot(self, provider_id, start):
+        """
+        Remove a slot from every state the provider is licensed in.
+
+        Args:
+            provider_id (int): provider whose slot was booked
+            start (int): slot start, in nanoseconds since the epoch
+        """
+        day = start // NS_PER_DAY
+        closed_starts = self.closed_slots.get((provider_id, day))
+        if closed_starts is not None:
+            position = bisect_left(closed_starts, start)
+            if position < len(closed_starts) and closed_starts[position] == start:
+                del closed_starts[position]
+            return
+
+        key = (start, provider_id)
+        for state in self.provider_states.get(provider_id, []):
+            free_slots = self.free_slots_by_state.get(state, {}).get(day, [])
+            position = bisect_left(free_slots, key)
+            if position < len(free_slots) and free_slots[position] == key:
+                del free_slots[position]
+                if not free_slots:
+                    self.__drop_day(state, day)
+
+    def add_slot(self, provider_id, start):
+        """
+        Put a slot back into every state the provider is licensed in. The slot of a closed
+        provider/day is held until the provider/day is reopened.
+
+        Args:
+            provider_id (int): provider whose slot was released
+            start (int): slot start, in nanoseconds since the epoch
+        """
+        day = start // NS_PER_DAY
+        closed_starts = self.closed_slots.get((provider_id, day))
+        if closed_starts is not None:
+            position = bisect_left(closed_starts, start)
+            if position == len(closed_starts) or closed_starts[position] != start:
+                closed_starts.insert(position, start)
+            return
+
+        key = (start, provider_id)
+        for state in self.provider_states.get(provider_id, []):
+            free_slots = self.__day_slots(state, day)
+            position = bisect_left(free_slots, key)
+            if position == len(free_slots) or free_slots[position] != key:
+                free_slots.insert(position, key)
+
+    def reopen_provider_day(self, provider_id, day):
+        """
+        Put the open slots of a closed provider/day back into every state the provider is licensed
+        in, e.g. once a cancellation takes the provider below the daily limit again.
+
+        Args:
+            provider_id (int): provider id
+            day (int): day, counted from the epoch
+        """
+        closed_starts = self.closed_slots.pop((provider_id, day), None)
+        for start in closed_starts or []:
+            self.add_slot(provider_id, start)
+
+    def add_calendar(self, calendar:ProviderCalendar):
+        """
+        Index the open timeslots of a calendar whose timeslots were added to the indexed one, such as
+        the next week of a rolling horizon, and the states of any new provider.
+
+        Args:
+            calendar (ProviderCalendar): the added timeslots
+        """
+        for provider_id, states in calendar.provider_states().items():
+            known_states = self.provider_states.setdefault(provider_id, [])
+            known_states.extend(state for state in states if state not in known_states)
+        self.__index_free_slots(calendar)
+
+    def evict_before(self, before):
+        """
+        Drop the slots, in every state, that start before a point in time.
+
+        Args:
+            before (int): earliest start to keep, in nanoseconds since the epoch
+        """
+        before_day = before // NS_PER_DAY
+        for state, days in self.days_by_state.items():
+            slots_by_day = self.free_slots_by_state[state]
+            evicted = bisect_left(days, before_day)
+            for day in days[:evicted]:
+                del slots_by_day[day]
+            del days[:evicted]
+            if days and days[0] == before_day:
+                free_slots = slots_by_day[before_day]
+                del free_slots[:bisect_left(free_slots, (before, ))]
+                if not free_slots:
+                    self.__drop_day(state, before_day)
+        for provider_day in [provider_day for provider_day in self.closed_slots if provider_day[1] < before_day]:
+            del self.closed_slots[provider_day]
+        for (provider_id, day), closed_starts in self.closed_slots.items():
+            if day == before_day:
+                del closed_starts[:bisect_left(closed_starts, before)]
+
+    def is_free(self, provider_id, start):
+        """
+        Check whether a slot is still open. The slots of a closed provider/day are open, though
+        the provider cannot take another new appointment that day.
+
+        Args:
+            provider_id (int): provider id
+            start (int): slot start, in nanoseconds since the epoch
+
+        Returns:
+            bool: True if the slot exists and has not been booked
+        """
+        day = start // NS_PER_DAY
+        closed_starts = self.closed_slots.get((provider_id, day))
+        if closed_starts is not None:
+            position = bisect_left(closed_starts, start)
+            return position < len(closed_starts) and closed_starts[position] == start
+
+        key = (start, provider_id)
+        for state in self.provider_states.get(provider_id, [])[:1]:
+            free_slots = self.free_slots_by_state.get(state, {}).get(day, [])
+            position = bisect_left(free_slots, key)
+            return position < len(free_slots) and free_slots[position] == key
+        return False
+
+    def get_slot_date(self, provider_id, start):
+        """
+        Return the calendar DATE of a slot.
+
+        Args:
+            provider_id (int): provider id
+            start (int): slot start, in nanoseconds since the epoch
+
+        Returns:
+            pd.Timestamp: the day the slot falls on
+        """
+        return pd.Timestamp(start).normalize()
+
+    def get_slot(self, provider_id, start, state=None):
+        """
+        Return the calendar details of a slot in the same shape as a calendar row.
+
+        Args:
+            provider_id (int): provider id
+            start (int): slot start, in nanoseconds since the epoch
+            state (str, optional): state the slot is being booked for
+
+        Returns:
+            pd.Series: PROVIDERID, DATE, START_DATETIME, END_DATETIME, TIME_RANGE and STATE
+
+        Raises:
+            KeyError: if the provider has no timeslot starting then
+        """
+        row = self.calendar.slot_row(provider_id, start)
+        if row < 0:
+            raise KeyError((provider_id, start))
+        start_datetime = pd.Timestamp(start)
+        end_datetime = pd.Timestamp(int(self.calendar.ends[row]))
+        return pd.Series({
+            'PROVIDERID': provider_id,
+            'DATE': start_datetime.normalize(),
+            'START_DATETIME': start_datetime,
+            'END_DATETIME': end_datetime,
+            'TIME_RANGE': end_datetime - start_datetime,
+            'STATE': state
+        })
+
+    def __index_free_slots(self, calendar:ProviderCalendar):
+        """
+        Adds the open timeslots of a calendar to the per-day lists. Slots later than every indexed
+        one of their day are appended; otherwise the day's list is sorted again.
+        """
+        rows, states = calendar.state_slot_rows(free_only=True)
+        providers = calendar.provider_ids[rows]
+        starts = calendar.starts[rows]
+        order = np.lexsort((providers, starts))
+
+        new_slots_by_state_day = {}
+        for state, provider_id, start in zip(states[order].tolist(), providers[order].tolist(), starts[order].tolist()):
+            day = start // NS_PER_DAY
+            if (provider_id, day) in self.closed_slots:
+                closed_starts = self.closed_slots[(provider_id, day)]
+                if start not in closed_starts:
+                    insort(closed_starts, start)
+                continue
+            new_slots_by_state_day.setdefault((state, day), []).append((start, provider_id))
+        for (state, day), new_slots in new_slots_by_state_day.items():
+            free_slots = self.__day_slots(state, day)
+            in_order = not free_slots or free_slots[-1] < new_slots[0]
+            free_slots.extend(new_slots)
+            if not in_order:
+                free_slots.sort()
+
+    def __day_slots(self, state, day) -> list:
+        """
+        The list of open slots of a state on a day, added to the index if the day had none.
+        """
+        slots_by_day = self.free_slots_by_state.setdefault(state, {})
+        free_slots = slots_by_day.get(day)
+        if free_slots is None:
+            free_slots = slots_by_day[day] = []
+            insort(self.days_by_state.setdefault(state, []), day)
+        return free_slots
+
+    def __drop_day(self, state, day):
+        """
+        Removes a day that has no open slots left in a state.
+        """
+        del self.free_slots_by_state[state][day]
+        days = self.days_by_state[state]
+        del days[bisect_left(days, day)]
+
+    def __close_provider_day(self, provider_id, day):
+        """
+        Takes the open slots of a provider/day that has reached its daily limit out of every state
+        the provider is licensed in, and holds them in closed_slots.
+        """
+        if (provider_id, day) in self.closed_slots:
+            return
+        closed_starts = set()
+        for state in self.provider_states.get(provider_id, []):
+            free_slots = self.free_slots_by_state.get(state, {}).get(day)
+            if free_slots is None:
+                continue
+            closed_starts.update(start for start, slot_provider_id in free_slots if slot_provider_id == provider_id)
+            free_slots[:] = [key for key in free_slots if key[1] != provider_id]
+            if not free_slots:
+                self.__drop_day(state, day)
+        self.closed_slots[(provider_id, day)] = sorted(closed_starts)
+
+    def __record_scan(self, scanned, rejected):
+        """
+        Counts the candidates one earliest_free_slot call looked at and rejected, if profiling.
+        """
+        if _profiler.enabled:
+            _profiler.observe('slots_scanned_per_patient', int(scanned))
+            _profiler.count('capacity_rejections', int(rejected))
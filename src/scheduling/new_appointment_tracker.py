@@ -2,39 +2,56 @@
 This module defines the NewAppointmentTracker class, a singleton that tracks the number of new appointments
 by date for each provider. The class ensures thread safety and prevents race conditions using a lock.
 
+The counts are stored in a provider x day NumPy int array, so the daily limit can be checked for a whole
+batch of candidate timeslots in one vectorized operation.
+
 Classes:
     NewAppointmentTracker: A singleton class that maintains a record of new appointments for providers by date.
 
 Methods:
     __new__(cls): Ensures only one instance of the class is created.
-    __init__(self): Initializes the new_appointment_tracker dictionary.
+    __init__(self): Initializes the provider x day counter.
+    reset(self): Clears all counts.
     get_provider(self, provider_id): Retrieves appointment details for a given provider.
-    get_provider_by_date(self, provider_id, date): Retrieves appointment details for a provider on a specific date.
-    add_provider(self, provider_id, date): Adds or updates a provider in the tracker.
+    get_provider_by_date(self, provider_id, date): Retrieves the appointment count for a provider on a specific date.
+    add_provider(self, provider_id, date): Adds a provider (and date) to the tracker without touching existing counts.
     increment_provider_appointments(self, provider_id, date):
         Increments the appointment count for a provider on a specific date.
+    decrement_provider_appointments(self, provider_id, date):
+        Decrements the appointment count for a provider on a specific date.
     remove_appointment(self, appointment_id): Removes an appointment if it exists.
     get_all_appointments(self): Retrieves all appointments.
     check_if_provider_has_availibility(self, appointment_info):
         Checks if a provider has availability for a particular day.
+    has_capacity(self, provider_ids, dates): Vectorized availability check for many provider/day pairs.
+    get_counts(self, provider_ids, dates): Vectorized count lookup for many provider/day pairs.
+    snapshot(self): Captures the counts so a run can be checkpointed.
+    restore(self, snapshot): Restores counts captured by snapshot.
+    save(self, path): Writes a snapshot to a .npz file.
+    load(self, path): Restores a snapshot from a .npz file.
 """
 
+import os
 import threading
 
+import numpy as np
+import pandas as pd
+
+from util.event_log import EventLog
+
 class NewAppointmentTracker:
     """
     A singleton class that tracks the amount of new appointments
     by date for each provider
-    {
-        provider_id: {
-            date: new appointment count,
-            date: new appointment count
-        },
-        provider_id: {
-            ...
-        }
-    }
+
+                 day 0   day 1   ...
+    provider 0 [   0,      2,    ... ]
+    provider 1 [   5,      0,    ... ]
+
+    Days are counted from first_day, the earliest day seen so far.
     """
+    MAX_NEW_APPOINTMENTS_PER_DAY = 5
+
     _instance = None
     _lock = threading.Lock()  # Ensures thread safety
 
@@ -48,45 +65,190 @@ class NewAppointmentTracker:
 
     def __init__(self):
         if not self._initialized:  # Ensures __init__ runs only once
-            self.new_appointment_tracker = {}
+            self.event_log = EventLog()
+            self.reset()
             self._initialized = True
 
+    def reset(self):
+        """Clear all counts."""
+        self.provider_rows = {}
+        self.provider_ids = []
+        self.first_day = None
+        self.counts = np.zeros((0, 0), dtype=np.int32)
+        self._provider_index = None
+
     def get_provider(self, provider_id):
-        """Retrieve appointment details."""
-        return self.new_appointment_tracker.get(provider_id, "Not found")
+        """Retrieve appointment details as {date: new appointment count}."""
+        row = self.provider_rows.get(provider_id)
+        if row is None:
+            return {}
+        days = np.flatnonzero(self.counts[row])
+        return {self.__to_date(day): int(self.counts[row, day]) for day in days}
 
     def get_provider_by_date(self, provider_id, date):
-        """Retrieve provider appointment by a specified date"""
-        provider_data = self.new_appointment_tracker.get(provider_id, "Not found")
-        if provider_data == "Not found":
-            return "Not found"
-        return provider_data.get(date, "Not found")
+        """Retrieve provider appointment count by a specified date (0 if none were booked)"""
+        row = self.provider_rows.get(provider_id)
+        if row is None or self.first_day is None:
+            return 0
+        column = self.__to_day(date) - self.first_day
+        if column < 0 or column >= self.counts.shape[1]:
+            return 0
+        return int(self.counts[row, column])
 
-    def add_provider(self, provider_id, date):
-        """Add or update an provider in the tracker."""
-        self.new_appointment_tracker[provider_id] = {}
-        self.new_appointment_tracker[provider_id][date] = 0
+    def add_provider(self, provider_id, date=None):
+        """Add a provider, and optionally a date, to the tracker. Existing counts are left untouched."""
+        row = self.__ensure_provider(provider_id)
+        if date is not None:
+            self.__ensure_day(self.__to_day(date))
+        return row
 
     def increment_provider_appointments(self, provider_id, date):
         """Find a provider's date and increment by one"""
-        self.new_appointment_tracker[provider_id][date] += 1
+        row = self.__ensure_provider(provider_id)
+        column = self.__ensure_day(self.__to_day(date))
+        self.counts[row, column] += 1
+
+    def decrement_provider_appointments(self, provider_id, date):
+        """Find a provider's date and decrement by one, never going below zero"""
+        if self.get_provider_by_date(provider_id, date) > 0:
+            row = self.provider_rows[provider_id]
+            self.counts[row, self.__to_day(date) - self.first_day] -= 1
 
     def remove_appointment(self, appointment_id):
         """Remove an appointment if it exists."""
-        if appointment_id in self.new_appointment_tracker:
-            del self.new_appointment_tracker[appointment_id]
+        row = self.provider_rows.get(appointment_id)
+        if row is not None:
+            self.counts[row] = 0
 
     def get_all_appointments(self):
         """Retrieve all appointments."""
-        return self.new_appointment_tracker
+        return {provider_id: self.get_provider(provider_id) for provider_id in self.provider_ids}
 
     def check_if_provider_has_availibility(self, appointment_info):
         """Check if a provider has availability for a particular day"""
         provider_id = appointment_info['PROVIDERID']
         appointment_date = appointment_info['DATE']
         new_appointment_count = self.get_provider_by_date(provider_id, appointment_date)
-        new_appointment_count = 0 if new_appointment_count == "Not found" else new_appointment_count
-        if new_appointment_count >= 5:
-            print(f'Provider: {provider_id} has booked the maximum amount of appointments for {appointment_date.strftime('%Y-%m-%d')}')
+        if new_appointment_count >= self.MAX_NEW_APPOINTMENTS_PER_DAY:
+            self.event_log.detail('provider_at_capacity',
+                                  'Provider: {provider_id} has booked the maximum amount of appointments for {date}',
+                                  provider_id=provider_id, date=pd.Timestamp(appointment_date).strftime("%Y-%m-%d"))
             return False
         return True
+
+    def has_capacity(self, provider_ids, dates):
+        """
+        Check the daily limit for many provider/day pairs at once.
+
+        Args:
+            provider_ids (array-like): provider id of each candidate
+            dates (array-like): day of each candidate, as datetime64 values, timestamps,
+                or int64 days since the epoch
+
+        Returns:
+            np.ndarray: True where the provider can take another new appointment that day
+        """
+        return self.get_counts(provider_ids, dates) < self.MAX_NEW_APPOINTMENTS_PER_DAY
+
+    def get_counts(self, provider_ids, dates):
+        """
+        Look up the new appointment counts for many provider/day pairs at once.
+
+        Args:
+            provider_ids (array-like): provider id of each pair
+            dates (array-like): day of each pair, as datetime64 values, timestamps,
+                or int64 days since the epoch
+
+        Returns:
+            np.ndarray: the count for each pair (0 for providers or days never booked)
+        """
+        days = self.__to_days(dates)
+        counts = np.zeros(len(days), dtype=np.int32)
+        if self.first_day is None or not self.provider_ids:
+            return counts
+
+        rows = self.__get_provider_index().get_indexer(np.asarray(provider_ids))
+        columns = days - self.first_day
+        tracked = (rows >= 0) & (columns >= 0) & (columns < self.counts.shape[1])
+        counts[tracked] = self.counts[rows[tracked], columns[tracked]]
+        return counts
+
+    def snapshot(self):
+        """
+        Capture the counts so a run can be checkpointed.
+
+        Returns:
+            dict: provider ids, first day and a copy of the counts
+        """
+        return {
+            'provider_ids': np.asarray(self.provider_ids),
+            'first_day': [] if self.first_day is None else [self.first_day],
+            'counts': self.counts.copy()
+        }
+
+    def restore(self, snapshot):
+        """Restore counts captured by snapshot()."""
+        self.reset()
+        self.provider_ids = list(np.asarray(snapshot['provider_ids']).tolist())
+        self.provider_rows = {provider_id: row for row, provider_id in enumerate(self.provider_ids)}
+        first_day = np.asarray(snapshot['first_day']).tolist()
+        self.first_day = int(first_day[0]) if first_day else None
+        self.counts = np.array(snapshot['counts'], dtype=np.int32)
+
+    def save(self, path):
+        """Write a snapshot of the counts to a .npz file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        np.savez(path, **self.snapshot())
+
+    def load(self, path):
+        """Restore the counts from a .npz file written by save()."""
+        with np.load(path) as snapshot:
+            self.restore(snapshot)
+
+    def __get_provider_index(self):
+        if self._provider_index is None:
+            self._provider_index = pd.Index(self.provider_ids)
+        return self._provider_index
+
+    def __ensure_provider(self, provider_id):
+        row = self.provider_rows.get(provider_id)
+        if row is None:
+            row = len(self.provider_ids)
+            self.provider_rows[provider_id] = row
+            self.provider_ids.append(provider_id)
+            self._provider_index = None
+            if row >= self.counts.shape[0]:
+                self.counts = self.__resize(max(2 * self.counts.shape[0], 16), self.counts.shape[1], 0)
+        return row
+
+    def __ensure_day(self, day):
+        if self.first_day is None:
+            self.first_day = day
+        if day < self.first_day:
+            # Shift existing columns right to make room for earlier days
+            shift = self.first_day - day
+            self.counts = self.__resize(self.counts.shape[0], self.counts.shape[1] + shift, shift)
+            self.first_day = day
+        column = day - self.first_day
+        if column >= self.counts.shape[1]:
+            self.counts = self.__resize(self.counts.shape[0], max(2 * self.counts.shape[1], column + 1, 31), 0)
+        return column
+
+    def __resize(self, n_rows, n_columns, column_offset):
+        counts = np.zeros((n_rows, n_columns), dtype=np.int32)
+        old_rows, old_columns = self.counts.shape
+        counts[:old_rows, column_offset:column_offset + old_columns] = self.counts
+        return counts
+
+    def __to_day(self, date):
+        return int(pd.Timestamp(date).to_datetime64().astype('datetime64[D]').astype(np.int64))
+
+    def __to_days(self, dates):
+        dates = np.asarray(dates)
+        if np.issubdtype(dates.dtype, np.integer):
+            return dates.astype(np.int64)
+        return pd.to_datetime(dates).to_numpy().astype('datetime64[D]').astype(np.int64)
+
+    def __to_date(self, day):
+        return pd.Timestamp(np.datetime64(int(day) + self.first_day, 'D'))
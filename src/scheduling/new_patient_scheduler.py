@@ -7,63 +7,260 @@ Classes:
     NewPatientScheduler: A class to schedule new patients into the calendar.
 
 Methods:
-    __init__(self): Initializes the NewPatientScheduler class with the necessary components.
-    schedule_new_patients(self, current_calendar_df: pd.DataFrame, new_patient_df: pd.DataFrame):
-        Schedules the earliest possible appointments for all new patients.
+    __init__(self, appointment_df=None, id_sequence_file=None, flush_every=None, calendar_store=None,
+             data_dir='data/', rolling_horizon=None):
+        Initializes the NewPatientScheduler class with the necessary components.
+    schedule_new_patients(self, current_calendar: ProviderCalendar, new_patient_df: pd.DataFrame,
+                          mode='greedy', objective='total', time_limit=30.0, workers=1):
+        Schedules the earliest possible appointments for all new patients, greedily or as one optimized batch.
+        Greedy scheduling can be planned in parallel, one worker per independent state/provider component.
+    cancel_appointment(self, appointment_id: int, current_calendar: ProviderCalendar, promote=True,
+                       max_promotions=None) -> ProviderCalendar:
+        Cancels an appointment, returns its patient to the queue and promotes patients into the freed timeslots.
     __sort_new_patients(self, new_patient_df: pd.DataFrame) -> pd.DataFrame:
         A private method to sort new patients in the order they registered.
 """
 
+import os
+import time
+
 import pandas as pd
 
 from analysis.analysis import Analysis
+from preprocessing.provider_calendar import ProviderCalendar
 from scheduling.appointment_data_handler import AppointmentDataHandler
+from scheduling.appointment_id_allocator import AppointmentIdAllocator
 from scheduling.appointment_scheduler import AppointmentScheduler
+from scheduling.batch_optimizer import BatchOptimizer
+from scheduling.component_scheduler import ComponentScheduler
 from scheduling.new_appointment_tracker import NewAppointmentTracker
+from scheduling.rolling_horizon import RollingHorizon
 from util.debug import Debug
+from util.event_log import EventLog
+from util.profiling import timed
 
 class NewPatientScheduler:
     """
     Class to schedule new patients into the calendar
     """
+    SCHEDULING_MODES = ('greedy', 'optimal')
 
-    def __init__(self,):
+    def __init__(self, appointment_df:pd.DataFrame=None, id_sequence_file:str=None, flush_every:int=None,
+                 calendar_store=None, data_dir:str='data/', rolling_horizon:RollingHorizon=None):
         """
         Initializes the NewPatientScheduler class with the necessary components
+
+        Args:
+            appointment_df (pd.DataFrame, optional): the loaded appointment data, used to seed
+                new appointment ids. When omitted, it is read from the data folder.
+            id_sequence_file (str, optional): file used to reserve blocks of appointment ids
+                so concurrent or resumed runs never hand out the same id
+            flush_every (int, optional): journal bookings every this many appointments, so a crash loses
+                at most that many. By default they are journaled once, after all patients are scheduled.
+                The journal is applied to the data files at the end of the run.
+            calendar_store (CalendarStore, optional): SQLite store that greedy lookups are served from
+                and every booking is recorded in
+            data_dir (str, optional): folder holding the appointment and new patient data files
+            rolling_horizon (RollingHorizon, optional): for greedy scheduling, build later weeks of the calendar
+                when patients run out of timeslots and evict the weeks behind them. The calendar returned by
+                schedule_new_patients then only holds the weeks still ahead.
         """
         self.debug = Debug()
+        self.event_log = EventLog()
         self.new_appointment_tracker = NewAppointmentTracker()
         self.analysis = Analysis()
-        self.appointment_scheduler = AppointmentScheduler(self.new_appointment_tracker, self.analysis)
-        self.appointment_data_handler = AppointmentDataHandler()
+        appointment_id_allocator = None
+        if appointment_df is not None or id_sequence_file is not None:
+            appointment_id_allocator = AppointmentIdAllocator(appointment_df, id_sequence_file)
+        self.appointment_data_handler = AppointmentDataHandler(os.path.join(data_dir, 'Appointment Data.csv'),
+                                                               os.path.join(data_dir, 'New Patient Data.csv'),
+                                                               flush_every)
+        self.appointment_scheduler = AppointmentScheduler(self.new_appointment_tracker, self.analysis,
+                                                          appointment_id_allocator, self.appointment_data_handler,
+                                                          calendar_store, data_dir, rolling_horizon)
+        self.waiting_patients = []
 
-    def schedule_new_patients(self, current_calendar_df:pd.DataFrame, new_patient_df:pd.DataFrame):
+    def schedule_new_patients(self, current_calendar:ProviderCalendar, new_patient_df:pd.DataFrame,
+                              mode:str='greedy', objective:str='total', time_limit:float=30.0, workers:int=1):
         """
         Schedules the earliest possible appointments for all new patients.
         If no available time slots exist for providers in the new patient area,
         those patients remain unscheduled.
 
         Args:
-            current_calendar_df (pd.DataFrame): The current state of the calendar before new appointments.
+            current_calendar (ProviderCalendar): The current state of the calendar before new appointments.
             new_patient_df (pd.DataFrame): A collection of all new patient registration data.
+            mode (str, optional): 'greedy' books patients one at a time in registration order.
+                'optimal' plans the whole backlog at once with BatchOptimizer. Defaults to 'greedy'.
+            objective (str, optional): for the optimal mode, minimize the 'total' or the 'max' TTFA
+            time_limit (float, optional): for the optimal mode, seconds before falling back to a heuristic
+            workers (int, optional): for the greedy mode, plan independent state/provider components in
+                this many worker processes (None for one per CPU). Bookings are identical to a serial run.
+                Defaults to 1, which books serially.
+
+        Raises:
+            ValueError: for an unknown mode, or a rolling horizon with another mode than serial greedy
         """
-        print('Scheduling new patients now...')
+        if mode not in self.SCHEDULING_MODES:
+            raise ValueError(f"mode must be one of {self.SCHEDULING_MODES}, got {mode}")
+        rolling_horizon = self.appointment_scheduler.rolling_horizon
+        if rolling_horizon is not None and (mode != 'greedy' or workers != 1):
+            raise ValueError("A rolling horizon needs greedy scheduling with a single worker")
+
+        self.event_log.info('scheduling_started', 'Scheduling new patients now...', mode=mode)
         sorted_new_patient_df = self.__sort_new_patients(new_patient_df)
+        self.appointment_scheduler.load_calendar(current_calendar)
+        self.appointment_data_handler.begin(new_patient_df, update_new_patients=not self.debug.get_debug())
+        if mode == 'greedy' and workers == 1:
+            current_calendar, booked_new_patient_ids = self.__schedule_greedy(current_calendar, sorted_new_patient_df)
+        elif mode == 'greedy':
+            current_calendar, booked_new_patient_ids = self.__schedule_parallel(
+                current_calendar, sorted_new_patient_df, workers)
+        else:
+            current_calendar, booked_new_patient_ids = self.__schedule_optimal(
+                current_calendar, sorted_new_patient_df, objective, time_limit)
+        self.appointment_data_handler.compact()
+        if rolling_horizon is not None:
+            summary = rolling_horizon.summary()
+            self.event_log.info('rolling_horizon', f"Rolling horizon: {summary['weeks_built']} weeks built, "
+                                f"{summary['slots_evicted']} timeslots evicted, {summary['slots_held']} held "
+                                f"({summary['memory_bytes'] / 1024 ** 2:.1f} MB)", **summary)
+        booked = sorted_new_patient_df['PATIENTID'].isin(booked_new_patient_ids)
+        self.waiting_patients = [new_patient for _, new_patient in sorted_new_patient_df[~booked].iterrows()]
+        self.event_log.info('scheduling_finished',
+                            f"Summary:\n"
+                            f"New Patient Appointments Scheduled: {len(booked_new_patient_ids)} out of {len(sorted_new_patient_df)}\n"
+                            f"Patients left unscheduled: {len(new_patient_df)-len(booked_new_patient_ids)}",
+                            scheduled=len(booked_new_patient_ids), patients=len(sorted_new_patient_df),
+                            unscheduled=len(new_patient_df)-len(booked_new_patient_ids))
+        self.analysis.calculate_statistics()
+        return current_calendar
+
+    def cancel_appointment(self, appointment_id:int, current_calendar:ProviderCalendar, promote:bool=True,
+                           max_promotions:int=None) -> ProviderCalendar:
+        """
+        Cancels an appointment after schedule_new_patients has run. Its timeslots are released in
+        place and, with promote, offered to the patients left unscheduled and then to booked patients
+        who can be seen earlier. A new patient whose appointment was cancelled goes back to the queue.
+        The changes are written to the data files before returning.
+
+        Args:
+            appointment_id (int): id of the appointment to cancel
+            current_calendar (ProviderCalendar): the calendar returned by schedule_new_patients
+            promote (bool, optional): fill the released timeslots. Defaults to True.
+            max_promotions (int, optional): stop after this many patients have been booked or moved
+
+        Returns:
+            ProviderCalendar: the updated calendar
+        """
+        current_calendar, cancelled_patient, promotions = self.appointment_scheduler.cancel_appointment(
+            appointment_id, current_calendar, promote, self.waiting_patients, max_promotions)
+        if cancelled_patient is not None:
+            self.waiting_patients.append(cancelled_patient)
+            self.waiting_patients.sort(key=lambda new_patient: (new_patient['REGISTRATIONDATE'], new_patient['PATIENTID']))
+        self.appointment_data_handler.compact()
+        self.event_log.info('cancellation_finished', f"Appointment {appointment_id} cancelled, {len(promotions)} patients promoted",
+                            appointment_id=appointment_id, promotions=len(promotions))
+        return current_calendar
+
+    @timed('scheduling')
+    def __schedule_greedy(self, current_calendar:ProviderCalendar, sorted_new_patient_df:pd.DataFrame):
+        """
+        Books each patient, in registration order, into the earliest available timeslot.
+
+        Returns:
+            tuple: the updated calendar and the ids of the booked patients
+        """
+        solve_started = time.perf_counter()
         booked_new_patient_ids = []
         for _, new_patient in sorted_new_patient_df.iterrows():
-            available_time_slots_df = self.appointment_scheduler.find_earliest_appointments(new_patient, current_calendar_df)
-            if available_time_slots_df.empty:
-                print(f"No available timeslots for {new_patient['PATIENTID']}")
+            available_time_slot = self.appointment_scheduler.find_earliest_appointment(new_patient)
+            if available_time_slot is None:
+                self.event_log.detail('patient_unscheduled', 'No available timeslots for {patient_id}',
+                                      patient_id=new_patient['PATIENTID'])
             else:
-                current_calendar_df = self.appointment_scheduler.book_earliest_appointment(new_patient, current_calendar_df, available_time_slots_df)
+                current_calendar = self.appointment_scheduler.book_earliest_appointment(new_patient, current_calendar, available_time_slot)
                 booked_new_patient_ids.append(new_patient.loc['PATIENTID'])
-        if not self.debug.get_debug():
-            self.appointment_data_handler.remove_scheduled_patients_from_new_patients_table(booked_new_patient_ids, new_patient_df)
-        print(f"Summary:")
-        print(f"New Patient Appointments Scheduled: {len(booked_new_patient_ids)} out of {len(sorted_new_patient_df)}")
-        print(f"Patients left unscheduled: {len(new_patient_df)-len(booked_new_patient_ids)}")
-        self.analysis.calculate_statistics()
-        return current_calendar_df
+        solve_time = time.perf_counter() - solve_started
+        self.event_log.info('engine_solved', f"Greedy engine solve time (including bookings): {solve_time:.2f}s",
+                            engine='greedy', solve_time=solve_time)
+        return current_calendar, booked_new_patient_ids
+
+    @timed('scheduling')
+    def __schedule_parallel(self, current_calendar:ProviderCalendar, sorted_new_patient_df:pd.DataFrame, workers:int):
+        """
+        Plans the greedy bookings of each independent component in a worker process, then books the
+        planned timeslots in registration order, so ids and analysis records match a serial run.
+
+        Returns:
+            tuple: the updated calendar and the ids of the booked patients
+        """
+        solve_started = time.perf_counter()
+        plan = ComponentScheduler(self.new_appointment_tracker, workers).plan(current_calendar, sorted_new_patient_df)
+
+        free_slot_index = self.appointment_scheduler.free_slot_index
+        booked_new_patient_ids = []
+        for (earliest_slot, rejected), (_, new_patient) in zip(plan, sorted_new_patient_df.iterrows()):
+            for start, provider_id in rejected:
+                self.event_log.detail('capacity_rejected', 'Provider: {provider_id} does not have ability for {date}',
+                                      provider_id=provider_id, date=free_slot_index.get_slot_date(provider_id, start))
+            if earliest_slot is None:
+                self.event_log.detail('patient_unscheduled', 'No available timeslots for {patient_id}',
+                                      patient_id=new_patient['PATIENTID'])
+                continue
+            start, provider_id = earliest_slot
+            available_time_slot = free_slot_index.get_slot(provider_id, start, new_patient['STATE'])
+            current_calendar = self.appointment_scheduler.book_earliest_appointment(new_patient, current_calendar, available_time_slot)
+            booked_new_patient_ids.append(new_patient.loc['PATIENTID'])
+        solve_time = time.perf_counter() - solve_started
+        self.event_log.info('engine_solved', f"Parallel greedy engine solve time (including bookings): {solve_time:.2f}s",
+                            engine='greedy-parallel', solve_time=solve_time)
+        return current_calendar, booked_new_patient_ids
+
+    @timed('scheduling')
+    def __schedule_optimal(self, current_calendar:ProviderCalendar, sorted_new_patient_df:pd.DataFrame,
+                           objective:str, time_limit:float):
+        """
+        Plans the whole backlog with BatchOptimizer, prints how it compares with the greedy
+        engine's plan on the same inputs, then books the planned timeslots in registration order.
+
+        Returns:
+            tuple: the updated calendar and the ids of the booked patients
+        """
+        optimizer = BatchOptimizer(self.appointment_scheduler.free_slot_index, self.new_appointment_tracker,
+                                   objective, time_limit)
+        greedy_plan = optimizer.plan_greedy(sorted_new_patient_df)
+        optimal_plan = optimizer.plan(sorted_new_patient_df)
+        self.__print_engine_comparison([greedy_plan, optimal_plan])
+
+        booked_new_patient_ids = []
+        assignments = optimal_plan['assignments']
+        for position, (_, new_patient) in enumerate(sorted_new_patient_df.iterrows()):
+            if position not in assignments:
+                self.event_log.detail('patient_unscheduled', 'No available timeslots for {patient_id}',
+                                      patient_id=new_patient['PATIENTID'])
+                continue
+            start, provider_id = assignments[position]
+            available_time_slot = self.appointment_scheduler.free_slot_index.get_slot(provider_id, start, new_patient['STATE'])
+            current_calendar = self.appointment_scheduler.book_earliest_appointment(new_patient, current_calendar, available_time_slot)
+            booked_new_patient_ids.append(new_patient.loc['PATIENTID'])
+        return current_calendar, booked_new_patient_ids
+
+    def __print_engine_comparison(self, plans:list):
+        """
+        Prints solve time and plan quality of each scheduling engine side by side.
+
+        Args:
+            plans (list): plans returned by BatchOptimizer
+        """
+        lines = ['Scheduling engine comparison:',
+                 f"{'engine':<20}{'solve time (s)':>16}{'scheduled':>12}{'total TTFA (h)':>18}{'max TTFA (h)':>16}"]
+        for plan in plans:
+            lines.append(f"{plan['engine']:<20}{plan['solve_time']:>16.3f}{plan['scheduled']:>12}"
+                         f"{plan['total_ttfa_hours']:>18.2f}{plan['max_ttfa_hours']:>16.2f}")
+        self.event_log.info('engine_comparison', '\n'.join(lines),
+                            engines=[{key: plan[key] for key in ['engine', 'solve_time', 'scheduled', 'total_ttfa_hours',
+                                                                 'max_ttfa_hours']} for plan in plans])
 
     def __sort_new_patients(self, new_patient_df:pd.DataFrame) -> pd.DataFrame:
         """
@@ -75,8 +272,8 @@ class NewPatientScheduler:
         Returns:
             pd.DataFrame: the dataframe of patients, but sorted
         """
-        print('Sorting new patients by registration date and patient id...')
+        self.event_log.info('sorting_new_patients', 'Sorting new patients by registration date and patient id...')
         sorted_new_patient_data_df = new_patient_df.sort_values(by=['REGISTRATIONDATE', 'PATIENTID', ], ascending=True)
-        print('New patients sorted')
+        self.event_log.info('new_patients_sorted', 'New patients sorted', patients=len(new_patient_df))
 
         return sorted_new_patient_data_df
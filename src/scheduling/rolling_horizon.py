@@ -0,0 +1,145 @@
+"""
+This module contains the RollingHorizon class, which grows the calendar week by week while new patients are
+scheduled, instead of scheduling into a fixed month built up front.
+
+A week of timeslots is built from the weekly provider schedule only when the search for a patient's timeslot
+reaches it, so a patient who registers near the end of the calendar, or lives in a state whose providers are
+booked out, is booked into a later week instead of being left unscheduled. Patients are searched for in
+registration order, so weeks that end before the earliest day the current patient can be booked on are no
+longer needed: they are evicted from the calendar and the free-slot index, which only hold the weeks between
+the current patient and the furthest week a search has reached.
+
+Classes:
+    RollingHorizon: Builds and evicts the weeks of the calendar as scheduling advances.
+
+Methods:
+    attach(calendar, free_slot_index): Sets the calendar and free-slot index weeks are added to and evicted from.
+    advance(after): Moves the horizon to the earliest start of the next patient.
+    extend(state): Builds the next week for a search that found no timeslot.
+    summary(): Weeks built and timeslots evicted so far.
+"""
+
+import pandas as pd
+
+from util.event_log import EventLog
+
+class RollingHorizon:
+    """
+    Weeks are counted from first_day: week k is the DAYS_PER_WEEK days from first_day + k weeks.
+    The calendar holds the days from evicted_until up to, but not including, next_day.
+    """
+    DAYS_PER_WEEK = 7
+
+    def __init__(self, build_calendar, first_day, last_day):
+        """
+        Args:
+            build_calendar (callable): called with start_date and end_date, the first and last day of a week,
+                returns the populated ProviderCalendar of those days (or None on failure), e.g.
+                Preprocessor.build_calendar
+            first_day (str or datetime): first day of the calendar scheduling starts from; weeks count from it
+            last_day (str or datetime): last day of that calendar
+        """
+        self.build_calendar = build_calendar
+        self.first_day = pd.Timestamp(first_day).normalize()
+        self.next_day = pd.Timestamp(last_day).normalize() + pd.Timedelta(days=1)
+        self.evicted_until = self.first_day
+        self.calendar = None
+        self.free_slot_index = None
+        self.weeks_built = 0
+        self.slots_evicted = 0
+        # States with a timeslot in the last whole week built; every later week repeats the same schedule
+        self.served_states = None
+        self.stopped = False
+        self.event_log = EventLog()
+
+    def attach(self, calendar, free_slot_index):
+        """
+        Sets the calendar and the free-slot index built on it, which weeks are added to and evicted from.
+
+        Args:
+            calendar (ProviderCalendar): the calendar being scheduled into
+            free_slot_index (FreeSlotIndex): the index of its open timeslots
+        """
+        self.calendar = calendar
+        self.free_slot_index = free_slot_index
+
+    def advance(self, after:int):
+        """
+        Moves the horizon to the earliest start of the next patient: the weeks before the one it falls
+        in are evicted, or never built, and the calendar is built up to and including that week.
+        Starts earlier than a previous call are searched in what is left of the calendar.
+
+        Args:
+            after (int): earliest acceptable start, in nanoseconds since the epoch
+        """
+        day = pd.Timestamp(after).normalize()
+        week_start = self.__week_start(day)
+        if week_start > self.evicted_until:
+            self.slots_evicted += self.calendar.evict(week_start.value)
+            self.free_slot_index.evict_before(week_start.value)
+            self.evicted_until = week_start
+            self.next_day = max(self.next_day, week_start)
+        while self.next_day <= day and self.__build_week():
+            pass
+
+    def extend(self, state:str):
+        """
+        Builds the next week for a search in a state that found no timeslot left in the calendar.
+
+        Args:
+            state (str): state the patient lives in
+
+        Returns:
+            int or None: the start of the new week, in nanoseconds since the epoch, or None when no later
+                week can have a timeslot in the state
+        """
+        if self.served_states is not None and state not in self.served_states:
+            return None
+        week_start = self.next_day
+        return week_start.value if self.__build_week() else None
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: weeks built, timeslots evicted, timeslots held and the calendar's memory in bytes
+        """
+        return {'weeks_built': self.weeks_built, 'slots_evicted': self.slots_evicted,
+                'slots_held': len(self.calendar), 'memory_bytes': self.calendar.memory_usage()}
+
+    def __build_week(self) -> bool:
+        """
+        Builds the days from next_day to the end of its week and adds them to the calendar and the index.
+
+        Returns:
+            bool: False if the week could not be built; no later week is built either
+        """
+        if self.stopped:
+            return False
+        week_end = self.__week_start(self.next_day) + pd.Timedelta(days=self.DAYS_PER_WEEK - 1)
+        week = self.build_calendar(start_date=self.next_day, end_date=week_end)
+        if week is None:
+            self.event_log.warning('week_not_built', f"Could not build the calendar from {self.next_day.date()} "
+                                   f"to {week_end.date()}, the horizon stops there",
+                                   start=str(self.next_day.date()), end=str(week_end.date()))
+            self.stopped = True
+            return False
+
+        whole_week = week_end - self.next_day == pd.Timedelta(days=self.DAYS_PER_WEEK - 1)
+        self.calendar.extend(week)
+        self.free_slot_index.add_calendar(week)
+        if whole_week:
+            # Providers without a timeslot that week cannot serve their states later either
+            self.served_states = set(week.licences.loc[week.licences['PROVIDERID'].isin(week.provider_ids),
+                                                       'STATE'].astype(str))
+        self.event_log.info('week_built', f"Built the calendar from {self.next_day.date()} to {week_end.date()}: "
+                            f"{len(week)} timeslots, {len(self.calendar)} held",
+                            start=str(self.next_day.date()), end=str(week_end.date()), timeslots=len(week),
+                            held=len(self.calendar))
+        self.weeks_built += 1
+        self.next_day = week_end + pd.Timedelta(days=1)
+        return True
+
+    def __week_start(self, day:pd.Timestamp) -> pd.Timestamp:
+        """The first day of the week a day falls in."""
+        weeks = (day - self.first_day).days // self.DAYS_PER_WEEK
+        return self.first_day + pd.Timedelta(days=weeks * self.DAYS_PER_WEEK)
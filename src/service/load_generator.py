@@ -0,0 +1,141 @@
+"""
+This module is a load generator for the scheduler service. It registers synthetic new patients over
+a number of concurrent connections and reports the booking latency percentiles.
+
+Usage:
+    python src/service/load_generator.py --socket /tmp/scheduler.sock --requests 2000 --concurrency 32
+
+Functions:
+    request(reader, writer, method, path, payload): Sends one HTTP request on an open connection.
+    run_load(...): Registers the patients and collects the latencies.
+    summarize(latencies, statuses, elapsed): Computes the latency percentiles and throughput.
+    main(argv): Runs the load generator from the command line.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+async def request(reader:asyncio.StreamReader, writer:asyncio.StreamWriter, method:str, path:str,
+                  payload:dict=None) -> tuple:
+    """
+    Sends one HTTP/1.1 request on a keep-alive connection and reads the JSON response.
+
+    Returns:
+        tuple: the HTTP status and the decoded JSON payload
+    """
+    body = b'' if payload is None else json.dumps(payload).encode()
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                 f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    data = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, json.loads(data) if data else None
+
+async def open_connection(host:str='127.0.0.1', port:int=8080, socket_path:str=None) -> tuple:
+    """
+    Opens a connection to the service over TCP or a Unix socket.
+    """
+    if socket_path:
+        return await asyncio.open_unix_connection(socket_path)
+    return await asyncio.open_connection(host, port)
+
+async def run_load(host:str='127.0.0.1', port:int=8080, socket_path:str=None, requests:int=1000,
+                   concurrency:int=16, start_date:str='2025-01-01', days:int=20, first_patient_id:int=900000,
+                   seed:int=0) -> tuple:
+    """
+    Registers synthetic patients, spread over the states the service serves and over a range of
+    registration dates, from a number of concurrent connections.
+
+    Returns:
+        tuple: booking latencies in seconds, response statuses and the elapsed wall time
+    """
+    reader, writer = await open_connection(host, port, socket_path)
+    _, health = await request(reader, writer, 'GET', '/health')
+    writer.close()
+
+    rng = random.Random(seed)
+    programs = ['Mental Health', 'SUD']
+    first_day = pd.Timestamp(start_date)
+    patients = [{
+        'PATIENTID': first_patient_id + number,
+        'STATE': rng.choice(health['states']),
+        'REGISTRATIONDATE': (first_day + pd.Timedelta(rng.randrange(days), unit='D')).strftime('%Y-%m-%d'),
+        'PROGRAM': rng.choice(programs)
+    } for number in range(requests)]
+
+    latencies = []
+    statuses = []
+    queue = asyncio.Queue()
+    for patient in patients:
+        queue.put_nowait(patient)
+
+    async def client():
+        reader, writer = await open_connection(host, port, socket_path)
+        try:
+            while not queue.empty():
+                patient = queue.get_nowait()
+                sent = time.perf_counter()
+                status, _ = await request(reader, writer, 'POST', '/register', patient)
+                latencies.append(time.perf_counter() - sent)
+                statuses.append(status)
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - started
+
+def summarize(latencies:list, statuses:list, elapsed:float) -> dict:
+    """
+    Computes the latency percentiles, in milliseconds, and the throughput.
+    """
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'booked': sum(status == 200 for status in statuses),
+        'unavailable': sum(status == 409 for status in statuses),
+        'errors': sum(status not in (200, 409) for status in statuses),
+        'p50_ms': float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else float('nan'),
+        'p99_ms': float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else float('nan'),
+        'max_ms': float(latencies_ms.max()) if len(latencies_ms) else float('nan'),
+        'requests_per_second': len(latencies) / elapsed if elapsed > 0 else float('nan')
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Register synthetic patients against the scheduler service.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--socket', default=None, help='Connect to this Unix socket instead of TCP')
+    parser.add_argument('--requests', type=int, default=1000, help='Number of registrations to send')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of concurrent connections')
+    parser.add_argument('--start-date', default='2025-01-01', help='First registration date')
+    parser.add_argument('--days', type=int, default=20, help='Registration dates are spread over this many days')
+    parser.add_argument('--first-patient-id', type=int, default=900000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    latencies, statuses, elapsed = asyncio.run(run_load(
+        args.host, args.port, args.socket, args.requests, args.concurrency, args.start_date, args.days,
+        args.first_patient_id, args.seed))
+    summary = summarize(latencies, statuses, elapsed)
+    print(f"{summary['requests']} registrations in {elapsed:.2f}s "
+          f"({summary['requests_per_second']:.0f}/s): {summary['booked']} booked, "
+          f"{summary['unavailable']} without a timeslot, {summary['errors']} errors")
+    print(f"Booking latency p50: {summary['p50_ms']:.2f} ms  p99: {summary['p99_ms']:.2f} ms  max: {summary['max_ms']:.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,450 @@
+"""
+This module contains the SchedulerService class, a long-running asyncio service that books new
+patients as they register instead of in one batch run.
+
+The service keeps the populated calendar, the NewAppointmentTracker and the free-slot index in
+memory, and answers small JSON requests over HTTP/1.1, on localhost TCP or on a Unix socket:
+
+    POST /register      {"PATIENTID", "STATE", "REGISTRATIONDATE", "PROGRAM"}
+        Books the earliest open timeslot for a new patient.
+    POST /book          {"PATIENTID", "STATE", "REGISTRATIONDATE", "PROGRAM", "PROVIDERID", "START_DATETIME"}
+        Books a specific timeslot.
+    GET  /availability?state=CT&after=2025-01-10&limit=10
+        Lists the earliest open timeslots in a state with providers below their daily limit.
+    POST /flush
+        Journals the buffered appointments.
+    GET  /health
+        Reports the states served and the number of bookings so far.
+    GET  /stats
+        Reports the live TTFA count, mean, median, p90 and p99 in hours, combined and by program.
+
+Timeslots are reserved on the event loop, so checking and taking a slot cannot interleave with
+another request. When a CalendarStore is used, each booking is then written to it on a writer
+thread; a booking the store could not record is undone and answered with a 500. Journaling the
+buffered appointments also runs on the writer thread. A lock per provider keeps a provider's
+bookings in order while bookings with other providers, and so in other states, carry on concurrently.
+
+Classes:
+    SchedulerService: Books new patients online as they register.
+
+Functions:
+    parse_args(argv): Parses the command line options.
+    run(args): Loads the calendar and runs the service until interrupted.
+    main(argv): Runs the service from the command line.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+# Allow running this file directly, like src/main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis.analysis import Analysis
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.appointment_data_handler import AppointmentDataHandler
+from scheduling.appointment_id_allocator import AppointmentIdAllocator
+from scheduling.appointment_scheduler import AppointmentScheduler
+from scheduling.free_slot_index import NS_PER_DAY
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+from storage.calendar_store import CalendarStore
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 409: 'Conflict', 500: 'Internal Server Error'}
+NS_PER_HOUR = 3_600_000_000_000
+
+class SchedulerService:
+    """
+    Books new patients online as they register, against an in-memory calendar.
+    """
+
+    def __init__(self, calendar:ProviderCalendar, appointment_df:pd.DataFrame=None, store_path:str=None,
+                 appointment_data_handler:AppointmentDataHandler=None, id_sequence_file:str=None,
+                 flush_every:int=None):
+        """
+        Args:
+            calendar (ProviderCalendar): the populated calendar
+            appointment_df (pd.DataFrame, optional): appointment data, used to seed new appointment ids
+            store_path (str, optional): CalendarStore file every booking is written to. It is built
+                from the calendar if it does not hold one yet.
+            appointment_data_handler (AppointmentDataHandler, optional): buffers and writes new
+                appointments to the data files
+            id_sequence_file (str, optional): file used to reserve blocks of appointment ids
+            flush_every (int, optional): journal buffered appointments every this many bookings. By
+                default they are journaled on /flush and on shutdown, when the journal is applied to
+                the data files.
+        """
+        self.new_appointment_tracker = NewAppointmentTracker()
+        self.analysis = Analysis()
+        self.appointment_data_handler = appointment_data_handler or AppointmentDataHandler()
+        # Online registrations are not in the new patients table, so only appointments are written
+        self.appointment_data_handler.begin(None, update_new_patients=False)
+        self.appointment_scheduler = AppointmentScheduler(self.new_appointment_tracker, self.analysis,
+                                                          AppointmentIdAllocator(appointment_df, id_sequence_file),
+                                                          self.appointment_data_handler)
+        self.appointment_scheduler.load_calendar(calendar)
+        self.free_slot_index = self.appointment_scheduler.free_slot_index
+        self.calendar = calendar
+        self.appointment_df = appointment_df
+        self.store_path = store_path
+        self.calendar_store = None
+        self.flush_every = flush_every
+
+        self.provider_locks = defaultdict(asyncio.Lock)
+        # sqlite3 connections belong to one thread, so the store is only used from this one
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.server = None
+        self.bookings = 0
+
+    async def start(self, host:str='127.0.0.1', port:int=8080, socket_path:str=None):
+        """
+        Opens the store, if any, and starts listening.
+
+        Args:
+            host (str, optional): address to listen on. Defaults to localhost.
+            port (int, optional): TCP port to listen on
+            socket_path (str, optional): listen on this Unix socket instead of TCP
+        """
+        if self.store_path:
+            await asyncio.get_running_loop().run_in_executor(self.writer, self.__open_store)
+
+        if socket_path:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path=socket_path)
+            print(f'Scheduler service listening on {socket_path}')
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port)
+            print(f'Scheduler service listening on http://{host}:{port}')
+
+    async def serve(self, host:str='127.0.0.1', port:int=8080, socket_path:str=None):
+        """
+        Runs the service until SIGINT or SIGTERM, then writes everything out.
+        """
+        await self.start(host, port, socket_path)
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                # Repeated signals only set the event again, so they cannot interrupt the final commit
+                loop.add_signal_handler(signal_number, stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        try:
+            await stopping.wait()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """
+        Stops listening, writes the buffered appointments and closes the store.
+        """
+        if self.server is not None:
+            self.server.close()
+        await asyncio.get_running_loop().run_in_executor(self.writer, self.appointment_data_handler.compact)
+        if self.calendar_store is not None:
+            # Runs after any queued booking writes, which the writer thread handles in order
+            self.writer.submit(self.calendar_store.close).result()
+            self.calendar_store = None
+        self.writer.shutdown(wait=True)
+        if self.server is not None:
+            server, self.server = self.server, None
+            try:
+                # Idle keep-alive connections would otherwise hold the shutdown up
+                await asyncio.wait_for(server.wait_closed(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    async def register(self, new_patient:dict) -> dict:
+        """
+        Books the earliest open timeslot for a newly registered patient.
+
+        Args:
+            new_patient (dict): PATIENTID, STATE, REGISTRATIONDATE and PROGRAM
+
+        Returns:
+            dict: the booked appointment, or None if no timeslot is available
+        """
+        # Patients can only be booked on a day after they registered
+        earliest_start = (pd.Timestamp(new_patient['REGISTRATIONDATE']).normalize() + pd.Timedelta(days=1)).value
+        while True:
+            # Unlike the batch run, slots skipped for the daily limit are not reported one by one
+            earliest_slot = self.free_slot_index.earliest_free_slot(
+                new_patient['STATE'], earliest_start, self.new_appointment_tracker.has_capacity)
+            if earliest_slot is None:
+                return None
+            start, provider_id = earliest_slot
+            available_time_slot = self.free_slot_index.get_slot(provider_id, start, new_patient['STATE'])
+            appointment = await self.__book(new_patient, available_time_slot)
+            if appointment is not None:
+                return appointment
+            # Another booking took the slot while this one waited for the provider; look again
+
+    async def book(self, new_patient:dict, provider_id:int, start:pd.Timestamp) -> dict:
+        """
+        Books a specific timeslot for a patient.
+
+        Args:
+            new_patient (dict): PATIENTID, STATE, REGISTRATIONDATE and PROGRAM
+            provider_id (int): provider of the timeslot
+            start (pd.Timestamp): start of the timeslot
+
+        Returns:
+            dict: the booked appointment, or None if the timeslot cannot be booked for the patient
+        """
+        if new_patient['STATE'] not in self.free_slot_index.provider_states.get(provider_id, []):
+            return None
+        if start.normalize() <= pd.Timestamp(new_patient['REGISTRATIONDATE']).normalize():
+            return None
+        if not self.free_slot_index.is_free(provider_id, start.value):
+            return None
+        available_time_slot = self.free_slot_index.get_slot(provider_id, start.value, new_patient['STATE'])
+        return await self.__book(new_patient, available_time_slot)
+
+    def availability(self, state:str, after:pd.Timestamp, limit:int=10) -> list[dict]:
+        """
+        Lists the earliest open timeslots in a state whose provider is below the daily limit.
+
+        Args:
+            state (str): state to search
+            after (pd.Timestamp): earliest start
+            limit (int, optional): maximum number of timeslots to return
+
+        Returns:
+            list[dict]: PROVIDERID, START_DATETIME and END_DATETIME of each timeslot
+        """
+        open_time_slots = []
+        for start, provider_id in self.free_slot_index.iter_free_slots(state, after.value):
+            if len(open_time_slots) >= limit:
+                break
+            if self.__has_capacity(provider_id, start):
+                time_slot = self.free_slot_index.get_slot(provider_id, start, state)
+                open_time_slots.append({
+                    'PROVIDERID': provider_id,
+                    'START_DATETIME': time_slot['START_DATETIME'].isoformat(),
+                    'END_DATETIME': time_slot['END_DATETIME'].isoformat()
+                })
+        return open_time_slots
+
+    async def handle_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        """
+        Serves HTTP/1.1 requests on one connection until the client closes it.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                request_parts = request_line.decode('latin-1').split(' ', 2)
+                if len(request_parts) != 3:
+                    # The rest of the request cannot be framed, so the connection is closed
+                    await self.__respond(writer, 400, {'error': f'Malformed request line: {request_line.strip()!r}'})
+                    break
+                method, target, _ = request_parts
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, payload = await self.dispatch(method, target, body)
+                await self.__respond(writer, status, payload)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method:str, target:str, body:bytes) -> tuple:
+        """
+        Routes a request.
+
+        Returns:
+            tuple: the HTTP status and the JSON payload
+        """
+        url = urlsplit(target)
+        try:
+            if method == 'POST' and url.path == '/register':
+                new_patient = self.__read_patient(body)
+                appointment = await self.register(new_patient)
+                if appointment is None:
+                    return 409, {'error': f"No available timeslots for {new_patient['PATIENTID']}"}
+                return 200, appointment
+
+            if method == 'POST' and url.path == '/book':
+                new_patient = self.__read_patient(body)
+                request = json.loads(body)
+                appointment = await self.book(new_patient, int(request['PROVIDERID']), pd.Timestamp(request['START_DATETIME']))
+                if appointment is None:
+                    return 409, {'error': f"Timeslot is not available for {new_patient['PATIENTID']}"}
+                return 200, appointment
+
+            if method == 'GET' and url.path == '/availability':
+                query = {name: values[0] for name, values in parse_qs(url.query).items()}
+                return 200, self.availability(query['state'], pd.Timestamp(query.get('after', 0)),
+                                              int(query.get('limit', 10)))
+
+            if method == 'POST' and url.path == '/flush':
+                flushed = await asyncio.get_running_loop().run_in_executor(
+                    self.writer, self.appointment_data_handler.commit)
+                return 200, {'flushed': flushed}
+
+            if method == 'GET' and url.path == '/stats':
+                return 200, self.analysis.live_statistics()
+
+            if method == 'GET' and url.path == '/health':
+                return 200, {'status': 'ok', 'states': sorted(self.free_slot_index.free_slots_by_state),
+                             'bookings': self.bookings}
+        except (KeyError, ValueError, TypeError) as e:
+            return 400, {'error': f'Invalid request: {e}'}
+        except Exception as e:
+            print(f"An unexpected error occurred: {e}")
+            return 500, {'error': str(e)}
+        return 404, {'error': f'No route for {method} {url.path}'}
+
+    async def __book(self, new_patient:dict, available_time_slot:pd.Series) -> dict:
+        """
+        Takes a timeslot if it is still open and the provider is below the daily limit, and writes
+        the booking to the store. Returns None if the timeslot was taken in the meantime.
+
+        Raises:
+            Exception: the store's error, once the booking has been undone in memory
+        """
+        provider_id = available_time_slot['PROVIDERID']
+        start = available_time_slot['START_DATETIME'].value
+        async with self.provider_locks[provider_id]:
+            if not self.free_slot_index.is_free(provider_id, start) or not self.__has_capacity(provider_id, start):
+                return None
+            self.calendar, new_appointment_id = self.appointment_scheduler.book_appointment(
+                new_patient, self.calendar, available_time_slot)
+            self.bookings += 1
+
+            if self.calendar_store is not None:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(
+                        self.writer, self.calendar_store.book, new_appointment_id, provider_id, start,
+                        new_patient['PATIENTID'])
+                except Exception as e:
+                    print(f"Error: appointment {new_appointment_id} could not be written to the store, "
+                          f"the booking is undone. {e}")
+                    # The timeslot, the daily limit, the analysis and the buffered appointment are released
+                    self.calendar, _, _ = self.appointment_scheduler.cancel_appointment(new_appointment_id, self.calendar)
+                    self.bookings -= 1
+                    raise
+
+        if self.flush_every is not None and self.bookings % self.flush_every == 0:
+            await asyncio.get_running_loop().run_in_executor(self.writer, self.appointment_data_handler.commit)
+
+        registration_date = pd.Timestamp(new_patient['REGISTRATIONDATE'])
+        return {
+            'APPOINTMENTID': new_appointment_id,
+            'PATIENTID': new_patient['PATIENTID'],
+            'PROVIDERID': provider_id,
+            'START_DATETIME': available_time_slot['START_DATETIME'].isoformat(),
+            'END_DATETIME': pd.Timestamp(available_time_slot['END_DATETIME']).isoformat(),
+            'TTFA_HOURS': (start - registration_date.value) / NS_PER_HOUR
+        }
+
+    async def __respond(self, writer:asyncio.StreamWriter, status:int, payload:dict):
+        data = json.dumps(payload).encode()
+        writer.write(f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n'
+                     f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n'.encode() + data)
+        await writer.drain()
+
+    def __has_capacity(self, provider_id:int, start:int) -> bool:
+        return bool(self.new_appointment_tracker.has_capacity(np.array([provider_id]),
+                                                              np.array([start // NS_PER_DAY]))[0])
+
+    def __read_patient(self, body:bytes) -> dict:
+        request = json.loads(body)
+        return {
+            'PATIENTID': int(request['PATIENTID']),
+            'STATE': str(request['STATE']),
+            'REGISTRATIONDATE': str(request['REGISTRATIONDATE']),
+            'PROGRAM': request.get('PROGRAM')
+        }
+
+    def __open_store(self):
+        """
+        Opens the store on the writer thread, building it from the in-memory calendar if it is empty.
+        """
+        self.calendar_store = CalendarStore(self.store_path)
+        if not self.calendar_store.is_initialized():
+            appointment_df = self.appointment_df if self.appointment_df is not None else \
+                pd.DataFrame(columns=['APPOINTMENTID', 'APPOINTMENTDATE', 'APPOINTMENTSTARTTIME',
+                                      'APPOINTMENTDURATION', 'PROVIDERID'])
+            self.calendar_store.initialize(self.calendar, pd.DataFrame(columns=['PATIENTID', 'STATE',
+                                           'REGISTRATIONDATE', 'PROGRAM']), appointment_df,
+                                           self.new_appointment_tracker)
+
+def parse_args(argv=None):
+    """
+    Parse the command line options.
+
+    Args:
+        argv (list[str], optional): Arguments to parse. Defaults to sys.argv.
+
+    Returns:
+        argparse.Namespace: The parsed options
+    """
+    parser = argparse.ArgumentParser(description='Run the online new patient scheduling service.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: localhost)')
+    parser.add_argument('--port', type=int, default=8080, help='TCP port to listen on')
+    parser.add_argument('--socket', default=None, help='Listen on this Unix socket instead of TCP')
+    parser.add_argument('--store', default=None,
+                        help='SQLite store to load the calendar from and write every booking to')
+    parser.add_argument('--data-dir', default='data/', help='Folder holding the CSV files and pattern_map.json')
+    parser.add_argument('--start-date', default='2025-01-01', help='First day of the calendar (YYYY-MM-DD)')
+    parser.add_argument('--end-date', default=None,
+                        help="Last day of the calendar (YYYY-MM-DD, default: the end of the start date's month)")
+    parser.add_argument('--cache-dir', default=None, help='Snapshot cache directory for the CSV inputs')
+    parser.add_argument('--id-sequence-file', default=None,
+                        help='File used to reserve blocks of appointment ids')
+    parser.add_argument('--flush-every', type=int, default=None,
+                        help='Journal bookings every N appointments (default: on /flush and shutdown)')
+    args = parser.parse_args(argv)
+    args.rebuild_cache = False
+    return args
+
+def run(args):
+    """
+    Loads the calendar, from the store if it holds one and otherwise from the CSV files, and serves
+    requests until interrupted.
+
+    Args:
+        args (argparse.Namespace): the options parse_args returns
+    """
+    calendar_store = CalendarStore(args.store) if args.store else None
+    if calendar_store is not None and calendar_store.is_initialized():
+        print(f'Loading calendar from {args.store}')
+        calendar = calendar_store.get_calendar()
+        appointment_df = calendar_store.get_appointment_df()
+        calendar_store.restore_tracker(NewAppointmentTracker())
+    else:
+        from main import load_inputs
+        calendar, _, appointment_df, _ = load_inputs(args)
+    if calendar_store is not None:
+        calendar_store.close()
+
+    appointment_data_handler = AppointmentDataHandler(os.path.join(args.data_dir, 'Appointment Data.csv'),
+                                                      os.path.join(args.data_dir, 'New Patient Data.csv'))
+    service = SchedulerService(calendar, appointment_df, args.store, appointment_data_handler,
+                               args.id_sequence_file, args.flush_every)
+    asyncio.run(service.serve(args.host, args.port, args.socket))
+    print('Scheduler service stopped')
+
+def main(argv=None):
+    run(parse_args(argv))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+"""
+This module provides the CalendarStore class, an optional SQLite backend that keeps the scheduling
+state on disk: timeslots, appointments, provider licences, the daily new appointment counters and
+the new patient queue. A scheduler restarted against an existing store reads it back instead of
+rebuilding the calendar from the CSV files.
+
+Tables:
+    licences (state, provider_id): which providers can see patients in which states
+    slots (provider_id, day, start_ns): every provider timeslot and the appointment booked in it
+    free_slots (state, start_ns, provider_id): open timeslots per state, ordered for earliest-slot lookups
+    daily_counts (provider_id, day): new appointments booked per provider per day
+    appointments (appointment_id): appointment records, in the Appointment Data columns
+    new_patients (patient_id): the new patient queue; booked patients keep their appointment id
+
+Times are stored as int64 nanoseconds since the epoch and days as days since the epoch.
+
+Classes:
+    CalendarStore: SQLite-backed calendar, appointment and new patient store.
+
+Methods:
+    is_initialized(): Whether the store holds a calendar.
+    initialize(calendar, new_patient_df, appointment_df, new_appointment_tracker): Replaces the store contents.
+    get_calendar(): Rebuilds the populated calendar.
+    get_new_patient_df(): Returns the patients still waiting for an appointment.
+    get_appointment_df(): Returns all appointments in the Appointment Data columns.
+    restore_tracker(new_appointment_tracker): Loads the daily counters into a tracker.
+    earliest_free_slot(state, after, max_per_day): Finds the earliest open slot for a state.
+    get_slot(provider_id, start, state): Returns the calendar details of a slot.
+    book(appointment_id, provider_id, start, patient_id): Books a slot in a single transaction.
+    cancel(appointment_id): Cancels an appointment and releases its slots in a single transaction.
+    close(): Closes the database connection.
+"""
+
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from preprocessing.provider_calendar import ProviderCalendar
+
+NS_PER_DAY = 86_400_000_000_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS licences (
+    state TEXT NOT NULL,
+    provider_id INTEGER NOT NULL,
+    PRIMARY KEY (state, provider_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS licences_by_provider ON licences (provider_id, state);
+CREATE TABLE IF NOT EXISTS slots (
+    provider_id INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    start_ns INTEGER NOT NULL,
+    end_ns INTEGER NOT NULL,
+    appointment_id INTEGER,
+    PRIMARY KEY (provider_id, day, start_ns)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS slots_by_appointment ON slots (appointment_id) WHERE appointment_id IS NOT NULL;
+CREATE TABLE IF NOT EXISTS free_slots (
+    state TEXT NOT NULL,
+    start_ns INTEGER NOT NULL,
+    provider_id INTEGER NOT NULL,
+    PRIMARY KEY (state, start_ns, provider_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily_counts (
+    provider_id INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (provider_id, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS appointments (
+    appointment_id INTEGER PRIMARY KEY,
+    appointment_date TEXT NOT NULL,
+    appointment_start_time TEXT NOT NULL,
+    appointment_duration INTEGER NOT NULL,
+    provider_id INTEGER NOT NULL,
+    patient_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS appointments_by_provider ON appointments (provider_id, appointment_date);
+CREATE TABLE IF NOT EXISTS new_patients (
+    patient_id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    registration_date TEXT NOT NULL,
+    registration_ns INTEGER NOT NULL,
+    program TEXT,
+    appointment_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS new_patients_queue ON new_patients (registration_ns, patient_id) WHERE appointment_id IS NULL;
+"""
+
+class CalendarStore:
+    """
+    Keeps the calendar, appointments, licences, daily counters and new patient queue in SQLite.
+    """
+    SCHEMA_VERSION = 1
+
+    def __init__(self, db_path:str):
+        """
+        Opens, and if needed creates, the store.
+
+        Args:
+            db_path (str): path of the SQLite database file
+        """
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def is_initialized(self) -> bool:
+        """
+        Returns:
+            bool: True if the store holds a calendar written by initialize()
+        """
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        return row is not None and int(row[0]) == self.SCHEMA_VERSION
+
+    def initialize(self, calendar:ProviderCalendar, new_patient_df:pd.DataFrame, appointment_df:pd.DataFrame,
+                   new_appointment_tracker=None):
+        """
+        Replaces the contents of the store in one transaction.
+
+        Args:
+            calendar (ProviderCalendar): the populated calendar
+            new_patient_df (pd.DataFrame): patients waiting for an appointment
+            appointment_df (pd.DataFrame): appointment data, in the Appointment Data columns
+            new_appointment_tracker (NewAppointmentTracker, optional): counts of new appointments
+                already booked per provider/day
+        """
+        providers = calendar.provider_ids.astype(np.int64)
+        appointment_ids = calendar.appointment_ids.tolist()
+        free_rows, free_states = calendar.state_slot_rows(free_only=True)
+
+        registration_dates = new_patient_df['REGISTRATIONDATE'].astype(str)
+        registration_ns = pd.to_datetime(registration_dates).to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+        with self.connection:
+            for table in ['meta', 'licences', 'slots', 'free_slots', 'daily_counts', 'appointments', 'new_patients']:
+                self.connection.execute(f'DELETE FROM {table}')
+
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO licences VALUES (?, ?)',
+                zip(calendar.licences['STATE'].astype(str).tolist(), calendar.licences['PROVIDERID'].astype(np.int64).tolist()))
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO slots VALUES (?, ?, ?, ?, ?)',
+                ((provider_id, start // NS_PER_DAY, start, end, None if appointment_id == ProviderCalendar.FREE else appointment_id)
+                 for provider_id, start, end, appointment_id in
+                 zip(providers.tolist(), calendar.starts.tolist(), calendar.ends.tolist(), appointment_ids)))
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO free_slots VALUES (?, ?, ?)',
+                zip(free_states.astype(str).tolist(), calendar.starts[free_rows].tolist(), providers[free_rows].tolist()))
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO appointments VALUES (?, ?, ?, ?, ?, NULL)',
+                zip(appointment_df['APPOINTMENTID'].tolist(), appointment_df['APPOINTMENTDATE'].tolist(),
+                    appointment_df['APPOINTMENTSTARTTIME'].tolist(), appointment_df['APPOINTMENTDURATION'].tolist(),
+                    appointment_df['PROVIDERID'].tolist()))
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO new_patients VALUES (?, ?, ?, ?, ?, NULL)',
+                zip(new_patient_df['PATIENTID'].tolist(), new_patient_df['STATE'].tolist(),
+                    registration_dates.tolist(), registration_ns.tolist(), new_patient_df['PROGRAM'].tolist()))
+            if new_appointment_tracker is not None:
+                self.connection.executemany(
+                    'INSERT INTO daily_counts VALUES (?, ?, ?)',
+                    ((provider_id, pd.Timestamp(date).value // NS_PER_DAY, count)
+                     for provider_id, counts in new_appointment_tracker.get_all_appointments().items()
+                     for date, count in counts.items()))
+            self.connection.execute("INSERT INTO meta VALUES ('schema_version', ?)", (str(self.SCHEMA_VERSION), ))
+
+    def get_calendar(self) -> ProviderCalendar:
+        """
+        Rebuilds the populated calendar from the slots and licences tables.
+
+        Returns:
+            ProviderCalendar: every provider timeslot, with the appointment booked in it
+        """
+        slots = pd.read_sql_query(
+            'SELECT provider_id AS PROVIDERID, start_ns AS START, end_ns AS "END", '
+            f'COALESCE(appointment_id, {ProviderCalendar.FREE}) AS APPOINTMENTID FROM slots', self.connection)
+        licences = pd.read_sql_query('SELECT provider_id AS PROVIDERID, state AS STATE FROM licences', self.connection)
+        return ProviderCalendar(slots, licences)
+
+    def get_new_patient_df(self) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: patients still waiting for an appointment, in the New Patient Data columns
+        """
+        rows = self.connection.execute(
+            'SELECT patient_id, state, registration_date, program FROM new_patients '
+            'WHERE appointment_id IS NULL ORDER BY registration_ns, patient_id').fetchall()
+        return pd.DataFrame(rows, columns=['PATIENTID', 'STATE', 'REGISTRATIONDATE', 'PROGRAM'])
+
+    def get_appointment_df(self) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: all appointments, in the Appointment Data columns
+        """
+        rows = self.connection.execute(
+            'SELECT appointment_id, appointment_date, appointment_start_time, appointment_duration, provider_id '
+            'FROM appointments ORDER BY appointment_id').fetchall()
+        return pd.DataFrame(rows, columns=['APPOINTMENTID', 'APPOINTMENTDATE', 'APPOINTMENTSTARTTIME',
+                                           'APPOINTMENTDURATION', 'PROVIDERID'])
+
+    def restore_tracker(self, new_appointment_tracker):
+        """
+        Replaces the counts of a NewAppointmentTracker with the daily counters in the store.
+
+        Args:
+            new_appointment_tracker (NewAppointmentTracker): tracker to fill
+        """
+        new_appointment_tracker.reset()
+        for provider_id, day, count in self.connection.execute('SELECT provider_id, day, count FROM daily_counts'):
+            date = pd.Timestamp(day * NS_PER_DAY)
+            for _ in range(count):
+                new_appointment_tracker.increment_provider_appointments(provider_id, date)
+
+    def earliest_free_slot(self, state:str, after:int, max_per_day:int):
+        """
+        Finds the earliest open slot in a state that starts at or after a point in time, with a
+        provider below the daily limit of new appointments. Ties go to the lowest provider id.
+
+        Args:
+            state (str): state the patient lives in
+            after (int): earliest acceptable start, in nanoseconds since the epoch
+            max_per_day (int): daily limit of new appointments per provider
+
+        Returns:
+            tuple or None: (start, provider_id) of the earliest acceptable slot, or None
+        """
+        earliest_slot = self.connection.execute(
+            'SELECT f.start_ns, f.provider_id FROM free_slots AS f '
+            'LEFT JOIN daily_counts AS c ON c.provider_id = f.provider_id AND c.day = f.start_ns / ? '
+            'WHERE f.state = ? AND f.start_ns >= ? AND COALESCE(c.count, 0) < ? '
+            'ORDER BY f.start_ns, f.provider_id LIMIT 1',
+            (NS_PER_DAY, state, int(after), max_per_day)).fetchone()
+        return None if earliest_slot is None else tuple(earliest_slot)
+
+    def get_slot(self, provider_id:int, start:int, state:str=None) -> pd.Series:
+        """
+        Return the calendar details of a slot in the same shape as a calendar row.
+
+        Args:
+            provider_id (int): provider id
+            start (int): slot start, in nanoseconds since the epoch
+            state (str, optional): state the slot is being booked for
+
+        Returns:
+            pd.Series: PROVIDERID, DATE, START_DATETIME, END_DATETIME, TIME_RANGE and STATE
+        """
+        row = self.connection.execute(
+            'SELECT end_ns FROM slots WHERE provider_id = ? AND day = ? AND start_ns = ?',
+            (int(provider_id), int(start) // NS_PER_DAY, int(start))).fetchone()
+        if row is None:
+            raise KeyError(f'No slot for provider {provider_id} at {pd.Timestamp(start)}')
+        start_datetime, end_datetime = pd.Timestamp(start), pd.Timestamp(row[0])
+        return pd.Series({
+            'PROVIDERID': provider_id,
+            'DATE': start_datetime.normalize(),
+            'START_DATETIME': start_datetime,
+            'END_DATETIME': end_datetime,
+            'TIME_RANGE': end_datetime - start_datetime,
+            'STATE': state
+        })
+
+    def book(self, appointment_id:int, provider_id:int, start:int, patient_id:int=None):
+        """
+        Books an open slot in a single transaction: the slot, the free-slot rows of every state
+        the provider is licensed in, the daily counter, the appointment record and the patient's
+        place in the queue are all updated together, or not at all.
+
+        Args:
+            appointment_id (int): id of the new appointment
+            provider_id (int): provider of the slot
+            start (int): slot start, in nanoseconds since the epoch
+            patient_id (int, optional): new patient the appointment is for
+
+        Raises:
+            ValueError: if the slot does not exist or is already booked
+        """
+        appointment_id, provider_id, start = int(appointment_id), int(provider_id), int(start)
+        patient_id = None if patient_id is None else int(patient_id)
+        day = start // NS_PER_DAY
+        with self.connection:
+            updated = self.connection.execute(
+                'UPDATE slots SET appointment_id = ? '
+                'WHERE provider_id = ? AND day = ? AND start_ns = ? AND appointment_id IS NULL',
+                (appointment_id, provider_id, day, start))
+            if updated.rowcount != 1:
+                raise ValueError(f'Provider {provider_id} has no open slot at {pd.Timestamp(start)}')
+            (end, ) = self.connection.execute(
+                'SELECT end_ns FROM slots WHERE provider_id = ? AND day = ? AND start_ns = ?',
+                (provider_id, day, start)).fetchone()
+
+            self.connection.execute(
+                'DELETE FROM free_slots WHERE state IN (SELECT state FROM licences WHERE provider_id = ?) '
+                'AND start_ns = ? AND provider_id = ?',
+                (provider_id, start, provider_id))
+            self.connection.execute(
+                'INSERT INTO daily_counts VALUES (?, ?, 1) '
+                'ON CONFLICT (provider_id, day) DO UPDATE SET count = count + 1',
+                (provider_id, day))
+            start_datetime = pd.Timestamp(start)
+            self.connection.execute(
+                'INSERT INTO appointments VALUES (?, ?, ?, ?, ?, ?)',
+                (appointment_id, start_datetime.strftime('%Y-%m-%d'), start_datetime.strftime('%I:%M %p'),
+                 (end - start) // 60_000_000_000, provider_id, patient_id))
+            if patient_id is not None:
+                self.connection.execute(
+                    'UPDATE new_patients SET appointment_id = ? WHERE patient_id = ?', (appointment_id, patient_id))
+
+    def cancel(self, appointment_id:int) -> list:
+        """
+        Cancels an appointment in a single transaction: its slots are released, put back in the
+        free-slot rows of every state the provider is licensed in, the daily counter of a new
+        patient appointment is decremented, the appointment record is deleted and the patient
+        returns to the new patient queue.
+
+        Args:
+            appointment_id (int): id of the cancelled appointment
+
+        Returns:
+            list: (start, provider_id) keys of the released slots
+        """
+        appointment_id = int(appointment_id)
+        with self.connection:
+            released_slots = self.connection.execute(
+                'SELECT start_ns, provider_id FROM slots WHERE appointment_id = ? ORDER BY start_ns',
+                (appointment_id, )).fetchall()
+            self.connection.execute('UPDATE slots SET appointment_id = NULL WHERE appointment_id = ?', (appointment_id, ))
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO free_slots SELECT state, ?, provider_id FROM licences WHERE provider_id = ?',
+                released_slots)
+
+            appointment = self.connection.execute(
+                'SELECT provider_id, patient_id FROM appointments WHERE appointment_id = ?', (appointment_id, )).fetchone()
+            # Only new patient appointments count towards the daily limit
+            if appointment is not None and appointment[1] is not None and released_slots:
+                self.connection.execute(
+                    'UPDATE daily_counts SET count = count - 1 WHERE provider_id = ? AND day = ? AND count > 0',
+                    (appointment[0], released_slots[0][0] // NS_PER_DAY))
+            self.connection.execute('DELETE FROM appointments WHERE appointment_id = ?', (appointment_id, ))
+            self.connection.execute(
+                'UPDATE new_patients SET appointment_id = NULL WHERE appointment_id = ?', (appointment_id, ))
+        return released_slots
+
+    def close(self):
+        """Closes the database connection."""
+        self.connection.close()
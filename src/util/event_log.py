@@ -0,0 +1,201 @@
+"""
+This module contains the EventLog class, a singleton structured event log that replaces the console
+output of the scheduling package.
+
+Every event has a name, a level and fields. Detail events are the per-patient and per-booking ones
+(timeslots booked, capacity rejections, unscheduled patients) that dominate the output of a large
+run; the mode decides how many of them are kept:
+
+    full     every detail event is kept
+    sampled  the first of every sample_every detail events of each name is kept
+    silent   detail events are only counted
+
+Info, warning and error events are always kept and always printed. Kept detail events are printed
+too, unless a JSONL file is configured: then they are buffered and written to it by a background
+thread, off the hot path. Console messages are rendered from a template only when printed.
+
+Classes:
+    EventLog: Singleton that filters, prints and writes events.
+"""
+
+import atexit
+import json
+import queue
+import threading
+import time
+
+class EventLog:
+    """
+    Singleton that filters, prints and writes events. Each line of the JSONL file is one event:
+
+    {"time": float, "level": str, "event": str, "message": str (info and above), field: value, ...}
+    """
+    MODES = ('silent', 'sampled', 'full')
+    DETAIL, INFO, WARNING, ERROR = 'detail', 'info', 'warning', 'error'
+    # Detail events are handed to the writer thread in batches of this size
+    BATCH_SIZE = 512
+
+    _instance = None
+    _lock = threading.Lock()  # Ensures thread safety
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:  # Prevents race conditions
+                if cls._instance is None:  # Double-check locking
+                    cls._instance = super().__new__(cls)
+                    cls._instance._initialized = False  # Prevents reinitialization issues
+        return cls._instance
+
+    def __init__(self):
+        if not self._initialized:  # Ensures __init__ runs only once
+            self.path = None
+            self._writer = None
+            self._buffer_lock = threading.Lock()
+            self.configure()
+            atexit.register(self.close)
+            self._initialized = True
+
+    def configure(self, mode:str='full', path:str=None, sample_every:int=100):
+        """
+        Sets the mode and the JSONL file. Events buffered for a previous file are written first.
+
+        Args:
+            mode (str, optional): 'silent', 'sampled' or 'full'. Defaults to 'full'.
+            path (str, optional): JSONL file events are appended to. Without one, kept detail
+                events are printed.
+            sample_every (int, optional): in the sampled mode, keep one in this many detail events
+                of each name
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {self.MODES}, got {mode}")
+        if sample_every < 1:
+            raise ValueError(f"sample_every must be at least 1, got {sample_every}")
+        self.close()
+        self.mode = mode
+        self.sample_every = 1 if mode == 'full' else sample_every
+        # Callers check this before doing any work to build a detail event
+        self.detail_enabled = mode != 'silent'
+        self.path = path
+        self.detail_counts = {}
+        self._buffer = []
+        if path is not None:
+            self._writer = _JsonlWriter(path)
+            self._writer.start()
+
+    def detail(self, event:str, template:str, **fields):
+        """
+        Records a per-patient or per-booking event. Cheap when the event is not kept.
+
+        Args:
+            event (str): name of the event, e.g. 'capacity_rejected'
+            template (str): console message, formatted with the fields only if it is printed
+            **fields: values recorded with the event
+        """
+        count = self.detail_counts.get(event, 0)
+        self.detail_counts[event] = count + 1
+        if not self.detail_enabled or count % self.sample_every:
+            return
+        if self._writer is None:
+            print(template.format(**fields))
+            return
+
+        fields['time'] = time.time()
+        fields['level'] = self.DETAIL
+        fields['event'] = event
+        with self._buffer_lock:
+            self._buffer.append(fields)
+            if len(self._buffer) >= self.BATCH_SIZE:
+                self._writer.put(self._buffer)
+                self._buffer = []
+
+    def info(self, event:str, message:str, **fields):
+        """Records and prints a run-level event."""
+        self.__emit(self.INFO, event, message, fields)
+
+    def warning(self, event:str, message:str, **fields):
+        """Records and prints something that went wrong but was handled."""
+        self.__emit(self.WARNING, event, message, fields)
+
+    def error(self, event:str, message:str, **fields):
+        """Records and prints a failure."""
+        self.__emit(self.ERROR, event, message, fields)
+
+    def __emit(self, level:str, event:str, message:str, fields:dict):
+        print(message)
+        if self._writer is None:
+            return
+        record = {'time': time.time(), 'level': level, 'event': event, 'message': message, **fields}
+        with self._buffer_lock:
+            # Keeps the file in the order events happened
+            self._buffer.append(record)
+            self._writer.put(self._buffer)
+            self._buffer = []
+
+    def flush(self):
+        """Blocks until every event recorded so far is written."""
+        if self._writer is None:
+            return
+        with self._buffer_lock:
+            if self._buffer:
+                self._writer.put(self._buffer)
+                self._buffer = []
+        self._writer.join_queue()
+
+    def close(self):
+        """
+        Writes the buffered events, a summary of the detail events recorded per name and stops the
+        writer thread. Called at exit.
+        """
+        if self._writer is None:
+            return
+        with self._buffer_lock:
+            self._buffer.append({'time': time.time(), 'level': self.INFO, 'event': 'event_log_closed',
+                                 'mode': self.mode, 'detail_counts': dict(self.detail_counts)})
+            self._writer.put(self._buffer)
+            self._buffer = []
+        self._writer.stop()
+        self._writer = None
+
+class _JsonlWriter(threading.Thread):
+    """
+    Background thread that appends batches of events to a JSONL file.
+    """
+
+    def __init__(self, path:str):
+        super().__init__(name='event-log-writer', daemon=True)
+        self.path = path
+        self.batches = queue.Queue()
+
+    def put(self, batch:list):
+        self.batches.put(batch)
+
+    def join_queue(self):
+        self.batches.join()
+
+    def stop(self):
+        self.batches.put(None)
+        self.join()
+
+    def run(self):
+        with open(self.path, 'a') as file:
+            while True:
+                batch = self.batches.get()
+                try:
+                    if batch is None:
+                        return
+                    file.write(''.join(json.dumps(record, default=_to_json) + '\n' for record in batch))
+                    file.flush()
+                except Exception as e:
+                    print(f"Error writing event log: {str(e)}")
+                finally:
+                    self.batches.task_done()
+
+def _to_json(value):
+    """
+    Converts the field values json cannot write: numpy scalars, timestamps and dates.
+    """
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
@@ -0,0 +1,270 @@
+"""
+This module contains the Profiler class, a singleton that times the stages of a run and counts events
+on the scheduling hot path, and the timed decorator that wraps a stage.
+
+Instrumentation is off until Profiler().start() is called. While it is off, timed methods run after a
+single attribute check and count/observe return immediately, so instrumented code pays next to nothing.
+
+Stages are timed inclusively: a stage that runs inside another is counted in both. An optional capture
+mode adds a cProfile of the whole run ('cprofile') or the peak traced memory of every stage ('tracemalloc').
+Results are written as a JSON report and in the Prometheus text exposition format.
+
+Classes:
+    Profiler: Singleton that collects stage timings, counters and observations.
+
+Functions:
+    timed(stage): Decorator that times every call of a function as a stage.
+"""
+
+import cProfile
+import functools
+import json
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+METRIC_PREFIX = 'staghack'
+_NOT_PROFILING = nullcontext()
+
+class Profiler:
+    """
+    Singleton that collects, while enabled,
+
+    stages = {
+        stage: {'calls': int, 'seconds': float, 'peak_memory_bytes': int (tracemalloc capture only)},
+        ...
+    }
+    counters = {name: int, ...}
+    observations = {name: {'count': int, 'sum': float, 'max': float}, ...}
+    """
+    CAPTURE_MODES = ('cprofile', 'tracemalloc')
+    # Number of functions listed from the cProfile capture, by cumulative time
+    TOP_FUNCTIONS = 30
+
+    _instance = None
+    _lock = threading.Lock()  # Ensures thread safety
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:  # Prevents race conditions
+                if cls._instance is None:  # Double-check locking
+                    cls._instance = super().__new__(cls)
+                    cls._instance._initialized = False  # Prevents reinitialization issues
+        return cls._instance
+
+    def __init__(self):
+        if not self._initialized:  # Ensures __init__ runs only once
+            self.enabled = False
+            self.reset()
+            self._initialized = True
+
+    def reset(self):
+        """Clear everything collected so far."""
+        self.stages = {}
+        self.counters = {}
+        self.observations = {}
+        self.capture = None
+        self.started_at = None
+        self.wall_time = 0.0
+        self.top_functions = []
+        self._cprofile = None
+        self._memory_stack = []
+
+    def start(self, capture:str=None):
+        """
+        Clear previous results and turn instrumentation on.
+
+        Args:
+            capture (str, optional): 'cprofile' to profile every function call of the run, or
+                'tracemalloc' to record the peak memory of every stage. Both slow the run down.
+        """
+        if capture is not None and capture not in self.CAPTURE_MODES:
+            raise ValueError(f"capture must be one of {self.CAPTURE_MODES}, got {capture}")
+        self.reset()
+        self.capture = capture
+        if capture == 'cprofile':
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        elif capture == 'tracemalloc' and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.started_at = time.perf_counter()
+        self.enabled = True
+
+    def stop(self):
+        """Turn instrumentation off, keeping the results for report()."""
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.wall_time = time.perf_counter() - self.started_at
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self.top_functions = self.__top_functions(self._cprofile)
+            self._cprofile = None
+        if self.capture == 'tracemalloc':
+            tracemalloc.stop()
+
+    def stage(self, name:str):
+        """
+        Context manager that times a stage.
+
+        Args:
+            name (str): name of the stage, e.g. 'read_csvs'
+        """
+        if not self.enabled:
+            return _NOT_PROFILING
+        return self.__timed_stage(name)
+
+    @contextmanager
+    def __timed_stage(self, name:str):
+        tracing = self.capture == 'tracemalloc'
+        if tracing:
+            self._memory_stack.append(0)
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            stage['calls'] += 1
+            stage['seconds'] += time.perf_counter() - started
+            if tracing and self._memory_stack:
+                # reset_peak inside a nested stage hides the outer stage's earlier peak, so nested
+                # peaks are handed up the stack
+                peak = max(tracemalloc.get_traced_memory()[1], self._memory_stack.pop())
+                stage['peak_memory_bytes'] = max(stage.get('peak_memory_bytes', 0), peak)
+                if self._memory_stack:
+                    self._memory_stack[-1] = max(self._memory_stack[-1], peak)
+
+    def count(self, name:str, value:int=1):
+        """
+        Adds to a counter, e.g. 'bookings' or 'capacity_rejections'.
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name:str, value:float):
+        """
+        Records one observation of a per-event quantity, e.g. 'slots_scanned_per_patient'.
+        """
+        if self.enabled:
+            observation = self.observations.get(name)
+            if observation is None:
+                self.observations[name] = {'count': 1, 'sum': value, 'max': value}
+            else:
+                observation['count'] += 1
+                observation['sum'] += value
+                observation['max'] = max(observation['max'], value)
+
+    def report(self) -> dict:
+        """
+        Summarizes the collected results.
+
+        Returns:
+            dict: 'capture', 'wall_time_s', 'stages', 'counters', 'observations' (with a 'mean' added),
+                'bookings_per_second' (bookings counted over the 'scheduling' stage time, or None) and,
+                for the cProfile capture, 'top_functions'
+        """
+        wall_time = time.perf_counter() - self.started_at if self.enabled else self.wall_time
+        scheduling_seconds = self.stages.get('scheduling', {}).get('seconds', 0.0)
+        bookings = self.counters.get('bookings', 0)
+        report = {
+            'capture': self.capture,
+            'wall_time_s': wall_time,
+            'stages': {name: dict(stage) for name, stage in self.stages.items()},
+            'counters': dict(self.counters),
+            'observations': {name: {**observation, 'mean': observation['sum'] / observation['count']}
+                             for name, observation in self.observations.items()},
+            'bookings_per_second': bookings / scheduling_seconds if scheduling_seconds > 0 else None
+        }
+        if self.top_functions:
+            report['top_functions'] = self.top_functions
+        return report
+
+    def write_json(self, path:str):
+        """
+        Writes report() to a JSON file.
+        """
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=4)
+        print(f'Profile report written to {path}')
+
+    def write_prometheus(self, path:str):
+        """
+        Writes report() in the Prometheus text exposition format, e.g. for a node exporter
+        textfile collector.
+        """
+        report = self.report()
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} {metric_type}')
+            for labels, value in samples:
+                lines.append(f'{METRIC_PREFIX}_{name}{labels} {float(value):.9g}')
+
+        def stage_label(stage):
+            return '{stage="' + stage.replace('\\', '\\\\').replace('"', '\\"') + '"}'
+
+        stages = report['stages']
+        # Summary samples pass their _count/_sum suffix where other metrics pass labels
+        metric('run_seconds', 'gauge', 'Wall time of the profiled run.', [('', report['wall_time_s'])])
+        metric('stage_seconds_total', 'counter', 'Time spent in each stage, nested stages included.',
+               [(stage_label(name), stage['seconds']) for name, stage in stages.items()])
+        metric('stage_calls_total', 'counter', 'Number of times each stage ran.',
+               [(stage_label(name), stage['calls']) for name, stage in stages.items()])
+        memory = [(stage_label(name), stage['peak_memory_bytes']) for name, stage in stages.items()
+                  if 'peak_memory_bytes' in stage]
+        if memory:
+            metric('stage_peak_memory_bytes', 'gauge', 'Peak traced memory during each stage.', memory)
+        for name, value in report['counters'].items():
+            metric(f'{self.__metric_name(name)}_total', 'counter', f'Number of {name.replace("_", " ")}.',
+                   [('', value)])
+        for name, observation in report['observations'].items():
+            metric_name = self.__metric_name(name)
+            metric(metric_name, 'summary', f'Distribution of {name.replace("_", " ")}.',
+                   [('_count', observation['count']), ('_sum', observation['sum'])])
+            metric(f'{metric_name}_max', 'gauge', f'Largest {name.replace("_", " ")}.', [('', observation['max'])])
+        if report['bookings_per_second'] is not None:
+            metric('bookings_per_second', 'gauge', 'Bookings per second of scheduling.',
+                   [('', report['bookings_per_second'])])
+
+        with open(path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        print(f'Prometheus metrics written to {path}')
+
+    def __metric_name(self, name:str) -> str:
+        return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+    def __top_functions(self, profile:cProfile.Profile) -> list:
+        """
+        Lists the functions with the most cumulative time in a cProfile capture.
+        """
+        stats = pstats.Stats(profile)
+        rows = []
+        for (file_name, line, function), (_, calls, total_time, cumulative_time, _) in stats.stats.items():
+            rows.append({'function': f'{file_name}:{line}({function})', 'calls': calls,
+                         'total_time_s': total_time, 'cumulative_time_s': cumulative_time})
+        rows.sort(key=lambda row: row['cumulative_time_s'], reverse=True)
+        return rows[:self.TOP_FUNCTIONS]
+
+def timed(stage:str):
+    """
+    Decorator that times every call of the decorated function as a stage of the Profiler.
+
+    Args:
+        stage (str): name of the stage
+    """
+    profiler = Profiler()
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with profiler.stage(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
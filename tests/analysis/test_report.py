@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from analysis.report import render_report
+from analysis.ttfa_accumulator import TtfaAccumulator
+
+class TestReport:
+
+    @pytest.fixture
+    def accumulator(self):
+        accumulator = TtfaAccumulator(capacity=4)
+        bookings = [(1, 'SUD', 10, 'PA'), (2, 'SUD', 20, 'PA'), (3, 'Mental Health', 30, 'OH'),
+                    (4, 'Mental Health', 40, None), (5, 'SUD', 50, 'OH')]
+        for patient_id, program, hours, state in bookings:
+            accumulator.add(patient_id, program, hours * 3600, state)
+        accumulator.remove(5)
+        return accumulator
+
+    def test_saved_bookings_load_back(self, accumulator, tmp_path):
+        accumulator.save(str(tmp_path / 'bookings.npz'))
+        loaded = TtfaAccumulator.load(str(tmp_path / 'bookings.npz'))
+
+        assert len(loaded) == 4
+        assert loaded.patient_ids_booked() == accumulator.patient_ids_booked()
+        for by in ('program', 'state'):
+            assert loaded.final_statistics(by=by) == accumulator.final_statistics(by=by)
+        assert loaded.live_statistics()['SUD']['mean'] == pytest.approx(15.0)
+
+    def test_render_report_writes_every_output(self, accumulator, tmp_path):
+        accumulator.save(str(tmp_path / 'bookings.npz'))
+        paths = render_report(str(tmp_path / 'bookings.npz'), str(tmp_path), 'test')
+
+        for path in paths.values():
+            assert (tmp_path / path.split('/')[-1]).stat().st_size > 0
+        with open(paths['json']) as file:
+            summary = json.load(file)
+        assert summary['bookings'] == 4
+        assert list(summary['by_program']) == ['Combined', 'Mental Health', 'SUD']
+        # The booking without a state only counts toward Combined
+        assert list(summary['by_state']) == ['Combined', 'OH', 'PA']
+        assert summary['by_state']['Combined']['mean'] == pytest.approx(25.0)
+        assert summary['by_state']['PA']['median'] == pytest.approx(15.0)
+        assert summary['by_state']['OH']['count'] == 1
+        assert summary['by_program']['Mental Health']['mean'] == pytest.approx(35.0)
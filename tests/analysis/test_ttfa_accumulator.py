@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from analysis.ttfa_accumulator import P2Quantile, TtfaAccumulator
+
+class TestTtfaAccumulator:
+
+    @pytest.fixture
+    def bookings(self):
+        rng = np.random.default_rng(7)
+        ttfa_seconds = rng.gamma(2.0, 16 * 3600, 5000)
+        programs = rng.choice(['SUD', 'Mental Health'], 5000)
+        return ttfa_seconds, programs
+
+    def test_final_statistics_match_numpy_after_cancellations(self, bookings):
+        ttfa_seconds, programs = bookings
+        accumulator = TtfaAccumulator(capacity=8)
+        for patient_id, (ttfa, program) in enumerate(zip(ttfa_seconds, programs)):
+            accumulator.add(patient_id, program, ttfa)
+        cancelled = np.arange(0, 5000, 5)
+        for patient_id in cancelled:
+            assert accumulator.remove(int(patient_id))
+        assert not accumulator.remove(0)
+
+        kept = np.ones(5000, dtype=bool)
+        kept[cancelled] = False
+        statistics = accumulator.final_statistics()
+        live = accumulator.live_statistics()
+        assert len(accumulator) == statistics['Combined']['count'] == live['Combined']['count'] == 4000
+        for program in ['Combined', 'SUD', 'Mental Health']:
+            selected = kept if program == 'Combined' else kept & (programs == program)
+            hours = ttfa_seconds[selected] / 3600
+            assert statistics[program]['count'] == len(hours)
+            assert statistics[program]['mean'] == pytest.approx(hours.mean())
+            assert live[program]['mean'] == pytest.approx(hours.mean())
+            assert statistics[program]['median'] == pytest.approx(np.median(hours))
+            assert statistics[program]['p90'] == pytest.approx(np.quantile(hours, 0.9))
+            assert statistics[program]['p99'] == pytest.approx(np.quantile(hours, 0.99))
+
+    def test_streaming_quantiles_track_the_exact_ones(self, bookings):
+        ttfa_seconds, _ = bookings
+        estimators = [P2Quantile(quantile) for quantile in (0.5, 0.9, 0.99)]
+        for estimator in estimators:
+            assert estimator.value() is None
+            for ttfa in ttfa_seconds[:3]:
+                estimator.add(ttfa)
+            # Exact until the markers are placed
+            assert estimator.value() == pytest.approx(np.quantile(ttfa_seconds[:3], estimator.quantile))
+            for ttfa in ttfa_seconds[3:]:
+                estimator.add(ttfa)
+            assert estimator.value() == pytest.approx(np.quantile(ttfa_seconds, estimator.quantile), rel=0.03)
+
+        empty = TtfaAccumulator().final_statistics()
+        assert empty == {'Combined': {'count': 0, 'mean': None, 'median': None, 'p90': None, 'p99': None}}
@@ -0,0 +1,72 @@
+import pytest
+import pandas as pd
+
+from backtesting.algorithms import SchedulingAlgorithm, get_algorithm, register_algorithm
+from backtesting.backtester import Backtester, format_table
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+
+class TestBacktester:
+
+    @pytest.fixture
+    def tracker(self):
+        tracker = NewAppointmentTracker()
+        tracker.reset()
+        yield tracker
+        tracker.reset()
+
+    @pytest.fixture
+    def calendar(self):
+        rows = []
+        for provider_id, state in [(1, 'CT'), (1, 'NY'), (2, 'CT')]:
+            for day in ['2025-01-02', '2025-01-03']:
+                for hour in range(9, 17):
+                    start = pd.Timestamp(f'{day} {hour:02d}:00')
+                    rows.append({
+                        'PROVIDERID': provider_id,
+                        'STATE': state,
+                        'DATE': pd.Timestamp(day),
+                        'START_DATETIME': start,
+                        'END_DATETIME': start + pd.Timedelta(hours=1),
+                        'TIME_RANGE': pd.Timedelta(hours=1),
+                        'APPOINTMENTID': None
+                    })
+        return ProviderCalendar.from_frame(pd.DataFrame(rows))
+
+    @pytest.fixture
+    def new_patient_df(self):
+        return pd.DataFrame({
+            'PATIENTID': range(1, 25),
+            'STATE': ['CT', 'CT', 'NY'] * 8,
+            'REGISTRATIONDATE': ['2025-01-01'] * 12 + ['2025-01-02'] * 12,
+            'PROGRAM': ['SUD', 'Mental Health'] * 12
+        })
+
+    def test_algorithms_run_on_copies_of_the_same_inputs(self, tracker, calendar, new_patient_df):
+        tracker.increment_provider_appointments(2, pd.Timestamp('2025-01-02'))
+        snapshot = tracker.snapshot()
+
+        results = Backtester(calendar, new_patient_df).run(['greedy', 'optimal-total'], measure_memory=False)
+
+        greedy, optimal = results
+        # Two providers over two days, provider 2 already has one new appointment on the first day
+        assert greedy['scheduled'] == optimal['scheduled'] == 19
+        assert greedy['unscheduled'] == 5
+        assert optimal['ttfa_hours']['Combined']['mean'] <= greedy['ttfa_hours']['Combined']['mean']
+        assert greedy['ttfa_hours']['SUD']['count'] + greedy['ttfa_hours']['Mental Health']['count'] == 19
+        assert calendar.booked_count() == 0
+        assert tracker.snapshot()['counts'].tolist() == snapshot['counts'].tolist()
+        assert 'optimal-total' in format_table(results)
+
+    def test_registered_algorithm_plans_are_validated(self, tracker, calendar, new_patient_df):
+        class DoubleBooking(SchedulingAlgorithm):
+            name = 'double-booking'
+
+            def plan(self, calendar, sorted_new_patient_df, new_appointment_tracker):
+                start = pd.Timestamp('2025-01-02 09:00').value
+                return {0: (start, 1), 1: (start, 1)}
+
+        register_algorithm(DoubleBooking())
+        assert isinstance(get_algorithm('double-booking'), DoubleBooking)
+        with pytest.raises(ValueError):
+            Backtester(calendar, new_patient_df).run(['double-booking'], measure_memory=False)
@@ -0,0 +1,36 @@
+import pytest
+
+from benchmarking.benchmark_suite import fit_scaling
+from benchmarking.synthetic_data import generate_dataset
+from preprocessing.preprocessor import Preprocessor
+from util.utility import read_json
+
+class TestBenchmarkSuite:
+
+    def test_generated_data_is_seeded_and_preprocesses(self, tmp_path):
+        counts = generate_dataset(str(tmp_path / 'a'), providers=20, weeks=2, backlog=50, seed=3)
+        generate_dataset(str(tmp_path / 'b'), providers=20, weeks=2, backlog=50, seed=3)
+        for name in ['Appointment Data.csv', 'New Patient Data.csv', 'Provider Schedule Data.csv',
+                     'Provider State Data.csv']:
+            assert (tmp_path / 'a' / name).read_bytes() == (tmp_path / 'b' / name).read_bytes()
+
+        preprocessor = Preprocessor(str(tmp_path / 'a') + '/')
+        preprocessor.read_csvs(read_json(str(tmp_path / 'a' / 'pattern_map.json')))
+        appointments = preprocessor.process_appointment_times()
+        availability = preprocessor.setup_provider_schedule(start_date=counts['start_date'], end_date=counts['end_date'])
+
+        assert len(preprocessor.get_dataframe('new_patient_df')) == 50
+        assert len(appointments) == counts['appointments']
+        assert availability['PROVIDERID'].nunique() == 20
+        # Every appointment starts on one of its provider's slots
+        slots = set(zip(availability['PROVIDERID'], availability['START_DATETIME']))
+        assert all(key in slots for key in zip(appointments['PROVIDERID'], appointments['appointment_start']))
+
+    def test_fit_recovers_power_law(self):
+        sizes = [100, 200, 400, 800]
+        scaling = fit_scaling(sizes, [0.002 * size ** 1.5 for size in sizes])
+
+        assert scaling['exponent'] == pytest.approx(1.5)
+        assert scaling['coefficient'] == pytest.approx(0.002)
+        assert scaling['r_squared'] == pytest.approx(1.0)
+        assert fit_scaling([100], [1.0])['exponent'] is None
@@ -0,0 +1,69 @@
+import pytest
+import pandas as pd
+
+from preprocessing.populator import CalendarPopulator
+
+class TestCalendarPopulator:
+
+    @pytest.fixture
+    def provider_availability(self):
+        starts = pd.to_datetime(['2025-01-02 09:00', '2025-01-02 09:40', '2025-01-02 10:20'])
+        rows = []
+        for provider_id in [1, 2]:
+            for state in ['CT', 'NY']:
+                for start in starts:
+                    rows.append({
+                        'PROVIDERID': provider_id,
+                        'DATE': start.date(),
+                        'START_DATETIME': start,
+                        'END_DATETIME': start + pd.Timedelta(minutes=40),
+                        'TIME_RANGE': pd.Timedelta(minutes=40),
+                        'STATE': state
+                    })
+        return pd.DataFrame(rows)
+
+    def test_populate_calendar_marks_every_state_row(self, provider_availability):
+        appointments_df = pd.DataFrame({
+            'APPOINTMENTID': [10, 11],
+            'PROVIDERID': [1, 2],
+            'appointment_start': pd.to_datetime(['2025-01-02 09:00', '2025-01-02 09:30']),
+            'appointment_end': pd.to_datetime(['2025-01-02 10:00', '2025-01-02 10:00'])
+        })
+
+        calendar = CalendarPopulator(provider_availability, appointments_df).populate_calendar()
+
+        booked = calendar[calendar['APPOINTMENTID'].notna()]
+        assert sorted(booked.loc[booked['PROVIDERID'] == 1, 'APPOINTMENTID']) == [10, 10, 10, 10]
+        # Provider 2's appointment starts inside the 9:00 slot and ends inside the 9:40 slot
+        provider_2 = booked[booked['PROVIDERID'] == 2]
+        assert list(provider_2['APPOINTMENTID']) == [11, 11, 11, 11]
+        assert set(provider_2['START_DATETIME']) == {pd.Timestamp('2025-01-02 09:00'), pd.Timestamp('2025-01-02 09:40')}
+
+    def test_populate_calendar_later_appointment_wins_overlap(self, provider_availability):
+        appointments_df = pd.DataFrame({
+            'APPOINTMENTID': [20, 21, 22],
+            'PROVIDERID': [1, 1, 3],
+            'appointment_start': pd.to_datetime(['2025-01-02 09:00', '2025-01-02 09:40', '2025-01-02 09:00']),
+            'appointment_end': pd.to_datetime(['2025-01-02 11:00', '2025-01-02 10:00', '2025-01-02 11:00'])
+        })
+
+        calendar = CalendarPopulator(provider_availability, appointments_df).populate_calendar()
+
+        provider_1 = calendar[calendar['PROVIDERID'] == 1].groupby('START_DATETIME')['APPOINTMENTID'].unique()
+        assert [list(ids) for ids in provider_1] == [[20], [21], [20]]
+        assert calendar.loc[calendar['PROVIDERID'] == 2, 'APPOINTMENTID'].isna().all()
+
+    def test_populate_calendar_marks_partial_overlaps_only(self, provider_availability):
+        appointments_df = pd.DataFrame({
+            'APPOINTMENTID': [30, 31, 32],
+            'PROVIDERID': [1, 1, 2],
+            # Inside the 9:00 slot, ending where the 10:20 slot starts, and on another day
+            'appointment_start': pd.to_datetime(['2025-01-02 09:10', '2025-01-02 10:00', '2025-01-03 09:00']),
+            'appointment_end': pd.to_datetime(['2025-01-02 09:20', '2025-01-02 10:20', '2025-01-03 10:00'])
+        })
+
+        calendar = CalendarPopulator(provider_availability, appointments_df).populate_calendar()
+
+        provider_1 = calendar[calendar['PROVIDERID'] == 1].groupby('START_DATETIME')['APPOINTMENTID'].first()
+        assert provider_1.tolist() == [30, 31, None]
+        assert calendar.loc[calendar['PROVIDERID'] == 2, 'APPOINTMENTID'].isna().all()
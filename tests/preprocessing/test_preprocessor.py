@@ -0,0 +1,229 @@
+from datetime import datetime
+
+import pytest
+import pandas as pd
+
+from preprocessing import preprocessor as preprocessor_module
+from preprocessing.preprocessor import Preprocessor
+
+PATTERN_MAPPING = {
+    "Appointment.*\\.csv": "appointment_df",
+    "New Patient.*\\.csv": "new_patient_df",
+    "Provider Schedule.*\\.csv": "provider_schedule_df",
+    "Provider State.*\\.csv": "provider_state_df"
+}
+
+class TestIncrementalAppointmentIngestion:
+
+    @pytest.fixture
+    def data_dir(self, tmp_path):
+        data_dir = tmp_path / 'data'
+        data_dir.mkdir()
+        (data_dir / 'Provider Schedule Data.csv').write_text(
+            'PROVIDERID,DAYOFWEEK,SLOTSTARTTIME,SLOTENDTIME\n' +
+            ''.join(f'{provider_id},{day},{hour}:00,{hour}:40\n'
+                    for provider_id in [1, 2] for day in range(1, 6) for hour in range(9, 17)))
+        (data_dir / 'Provider State Data.csv').write_text('PROVIDERID,STATE\n1,CT\n1,NY\n2,CT\n')
+        (data_dir / 'New Patient Data.csv').write_text('PATIENTID,STATE,REGISTRATIONDATE,PROGRAM\n10,CT,2025-01-01,SUD\n')
+        (data_dir / 'Appointment Data.csv').write_text(
+            'APPOINTMENTID,APPOINTMENTDATE,APPOINTMENTSTARTTIME,APPOINTMENTDURATION,PROVIDERID\n'
+            '500,2025-01-02,09:00 AM,60,1\n')
+        return data_dir
+
+    def populate(self, data_dir, cache_dir=None):
+        preprocessor = Preprocessor(str(data_dir) + '/', cache_dir=cache_dir)
+        preprocessor.read_csvs(PATTERN_MAPPING)
+        return preprocessor, preprocessor.populate_calendar(year=2025, month=1)
+
+    def test_appended_rows_update_the_cached_calendar(self, data_dir, tmp_path):
+        cache_dir = str(tmp_path / 'cache')
+        self.populate(data_dir, cache_dir)
+
+        with open(data_dir / 'Appointment Data.csv', 'a') as file:
+            file.write('501,2025-01-03,10:00 AM,40,2\n502,2025-01-03,10:00 AM,40,1\n')
+        (data_dir / 'New Patient Data.csv').write_text('PATIENTID,STATE,REGISTRATIONDATE,PROGRAM\n11,NY,2025-01-02,SUD\n')
+
+        preprocessor, calendar = self.populate(data_dir, cache_dir)
+        _, expected = self.populate(data_dir)
+
+        assert preprocessor.loaded_from_snapshot
+        assert len(preprocessor.appended_rows) == 0
+        assert preprocessor.get_dataframe('appointment_df')['APPOINTMENTID'].tolist() == [500, 501, 502]
+        assert preprocessor.get_dataframe('new_patient_df')['PATIENTID'].tolist() == [11]
+        pd.testing.assert_frame_equal(calendar.to_frame(), expected.to_frame())
+
+        # The next run finds nothing new
+        preprocessor, calendar = self.populate(data_dir, cache_dir)
+        assert preprocessor.loaded_from_snapshot
+        pd.testing.assert_frame_equal(calendar.to_frame(), expected.to_frame())
+
+    def test_appended_rows_reach_every_cached_calendar(self, data_dir, tmp_path):
+        cache_dir = str(tmp_path / 'cache')
+        week = {'start_date': '2025-01-06', 'end_date': '2025-01-12'}
+        preprocessor, _ = self.populate(data_dir, cache_dir)
+        preprocessor.populate_calendar(**week)
+
+        with open(data_dir / 'Appointment Data.csv', 'a') as file:
+            file.write('501,2025-01-07,10:00 AM,40,2\n')
+
+        # Refreshing one calendar moves the high-water mark past the row for the other as well
+        preprocessor, month = self.populate(data_dir, cache_dir)
+        assert preprocessor.loaded_from_snapshot
+        preprocessor, _ = self.populate(data_dir)
+        pd.testing.assert_frame_equal(month.to_frame(), preprocessor.populate_calendar(year=2025, month=1).to_frame())
+
+        preprocessor = Preprocessor(str(data_dir) + '/', cache_dir=cache_dir)
+        preprocessor.read_csvs(PATTERN_MAPPING)
+        assert preprocessor.loaded_from_snapshot
+        cached_week = preprocessor.populate_calendar(**week)
+        fresh = Preprocessor(str(data_dir) + '/')
+        fresh.read_csvs(PATTERN_MAPPING)
+        pd.testing.assert_frame_equal(cached_week.to_frame(), fresh.populate_calendar(**week).to_frame())
+        assert cached_week.booked_count() == 1
+
+    def test_rewritten_file_rebuilds_the_snapshot(self, data_dir, tmp_path):
+        cache_dir = str(tmp_path / 'cache')
+        self.populate(data_dir, cache_dir)
+
+        (data_dir / 'Appointment Data.csv').write_text(
+            'APPOINTMENTID,APPOINTMENTDATE,APPOINTMENTSTARTTIME,APPOINTMENTDURATION,PROVIDERID\n'
+            '501,2025-01-03,10:00 AM,40,2\n500,2025-01-02,09:00 AM,60,1\n')
+
+        preprocessor, calendar = self.populate(data_dir, cache_dir)
+        _, expected = self.populate(data_dir)
+
+        assert not preprocessor.loaded_from_snapshot
+        pd.testing.assert_frame_equal(calendar.to_frame(), expected.to_frame())
+
+    def test_a_cold_start_preprocesses_once(self, data_dir, tmp_path, capsys):
+        preprocessor, calendar = self.populate(data_dir, str(tmp_path / 'cache'))
+
+        assert not preprocessor.loaded_from_snapshot
+        output = capsys.readouterr().out
+        # Filling the snapshot processed the appointments and joined the schedule; the calendar reused both
+        assert output.count('Successfully processed appointment times.') == 1
+        assert output.count('Successfully joined provider state data') == 1
+        assert calendar.booked_count() == 1
+
+    def test_rebuild_cache_ignores_the_snapshot(self, data_dir, tmp_path):
+        cache_dir = str(tmp_path / 'cache')
+        self.populate(data_dir, cache_dir)
+
+        preprocessor = Preprocessor(str(data_dir) + '/', cache_dir=cache_dir, rebuild_cache=True)
+        preprocessor.read_csvs(PATTERN_MAPPING)
+        assert not preprocessor.loaded_from_snapshot
+
+        # The rebuilt snapshot is used by the next run
+        preprocessor, _ = self.populate(data_dir, cache_dir)
+        assert preprocessor.loaded_from_snapshot
+
+    def test_weekly_calendars_reuse_the_preprocessing_and_populate_their_own_appointments(self, data_dir, capsys, monkeypatch):
+        with open(data_dir / 'Appointment Data.csv', 'a') as file:
+            # 504 overlaps 503 and, coming later, keeps the 9:00 timeslot
+            file.write('501,2025-01-07,10:00 AM,40,2\n502,2025-01-07,10:00 AM,40,1\n'
+                       '503,2025-01-14,09:00 AM,40,1\n504,2025-01-14,09:10 AM,30,1\n')
+        populated = []
+
+        class RecordingPopulator(preprocessor_module.CalendarPopulator):
+            def __init__(self, provider_availability_df=None, appointments_df=None):
+                populated.append(sorted(appointments_df['APPOINTMENTID']))
+                super().__init__(provider_availability_df, appointments_df)
+        monkeypatch.setattr(preprocessor_module, 'CalendarPopulator', RecordingPopulator)
+
+        preprocessor = Preprocessor(str(data_dir) + '/')
+        preprocessor.read_csvs(PATTERN_MAPPING)
+        weeks = [preprocessor.build_calendar(start_date=f'2025-01-{day:02d}', end_date=f'2025-01-{day + 6:02d}')
+                 for day in (6, 13, 20)]
+        month = preprocessor.build_calendar(year=2025, month=1)
+
+        output = capsys.readouterr().out
+        assert output.count('Successfully processed appointment times.') == 1
+        assert output.count('Successfully joined provider state data') == 1
+        assert populated == [[501, 502], [503, 504], [], [500, 501, 502, 503, 504]]
+        month_df = month.to_frame()
+        for week, first_day in zip(weeks, ('2025-01-06', '2025-01-13', '2025-01-20')):
+            in_week = (month_df['START_DATETIME'] >= pd.Timestamp(first_day)) & \
+                (month_df['START_DATETIME'] < pd.Timestamp(first_day) + pd.Timedelta(days=7))
+            pd.testing.assert_frame_equal(week.to_frame().reset_index(drop=True),
+                                          month_df[in_week].reset_index(drop=True))
+        week_df = weeks[1].to_frame()
+        assert week_df.loc[(week_df['PROVIDERID'] == 1) & (week_df['START_DATETIME'] == pd.Timestamp('2025-01-14 09:00')),
+                           'APPOINTMENTID'].tolist() == [504, 504]
+
+class TestProviderSchedule:
+
+    @pytest.fixture
+    def preprocessor(self):
+        preprocessor = Preprocessor()
+        preprocessor.dataframes['provider_schedule_df'] = pd.DataFrame({
+            'PROVIDERID': [1, 1, 1, 2, 2, 3, 3],
+            'DAYOFWEEK': [1, 1, 5, 3, 7, 6, 2],
+            'SLOTSTARTTIME': ['09:00', '9:40', '14:20', '08:30', '20:50', '10:00', '07:00'],
+            'SLOTENDTIME': ['09:40', '10:20', '15:00', '09:10', '21:30', '10:30', '07:40']
+        })
+        preprocessor.dataframes['provider_state_df'] = pd.DataFrame({'PROVIDERID': [1, 1, 2, 3], 'STATE': ['CT', 'NY', 'CT', 'NJ']})
+        return preprocessor
+
+    def per_day_loop(self, preprocessor, start_date, end_date):
+        """The schedule as the original generator built it, visiting every template row and day in turn."""
+        schedule_df = preprocessor.join_provider_state_data()
+        schedule_df = schedule_df.drop_duplicates(['PROVIDERID', 'DAYOFWEEK', 'SLOTSTARTTIME', 'SLOTENDTIME'])
+        schedule_entries = []
+        for _, row in schedule_df.iterrows():
+            start_time = datetime.strptime(row['SLOTSTARTTIME'], '%H:%M').time()
+            end_time = datetime.strptime(row['SLOTENDTIME'], '%H:%M').time()
+            for current_date in pd.date_range(start_date, end_date, freq='D'):
+                if current_date.weekday() + 1 == row['DAYOFWEEK']:
+                    slot_start = datetime.combine(current_date.date(), start_time)
+                    slot_end = datetime.combine(current_date.date(), end_time)
+                    schedule_entries.append({'PROVIDERID': row['PROVIDERID'], 'DATE': current_date,
+                                             'START_DATETIME': pd.Timestamp(slot_start), 'END_DATETIME': pd.Timestamp(slot_end),
+                                             'TIME_RANGE': slot_end - slot_start})
+        return pd.DataFrame(schedule_entries).sort_values(['DATE', 'START_DATETIME', 'PROVIDERID']).reset_index(drop=True)
+
+    @pytest.mark.parametrize('start_date, end_date', [
+        ('2025-01-27', '2025-02-09'),   # crosses a month boundary
+        ('2025-02-12', '2025-02-14'),   # a few days starting mid-week
+        ('2024-12-01', '2025-03-31')    # several months across a year end
+    ])
+    def test_vectorized_schedule_matches_the_per_day_loop(self, preprocessor, start_date, end_date):
+        schedule_df = preprocessor.setup_provider_schedule(start_date=start_date, end_date=end_date).reset_index(drop=True)
+
+        pd.testing.assert_frame_equal(schedule_df, self.per_day_loop(preprocessor, start_date, end_date), check_dtype=False)
+
+    def test_template_weekdays_land_on_matching_dates(self, preprocessor):
+        schedule_df = preprocessor.setup_provider_schedule(year=2025, month=2)
+
+        # 1 = Monday ... 7 = Sunday, as in the DAYOFWEEK column
+        weekdays = schedule_df.groupby('PROVIDERID')['DATE'].apply(lambda dates: sorted(set(dates.dt.dayofweek + 1)))
+        assert weekdays.to_dict() == {1: [1, 5], 2: [3, 7], 3: [6]}
+        assert schedule_df['DATE'].min() == pd.Timestamp('2025-02-01')
+        assert schedule_df['DATE'].max() == pd.Timestamp('2025-02-28')
+        # Four Mondays with two timeslots each, four Fridays with one
+        assert (schedule_df['PROVIDERID'] == 1).sum() == 4 * 2 + 4
+
+class TestAppointmentIntervals:
+
+    def test_memory_report_is_an_estimate_printed_on_request(self, capsys):
+        preprocessor = Preprocessor()
+        preprocessor.dataframes['appointment_df'] = pd.DataFrame({
+            'APPOINTMENTID': [500, 501, 502],
+            'APPOINTMENTDATE': ['2025-01-02', '2025-01-02', '2025-01-03'],
+            'APPOINTMENTSTARTTIME': ['09:00 AM', '08:50 PM', '10:00 AM'],
+            'APPOINTMENTDURATION': [60, 20, 40],
+            'PROVIDERID': [1, 1, 2]
+        })
+        processed_df = preprocessor.process_appointment_times()
+
+        # The appointment running past 9:00 PM is outside business hours
+        assert processed_df['APPOINTMENTID'].tolist() == [500, 502]
+        assert 'memory report' not in capsys.readouterr().out
+
+        report = preprocessor.appointment_interval_memory_report()
+        assert report['interval_bytes'] == 2 * 2 * 8
+        # A timestamp for every minute, start and end included, plus the same overhead for each appointment
+        index_overheads = report['estimated_time_range_bytes'] - (61 + 41) * 8
+        assert index_overheads > 0 and index_overheads % 2 == 0
+
+        preprocessor.print_appointment_interval_memory_report()
+        assert 'estimated from the durations' in capsys.readouterr().out
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+import pandas as pd
+
+from preprocessing.provider_calendar import ProviderCalendar
+from util.event_log import EventLog
+
+class TestProviderCalendar:
+
+    @pytest.fixture
+    def calendar(self):
+        starts = pd.date_range('2025-01-02 09:00', periods=8, freq='h')
+        slots_df = pd.DataFrame({
+            'PROVIDERID': [2] * 8 + [1] * 8,
+            'START_DATETIME': list(starts) * 2,
+            'END_DATETIME': list(starts + pd.Timedelta(minutes=40)) * 2,
+            'APPOINTMENTID': [None] * 15 + [500]
+        })
+        licences_df = pd.DataFrame({'PROVIDERID': [1, 1, 1, 2], 'STATE': ['NY', 'CT', 'NJ', 'CT']})
+        return ProviderCalendar.from_slots(slots_df, licences_df)
+
+    def test_view_has_a_row_per_slot_and_state(self, calendar):
+        calendar_df = calendar.to_frame()
+
+        assert len(calendar) == 16
+        assert len(calendar_df) == calendar.state_slot_count() == 8 * 3 + 8
+        assert calendar_df[['PROVIDERID', 'STATE']].iloc[:3].values.tolist() == [[1, 'CT'], [1, 'NJ'], [1, 'NY']]
+        booked = calendar.to_frame(booked_only=True)
+        assert booked['APPOINTMENTID'].tolist() == [500, 500, 500]
+        assert (booked['START_DATETIME'] == pd.Timestamp('2025-01-02 16:00')).all()
+        assert calendar.memory_usage() < calendar_df.memory_usage(deep=True).sum() / 4
+
+    def test_duplicate_timeslots_are_dropped_with_a_warning_event(self, tmp_path):
+        path = tmp_path / 'events.jsonl'
+        event_log = EventLog()
+        event_log.configure('silent', str(path))
+        try:
+            starts = pd.to_datetime(['2025-01-02 09:00', '2025-01-02 09:00', '2025-01-02 10:00', '2025-01-02 09:00'])
+            slots_df = pd.DataFrame({'PROVIDERID': [1, 1, 1, 2], 'START_DATETIME': starts,
+                                     'END_DATETIME': starts + pd.Timedelta(minutes=40), 'APPOINTMENTID': [None] * 4})
+            calendar = ProviderCalendar.from_slots(slots_df, pd.DataFrame({'PROVIDERID': [1, 2], 'STATE': ['CT', 'CT']}))
+            event_log.close()
+        finally:
+            event_log.configure()
+
+        assert len(calendar) == 3
+        events = [json.loads(line) for line in path.read_text().splitlines()]
+        duplicates, = [event for event in events if event['event'] == 'duplicate_timeslots']
+        assert (duplicates['level'], duplicates['dropped']) == ('warning', 1)
+
+    def test_a_timeslot_is_booked_once_across_states(self, calendar):
+        start = pd.Timestamp('2025-01-02 10:00').value
+        calendar.book(1, start, 601)
+
+        with pytest.raises(ValueError):
+            calendar.book(1, start, 602)
+        with pytest.raises(ValueError):
+            calendar.book(3, start, 602)
+        calendar_df = calendar.to_frame(booked_only=True)
+        assert calendar_df.loc[calendar_df['APPOINTMENTID'] == 601, 'STATE'].tolist() == ['CT', 'NJ', 'NY']
+
+        assert calendar.release(601) == [(start, 1)]
+        assert calendar.booked_count() == 1
+        calendar.book(1, start, 602)
+
+    def test_appointments_of_any_length_book_every_overlapped_timeslot(self):
+        starts = pd.to_datetime(['2025-01-02 09:00', '2025-01-02 09:40', '2025-01-02 10:40'])
+        slots_df = pd.DataFrame({'PROVIDERID': [1, 1, 1], 'START_DATETIME': starts,
+                                 'END_DATETIME': starts + pd.Timedelta(minutes=40), 'APPOINTMENTID': [None] * 3})
+        calendar = ProviderCalendar.from_slots(slots_df, pd.DataFrame({'PROVIDERID': [1], 'STATE': ['NY']}))
+        after = pd.Timestamp('2025-01-02 08:00').value
+        start = calendar.earliest_window(1, 60, after)
+        assert start == starts[0].value
+
+        assert calendar.book_window(1, start, 60, 601) == [(starts[0].value, 1), (starts[1].value, 1)]
+        with pytest.raises(ValueError):
+            calendar.book_window(1, pd.Timestamp('2025-01-02 10:30').value, 20, 602)
+        # The 10:20-10:40 gap between timeslots breaks up the open minutes
+        assert calendar.earliest_window(1, 45, after) is None
+        assert calendar.earliest_window(1, 40, after) == starts[2].value
+
+        calendar.release(601)
+        assert calendar.earliest_window(1, 80, after) == starts[0].value
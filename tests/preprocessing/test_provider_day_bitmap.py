@@ -0,0 +1,54 @@
+import random
+
+import pandas as pd
+
+from preprocessing.provider_day_bitmap import ProviderDayBitmap, within_business_hours
+
+def ns(*timestamps):
+    return [pd.Timestamp(timestamp).value for timestamp in timestamps]
+
+class TestProviderDayBitmap:
+
+    def test_marked_intervals_are_found_by_overlap_and_window(self):
+        bitmap = ProviderDayBitmap.covering([1, 1, 2], ns('2025-01-02', '2025-01-03', '2025-01-02'))
+        # Provider 1 is open 9:00-9:40 and 9:40-10:20 on the 2nd, and 9:00-9:20 on the 3rd
+        bitmap.mark([1, 1, 1], ns('2025-01-02 09:00', '2025-01-02 09:40', '2025-01-03 09:00'),
+                    ns('2025-01-02 09:40', '2025-01-02 10:20', '2025-01-03 09:20'))
+
+        assert bitmap.any_marked([1, 1, 2, 3], ns('2025-01-02 08:50', '2025-01-02 10:20', '2025-01-02 09:00', '2025-01-02 09:00'),
+                                 ns('2025-01-02 09:05', '2025-01-02 11:00', '2025-01-02 10:00', '2025-01-02 10:00')).tolist() \
+            == [True, False, False, False]
+        assert bitmap.all_marked([1, 1], ns('2025-01-02 09:00', '2025-01-02 08:55'),
+                                 ns('2025-01-02 10:20', '2025-01-02 09:30')).tolist() == [True, False]
+
+        after = pd.Timestamp('2025-01-02 09:07').value
+        assert bitmap.earliest_window(1, 60, after) == pd.Timestamp('2025-01-02 09:10').value
+        assert bitmap.earliest_window(1, 75, after) is None
+        assert bitmap.earliest_window(1, 20, pd.Timestamp('2025-01-02 10:05').value) == pd.Timestamp('2025-01-03 09:00').value
+        assert bitmap.earliest_window(2, 5, after) is None
+
+    def test_earliest_window_matches_a_bin_by_bin_scan(self):
+        randomizer = random.Random(3)
+        days = ns('2025-01-02', '2025-01-03', '2025-01-06', '2025-01-07')
+        bin_ns = ProviderDayBitmap.NS_PER_BIN
+        for _ in range(50):
+            bitmap = ProviderDayBitmap.covering([1] * len(days), days)
+            starts = [day + randomizer.randrange(96, 216) * bin_ns for day in days for _ in range(3)]
+            ends = [start + randomizer.randrange(1, 24) * bin_ns for start in starts]
+            bitmap.mark([1] * len(starts), starts, ends)
+            open_bins = {start + position * bin_ns for start, end in zip(starts, ends) for position in range((end - start) // bin_ns)}
+
+            minutes = randomizer.choice([5, 20, 45, 90, 240])
+            after = days[0] + randomizer.randrange(3 * 24 * 60) * 60_000_000_000
+            width = minutes // ProviderDayBitmap.GRANULARITY_MINUTES
+            # A run starts on a bin boundary at or after `after` and does not cross midnight
+            candidates = sorted(start for start in open_bins if start >= after and
+                                all(start + position * bin_ns in open_bins for position in range(width)) and
+                                (start + width * bin_ns - 1) // 86_400_000_000_000 == start // 86_400_000_000_000)
+            assert bitmap.earliest_window(1, minutes, after) == (candidates[0] if candidates else None)
+
+    def test_within_business_hours(self):
+        starts = ns('2025-01-02 08:30', '2025-01-02 08:28', '2025-01-02 20:40', '2025-01-02 20:45', '2025-01-02 23:50')
+        ends = ns('2025-01-02 09:00', '2025-01-02 08:48', '2025-01-02 21:00', '2025-01-02 21:02', '2025-01-03 00:10')
+
+        assert within_business_hours(starts, ends).tolist() == [True, False, True, False, False]
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+import pandas as pd
+
+from preprocessing.snapshot_cache import SnapshotCache
+
+class TestSnapshotCache:
+
+    @pytest.fixture
+    def source_files(self, tmp_path):
+        schedule_path = tmp_path / 'Provider Schedule Data.csv'
+        schedule_path.write_text('PROVIDERID,DAYOFWEEK,SLOTSTARTTIME,SLOTENDTIME\n1,1,09:00,09:40\n')
+        new_patient_path = tmp_path / 'New Patient Data.csv'
+        new_patient_path.write_text('PATIENTID,STATE,REGISTRATIONDATE,PROGRAM\n10,CT,2025-01-01,SUD\n')
+        return {'provider_schedule_df': str(schedule_path), 'new_patient_df': str(new_patient_path)}
+
+    @pytest.fixture
+    def cache(self, tmp_path, source_files):
+        cache = SnapshotCache(str(tmp_path / 'cache'))
+        cache.save(source_files, {name: pd.read_csv(path) for name, path in source_files.items()})
+        return cache
+
+    def load(self, cache, source_files):
+        return cache.load(source_files, independent=('new_patient_df', ))
+
+    def touch(self, path, seconds=10):
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 1_000_000_000))
+
+    def test_unchanged_sources_load_the_snapshot(self, cache, source_files):
+        dataframes = self.load(cache, source_files)
+
+        assert sorted(dataframes) == ['new_patient_df', 'provider_schedule_df']
+        assert dataframes['provider_schedule_df']['SLOTSTARTTIME'].tolist() == ['09:00']
+
+    def test_a_size_change_invalidates_the_snapshot(self, cache, source_files):
+        with open(source_files['provider_schedule_df'], 'a') as file:
+            file.write('1,2,09:00,09:40\n')
+
+        assert self.load(cache, source_files) is None
+
+    def test_a_touched_file_with_the_same_content_is_still_valid(self, cache, source_files):
+        self.touch(source_files['provider_schedule_df'])
+
+        assert self.load(cache, source_files) is not None
+        # The new modification time is recorded, so the next load skips the hash
+        manifest = pd.read_json(cache.manifest_path, typ='series')
+        assert manifest['sources']['provider_schedule_df']['mtime_ns'] == \
+            os.stat(source_files['provider_schedule_df']).st_mtime_ns
+
+    def test_same_size_different_content_is_caught_by_the_hash(self, cache, source_files):
+        with open(source_files['provider_schedule_df'], 'w') as file:
+            file.write('PROVIDERID,DAYOFWEEK,SLOTSTARTTIME,SLOTENDTIME\n1,1,10:00,10:40\n')
+        self.touch(source_files['provider_schedule_df'])
+
+        assert self.load(cache, source_files) is None
+
+    def test_a_changed_independent_source_is_left_out_for_re_reading(self, cache, source_files):
+        with open(source_files['new_patient_df'], 'a') as file:
+            file.write('11,NY,2025-01-02,SUD\n')
+
+        dataframes = self.load(cache, source_files)
+
+        assert list(dataframes) == ['provider_schedule_df']
+        assert cache.stale_sources == {'new_patient_df'}
+
+    def test_a_different_version_is_ignored(self, cache, source_files, monkeypatch):
+        monkeypatch.setattr(SnapshotCache, 'SNAPSHOT_VERSION', SnapshotCache.SNAPSHOT_VERSION + 1)
+
+        assert self.load(cache, source_files) is None
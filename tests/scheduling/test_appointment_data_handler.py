@@ -0,0 +1,178 @@
+import os
+
+import pytest
+import pandas as pd
+
+from preprocessing.snapshot_cache import SnapshotCache
+from scheduling.appointment_data_handler import AppointmentDataHandler
+
+APPOINTMENT_HEADER = 'APPOINTMENTID,APPOINTMENTDATE,APPOINTMENTSTARTTIME,APPOINTMENTDURATION,PROVIDERID\n'
+
+def time_slot(start):
+    start = pd.Timestamp(start)
+    return pd.Series({'DATE': start.normalize(), 'START_DATETIME': start, 'TIME_RANGE': pd.Timedelta(minutes=60),
+                      'PROVIDERID': 7})
+
+class TestAppointmentDataHandler:
+
+    @pytest.fixture
+    def data_dir(self, tmp_path):
+        (tmp_path / 'Appointment Data.csv').write_text(APPOINTMENT_HEADER + '500,2025-01-03,04:00 PM,60,1\n')
+        (tmp_path / 'New Patient Data.csv').write_text('PATIENTID,STATE,REGISTRATIONDATE,PROGRAM\n'
+                                                       '10,CT,2025-01-01,SUD\n11,CT,2025-01-01,SUD\n12,NY,2025-01-01,SUD\n')
+        return tmp_path
+
+    def handler(self, data_dir):
+        handler = AppointmentDataHandler(str(data_dir / 'Appointment Data.csv'), str(data_dir / 'New Patient Data.csv'))
+        handler.begin(pd.read_csv(data_dir / 'New Patient Data.csv'))
+        return handler
+
+    def appointment_ids(self, data_dir):
+        return pd.read_csv(data_dir / 'Appointment Data.csv')['APPOINTMENTID'].tolist()
+
+    def new_patient_ids(self, data_dir):
+        return pd.read_csv(data_dir / 'New Patient Data.csv')['PATIENTID'].tolist()
+
+    def journal_lines(self, handler):
+        with open(handler.journal_path) as file:
+            return file.read().splitlines()
+
+    def test_building_a_handler_leaves_the_data_folder_alone(self, data_dir):
+        leftovers = [data_dir / 'Appointment Data.csv.tmp', data_dir / '.appointment_journal.jsonl']
+        for path in leftovers:
+            path.write_text('left by a crash\n')
+
+        AppointmentDataHandler(str(data_dir / 'Appointment Data.csv'), str(data_dir / 'New Patient Data.csv'))
+
+        assert all(path.read_text() == 'left by a crash\n' for path in leftovers)
+
+    def test_commits_append_to_the_journal_until_compacted(self, data_dir):
+        handler = self.handler(data_dir)
+        handler.update_appointment_data_table(501, time_slot('2025-01-02 09:00'), 10)
+        assert handler.commit()
+        handler.update_appointment_data_table(502, time_slot('2025-01-02 10:30'), 11)
+        assert handler.commit()
+
+        # The tables are untouched; each commit added one line
+        assert self.appointment_ids(data_dir) == [500]
+        assert self.new_patient_ids(data_dir) == [10, 11, 12]
+        assert len(self.journal_lines(handler)) == 2
+
+        assert handler.compact()
+        assert (data_dir / 'Appointment Data.csv').read_text() == APPOINTMENT_HEADER + \
+            '500,2025-01-03,04:00 PM,60,1\n501,2025-01-02,09:00 AM,60,7\n502,2025-01-02,10:30 AM,60,7\n'
+        assert self.new_patient_ids(data_dir) == [12]
+        assert not os.path.exists(handler.journal_path)
+        assert not os.path.exists(handler.compaction_path)
+
+    def test_cancellations_are_applied_by_the_compaction(self, data_dir):
+        handler = self.handler(data_dir)
+        handler.update_appointment_data_table(501, time_slot('2025-01-02 09:00'), 10)
+        handler.update_appointment_data_table(502, time_slot('2025-01-02 10:00'), 11)
+        assert handler.commit()
+
+        # A journaled booking and one already in the table are cancelled; patient 10 is new again
+        handler.cancel_appointment(501, 10)
+        handler.cancel_appointment(500)
+        assert handler.commit()
+        assert handler.compact()
+
+        assert self.appointment_ids(data_dir) == [502]
+        assert self.new_patient_ids(data_dir) == [10, 12]
+
+    def test_a_cancellation_leaves_the_other_rows_byte_for_byte(self, data_dir):
+        # Hand-edited rows: a quoted id, padding, Windows line endings and a missing final newline
+        rows = ['"500",2025-01-03,04:00 PM,60,1\r\n', '5000,2025-01-04, 09:00 AM ,60,1\r\n',
+                '501,2025-01-04,10:00 AM,60.0,2\r\n', '50,2025-01-05,11:00 AM,60,3']
+        (data_dir / 'Appointment Data.csv').write_bytes((APPOINTMENT_HEADER + ''.join(rows)).encode())
+        handler = self.handler(data_dir)
+
+        handler.cancel_appointment(500)
+        handler.cancel_appointment(501)
+        handler.update_appointment_data_table(502, time_slot('2025-01-02 09:00'), 10)
+        assert handler.compact()
+
+        assert (data_dir / 'Appointment Data.csv').read_bytes() == \
+            (APPOINTMENT_HEADER + rows[1] + rows[3] + '\n502,2025-01-02,09:00 AM,60,7\n').encode()
+
+    def test_cancelling_an_appended_row_keeps_the_high_water_mark(self, data_dir, tmp_path):
+        appointment_data_path = str(data_dir / 'Appointment Data.csv')
+        (data_dir / 'Appointment Data.csv').write_bytes((APPOINTMENT_HEADER + '"500",2025-01-03,04:00 PM,60,1\r\n').encode())
+        cache = SnapshotCache(str(tmp_path / 'cache'))
+        mark = cache.high_water_mark(appointment_data_path, os.path.getsize(appointment_data_path), 500)
+        handler = self.handler(data_dir)
+        handler.update_appointment_data_table(501, time_slot('2025-01-02 09:00'), 10)
+        handler.update_appointment_data_table(502, time_slot('2025-01-02 10:00'), 11)
+        assert handler.compact()
+
+        handler.cancel_appointment(501)
+        assert handler.compact()
+
+        assert self.appointment_ids(data_dir) == [500, 502]
+        assert cache.high_water_mark(appointment_data_path, mark['offset'], 500) == mark
+
+    def test_a_record_cut_short_by_a_crash_is_ignored(self, data_dir):
+        handler = self.handler(data_dir)
+        handler.update_appointment_data_table(501, time_slot('2025-01-02 09:00'), 10)
+        assert handler.commit()
+        with open(handler.journal_path, 'a') as file:
+            file.write('{"appointments": [["502", "2025-01-02"')
+
+        # A later record still lands on a line of its own
+        handler.update_appointment_data_table(503, time_slot('2025-01-02 11:00'), 11)
+        assert handler.commit()
+        assert len(self.journal_lines(handler)) == 3
+
+        assert handler.compact()
+        assert self.appointment_ids(data_dir) == [500, 501, 503]
+
+    def test_recover_applies_the_journal_of_an_interrupted_run(self, data_dir):
+        interrupted = self.handler(data_dir)
+        interrupted.update_appointment_data_table(501, time_slot('2025-01-02 09:00'), 10)
+        interrupted.update_appointment_data_table(502, time_slot('2025-01-02 10:00'), 11)
+        assert interrupted.commit()
+        interrupted.cancel_appointment(502, 11)
+        assert interrupted.commit()
+        # The run dies before compacting
+
+        AppointmentDataHandler(str(data_dir / 'Appointment Data.csv'), str(data_dir / 'New Patient Data.csv')).recover()
+
+        assert self.appointment_ids(data_dir) == [500, 501]
+        assert self.new_patient_ids(data_dir) == [11, 12]
+        assert not os.path.exists(interrupted.journal_path)
+
+    def test_recover_finishes_a_compaction_interrupted_during_the_renames(self, data_dir, monkeypatch):
+        handler = self.handler(data_dir)
+        handler.update_appointment_data_table(501, time_slot('2025-01-02 09:00'), 10)
+        replace = os.replace
+
+        def crash_on_the_new_patients(source, destination):
+            if str(destination).endswith('New Patient Data.csv'):
+                raise OSError('disk went away')
+            replace(source, destination)
+        monkeypatch.setattr(os, 'replace', crash_on_the_new_patients)
+
+        # The appointments were renamed into place, the new patients were not
+        assert not handler.compact()
+        assert self.appointment_ids(data_dir) == [500, 501]
+        assert self.new_patient_ids(data_dir) == [10, 11, 12]
+
+        monkeypatch.setattr(os, 'replace', replace)
+        AppointmentDataHandler(str(data_dir / 'Appointment Data.csv'), str(data_dir / 'New Patient Data.csv')).recover()
+
+        # The journal is not replayed over the renamed table
+        assert self.appointment_ids(data_dir) == [500, 501]
+        assert self.new_patient_ids(data_dir) == [11, 12]
+        assert not os.path.exists(handler.journal_path)
+        assert not os.path.exists(handler.compaction_path)
+
+    def test_recover_discards_the_temporary_files_of_an_unjournaled_compaction(self, data_dir):
+        handler = self.handler(data_dir)
+        handler.update_appointment_data_table(501, time_slot('2025-01-02 09:00'), 10)
+        assert handler.commit()
+        (data_dir / 'Appointment Data.csv.tmp').write_text(APPOINTMENT_HEADER)
+
+        handler.recover()
+
+        assert not os.path.exists(data_dir / 'Appointment Data.csv.tmp')
+        assert self.appointment_ids(data_dir) == [500, 501]
@@ -0,0 +1,87 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+import pandas as pd
+
+from scheduling.appointment_id_allocator import AppointmentIdAllocator
+
+def allocate(sequence_file, count):
+    """Hands out ids from a fresh allocator, as another run sharing the sequence file would."""
+    allocator = AppointmentIdAllocator(pd.DataFrame({'APPOINTMENTID': [500]}), sequence_file, block_size=7)
+    return [allocator.next_id() for _ in range(count)]
+
+class TestAppointmentIdAllocator:
+
+    @pytest.fixture
+    def appointment_df(self):
+        return pd.DataFrame({'APPOINTMENTID': [12, 500, 40]})
+
+    def read_sequence(self, sequence_file):
+        with open(sequence_file) as file:
+            return int(file.read())
+
+    def test_ids_count_up_from_the_highest_loaded_id(self, appointment_df):
+        allocator = AppointmentIdAllocator(appointment_df)
+
+        assert allocator.peek_next_id() == 501
+        assert [allocator.next_id() for _ in range(3)] == [501, 502, 503]
+        assert AppointmentIdAllocator().next_id() == 1
+
+    def test_a_block_is_reserved_in_the_sequence_file_before_it_is_used(self, appointment_df, tmp_path):
+        sequence_file = str(tmp_path / 'sequence' / 'appointment_id.seq')
+        allocator = AppointmentIdAllocator(appointment_df, sequence_file, block_size=10)
+
+        assert allocator.next_id() == 501
+        assert self.read_sequence(sequence_file) == 510
+        assert [allocator.next_id() for _ in range(9)] == list(range(502, 511))
+        assert self.read_sequence(sequence_file) == 510
+
+        # The eleventh id needs the next block
+        assert allocator.next_id() == 511
+        assert self.read_sequence(sequence_file) == 520
+
+    def test_a_resumed_run_continues_after_the_reserved_block(self, appointment_df, tmp_path):
+        sequence_file = str(tmp_path / 'appointment_id.seq')
+        first_run = AppointmentIdAllocator(appointment_df, sequence_file, block_size=10)
+        first_ids = [first_run.next_id() for _ in range(3)]
+
+        # The appointment data only holds the ids that were written; the file remembers the whole block
+        resumed_df = pd.concat([appointment_df, pd.DataFrame({'APPOINTMENTID': first_ids[:1]})])
+        resumed_run = AppointmentIdAllocator(resumed_df, sequence_file, block_size=10)
+
+        assert resumed_run.next_id() == 511
+        assert self.read_sequence(sequence_file) == 520
+
+    def test_loaded_ids_above_the_sequence_file_win(self, tmp_path):
+        sequence_file = tmp_path / 'appointment_id.seq'
+        sequence_file.write_text('100\n')
+        allocator = AppointmentIdAllocator(pd.DataFrame({'APPOINTMENTID': [900]}), str(sequence_file), block_size=10)
+
+        assert allocator.next_id() == 901
+        assert self.read_sequence(sequence_file) == 910
+
+    def test_two_allocators_sharing_a_file_never_collide(self, appointment_df, tmp_path):
+        sequence_file = str(tmp_path / 'appointment_id.seq')
+        first = AppointmentIdAllocator(appointment_df, sequence_file, block_size=4)
+        second = AppointmentIdAllocator(appointment_df, sequence_file, block_size=4)
+
+        ids = []
+        for _ in range(10):
+            ids.extend([first.next_id(), second.next_id(), second.next_id()])
+
+        assert len(set(ids)) == len(ids)
+        assert min(ids) == 501
+        assert max(ids) <= self.read_sequence(sequence_file)
+
+    def test_processes_sharing_a_file_never_collide(self, tmp_path):
+        sequence_file = str(tmp_path / 'appointment_id.seq')
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            runs = list(executor.map(allocate, [sequence_file] * 8, [25] * 8))
+
+        ids = [new_appointment_id for run in runs for new_appointment_id in run]
+        assert len(set(ids)) == len(ids) == 200
+        assert self.read_sequence(sequence_file) >= max(ids)
+
+    def test_block_size_must_be_positive(self):
+        with pytest.raises(ValueError):
+            AppointmentIdAllocator(block_size=0)
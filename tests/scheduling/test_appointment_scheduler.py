@@ -0,0 +1,139 @@
+import pytest
+import pandas as pd
+
+from analysis.analysis import Analysis
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.appointment_data_handler import AppointmentDataHandler
+from scheduling.appointment_id_allocator import AppointmentIdAllocator
+from scheduling.appointment_scheduler import AppointmentScheduler
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+
+class TestAppointmentCancellation:
+
+    @pytest.fixture
+    def tracker(self):
+        tracker = NewAppointmentTracker()
+        tracker.reset()
+        yield tracker
+        tracker.reset()
+
+    @pytest.fixture
+    def calendar(self):
+        rows = []
+        for state in ['CT', 'NY']:
+            for day in ['2025-01-02', '2025-01-03']:
+                for hour in range(9, 17):
+                    start = pd.Timestamp(f'{day} {hour:02d}:00')
+                    rows.append({
+                        'PROVIDERID': 1,
+                        'STATE': state,
+                        'DATE': pd.Timestamp(day),
+                        'START_DATETIME': start,
+                        'END_DATETIME': start + pd.Timedelta(hours=1),
+                        'TIME_RANGE': pd.Timedelta(hours=1),
+                        'APPOINTMENTID': 500 if start == pd.Timestamp('2025-01-03 16:00') else None
+                    })
+        return ProviderCalendar.from_frame(pd.DataFrame(rows))
+
+    @pytest.fixture
+    def scheduler(self, tracker, calendar, tmp_path):
+        appointment_data_path = tmp_path / 'Appointment Data.csv'
+        appointment_data_path.write_text('APPOINTMENTID,APPOINTMENTDATE,APPOINTMENTSTARTTIME,APPOINTMENTDURATION,PROVIDERID\n'
+                                         '500,2025-01-03,04:00 PM,60,1\n')
+        handler = AppointmentDataHandler(str(appointment_data_path), str(tmp_path / 'New Patient Data.csv'))
+        scheduler = AppointmentScheduler(tracker, Analysis(), AppointmentIdAllocator(pd.DataFrame({'APPOINTMENTID': [500]})),
+                                         handler)
+        scheduler.load_calendar(calendar)
+        return scheduler
+
+    def book_patients(self, scheduler, calendar, patient_ids):
+        appointment_ids = {}
+        for patient_id in patient_ids:
+            new_patient = pd.Series({'PATIENTID': patient_id, 'STATE': 'CT', 'REGISTRATIONDATE': '2025-01-01', 'PROGRAM': 'SUD'})
+            available_time_slot = scheduler.find_earliest_appointment(new_patient)
+            calendar, appointment_ids[patient_id] = scheduler.book_appointment(new_patient, calendar, available_time_slot)
+        return calendar, appointment_ids
+
+    def booked_start(self, calendar, appointment_id):
+        calendar_df = calendar.to_frame(booked_only=True)
+        return set(calendar_df.loc[calendar_df['APPOINTMENTID'] == appointment_id, 'START_DATETIME'])
+
+    def test_cancel_promotes_waiting_patient(self, scheduler, tracker, calendar, tmp_path):
+        calendar, appointment_ids = self.book_patients(scheduler, calendar, range(1, 7))
+        waiting_patient = pd.Series({'PATIENTID': 7, 'STATE': 'NY', 'REGISTRATIONDATE': '2025-01-01', 'PROGRAM': 'SUD'})
+        waiting_patients = [waiting_patient]
+
+        calendar, cancelled_patient, promotions = scheduler.cancel_appointment(
+            appointment_ids[1], calendar, promote=True, waiting_patients=waiting_patients)
+
+        assert cancelled_patient['PATIENTID'] == 1
+        assert waiting_patients == []
+        (patient_id, appointment_id), = promotions
+        assert patient_id == 7
+        # Both state rows of the released timeslot now hold the promoted appointment
+        calendar_df = calendar.to_frame(booked_only=True)
+        assert len(calendar_df[calendar_df['APPOINTMENTID'] == appointment_id]) == 2
+        assert self.booked_start(calendar, appointment_id) == {pd.Timestamp('2025-01-02 09:00')}
+        assert tracker.get_provider_by_date(1, pd.Timestamp('2025-01-02')) == 5
+        assert sorted(scheduler.analysis.ttfa.patient_ids_booked()) == [2, 3, 4, 5, 6, 7]
+
+    def test_cancel_moves_booked_patient_forward(self, scheduler, tracker, calendar, tmp_path):
+        calendar, appointment_ids = self.book_patients(scheduler, calendar, range(1, 7))
+        assert self.booked_start(calendar, appointment_ids[6]) == {pd.Timestamp('2025-01-03 09:00')}
+
+        calendar, _, promotions = scheduler.cancel_appointment(appointment_ids[2], calendar, promote=True)
+
+        (patient_id, appointment_id), = promotions
+        assert patient_id == 6
+        assert self.booked_start(calendar, appointment_id) == {pd.Timestamp('2025-01-02 10:00')}
+        assert (calendar.appointment_ids == appointment_ids[6]).sum() == 0
+        assert tracker.get_provider_by_date(1, pd.Timestamp('2025-01-02')) == 5
+        assert tracker.get_provider_by_date(1, pd.Timestamp('2025-01-03')) == 0
+        assert scheduler.free_slot_index.is_free(1, pd.Timestamp('2025-01-03 09:00').value)
+
+        # An existing appointment is released without touching the daily limit
+        calendar, cancelled_patient, _ = scheduler.cancel_appointment(500, calendar)
+        assert cancelled_patient is None
+        assert scheduler.free_slot_index.is_free(1, pd.Timestamp('2025-01-03 16:00').value)
+        assert tracker.get_provider_by_date(1, pd.Timestamp('2025-01-03')) == 0
+
+        assert scheduler.appointment_data_handler.compact()
+        appointment_data_df = pd.read_csv(tmp_path / 'Appointment Data.csv')
+        assert sorted(appointment_data_df['APPOINTMENTID']) == \
+            sorted([appointment_ids[1], appointment_ids[3], appointment_ids[4], appointment_ids[5], appointment_id])
+
+    def test_window_appointments_keep_the_bookkeeping_in_sync(self, scheduler, tracker, calendar, tmp_path):
+        def new_patient(patient_id):
+            return pd.Series({'PATIENTID': patient_id, 'STATE': 'CT', 'REGISTRATIONDATE': '2025-01-01', 'PROGRAM': 'SUD'})
+
+        start, provider_id = scheduler.find_earliest_window(new_patient(1), calendar, 90)
+        assert (start, provider_id) == (pd.Timestamp('2025-01-02 09:00').value, 1)
+        calendar, window_appointment_id = scheduler.book_window_appointment(new_patient(1), calendar, provider_id, start, 90)
+
+        # Both timeslots the appointment overlaps are taken; the daily limit counts it once
+        assert not scheduler.free_slot_index.is_free(1, pd.Timestamp('2025-01-02 09:00').value)
+        assert not scheduler.free_slot_index.is_free(1, pd.Timestamp('2025-01-02 10:00').value)
+        assert tracker.get_provider_by_date(1, pd.Timestamp('2025-01-02')) == 1
+        calendar, appointment_ids = self.book_patients(scheduler, calendar, range(2, 6))
+        assert self.booked_start(calendar, appointment_ids[2]) == {pd.Timestamp('2025-01-02 11:00')}
+
+        # 15:00 to 17:00 is open on the 2nd, but the provider is at the daily limit
+        start, provider_id = scheduler.find_earliest_window(new_patient(6), calendar, 90)
+        assert start == pd.Timestamp('2025-01-03 09:00').value
+        calendar, later_window_appointment_id = scheduler.book_window_appointment(new_patient(6), calendar, provider_id, start, 90)
+        with pytest.raises(ValueError):
+            scheduler.book_window_appointment(new_patient(7), calendar, 1, pd.Timestamp('2025-01-03 10:30').value, 60)
+
+        # The released run is offered to single-timeslot appointments only
+        calendar, _, promotions = scheduler.cancel_appointment(window_appointment_id, calendar, promote=True, max_promotions=1)
+        assert [patient_id for patient_id, _ in promotions] == [5]
+        assert (calendar.appointment_ids == later_window_appointment_id).sum() == 2
+        assert scheduler.free_slot_index.is_free(1, pd.Timestamp('2025-01-02 10:00').value)
+        assert tracker.get_provider_by_date(1, pd.Timestamp('2025-01-02')) == 4
+        assert tracker.get_provider_by_date(1, pd.Timestamp('2025-01-03')) == 1
+        assert sorted(scheduler.analysis.ttfa.patient_ids_booked()) == [2, 3, 4, 5, 6]
+
+        assert scheduler.appointment_data_handler.compact()
+        appointment_data_df = pd.read_csv(tmp_path / 'Appointment Data.csv').set_index('APPOINTMENTID')
+        assert window_appointment_id not in appointment_data_df.index
+        assert appointment_data_df.loc[later_window_appointment_id, 'APPOINTMENTDURATION'] == 90
@@ -0,0 +1,174 @@
+import random
+
+import pytest
+import pandas as pd
+
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.batch_optimizer import BatchOptimizer
+from scheduling.free_slot_index import FreeSlotIndex, NS_PER_DAY
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+
+def build_index(slots, licences):
+    """slots: (provider_id, start) pairs; licences: (provider_id, state) pairs."""
+    slots_df = pd.DataFrame({'PROVIDERID': [provider_id for provider_id, _ in slots],
+                             'START_DATETIME': [pd.Timestamp(start) for _, start in slots],
+                             'END_DATETIME': [pd.Timestamp(start) + pd.Timedelta(minutes=30) for _, start in slots],
+                             'APPOINTMENTID': [None] * len(slots)})
+    licences_df = pd.DataFrame(licences, columns=['PROVIDERID', 'STATE'])
+    return FreeSlotIndex(ProviderCalendar.from_slots(slots_df, licences_df))
+
+def build_patients(patients):
+    """patients: (state, registration) pairs, returned in first-come-first-served order."""
+    patient_df = pd.DataFrame(patients, columns=['STATE', 'REGISTRATIONDATE'])
+    patient_df['REGISTRATIONDATE'] = pd.to_datetime(patient_df['REGISTRATIONDATE'])
+    return patient_df.sort_values('REGISTRATIONDATE', kind='stable').reset_index(drop=True)
+
+def ttfas(assignments, patient_df):
+    registration = patient_df['REGISTRATIONDATE'].to_numpy(dtype='datetime64[ns]').view('int64')
+    return [start - int(registration[position]) for position, (start, _) in assignments.items()]
+
+def objective_key(objective, ttfa_list):
+    """Smaller is better: more patients booked first, then the objective."""
+    if objective == 'total':
+        return (-len(ttfa_list), sum(ttfa_list))
+    return (-len(ttfa_list), max(ttfa_list, default=0), sum(ttfa_list))
+
+def brute_force(free_slot_index, tracker, patient_df, objective):
+    """The best objective key over every valid assignment of patients to open slots."""
+    registration = patient_df['REGISTRATIONDATE'].to_numpy(dtype='datetime64[ns]').view('int64').tolist()
+    states = patient_df['STATE'].tolist()
+    keys = sorted(set(free_slot_index.iter_open_keys()))
+    remaining = {}
+    for start, provider_id in keys:
+        remaining[(provider_id, start // NS_PER_DAY)] = NewAppointmentTracker.MAX_NEW_APPOINTMENTS_PER_DAY - \
+            int(tracker.get_counts([provider_id], [start // NS_PER_DAY])[0])
+    best = [objective_key(objective, [])]
+    taken = set()
+
+    def search(patient, ttfa_list):
+        if patient == len(states):
+            best[0] = min(best[0], objective_key(objective, ttfa_list))
+            return
+        search(patient + 1, ttfa_list)
+        earliest_start = (registration[patient] // NS_PER_DAY + 1) * NS_PER_DAY
+        for start, provider_id in keys:
+            provider_day = (provider_id, start // NS_PER_DAY)
+            if start < earliest_start or (start, provider_id) in taken or remaining[provider_day] <= 0 or \
+                    states[patient] not in free_slot_index.provider_states[provider_id]:
+                continue
+            taken.add((start, provider_id))
+            remaining[provider_day] -= 1
+            search(patient + 1, ttfa_list + [start - registration[patient]])
+            remaining[provider_day] += 1
+            taken.discard((start, provider_id))
+
+    search(0, [])
+    return best[0]
+
+def random_instance(randomizer, tracker):
+    slots, licences = [], []
+    for provider_id in (1, 2, 3):
+        for state in randomizer.choice([['CT'], ['NY'], ['CT', 'NY']]):
+            licences.append((provider_id, state))
+        for day in ('2025-01-02', '2025-01-03'):
+            for hour in randomizer.sample(range(9, 17), randomizer.randint(0, 2)):
+                slots.append((provider_id, f'{day} {hour:02d}:{randomizer.choice(["00", "30"])}'))
+            # Most provider/days are already close to the daily limit
+            for _ in range(randomizer.choice([0, 3, 4, 4, 5])):
+                tracker.increment_provider_appointments(provider_id, pd.Timestamp(day))
+    patients = [(randomizer.choice(['CT', 'NY']),
+                 pd.Timestamp(randomizer.choice(['2024-12-31', '2025-01-01', '2025-01-02'])) +
+                 pd.Timedelta(minutes=randomizer.randrange(0, 24 * 60, 15)))
+                for _ in range(4)]
+    return build_index(slots, licences), build_patients(patients)
+
+def assert_valid(plan, free_slot_index, tracker, patient_df):
+    """Every slot is used once, in the patient's state, after registration and within the daily limit."""
+    registration = patient_df['REGISTRATIONDATE'].to_numpy(dtype='datetime64[ns]').view('int64')
+    used = list(plan['assignments'].values())
+    assert len(set(used)) == len(used)
+    per_provider_day = {}
+    for position, (start, provider_id) in plan['assignments'].items():
+        assert patient_df['STATE'][position] in free_slot_index.provider_states[provider_id]
+        assert start // NS_PER_DAY > registration[position] // NS_PER_DAY
+        provider_day = (provider_id, start // NS_PER_DAY)
+        per_provider_day[provider_day] = per_provider_day.get(provider_day, 0) + 1
+    for (provider_id, day), booked in per_provider_day.items():
+        assert booked + tracker.get_counts([provider_id], [day])[0] <= NewAppointmentTracker.MAX_NEW_APPOINTMENTS_PER_DAY
+
+class TestBatchOptimizer:
+
+    @pytest.fixture
+    def tracker(self):
+        tracker = NewAppointmentTracker()
+        tracker.reset()
+        yield tracker
+        tracker.reset()
+
+    @pytest.mark.parametrize('objective', BatchOptimizer.OBJECTIVES)
+    def test_plan_matches_a_brute_force_optimum(self, tracker, objective):
+        randomizer = random.Random(11)
+        for _ in range(40):
+            tracker.reset()
+            free_slot_index, patient_df = random_instance(randomizer, tracker)
+
+            plan = BatchOptimizer(free_slot_index, tracker, objective).plan(patient_df)
+
+            assert plan['engine'] == f'optimal ({objective})'
+            assert_valid(plan, free_slot_index, tracker, patient_df)
+            assert objective_key(objective, ttfas(plan['assignments'], patient_df)) == \
+                brute_force(free_slot_index, tracker, patient_df, objective)
+
+    def test_max_objective_trades_total_for_the_worst_wait(self, tracker):
+        # The CT patient can take the 6:00 or the 11:00 slot, the NY patient the 6:00 or the 16:00 slot
+        free_slot_index = build_index([(1, '2025-01-02 06:00'), (2, '2025-01-02 11:00'), (3, '2025-01-02 16:00')],
+                                      [(1, 'CT'), (1, 'NY'), (2, 'CT'), (3, 'NY')])
+        patient_df = build_patients([('CT', '2025-01-01 00:00'), ('NY', '2025-01-01 20:00')])
+
+        total = BatchOptimizer(free_slot_index, tracker, 'total').plan(patient_df)
+        worst = BatchOptimizer(free_slot_index, tracker, 'max').plan(patient_df)
+
+        assert (total['total_ttfa_hours'], total['max_ttfa_hours']) == (45.0, 35.0)
+        assert (worst['total_ttfa_hours'], worst['max_ttfa_hours']) == (50.0, 30.0)
+
+    @pytest.mark.parametrize('objective', BatchOptimizer.OBJECTIVES)
+    def test_the_daily_limit_caps_each_provider_day(self, tracker, objective):
+        free_slot_index = build_index([(1, f'2025-01-02 {hour:02d}:00') for hour in range(9, 17)], [(1, 'CT')])
+        patient_df = build_patients([('CT', '2025-01-01')] * 7)
+
+        plan = BatchOptimizer(free_slot_index, tracker, objective).plan(patient_df)
+        assert plan['scheduled'] == NewAppointmentTracker.MAX_NEW_APPOINTMENTS_PER_DAY
+        # The earliest slots of the provider/day are the ones used
+        assert sorted(start for start, _ in plan['assignments'].values()) == \
+            [pd.Timestamp(f'2025-01-02 {hour:02d}:00').value for hour in range(9, 14)]
+
+        # Appointments already booked that day count against the limit
+        for _ in range(3):
+            tracker.increment_provider_appointments(1, pd.Timestamp('2025-01-02'))
+        assert BatchOptimizer(free_slot_index, tracker, objective).plan(patient_df)['scheduled'] == 2
+
+    @pytest.mark.parametrize('options', [{'max_units': 0}, {'time_limit': 0}])
+    def test_falls_back_to_the_greedy_heuristic(self, tracker, options):
+        randomizer = random.Random(5)
+        free_slot_index, patient_df = random_instance(randomizer, tracker)
+        optimizer = BatchOptimizer(free_slot_index, tracker, 'max', **options)
+
+        plan = optimizer.plan(patient_df)
+
+        assert plan['engine'] == 'greedy fallback'
+        assert plan['assignments'] == optimizer.plan_greedy(patient_df)['assignments']
+        assert_valid(plan, free_slot_index, tracker, patient_df)
+
+    def test_greedy_books_first_come_first_served(self, tracker):
+        free_slot_index = build_index([(1, '2025-01-02 09:00'), (1, '2025-01-02 10:00')], [(1, 'CT')])
+        patient_df = build_patients([('CT', '2025-01-01 08:00'), ('CT', '2025-01-01 07:00'), ('CT', '2025-01-01 09:00')])
+
+        plan = BatchOptimizer(free_slot_index, tracker).plan_greedy(patient_df)
+
+        assert plan['engine'] == 'greedy'
+        assert plan['assignments'] == {0: (pd.Timestamp('2025-01-02 09:00').value, 1),
+                                       1: (pd.Timestamp('2025-01-02 10:00').value, 1)}
+
+    def test_unknown_objective_is_rejected(self, tracker):
+        with pytest.raises(ValueError):
+            BatchOptimizer(build_index([(1, '2025-01-02 09:00')], [(1, 'CT')]), tracker, 'median')
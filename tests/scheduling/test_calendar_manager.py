@@ -70,4 +70,52 @@
 #         })
 
 #         result_df = calendar_manager.update_calendar(new_appointment_id, new_appointment, current_calendar_df)
-#         pd.testing.assert_frame_equal(result_df, expected_df)
\ No newline at end of file
+#         pd.testing.assert_frame_equal(result_df, expected_df)
+
+
+import pytest
+import pandas as pd
+
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.calendar_manager import CalendarManager
+
+class TestCalendarManagerUpdate:
+
+    @pytest.fixture
+    def calendar(self):
+        rows = []
+        for provider_id, state in [(1, 'CT'), (1, 'NY'), (2, 'CT')]:
+            for start in ['2025-01-02 09:00', '2025-01-02 10:00']:
+                rows.append({
+                    'PROVIDERID': provider_id,
+                    'STATE': state,
+                    'DATE': '2025-01-02',
+                    'START_DATETIME': pd.Timestamp(start),
+                    'END_DATETIME': pd.Timestamp(start) + pd.Timedelta(hours=1),
+                    'APPOINTMENTID': None
+                })
+        return ProviderCalendar.from_frame(pd.DataFrame(rows))
+
+    def test_update_calendar_books_every_state_row(self, calendar):
+        calendar_manager = CalendarManager()
+        new_appointment = pd.Series({'PROVIDERID': 1, 'DATE': '2025-01-02', 'START_DATETIME': '2025-01-02 10:00'})
+
+        updated_calendar = calendar_manager.update_calendar(7, new_appointment, calendar)
+
+        assert updated_calendar.booked_count() == 1
+        calendar_df = updated_calendar.to_frame()
+        booked = calendar_df[calendar_df['APPOINTMENTID'].notna()]
+        assert booked[['PROVIDERID', 'STATE']].values.tolist() == [[1, 'CT'], [1, 'NY']]
+        assert (booked['START_DATETIME'] == pd.Timestamp('2025-01-02 10:00')).all()
+        with pytest.raises(ValueError):
+            calendar_manager.update_calendar(8, new_appointment, updated_calendar)
+
+    def test_release_appointment_frees_the_timeslot(self, calendar):
+        calendar_manager = CalendarManager()
+        new_appointment = pd.Series({'PROVIDERID': 1, 'DATE': '2025-01-02', 'START_DATETIME': '2025-01-02 09:00'})
+        calendar_manager.update_calendar(7, new_appointment, calendar)
+
+        released = calendar_manager.release_appointment(7, calendar)
+
+        assert released == [(pd.Timestamp('2025-01-02 09:00').value, 1)]
+        assert calendar.booked_count() == 0
@@ -0,0 +1,60 @@
+import pytest
+import pandas as pd
+
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.component_scheduler import ComponentScheduler, find_components
+from scheduling.free_slot_index import FreeSlotIndex
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+
+class TestComponentScheduler:
+
+    @pytest.fixture
+    def tracker(self):
+        tracker = NewAppointmentTracker()
+        tracker.reset()
+        yield tracker
+        tracker.reset()
+
+    @pytest.fixture
+    def calendar(self):
+        # Providers 1 and 2 share CT, provider 2 also covers NY; provider 3 only covers TX
+        licences = [(1, 'CT'), (2, 'CT'), (2, 'NY'), (3, 'TX')]
+        rows = []
+        for provider_id, state in licences:
+            for day in ['2025-01-02', '2025-01-03']:
+                for hour in range(9, 17):
+                    start = pd.Timestamp(f'{day} {hour:02d}:00')
+                    rows.append({
+                        'PROVIDERID': provider_id,
+                        'STATE': state,
+                        'DATE': pd.Timestamp(day),
+                        'START_DATETIME': start,
+                        'END_DATETIME': start + pd.Timedelta(hours=1),
+                        'TIME_RANGE': pd.Timedelta(hours=1),
+                        'APPOINTMENTID': None
+                    })
+        return ProviderCalendar.from_frame(pd.DataFrame(rows))
+
+    def test_find_components(self, calendar):
+        components = find_components(calendar)
+
+        assert components == [{'states': {'CT', 'NY'}, 'providers': {1, 2}},
+                              {'states': {'TX'}, 'providers': {3}}]
+
+    def test_parallel_plan_matches_serial_greedy(self, tracker, calendar):
+        patients_df = pd.DataFrame({
+            'STATE': ['CT', 'TX', 'NY', 'CT', 'TX', 'CT', 'NY', 'WA'] * 3,
+            'REGISTRATIONDATE': pd.to_datetime(['2025-01-01'] * 24)
+        })
+
+        plan = ComponentScheduler(tracker, workers=2).plan(calendar, patients_df)
+
+        free_slot_index = FreeSlotIndex(calendar)
+        for (earliest_slot, _), state in zip(plan, patients_df['STATE']):
+            expected = free_slot_index.earliest_free_slot(state, pd.Timestamp('2025-01-02').value, tracker.has_capacity)
+            assert earliest_slot == expected
+            if expected is not None:
+                start, provider_id = expected
+                free_slot_index.remove_slot(provider_id, start)
+                tracker.increment_provider_appointments(provider_id, pd.Timestamp(start))
+        assert sum(earliest_slot is not None for earliest_slot, _ in plan) == 21
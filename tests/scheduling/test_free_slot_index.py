@@ -0,0 +1,155 @@
+import random
+
+import pytest
+import pandas as pd
+
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.free_slot_index import FreeSlotIndex, NS_PER_DAY
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+
+def ns(timestamp):
+    return pd.Timestamp(timestamp).value
+
+class TestFreeSlotIndex:
+
+    @pytest.fixture
+    def tracker(self):
+        tracker = NewAppointmentTracker()
+        tracker.reset()
+        yield tracker
+        tracker.reset()
+
+    @pytest.fixture
+    def calendar(self):
+        # Providers 1 and 2 are licensed in CT, provider 2 also in NY; each has 9:00 to 16:00 on two days
+        starts = [(provider_id, pd.Timestamp(f'{day} {hour:02d}:00'))
+                  for provider_id in (1, 2) for day in ('2025-01-02', '2025-01-03') for hour in range(9, 17)]
+        slots_df = pd.DataFrame({'PROVIDERID': [provider_id for provider_id, _ in starts],
+                                 'START_DATETIME': [start for _, start in starts],
+                                 'END_DATETIME': [start + pd.Timedelta(hours=1) for _, start in starts],
+                                 'APPOINTMENTID': [None] * len(starts)})
+        licences_df = pd.DataFrame({'PROVIDERID': [1, 2, 2], 'STATE': ['CT', 'CT', 'NY']})
+        return ProviderCalendar.from_slots(slots_df, licences_df)
+
+    def book(self, free_slot_index, tracker, state, after):
+        earliest_slot = free_slot_index.earliest_free_slot(state, after, tracker.has_capacity)
+        if earliest_slot is not None:
+            start, provider_id = earliest_slot
+            free_slot_index.remove_slot(provider_id, start)
+            tracker.increment_provider_appointments(provider_id, pd.Timestamp(start))
+        return earliest_slot
+
+    def test_earliest_free_slot_breaks_ties_on_provider_id(self, calendar):
+        free_slot_index = FreeSlotIndex(calendar)
+
+        assert free_slot_index.earliest_free_slot('CT', ns('2025-01-02 09:30')) == (ns('2025-01-02 10:00'), 1)
+        assert free_slot_index.earliest_free_slot('NY', ns('2025-01-02')) == (ns('2025-01-02 09:00'), 2)
+        assert free_slot_index.earliest_free_slot('CT', ns('2025-01-03 16:30')) is None
+        assert free_slot_index.earliest_free_slot('TX', ns('2025-01-02')) is None
+
+    def test_remove_and_add_slot_keep_every_state_in_sync(self, calendar):
+        free_slot_index = FreeSlotIndex(calendar)
+        start = ns('2025-01-02 09:00')
+
+        free_slot_index.remove_slot(1, start)
+        free_slot_index.remove_slot(2, start)
+        assert free_slot_index.earliest_free_slot('CT', start) == (ns('2025-01-02 10:00'), 1)
+        assert free_slot_index.earliest_free_slot('NY', start) == (ns('2025-01-02 10:00'), 2)
+        assert not free_slot_index.is_free(2, start)
+
+        free_slot_index.add_slot(2, start)
+        free_slot_index.add_slot(2, start)
+        assert free_slot_index.earliest_free_slot('CT', start) == (start, 2)
+        assert free_slot_index.earliest_free_slot('NY', start) == (start, 2)
+        assert list(free_slot_index.iter_free_slots('NY', start))[:2] == [(start, 2), (ns('2025-01-02 10:00'), 2)]
+
+    def test_a_day_with_no_slots_left_is_skipped(self, calendar):
+        free_slot_index = FreeSlotIndex(calendar)
+        for hour in range(9, 17):
+            free_slot_index.remove_slot(2, ns(f'2025-01-02 {hour:02d}:00'))
+
+        assert free_slot_index.days_by_state['NY'] == [ns('2025-01-03') // NS_PER_DAY]
+        assert free_slot_index.earliest_free_slot('NY', ns('2025-01-02')) == (ns('2025-01-03 09:00'), 2)
+
+    def test_a_full_provider_day_is_closed_and_not_scanned_again(self, calendar, tracker):
+        free_slot_index = FreeSlotIndex(calendar)
+        checked = []
+
+        def has_capacity(provider_ids, days):
+            checked.extend(days.tolist())
+            return tracker.has_capacity(provider_ids, days)
+
+        booked = [self.book(free_slot_index, tracker, 'CT', ns('2025-01-02')) for _ in range(10)]
+        assert [provider_id for _, provider_id in booked] == [1, 2] * 5
+
+        rejected = []
+        assert free_slot_index.earliest_free_slot('CT', ns('2025-01-02'), has_capacity, rejected.extend) == \
+            (ns('2025-01-03 09:00'), 1)
+        assert rejected == [(ns(f'2025-01-02 {hour:02d}:00'), provider_id) for hour in (14, 15, 16) for provider_id in (1, 2)]
+        # The other states of a closed provider/day lose its slots too
+        assert free_slot_index.earliest_free_slot('NY', ns('2025-01-02')) == (ns('2025-01-03 09:00'), 2)
+
+        checked.clear()
+        assert free_slot_index.earliest_free_slot('CT', ns('2025-01-02'), has_capacity) == (ns('2025-01-03 09:00'), 1)
+        assert ns('2025-01-02') // NS_PER_DAY not in checked
+        # Closed slots are still open, the provider just cannot take them
+        assert free_slot_index.is_free(1, ns('2025-01-02 14:00'))
+
+    def test_a_cancellation_reopens_a_closed_provider_day(self, calendar, tracker):
+        free_slot_index = FreeSlotIndex(calendar)
+        for _ in range(10):
+            self.book(free_slot_index, tracker, 'CT', ns('2025-01-02'))
+        self.book(free_slot_index, tracker, 'CT', ns('2025-01-02'))
+
+        # A slot released while the provider/day is closed is held back with the others
+        free_slot_index.add_slot(2, ns('2025-01-02 09:00'))
+        assert free_slot_index.earliest_free_slot('NY', ns('2025-01-02')) == (ns('2025-01-03 09:00'), 2)
+
+        tracker.decrement_provider_appointments(2, pd.Timestamp('2025-01-02'))
+        free_slot_index.reopen_provider_day(2, ns('2025-01-02') // NS_PER_DAY)
+        assert free_slot_index.earliest_free_slot('NY', ns('2025-01-02'), tracker.has_capacity) == (ns('2025-01-02 09:00'), 2)
+        assert [key for key in free_slot_index.iter_free_slots('CT', ns('2025-01-02')) if key[1] == 2][:4] == \
+            [(ns(f'2025-01-02 {hour:02d}:00'), 2) for hour in (9, 14, 15, 16)]
+
+    def test_evict_before_drops_open_and_closed_slots(self, calendar, tracker):
+        free_slot_index = FreeSlotIndex(calendar)
+        for _ in range(11):
+            self.book(free_slot_index, tracker, 'CT', ns('2025-01-02'))
+
+        free_slot_index.evict_before(ns('2025-01-03'))
+
+        assert free_slot_index.closed_slots == {}
+        assert free_slot_index.days_by_state == {'CT': [ns('2025-01-03') // NS_PER_DAY],
+                                                 'NY': [ns('2025-01-03') // NS_PER_DAY]}
+        assert free_slot_index.earliest_free_slot('CT', 0) == (ns('2025-01-03 09:00'), 2)
+
+    def test_bookings_and_cancellations_match_a_full_scan(self, calendar, tracker):
+        free_slot_index = FreeSlotIndex(calendar)
+        licences = {1: ['CT'], 2: ['CT', 'NY']}
+        open_slots = {(int(start), int(provider_id)) for provider_id, start in zip(calendar.provider_ids, calendar.starts)}
+        booked = []
+        randomizer = random.Random(7)
+
+        def full_scan(state, after):
+            counts = {}
+            for start, provider_id in booked:
+                counts[(provider_id, start // NS_PER_DAY)] = counts.get((provider_id, start // NS_PER_DAY), 0) + 1
+            candidates = sorted(key for key in open_slots if key[0] >= after and state in licences[key[1]] and
+                                counts.get((key[1], key[0] // NS_PER_DAY), 0) < NewAppointmentTracker.MAX_NEW_APPOINTMENTS_PER_DAY)
+            return candidates[0] if candidates else None
+
+        for _ in range(200):
+            if booked and randomizer.random() < 0.3:
+                start, provider_id = booked.pop(randomizer.randrange(len(booked)))
+                open_slots.add((start, provider_id))
+                free_slot_index.add_slot(provider_id, start)
+                tracker.decrement_provider_appointments(provider_id, pd.Timestamp(start))
+                free_slot_index.reopen_provider_day(provider_id, start // NS_PER_DAY)
+                continue
+            state = randomizer.choice(['CT', 'NY'])
+            after = ns('2025-01-02') + randomizer.randrange(2 * NS_PER_DAY)
+            expected = full_scan(state, after)
+            assert self.book(free_slot_index, tracker, state, after) == expected
+            if expected is not None:
+                open_slots.discard(expected)
+                booked.append(expected)
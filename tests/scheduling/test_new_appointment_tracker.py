@@ -0,0 +1,44 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+
+class TestNewAppointmentTracker:
+
+    @pytest.fixture
+    def tracker(self):
+        tracker = NewAppointmentTracker()
+        tracker.reset()
+        yield tracker
+        tracker.reset()
+
+    def test_new_date_keeps_existing_counts(self, tracker):
+        for _ in range(5):
+            tracker.increment_provider_appointments(202, pd.Timestamp('2025-01-15'))
+        tracker.add_provider(202, pd.Timestamp('2025-01-16'))
+        tracker.increment_provider_appointments(202, pd.Timestamp('2025-01-16'))
+
+        assert tracker.get_provider_by_date(202, pd.Timestamp('2025-01-15')) == 5
+        assert tracker.get_provider_by_date(202, pd.Timestamp('2025-01-16')) == 1
+        assert not tracker.check_if_provider_has_availibility({'PROVIDERID': 202, 'DATE': pd.Timestamp('2025-01-15')})
+
+    def test_has_capacity_masks_full_provider_days(self, tracker):
+        for _ in range(5):
+            tracker.increment_provider_appointments(1, pd.Timestamp('2025-01-02'))
+        tracker.increment_provider_appointments(2, pd.Timestamp('2025-01-02'))
+
+        available = tracker.has_capacity(
+            [1, 1, 2, 3],
+            pd.to_datetime(['2025-01-02', '2025-01-03', '2025-01-02', '2025-01-02']))
+
+        np.testing.assert_array_equal(available, [False, True, True, True])
+
+    def test_snapshot_and_restore(self, tracker):
+        tracker.increment_provider_appointments(1, pd.Timestamp('2025-01-02'))
+        snapshot = tracker.snapshot()
+        tracker.increment_provider_appointments(1, pd.Timestamp('2025-01-02'))
+
+        tracker.restore(snapshot)
+
+        assert tracker.get_all_appointments() == {1: {pd.Timestamp('2025-01-02'): 1}}
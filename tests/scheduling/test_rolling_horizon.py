@@ -0,0 +1,107 @@
+import pytest
+import pandas as pd
+
+from analysis.analysis import Analysis
+from preprocessing.preprocessor import Preprocessor
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.appointment_data_handler import AppointmentDataHandler
+from scheduling.appointment_id_allocator import AppointmentIdAllocator
+from scheduling.appointment_scheduler import AppointmentScheduler
+from scheduling.free_slot_index import FreeSlotIndex
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+from scheduling.rolling_horizon import RollingHorizon
+
+def build_calendar(start_date, end_date):
+    """Provider 1, licensed in CT, has a timeslot at 9:00 and at 10:00 every day."""
+    starts = [day + pd.Timedelta(hours=hour) for day in pd.date_range(start_date, end_date) for hour in (9, 10)]
+    slots_df = pd.DataFrame({'PROVIDERID': [1] * len(starts), 'START_DATETIME': starts,
+                             'END_DATETIME': [start + pd.Timedelta(hours=1) for start in starts],
+                             'APPOINTMENTID': [None] * len(starts)})
+    return ProviderCalendar.from_slots(slots_df, pd.DataFrame({'PROVIDERID': [1], 'STATE': ['CT']}))
+
+PATTERN_MAPPING = {
+    "Appointment.*\\.csv": "appointment_df",
+    "New Patient.*\\.csv": "new_patient_df",
+    "Provider Schedule.*\\.csv": "provider_schedule_df",
+    "Provider State.*\\.csv": "provider_state_df"
+}
+
+class TestRollingHorizon:
+
+    @pytest.fixture
+    def tracker(self):
+        tracker = NewAppointmentTracker()
+        tracker.reset()
+        yield tracker
+        tracker.reset()
+
+    def test_weeks_are_built_when_reached_and_evicted_once_behind(self, tracker, tmp_path):
+        calendar = build_calendar('2025-01-01', '2025-01-07')
+        horizon = RollingHorizon(build_calendar, '2025-01-01', '2025-01-07')
+        handler = AppointmentDataHandler(str(tmp_path / 'Appointment Data.csv'), str(tmp_path / 'New Patient Data.csv'))
+        scheduler = AppointmentScheduler(tracker, Analysis(), AppointmentIdAllocator(pd.DataFrame({'APPOINTMENTID': [500]})),
+                                         handler, rolling_horizon=horizon)
+        scheduler.load_calendar(calendar)
+
+        def book(registration_date, state='CT'):
+            new_patient = pd.Series({'PATIENTID': 1, 'STATE': state, 'REGISTRATIONDATE': registration_date, 'PROGRAM': 'SUD'})
+            available_time_slot = scheduler.find_earliest_appointment(new_patient)
+            if available_time_slot is None:
+                return None
+            scheduler.book_appointment(new_patient, calendar, available_time_slot)
+            return available_time_slot['START_DATETIME']
+
+        # The first week runs out after two patients, so the next one is built
+        assert [book('2025-01-06') for _ in range(3)] == \
+            [pd.Timestamp('2025-01-07 09:00'), pd.Timestamp('2025-01-07 10:00'), pd.Timestamp('2025-01-08 09:00')]
+        assert horizon.weeks_built == 1
+        assert len(calendar) == 28
+
+        # Both weeks end before this patient's first day, so they are evicted and only the third week is held
+        assert book('2025-01-20') == pd.Timestamp('2025-01-21 09:00')
+        assert (horizon.weeks_built, horizon.slots_evicted, len(calendar)) == (2, 28, 14)
+        assert calendar.starts.min() == pd.Timestamp('2025-01-15 09:00').value
+        assert scheduler.free_slot_index.earliest_free_slot('CT', 0) == (pd.Timestamp('2025-01-15 09:00').value, 1)
+
+        # No week ever has a timeslot in NY, so the search stops instead of building weeks forever
+        assert book('2025-01-20', 'NY') is None
+        assert horizon.weeks_built == 2
+
+    def test_weeks_match_a_fresh_build_after_the_appointment_data_grows(self, tracker, tmp_path):
+        data_dir = tmp_path / 'data'
+        data_dir.mkdir()
+        (data_dir / 'Provider Schedule Data.csv').write_text(
+            'PROVIDERID,DAYOFWEEK,SLOTSTARTTIME,SLOTENDTIME\n' +
+            ''.join(f'{provider_id},{day},{hour}:00,{hour}:40\n'
+                    for provider_id in [1, 2] for day in range(1, 6) for hour in range(9, 17)))
+        (data_dir / 'Provider State Data.csv').write_text('PROVIDERID,STATE\n1,CT\n2,CT\n')
+        (data_dir / 'New Patient Data.csv').write_text('PATIENTID,STATE,REGISTRATIONDATE,PROGRAM\n10,CT,2025-01-01,SUD\n')
+        (data_dir / 'Appointment Data.csv').write_text(
+            'APPOINTMENTID,APPOINTMENTDATE,APPOINTMENTSTARTTIME,APPOINTMENTDURATION,PROVIDERID\n'
+            '500,2025-01-07,09:00 AM,60,1\n')
+
+        def two_weeks(cache_dir=None):
+            """The first week through populate_calendar, as main loads it, and the next built by the horizon."""
+            preprocessor = Preprocessor(str(data_dir) + '/', cache_dir=cache_dir)
+            preprocessor.read_csvs(PATTERN_MAPPING)
+            calendar = preprocessor.populate_calendar(start_date='2025-01-06', end_date='2025-01-12')
+            horizon = RollingHorizon(preprocessor.build_calendar, '2025-01-06', '2025-01-12')
+            horizon.attach(calendar, FreeSlotIndex(calendar))
+            assert horizon.extend('CT') == pd.Timestamp('2025-01-13').value
+            return preprocessor, calendar
+
+        cache_dir = str(tmp_path / 'cache')
+        two_weeks(cache_dir)
+        with open(data_dir / 'Appointment Data.csv', 'a') as file:
+            file.write('501,2025-01-08,10:00 AM,40,2\n502,2025-01-15,11:00 AM,40,1\n')
+        # Another run reads the appended rows for its own horizon and moves the high-water mark past them
+        other_run = Preprocessor(str(data_dir) + '/', cache_dir=cache_dir)
+        other_run.read_csvs(PATTERN_MAPPING)
+        other_run.populate_calendar(year=2025, month=1)
+
+        preprocessor, calendar = two_weeks(cache_dir)
+        _, expected = two_weeks()
+
+        assert preprocessor.loaded_from_snapshot
+        pd.testing.assert_frame_equal(calendar.to_frame(), expected.to_frame())
+        assert sorted(set(calendar.appointment_ids[calendar.appointment_ids != ProviderCalendar.FREE])) == [500, 501, 502]
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import shutil
+import threading
+
+import pytest
+import pandas as pd
+
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.appointment_data_handler import AppointmentDataHandler
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+from service.load_generator import open_connection, request
+from service.scheduler_service import SchedulerService, parse_args, run
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data')
+
+class TestSchedulerService:
+
+    @pytest.fixture
+    def tracker(self):
+        tracker = NewAppointmentTracker()
+        tracker.reset()
+        yield tracker
+        tracker.reset()
+
+    @pytest.fixture
+    def calendar(self):
+        rows = []
+        for provider_id, state in [(1, 'CT'), (1, 'NY'), (2, 'CT')]:
+            for day in ['2025-01-02', '2025-01-03']:
+                for hour in range(9, 17):
+                    start = pd.Timestamp(f'{day} {hour:02d}:00')
+                    rows.append({
+                        'PROVIDERID': provider_id,
+                        'STATE': state,
+                        'DATE': pd.Timestamp(day),
+                        'START_DATETIME': start,
+                        'END_DATETIME': start + pd.Timedelta(hours=1),
+                        'TIME_RANGE': pd.Timedelta(hours=1),
+                        'APPOINTMENTID': None
+                    })
+        return ProviderCalendar.from_frame(pd.DataFrame(rows))
+
+    @pytest.fixture
+    def handler(self, tmp_path):
+        appointment_data_path = tmp_path / 'Appointment Data.csv'
+        appointment_data_path.write_text('APPOINTMENTID,APPOINTMENTDATE,APPOINTMENTSTARTTIME,APPOINTMENTDURATION,PROVIDERID\n')
+        return AppointmentDataHandler(str(appointment_data_path), str(tmp_path / 'New Patient Data.csv'))
+
+    def test_concurrent_registrations_respect_slots_and_daily_limit(self, tracker, calendar, handler, tmp_path):
+        socket_path = str(tmp_path / 'scheduler.sock')
+        service = SchedulerService(calendar, store_path=str(tmp_path / 'calendar.db'), appointment_data_handler=handler)
+
+        async def register(patient_ids):
+            reader, writer = await open_connection(socket_path=socket_path)
+            responses = []
+            for patient_id in patient_ids:
+                state = 'NY' if patient_id % 3 == 0 else 'CT'
+                responses.append(await request(reader, writer, 'POST', '/register', {
+                    'PATIENTID': patient_id, 'STATE': state, 'REGISTRATIONDATE': '2025-01-01', 'PROGRAM': 'SUD'}))
+            writer.close()
+            return responses
+
+        async def run():
+            await service.start(socket_path=socket_path)
+            try:
+                batches = await asyncio.gather(*(register(range(start, 30, 6)) for start in range(6)))
+                reader, writer = await open_connection(socket_path=socket_path)
+                availability = await request(reader, writer, 'GET', '/availability?state=CT&after=2025-01-01')
+                statistics = await request(reader, writer, 'GET', '/stats')
+                writer.close()
+            finally:
+                await service.stop()
+            return [response for batch in batches for response in batch], availability, statistics
+
+        responses, (_, open_time_slots), (_, statistics) = asyncio.run(run())
+
+        booked = [payload for status, payload in responses if status == 200]
+        # Two providers with a daily limit of 5 over two days
+        assert len(booked) == 20
+        assert sum(status == 409 for status, _ in responses) == 10
+        assert len({(payload['PROVIDERID'], payload['START_DATETIME']) for payload in booked}) == 20
+        assert pd.DataFrame(booked).assign(DAY=lambda df: df['START_DATETIME'].str[:10]) \
+            .groupby(['PROVIDERID', 'DAY']).size().max() == 5
+        assert open_time_slots == []
+        assert statistics['Combined']['count'] == statistics['SUD']['count'] == 20
+        assert len(pd.read_csv(tmp_path / 'Appointment Data.csv')) == 20
+
+    def test_run_serves_the_calendar_built_from_the_csv_files(self, tracker, tmp_path, monkeypatch):
+        data_dir = tmp_path / 'data'
+        shutil.copytree(DATA_DIR, data_dir)
+        served = []
+
+        async def serve(service, host, port, socket_path):
+            served.append(service)
+        monkeypatch.setattr(SchedulerService, 'serve', serve)
+
+        run(parse_args(['--data-dir', str(data_dir) + os.sep, '--end-date', '2025-01-07']))
+
+        assert served[0].free_slot_index.earliest_free_slot('CT', 0) is not None
+
+    def test_a_malformed_request_line_is_answered_with_400(self, tracker, calendar, handler, tmp_path):
+        socket_path = str(tmp_path / 'scheduler.sock')
+        service = SchedulerService(calendar, appointment_data_handler=handler)
+
+        async def run():
+            await service.start(socket_path=socket_path)
+            try:
+                reader, writer = await open_connection(socket_path=socket_path)
+                writer.write(b'GARBAGE\r\n\r\n')
+                await writer.drain()
+                response = await reader.read()
+                writer.close()
+            finally:
+                await service.stop()
+            return response
+
+        response = asyncio.run(run())
+
+        assert response.startswith(b'HTTP/1.1 400 Bad Request\r\n')
+        assert b'Malformed request line' in response
+
+    def test_a_booking_the_store_cannot_write_is_undone(self, tracker, calendar, handler, tmp_path):
+        socket_path = str(tmp_path / 'scheduler.sock')
+        service = SchedulerService(calendar, store_path=str(tmp_path / 'calendar.db'), appointment_data_handler=handler)
+        new_patient = {'PATIENTID': 10, 'STATE': 'CT', 'REGISTRATIONDATE': '2025-01-01', 'PROGRAM': 'SUD'}
+
+        def failing_book(*args):
+            raise OSError('disk full')
+
+        async def run():
+            await service.start(socket_path=socket_path)
+            try:
+                service.calendar_store.book = failing_book
+                reader, writer = await open_connection(socket_path=socket_path)
+                response = await request(reader, writer, 'POST', '/register', new_patient)
+                availability = await request(reader, writer, 'GET', '/availability?state=CT&after=2025-01-01&limit=1')
+                statistics = await request(reader, writer, 'GET', '/stats')
+                writer.close()
+            finally:
+                await service.stop()
+            return response, availability, statistics
+
+        (status, _), (_, open_time_slots), (_, statistics) = asyncio.run(run())
+
+        assert status == 500
+        # The timeslot is open again and nothing counts the booking
+        assert open_time_slots[0]['START_DATETIME'] == '2025-01-02T09:00:00'
+        assert tracker.get_counts([open_time_slots[0]['PROVIDERID']], [pd.Timestamp('2025-01-02').value // 86_400_000_000_000])[0] == 0
+        assert service.bookings == 0
+        assert statistics.get('Combined', {}).get('count', 0) == 0
+        assert len(pd.read_csv(tmp_path / 'Appointment Data.csv')) == 0
+
+    def test_appointments_are_journaled_on_the_writer_thread(self, tracker, calendar, handler, tmp_path, monkeypatch):
+        socket_path = str(tmp_path / 'scheduler.sock')
+        service = SchedulerService(calendar, appointment_data_handler=handler, flush_every=1)
+        commit = handler.commit
+        threads = []
+
+        def recording_commit():
+            threads.append(threading.get_ident())
+            return commit()
+        monkeypatch.setattr(handler, 'commit', recording_commit)
+
+        async def run():
+            await service.start(socket_path=socket_path)
+            try:
+                reader, writer = await open_connection(socket_path=socket_path)
+                await request(reader, writer, 'POST', '/register',
+                              {'PATIENTID': 10, 'STATE': 'CT', 'REGISTRATIONDATE': '2025-01-01', 'PROGRAM': 'SUD'})
+                flushed = await request(reader, writer, 'POST', '/flush')
+                writer.close()
+            finally:
+                await service.stop()
+            return flushed
+
+        assert asyncio.run(run()) == (200, {'flushed': True})
+        # The booking, /flush and the compaction on shutdown
+        assert len(threads) == 3
+        assert threading.get_ident() not in threads
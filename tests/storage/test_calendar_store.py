@@ -0,0 +1,92 @@
+import pytest
+import pandas as pd
+
+from preprocessing.provider_calendar import ProviderCalendar
+from scheduling.new_appointment_tracker import NewAppointmentTracker
+from storage.calendar_store import CalendarStore
+
+class TestCalendarStore:
+
+    @pytest.fixture
+    def tracker(self):
+        tracker = NewAppointmentTracker()
+        tracker.reset()
+        yield tracker
+        tracker.reset()
+
+    @pytest.fixture
+    def store(self, tmp_path, tracker):
+        rows = []
+        for provider_id, state in [(1, 'CT'), (1, 'NY'), (2, 'CT')]:
+            for hour in range(9, 16):
+                start = pd.Timestamp(f'2025-01-02 {hour:02d}:00')
+                rows.append({
+                    'PROVIDERID': provider_id,
+                    'DATE': start.normalize(),
+                    'START_DATETIME': start,
+                    'END_DATETIME': start + pd.Timedelta(minutes=40),
+                    'TIME_RANGE': pd.Timedelta(minutes=40),
+                    'STATE': state,
+                    'APPOINTMENTID': 500 if (provider_id, hour) == (1, 9) else None
+                })
+        new_patient_df = pd.DataFrame({
+            'PATIENTID': [10, 11],
+            'STATE': ['NY', 'CT'],
+            'REGISTRATIONDATE': ['2025-01-01', '2025-01-01'],
+            'PROGRAM': ['SUD', 'SUD']
+        })
+        appointment_df = pd.DataFrame({
+            'APPOINTMENTID': [500],
+            'APPOINTMENTDATE': ['2025-01-02'],
+            'APPOINTMENTSTARTTIME': ['09:00 AM'],
+            'APPOINTMENTDURATION': [60],
+            'PROVIDERID': [1]
+        })
+
+        store = CalendarStore(str(tmp_path / 'calendar.db'))
+        store.initialize(ProviderCalendar.from_frame(pd.DataFrame(rows)), new_patient_df, appointment_df, tracker)
+        yield store
+        store.close()
+
+    def test_earliest_free_slot_skips_booked_and_full_days(self, store):
+        day_start = pd.Timestamp('2025-01-02').value
+        assert store.earliest_free_slot('NY', day_start, 5) == (pd.Timestamp('2025-01-02 10:00').value, 1)
+
+        for appointment_id, hour in enumerate(range(10, 15), start=600):
+            store.book(appointment_id, 1, pd.Timestamp(f'2025-01-02 {hour}:00').value)
+
+        assert store.earliest_free_slot('NY', day_start, 5) is None
+        assert store.earliest_free_slot('CT', day_start, 5) == (pd.Timestamp('2025-01-02 09:00').value, 2)
+
+    def test_book_is_one_transaction_and_persists(self, store, tracker, tmp_path):
+        start = pd.Timestamp('2025-01-02 10:00').value
+        store.book(601, 1, start, patient_id=10)
+        with pytest.raises(ValueError):
+            store.book(602, 1, start, patient_id=11)
+
+        reopened = CalendarStore(str(tmp_path / 'calendar.db'))
+        assert reopened.is_initialized()
+        calendar_df = reopened.get_calendar().to_frame()
+        booked = calendar_df[(calendar_df['START_DATETIME'] == pd.Timestamp(start)) & (calendar_df['PROVIDERID'] == 1)]
+        assert booked.set_index('STATE')['APPOINTMENTID'].to_dict() == {'CT': 601, 'NY': 601}
+        assert reopened.get_new_patient_df()['PATIENTID'].tolist() == [11]
+        assert reopened.get_appointment_df()['APPOINTMENTID'].tolist() == [500, 601]
+
+        reopened.restore_tracker(tracker)
+        assert tracker.get_provider_by_date(1, pd.Timestamp('2025-01-02')) == 1
+        reopened.close()
+
+    def test_cancel_releases_slot_and_returns_patient_to_queue(self, store, tracker):
+        start = pd.Timestamp('2025-01-02 10:00').value
+        store.book(601, 1, start, patient_id=10)
+
+        assert store.cancel(601) == [(start, 1)]
+        assert store.earliest_free_slot('NY', pd.Timestamp('2025-01-02').value, 5) == (start, 1)
+        assert store.get_new_patient_df()['PATIENTID'].tolist() == [10, 11]
+        assert store.get_appointment_df()['APPOINTMENTID'].tolist() == [500]
+        store.restore_tracker(tracker)
+        assert tracker.get_provider_by_date(1, pd.Timestamp('2025-01-02')) == 0
+
+        # Existing appointments release every slot they cover
+        assert store.cancel(500) == [(pd.Timestamp('2025-01-02 09:00').value, 1)]
+        assert store.earliest_free_slot('NY', pd.Timestamp('2025-01-02').value, 5) == (pd.Timestamp('2025-01-02 09:00').value, 1)
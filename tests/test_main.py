@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import main
+
+SRC_DIR = os.path.dirname(os.path.abspath(main.__file__))
+HEAVY_MODULES = ['pandas', 'numpy', 'matplotlib', 'scipy']
+# --help and argument parsing must not pay for the data stack
+STARTUP_BUDGET_SECONDS = 0.5
+
+class TestMain:
+
+    def run_python(self, *args):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, *args], cwd=SRC_DIR, capture_output=True, text=True, timeout=60)
+        return result, time.perf_counter() - started
+
+    def test_parsing_every_command_imports_nothing_heavy(self):
+        code = ("import sys, main\n"
+                "for command in main.COMMANDS:\n"
+                "    main.parse_args([command])\n"
+                f"print(','.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))")
+        result, _ = self.run_python('-c', code)
+
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip() == ''
+
+    def test_help_starts_within_budget(self):
+        for argv in (['--help'], ['schedule', '--help'], ['backtest', '--bogus']):
+            # The best of a few runs, so a busy machine does not fail the test
+            timings = []
+            for _ in range(3):
+                result, seconds = self.run_python('main.py', *argv)
+                timings.append(seconds)
+            assert result.returncode == (2 if '--bogus' in argv else 0)
+            assert min(timings) < STARTUP_BUDGET_SECONDS
+
+    def test_options_without_a_command_are_schedule_options(self):
+        args = main.parse_args(['--algorithm', 'optimal-max', '--rebuild-cache', '--end-date', '2025-03-31'])
+
+        assert args.handler is main.schedule
+        assert main.ALGORITHMS[args.algorithm] == ('optimal', 'max')
+        assert args.cache_dir == main.DEFAULT_CACHE_DIR
+        assert (args.data_dir, args.start_date, args.end_date) == ('data/', '2025-01-01', '2025-03-31')
+        with pytest.raises(SystemExit):
+            main.parse_args(['schedule', '--start-date', '2025-02-30'])
@@ -0,0 +1,47 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from util.event_log import EventLog
+
+class TestEventLog:
+
+    @pytest.fixture
+    def event_log(self):
+        event_log = EventLog()
+        yield event_log
+        event_log.configure()
+
+    def test_detail_events_are_sampled_and_written_off_the_console(self, event_log, tmp_path, capsys):
+        path = tmp_path / 'events.jsonl'
+        event_log.configure('sampled', str(path), sample_every=3)
+        for patient_id in range(7):
+            event_log.detail('patient_unscheduled', 'No available timeslots for {patient_id}',
+                             patient_id=np.int64(patient_id))
+        event_log.detail('capacity_rejected', 'Provider: {provider_id} does not have ability for {date}',
+                         provider_id=1, date=pd.Timestamp('2025-01-02'))
+        event_log.info('scheduling_finished', 'Summary', scheduled=3)
+        event_log.close()
+
+        assert capsys.readouterr().out == 'Summary\n'
+        events = [json.loads(line) for line in path.read_text().splitlines()]
+        unscheduled = [event['patient_id'] for event in events if event['event'] == 'patient_unscheduled']
+        assert unscheduled == [0, 3, 6]
+        assert [event['event'] for event in events[-3:]] == ['capacity_rejected', 'scheduling_finished', 'event_log_closed']
+        assert events[-3]['date'] == '2025-01-02T00:00:00'
+        assert events[-1]['detail_counts'] == {'patient_unscheduled': 7, 'capacity_rejected': 1}
+
+    def test_full_mode_prints_and_silent_mode_drops(self, event_log, capsys):
+        event_log.configure('full')
+        event_log.detail('timeslots_booked', 'Provider timeslots booked as a result of this appointment: {timeslots}',
+                         appointment_id=1, timeslots=2)
+        assert capsys.readouterr().out == 'Provider timeslots booked as a result of this appointment: 2\n'
+
+        event_log.configure('silent')
+        event_log.detail('timeslots_booked', 'Provider timeslots booked as a result of this appointment: {timeslots}',
+                         appointment_id=1, timeslots=2)
+        event_log.warning('optimal_solve_timeout', 'Optimal solve exceeded 1s')
+        assert capsys.readouterr().out == 'Optimal solve exceeded 1s\n'
+        assert event_log.detail_counts == {'timeslots_booked': 1}
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from util.profiling import Profiler, timed
+
+class TestProfiler:
+
+    @pytest.fixture
+    def profiler(self):
+        profiler = Profiler()
+        profiler.stop()
+        profiler.reset()
+        yield profiler
+        profiler.stop()
+        profiler.reset()
+
+    def test_nothing_is_collected_while_off(self, profiler):
+        @timed('scheduling')
+        def schedule():
+            profiler.count('bookings')
+            profiler.observe('slots_scanned_per_patient', 3)
+            return 'done'
+
+        assert schedule() == 'done'
+        assert profiler.stages == profiler.counters == profiler.observations == {}
+
+    def test_report_and_prometheus_output(self, profiler, tmp_path):
+        @timed('scheduling')
+        def schedule(patients):
+            with profiler.stage('writes'):
+                pass
+            for scanned in patients:
+                profiler.observe('slots_scanned_per_patient', scanned)
+                profiler.count('bookings')
+
+        profiler.start('tracemalloc')
+        schedule([1, 4])
+        schedule([2])
+        profiler.stop()
+        profiler.write_json(str(tmp_path / 'profile.json'))
+        profiler.write_prometheus(str(tmp_path / 'profile.prom'))
+
+        report = json.loads((tmp_path / 'profile.json').read_text())
+        assert report['stages']['scheduling']['calls'] == 2
+        assert report['stages']['writes']['calls'] == 2
+        # Nested stages are timed inclusively
+        assert report['stages']['scheduling']['seconds'] >= report['stages']['writes']['seconds']
+        assert report['stages']['scheduling']['peak_memory_bytes'] > 0
+        assert report['counters'] == {'bookings': 3}
+        assert report['observations']['slots_scanned_per_patient'] == {'count': 3, 'sum': 7, 'max': 4, 'mean': 7 / 3}
+        assert report['bookings_per_second'] > 0
+
+        prometheus = (tmp_path / 'profile.prom').read_text().splitlines()
+        assert '# TYPE staghack_stage_seconds_total counter' in prometheus
+        assert 'staghack_stage_calls_total{stage="scheduling"} 2' in prometheus
+        assert 'staghack_bookings_total 3' in prometheus
+        assert 'staghack_slots_scanned_per_patient_sum 7' in prometheus